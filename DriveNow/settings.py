@@ -201,19 +201,61 @@ CORS_ALLOW_HEADERS = [
     "x-csrftoken",
     "x-requested-with",
     "x-header-token",
-    "x-file-token"
+    "x-file-token",
+    # tus resumable uploads
+    "tus-resumable",
+    "upload-length",
+    "upload-offset",
+    "upload-metadata",
+    "upload-checksum",
+]
+
+# Readable by the frontend, for tus resumable uploads
+CORS_EXPOSE_HEADERS = [
+    "location",
+    "tus-resumable",
+    "tus-version",
+    "tus-extension",
+    "tus-max-size",
+    "tus-checksum-algorithm",
+    "upload-offset",
+    "upload-length",
+    "x-file-token",
 ]
 
 # Storage Bucket
+# "s3", "local" (files on disk) or "memory" (tests and benchmarks)
 FILE_UPLOAD_STORAGE = os.environ.get("FILE_UPLOAD_STORAGE", default="s3")
 
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+if FILE_UPLOAD_STORAGE == "s3":
+    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+else:
+    # Through the storage backend, see FileProcessing.storage
+    DEFAULT_FILE_STORAGE = 'FileProcessing.storage.BackendFileStorage'
+
+FILE_STORAGE_LOCAL_ROOT = os.environ.get("FILE_STORAGE_LOCAL_ROOT", default=os.path.join(BASE_DIR, "media"))
+# Directory levels keys are spread over (256 each), 0 keeps the plain `<root>/<key>` layout
+FILE_STORAGE_LOCAL_SHARD_DEPTH = int(os.environ.get("FILE_STORAGE_LOCAL_SHARD_DEPTH", default=0))
+# Simulated storage of the memory backend
+FILE_STORAGE_MEMORY_LATENCY = float(os.environ.get("FILE_STORAGE_MEMORY_LATENCY", default=0))      # Seconds per call
+FILE_STORAGE_MEMORY_BANDWIDTH = int(os.environ.get("FILE_STORAGE_MEMORY_BANDWIDTH", default=0))    # Bytes per second per stream, 0: unlimited
+FILE_STORAGE_MEMORY_ERROR_RATE = float(os.environ.get("FILE_STORAGE_MEMORY_ERROR_RATE", default=0))  # Fraction of calls failing with SlowDown
 
 AWS_S3_ACCESS_KEY_ID = os.environ.get("AWS_S3_ACCESS_KEY_ID")
 AWS_S3_SECRET_ACCESS_KEY = os.environ.get("AWS_S3_SECRET_ACCESS_KEY")
 AWS_STORAGE_BUCKET_NAME = os.environ.get("AWS_STORAGE_BUCKET_NAME")
 AWS_S3_REGION_NAME = os.environ.get("AWS_S3_REGION_NAME")
 AWS_S3_SIGNATURE_VERSION = os.environ.get("AWS_S3_SIGNATURE_VERSION", default="s3v4")
+# S3 compatible storage (MinIO, Ceph...) instead of AWS
+AWS_S3_ENDPOINT_URL = os.environ.get("AWS_S3_ENDPOINT_URL")
+# One boto3 client per process, shared by requests and upload threads
+AWS_S3_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_S3_MAX_POOL_CONNECTIONS", default=32))  # Kept-alive connections to S3
+AWS_S3_CONNECT_TIMEOUT = float(os.environ.get("AWS_S3_CONNECT_TIMEOUT", default=3.05))
+AWS_S3_READ_TIMEOUT = float(os.environ.get("AWS_S3_READ_TIMEOUT", default=60))
+# "standard", or "adaptive" to also slow down client side when S3 throttles (SlowDown)
+AWS_S3_RETRY_MODE = os.environ.get("AWS_S3_RETRY_MODE", default="standard")
+AWS_S3_MAX_ATTEMPTS = int(os.environ.get("AWS_S3_MAX_ATTEMPTS", default=3))  # Including the first one
+AWS_S3_TCP_KEEPALIVE = os.environ.get("AWS_S3_TCP_KEEPALIVE", default="True") == "True"
 
 # https://docs.aws.amazon.com/AmazonS3/latest/userguide/acl-overview.html#canned-acl
 AWS_DEFAULT_ACL = os.environ.get("AWS_DEFAULT_ACL", default="private")
@@ -222,6 +264,98 @@ AWS_PRESIGNED_EXPIRY = os.environ.get("AWS_PRESIGNED_EXPIRY", default=36000)
 
 FILE_MAX_SIZE = os.environ.get("FILE_MAX_SIZE", default=4194304000)
 
+# Multipart uploads: preferred part size (grown for files over 10,000 parts), presigned upload_part URLs per batch
+FILE_MULTIPART_PART_SIZE = int(os.environ.get("FILE_MULTIPART_PART_SIZE", default=8388608))
+FILE_MULTIPART_PRESIGN_BATCH = int(os.environ.get("FILE_MULTIPART_PRESIGN_BATCH", default=100))
+FILE_MULTIPART_PRESIGNED_EXPIRY = int(os.environ.get("FILE_MULTIPART_PRESIGNED_EXPIRY", default=3600))
+# Space reserved by an upload at start is given back if it is not finished within this many seconds
+FILE_UPLOAD_RESERVATION_TTL = int(os.environ.get("FILE_UPLOAD_RESERVATION_TTL", default=86400))
+# Uploads never finished are cleaned up after this many seconds by manage.py reapuploads, run from cron
+# or as a single long-running process with --interval
+FILE_UPLOAD_REAPER_TTL = int(os.environ.get("FILE_UPLOAD_REAPER_TTL", default=FILE_UPLOAD_RESERVATION_TTL))
+FILE_UPLOAD_REAPER_BATCH_SIZE = int(os.environ.get("FILE_UPLOAD_REAPER_BATCH_SIZE", default=500))
+FILE_UPLOAD_REAPER_CONCURRENCY = int(os.environ.get("FILE_UPLOAD_REAPER_CONCURRENCY", default=8))
+# Parts uploaded at once while the standard upload streams a request body to S3, each holds a part in memory
+FILE_UPLOAD_STREAM_CONCURRENCY = int(os.environ.get("FILE_UPLOAD_STREAM_CONCURRENCY", default=2))
+
+# Content-addressed deduplication: uploads with the bytes of an existing File link to it, their object is dropped
+FILE_DEDUP_ENABLED = os.environ.get("FILE_DEDUP_ENABLED", default="True") == "True"
+# Multipart / tus uploads are hashed by reading the object back once complete, not past this size
+FILE_DEDUP_READBACK_MAX_SIZE = int(os.environ.get("FILE_DEDUP_READBACK_MAX_SIZE", default=1073741824))
+# Instant uploads prove possession by hashing this many bytes, at an offset chosen by the server
+FILE_DEDUP_CHALLENGE_BYTES = int(os.environ.get("FILE_DEDUP_CHALLENGE_BYTES", default=65536))
+FILE_DEDUP_CHALLENGE_MAX_AGE = int(os.environ.get("FILE_DEDUP_CHALLENGE_MAX_AGE", default=300))
+
+# Batch uploads: many small files in one request (multipart `files` fields or a tar stream)
+FILE_BATCH_MAX_FILES = int(os.environ.get("FILE_BATCH_MAX_FILES", default=1000))
+FILE_BATCH_MAX_FILE_SIZE = int(os.environ.get("FILE_BATCH_MAX_FILE_SIZE", default=10485760))  # Bigger files go through the other upload APIs
+FILE_BATCH_UPLOAD_CONCURRENCY = int(os.environ.get("FILE_BATCH_UPLOAD_CONCURRENCY", default=16))   # Objects written to storage at once
+# Django refuses requests with more files than this, 100 by default
+DATA_UPLOAD_MAX_NUMBER_FILES = FILE_BATCH_MAX_FILES
+
+# Imports from URLs, fetched by background jobs of the web process
+FILE_IMPORT_MAX_JOBS = int(os.environ.get("FILE_IMPORT_MAX_JOBS", default=2))          # Jobs running at once, the others wait
+FILE_IMPORT_CONCURRENCY = int(os.environ.get("FILE_IMPORT_CONCURRENCY", default=4))    # Ranges fetched, and parts held in memory, per job
+# Lets imports fetch from loopback and private networks, for development only
+FILE_IMPORT_ALLOW_PRIVATE_HOSTS = os.environ.get("FILE_IMPORT_ALLOW_PRIVATE_HOSTS", default="False") == "True"
+
+# Bytes read from storage per iteration when proxying a file (256 KiB to 1 MiB works well)
+FILE_STREAM_CHUNK_SIZE = int(os.environ.get("FILE_STREAM_CHUNK_SIZE", default=262144))
+# Serve get/<token>/ and get/d/<token>/ with async views, for ASGI deployments (uvicorn DriveNow.asgi:application).
+# Under WSGI keep it off: Django buffers the whole body of async streaming responses there.
+FILE_STREAM_ASYNC = os.environ.get("FILE_STREAM_ASYNC", default="False") == "True"
+
+# Tail latency of storage reads when streaming: how long opening a read may take (the video start)
+FILE_STORAGE_READ_DEADLINE = float(os.environ.get("FILE_STORAGE_READ_DEADLINE", default=0))           # Seconds until headers, 0: unbounded
+# Sends a second GET for reads still waiting at the percentile of recent first-byte latencies, keeps the first answer
+FILE_STORAGE_HEDGE_ENABLED = os.environ.get("FILE_STORAGE_HEDGE_ENABLED", default="False") == "True"
+FILE_STORAGE_HEDGE_PERCENTILE = float(os.environ.get("FILE_STORAGE_HEDGE_PERCENTILE", default=95))
+FILE_STORAGE_HEDGE_MIN_DELAY = float(os.environ.get("FILE_STORAGE_HEDGE_MIN_DELAY", default=0.05))    # Seconds
+FILE_STORAGE_HEDGE_MAX_DELAY = float(os.environ.get("FILE_STORAGE_HEDGE_MAX_DELAY", default=2))       # Seconds, also the delay until enough reads were timed
+FILE_STORAGE_HEDGE_BUDGET = float(os.environ.get("FILE_STORAGE_HEDGE_BUDGET", default=0.05))          # Hedges per read at most
+# Consecutive failed reads refusing the next ones (503) for the cooldown, 0: never
+FILE_STORAGE_BREAKER_FAILURES = int(os.environ.get("FILE_STORAGE_BREAKER_FAILURES", default=0))
+FILE_STORAGE_BREAKER_COOLDOWN = float(os.environ.get("FILE_STORAGE_BREAKER_COOLDOWN", default=10))    # Seconds
+
+# Parallel range requests for big downloads (get/d/<token>/), a single storage stream is slower than the NIC
+FILE_PARALLEL_DOWNLOAD_ENABLED = os.environ.get("FILE_PARALLEL_DOWNLOAD_ENABLED", default="False") == "True"
+FILE_PARALLEL_DOWNLOAD_MIN_SIZE = int(os.environ.get("FILE_PARALLEL_DOWNLOAD_MIN_SIZE", default=67108864))  # Smaller downloads use one stream
+FILE_PARALLEL_DOWNLOAD_PART_SIZE = int(os.environ.get("FILE_PARALLEL_DOWNLOAD_PART_SIZE", default=8388608))
+FILE_PARALLEL_DOWNLOAD_CONCURRENCY = int(os.environ.get("FILE_PARALLEL_DOWNLOAD_CONCURRENCY", default=4))   # Ranges in flight, and buffered, per download
+
+# Local disk read-through cache of proxied file content, shared by the workers of a host
+FILE_CACHE_ENABLED = os.environ.get("FILE_CACHE_ENABLED", default="False") == "True"
+FILE_CACHE_DIR = os.environ.get("FILE_CACHE_DIR", default=os.path.join(BASE_DIR, "filecache"))
+FILE_CACHE_MAX_BYTES = int(os.environ.get("FILE_CACHE_MAX_BYTES", default=10737418240))          # 10 GiB budget
+FILE_CACHE_MAX_FILE_BYTES = int(os.environ.get("FILE_CACHE_MAX_FILE_BYTES", default=536870912))  # Bigger files are never cached whole
+FILE_CACHE_PREFIX_BYTES = int(os.environ.get("FILE_CACHE_PREFIX_BYTES", default=8388608))        # First 8 MiB of videos for fast starts
+FILE_CACHE_PREFIX_CONTENT_TYPES = ["video/", "audio/"]
+
+# How get/<token>/ and get/d/<token>/ deliver bytes: "proxy" through the worker, "redirect" to a presigned URL,
+# or hand the transfer to the fronting web server with "x-accel-redirect" (nginx) / "x-sendfile" (Apache, lighttpd, local storage only)
+FILE_DELIVERY_MODE = os.environ.get("FILE_DELIVERY_MODE", default="proxy")
+# Content type prefixes always proxied whatever the delivery mode, e.g. "text/,application/pdf"
+FILE_DELIVERY_PROXY_CONTENT_TYPES = [prefix for prefix in os.environ.get("FILE_DELIVERY_PROXY_CONTENT_TYPES", default="").split(",") if prefix]
+FILE_DELIVERY_PRESIGNED_EXPIRY = int(os.environ.get("FILE_DELIVERY_PRESIGNED_EXPIRY", default=300))
+# Presigned download URLs are handed out again until this many seconds before they expire (per process, LRU, 0 disables)
+FILE_PRESIGN_CACHE_SIZE = int(os.environ.get("FILE_PRESIGN_CACHE_SIZE", default=10000))
+FILE_PRESIGN_CACHE_MARGIN = int(os.environ.get("FILE_PRESIGN_CACHE_MARGIN", default=60))
+# Tokens per get/presign/ request, whose URLs last AWS_PRESIGNED_EXPIRY seconds
+FILE_PRESIGN_BATCH_MAX = int(os.environ.get("FILE_PRESIGN_BATCH_MAX", default=500))
+# nginx `internal` locations for x-accel-redirect: an alias of the local media root, and a proxy_pass to S3
+FILE_DELIVERY_ACCEL_LOCAL_PREFIX = os.environ.get("FILE_DELIVERY_ACCEL_LOCAL_PREFIX", default="/protected/")
+FILE_DELIVERY_ACCEL_S3_PREFIX = os.environ.get("FILE_DELIVERY_ACCEL_S3_PREFIX", default="/s3-proxy/")
+
+# Upstream (storage) HTTP connection pool, per process
+UPSTREAM_POOL_CONNECTIONS = int(os.environ.get("UPSTREAM_POOL_CONNECTIONS", default=4))     # Storage hosts kept pooled
+UPSTREAM_POOL_MAXSIZE = int(os.environ.get("UPSTREAM_POOL_MAXSIZE", default=16))            # Connections per storage host
+UPSTREAM_POOL_TIMEOUT = float(os.environ.get("UPSTREAM_POOL_TIMEOUT", default=10))          # Max wait for a free connection
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", default=3.05))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", default=30))
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", default=3))
+UPSTREAM_RETRY_BACKOFF = float(os.environ.get("UPSTREAM_RETRY_BACKOFF", default=0.2))
+UPSTREAM_ASYNC_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_ASYNC_MAX_CONNECTIONS", default=2048))  # Per event loop, one per download in flight
+
 # Web Host
 WEBHOST = os.environ.get("WEBHOST")
 
@@ -231,5 +365,3 @@ STORAGE_PER_USER = os.environ.get("STORAGE_PER_USER")
 # CPM Rate
 CPM = os.environ.get("CPM")
 
-# Local Variable DB
-ON_GOING_UPLOADS = {}
@@ -0,0 +1,122 @@
+import os
+import zipfile
+from typing import Iterable, Iterator, List, Tuple
+
+from django.utils import timezone
+
+from FileProcessing.models import File
+from FileProcessing.streaming import FileStreamWrapper, storage_open_stream
+
+# Members of these types are deflated, anything else (images, video, audio, archives, office documents)
+# is already compressed and stored as-is.
+ARCHIVE_DEFLATE_CONTENT_TYPES = (
+    "text/",
+    "application/json",
+    "application/xml",
+    "application/javascript",
+    "application/x-sh",
+    "image/svg+xml",
+    "image/bmp",
+)
+
+
+class ZipStreamSink:
+    """
+    Unseekable write end handed to `zipfile`.
+
+    zipfile then writes local headers with data descriptors, so nothing is ever
+    seeked back to. The response iterator drains it after every member write,
+    which keeps memory bounded by one chunk whatever the archive size.
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        if len(self.chunks) == 1:
+            data = self.chunks[0]
+        else:
+            data = b"".join(self.chunks)
+        self.chunks.clear()
+
+        return data
+
+
+def archive_member_names(display_names: Iterable[str]) -> List[str]:
+    """
+    Flattens display names into unique archive member names:
+    `report.pdf`, `report (1).pdf`, `report (2).pdf`...
+    """
+    names = []
+    seen = set()
+
+    for display_name in display_names:
+        name = display_name.replace("/", "_").replace("\\", "_").strip() or "file"
+        root, extension = os.path.splitext(name)
+
+        candidate, counter = name, 0
+        while candidate.lower() in seen:
+            counter += 1
+            candidate = f"{root} ({counter}){extension}"
+
+        seen.add(candidate.lower())
+        names.append(candidate)
+
+    return names
+
+
+def archive_compress_type(content_type: str) -> int:
+    if content_type.startswith(ARCHIVE_DEFLATE_CONTENT_TYPES):
+        return zipfile.ZIP_DEFLATED
+
+    return zipfile.ZIP_STORED
+
+
+def archive_open_member(file: File):
+    body = storage_open_stream(file.file.name)
+    body.raise_for_status()
+
+    return body
+
+
+def zip_stream(members: List[Tuple[str, File]]) -> Iterator[bytes]:
+    """
+    Yields a ZIP64 archive of `members`, (member name, File) pairs, built on the fly.
+
+    Members are read sequentially from storage, one at a time, in FILE_STREAM_CHUNK_SIZE chunks.
+    """
+    sink = ZipStreamSink()
+
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+        for name, file in members:
+            modified_at = timezone.localtime(file.upload_finished_at or file.created_at)
+
+            member = zipfile.ZipInfo(name, date_time=modified_at.timetuple()[:6])
+            member.compress_type = archive_compress_type(file.file_type)
+            member.external_attr = 0o644 << 16
+
+            body = archive_open_member(file)
+            try:
+                # The size is only known for sure once read, force ZIP64 sizes up front.
+                with archive.open(member, mode="w", force_zip64=True) as destination:
+                    for chunk in FileStreamWrapper(body):
+                        destination.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            finally:
+                body.close()
+
+            data = sink.drain()
+            if data:
+                yield data
+
+    # Central directory and (ZIP64) end of central directory records
+    yield sink.drain()
@@ -0,0 +1,63 @@
+import mimetypes
+import os
+import shutil
+import tarfile
+import tempfile
+from typing import Iterator
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+
+from FileProcessing.models import File
+from integrations.storage.base import StorageBackend
+
+# Request bodies read as a tar stream (plain or compressed) by the batch upload
+BATCH_TAR_CONTENT_TYPES = (
+    "application/x-tar",
+    "application/x-gtar",
+    "application/gzip",
+    "application/x-gzip",
+)
+
+
+def batch_read_tar(stream) -> Iterator[UploadedFile]:
+    """
+    The regular files of a tar stream, read in one pass as they arrive (`stream` is never seeked).
+
+    Members are spooled like Django spools uploads, in memory up to FILE_UPLOAD_MAX_MEMORY_SIZE.
+    Those over FILE_BATCH_MAX_FILE_SIZE are skipped unread, with no file but their size,
+    so they can still be reported.
+    """
+    try:
+        with tarfile.open(fileobj=stream, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+
+                name = os.path.basename(member.name)
+                content_type = mimetypes.guess_type(name)[0] or ""
+
+                if member.size > settings.FILE_BATCH_MAX_FILE_SIZE:
+                    yield UploadedFile(file=None, name=name, content_type=content_type, size=member.size)
+                    continue
+
+                spooled = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+                shutil.copyfileobj(archive.extractfile(member), spooled)
+                spooled.seek(0)
+
+                yield UploadedFile(file=spooled, name=name, content_type=content_type, size=member.size)
+    except (tarfile.TarError, EOFError):
+        raise ValidationError("Invalid tar archive")
+
+
+def batch_store(file: File, file_obj, backend: StorageBackend) -> str:
+    """
+    Writes `file_obj` where `file` points, returns the ETag reported by storage.
+
+    Runs in the batch upload's threads, which share `backend`: backends (and the S3 client behind
+    theirs) are thread-safe.
+    """
+    file_obj.seek(0)
+
+    return backend.put(file.file.name, file_obj)
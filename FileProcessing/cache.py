@@ -0,0 +1,379 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from attrs import define
+from django.conf import settings
+
+content_range_re = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+FULL_SUFFIX = ".full"
+PREFIX_SUFFIX = ".prefix"
+
+
+def file_cache_key(file_id: str, etag: Optional[str]) -> str:
+    """
+    Entries are keyed by fileID and the ETag, so replacing the bytes of a file never serves stale content.
+    """
+    return f"{file_id}.{hashlib.sha1((etag or '').encode()).hexdigest()[:16]}"
+
+
+@define
+class FileCacheEntry:
+    path: str
+    kind: str
+    size: int   # Bytes available in the entry
+    total: int  # Size of the whole object
+
+
+class FileCacheStats:
+    """
+    Per process hit / miss / eviction counters.
+
+    They are flushed to `<cache dir>/stats/<pid>.json` every few seconds,
+    so the `filecache` management command can add up all workers.
+    """
+
+    fields = ("hits", "partial_hits", "misses", "fills", "fill_aborts", "evictions", "evicted_bytes")
+    flush_interval = 5
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.fields, 0)
+        self._flushed_at = 0.0
+
+    def record(self, field: str, amount: int = 1):
+        with self._lock:
+            self._counters[field] += amount
+            flush = time.monotonic() - self._flushed_at > self.flush_interval
+            if flush:
+                self._flushed_at = time.monotonic()
+                counters = dict(self._counters)
+
+        if flush:
+            self._flush(counters)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def _flush(self, counters: Dict[str, int]):
+        path = os.path.join(self.directory, "stats", f"{os.getpid()}.json")
+        tmp_path = f"{path}.{uuid.uuid4().hex}"
+        try:
+            with open(tmp_path, "w") as fp:
+                json.dump(counters, fp)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+
+class CacheFillStream:
+    """
+    Tees an upstream response into a temp file while it is streamed to the client.
+
+    The temp file is atomically renamed into place once `limit` bytes went through,
+    it is thrown away when the client disconnects first.
+    """
+
+    def __init__(self, cache, upstream, *, key: str, kind: str, limit: int, total: int, lock_fd: int):
+        self.cache = cache
+        self.upstream = upstream
+        self.key = key
+        self.kind = kind
+        self.limit = limit
+        self.total = total
+        self.lock_fd = lock_fd
+
+        self.written = 0
+        self.tmp_path = os.path.join(cache.directory, "tmp", f"{key}.{os.getpid()}.{uuid.uuid4().hex}")
+        self.tmp_file = open(self.tmp_path, "wb")
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        data = self.upstream.read(amt)
+
+        if self.tmp_file is not None and data:
+            try:
+                self.tmp_file.write(memoryview(data)[:self.limit - self.written])
+                self.written = min(self.written + len(data), self.limit)
+                if self.written == self.limit:
+                    self._commit()
+            except OSError:
+                self._abort()
+
+        return data
+
+    def close(self):
+        if self.tmp_file is not None:
+            self._abort()
+
+        self.upstream.close()
+
+    def _commit(self):
+        self.tmp_file.close()
+        self.tmp_file = None
+
+        self.cache.commit(self.tmp_path, self.key, kind=self.kind, total=self.total)
+        self._release()
+
+    def _abort(self):
+        self.tmp_file.close()
+        self.tmp_file = None
+
+        try:
+            os.unlink(self.tmp_path)
+        except OSError:
+            pass
+
+        self.cache.stats.record("fill_aborts")
+        self._release()
+
+    def _release(self):
+        fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+        os.close(self.lock_fd)
+
+
+class FileContentCache:
+    """
+    Size bounded, read-through disk cache of file content, shared by all workers of a host.
+
+    Layout of the cache directory:
+
+    <key>.full                Whole objects
+    <key>.<total>.prefix      The first FILE_CACHE_PREFIX_BYTES of a video / audio object
+    locks/<key>.lock          flock'ed by the single worker filling <key>
+    tmp/                      Fills in progress, renamed into place once complete
+    stats/<pid>.json          Counters of each worker
+
+    Hits bump the mtime of an entry, eviction removes the least recently used entries first.
+    """
+
+    def __init__(self, *, directory: str, max_bytes: int, max_file_bytes: int, prefix_bytes: int, prefix_content_types: List[str]):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.prefix_bytes = prefix_bytes
+        self.prefix_content_types = prefix_content_types
+
+        for subdirectory in ("locks", "tmp", "stats"):
+            os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+
+        self.stats = FileCacheStats(directory)
+
+    def _path(self, key: str, kind: str, total: int = 0) -> str:
+        if kind == "full":
+            return os.path.join(self.directory, f"{key}{FULL_SUFFIX}")
+
+        return os.path.join(self.directory, f"{key}.{total}{PREFIX_SUFFIX}")
+
+    def lookup(self, key: str, total: int) -> Optional[FileCacheEntry]:
+        for kind in ("full", "prefix"):
+            path = self._path(key, kind, total)
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+
+            return FileCacheEntry(path=path, kind=kind, size=size, total=size if kind == "full" else total)
+
+        return None
+
+    def open_entry(self, entry: FileCacheEntry):
+        """
+        Returns an open file, or None when the entry got evicted in the meantime.
+        """
+        try:
+            fp = open(entry.path, "rb")
+        except OSError:
+            return None
+
+        try:
+            # Recency for LRU eviction
+            os.utime(entry.path)
+        except OSError:
+            pass
+
+        return fp
+
+    def filler(self, key: str, upstream, *, content_type: str):
+        """
+        Wraps `upstream` to fill the cache while it streams, when the response starts at byte 0
+        and nobody else is filling the same key. Otherwise `upstream` is returned untouched.
+        """
+        if upstream.status_code == 206:
+            content_range_match = content_range_re.match(upstream.headers.get("Content-Range", ""))
+            if not content_range_match:
+                return upstream
+            first_byte, last_byte, total = map(int, content_range_match.groups())
+        else:
+            first_byte, total = 0, int(upstream.headers.get("Content-Length", -1))
+            last_byte = total - 1
+
+        if first_byte != 0 or total <= 0:
+            return upstream
+
+        covered = last_byte + 1
+        prefix_limit = min(self.prefix_bytes, total)
+
+        if covered == total and total <= self.max_file_bytes:
+            kind, limit = "full", total
+        elif any(content_type.startswith(prefix) for prefix in self.prefix_content_types) and covered >= prefix_limit:
+            kind, limit = ("full", total) if prefix_limit == total else ("prefix", prefix_limit)
+        else:
+            return upstream
+
+        if self.lookup(key, total) is not None and kind == "prefix":
+            return upstream
+
+        lock_fd = os.open(os.path.join(self.directory, "locks", f"{key}.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            # One filler per key, the other workers just proxy.
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(lock_fd)
+            return upstream
+
+        try:
+            return CacheFillStream(self, upstream, key=key, kind=kind, limit=limit, total=total, lock_fd=lock_fd)
+        except OSError:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+            return upstream
+
+    def commit(self, tmp_path: str, key: str, *, kind: str, total: int):
+        os.replace(tmp_path, self._path(key, kind, total))
+        self.stats.record("fills")
+
+        if kind == "full":
+            try:
+                os.unlink(self._path(key, "prefix", total))
+            except OSError:
+                pass
+
+        self.evict()
+
+    def entries(self) -> List[Dict[str, Any]]:
+        entries = []
+
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if not dir_entry.is_file() or not dir_entry.name.endswith((FULL_SUFFIX, PREFIX_SUFFIX)):
+                    continue
+                try:
+                    stat = dir_entry.stat()
+                except OSError:
+                    continue
+
+                kind = "full" if dir_entry.name.endswith(FULL_SUFFIX) else "prefix"
+                entries.append({
+                    "name": dir_entry.name,
+                    "path": dir_entry.path,
+                    "kind": kind,
+                    "file_id": dir_entry.name.split(".", 1)[0],
+                    "size": stat.st_size,
+                    "last_used": stat.st_mtime,
+                })
+
+        return entries
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """
+        Removes least recently used entries until the cache fits in its byte budget.
+        Returns the number of bytes freed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+
+        lock_fd = os.open(os.path.join(self.directory, "locks", "evict.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker is already evicting.
+                return 0
+
+            self._remove_stale_fills()
+
+            entries = sorted(self.entries(), key=lambda entry: entry["last_used"])
+            used = sum(entry["size"] for entry in entries)
+            freed = 0
+
+            for entry in entries:
+                if used <= max_bytes:
+                    break
+                try:
+                    os.unlink(entry["path"])
+                except OSError:
+                    continue
+                used -= entry["size"]
+                freed += entry["size"]
+                self.stats.record("evictions")
+                self.stats.record("evicted_bytes", entry["size"])
+
+            return freed
+        finally:
+            os.close(lock_fd)
+
+    def _remove_stale_fills(self, max_age: int = 3600):
+        # Left behind by workers that were killed mid-fill.
+        tmp_directory = os.path.join(self.directory, "tmp")
+
+        for name in os.listdir(tmp_directory):
+            path = os.path.join(tmp_directory, name)
+            try:
+                if time.time() - os.stat(path).st_mtime > max_age:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+    def purge(self, file_id: Optional[str] = None) -> int:
+        removed = 0
+
+        for entry in self.entries():
+            if file_id is not None and entry["file_id"] != file_id:
+                continue
+            try:
+                os.unlink(entry["path"])
+                removed += 1
+            except OSError:
+                pass
+
+        return removed
+
+    def aggregated_stats(self) -> Dict[str, int]:
+        totals = dict.fromkeys(FileCacheStats.fields, 0)
+        stats_directory = os.path.join(self.directory, "stats")
+
+        for name in os.listdir(stats_directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(stats_directory, name)) as fp:
+                    counters = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            for field in totals:
+                totals[field] += counters.get(field, 0)
+
+        return totals
+
+
+@lru_cache
+def file_cache_get() -> Optional[FileContentCache]:
+    if not settings.FILE_CACHE_ENABLED:
+        return None
+
+    return FileContentCache(
+        directory=str(settings.FILE_CACHE_DIR),
+        max_bytes=settings.FILE_CACHE_MAX_BYTES,
+        max_file_bytes=settings.FILE_CACHE_MAX_FILE_BYTES,
+        prefix_bytes=settings.FILE_CACHE_PREFIX_BYTES,
+        prefix_content_types=settings.FILE_CACHE_PREFIX_CONTENT_TYPES,
+    )
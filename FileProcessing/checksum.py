@@ -0,0 +1,43 @@
+import base64
+import hashlib
+from typing import Iterable, List
+
+from django.core.exceptions import ValidationError
+
+# S3 additional checksums: each part of a multipart upload carries one, S3 checks it on arrival
+# and gives the object a composite one.
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/checking-object-integrity.html
+CHECKSUM_ALGORITHM = "SHA256"
+
+
+def checksum_part(data) -> str:
+    """
+    Base64 SHA-256 of a part, as S3 expects it in ChecksumSHA256.
+
+    bytes, bytearray and memoryview are hashed in place, without a copy.
+    """
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+def checksum_file_part(file_obj) -> str:
+    """
+    `checksum_part` of an uploaded file, read chunk by chunk and rewound for the upload.
+    """
+    hasher = hashlib.sha256()
+    for chunk in file_obj.chunks():
+        hasher.update(chunk)
+    file_obj.seek(0)
+
+    return base64.b64encode(hasher.digest()).decode()
+
+
+def checksum_composite(part_checksums: Iterable[str]) -> str:
+    """
+    The checksum S3 gives the object a multipart upload assembled: the SHA-256 of the parts'
+    digests, followed by `-<part count>`.
+    """
+    digests: List[bytes] = [base64.b64decode(checksum) for checksum in part_checksums]
+    if not all(digests):
+        raise ValidationError("Missing part checksums")
+
+    return f"{base64.b64encode(hashlib.sha256(b''.join(digests)).digest()).decode()}-{len(digests)}"
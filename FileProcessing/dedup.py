@@ -0,0 +1,212 @@
+import hashlib
+import hmac
+import secrets
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from FileProcessing.models import File, UserPersonalFileToken
+from FileProcessing.storage import storage_get_backend
+from FileProcessing.streaming import FileStreamWrapper, storage_open_stream
+
+DEDUP_CHALLENGE_SALT = "FileProcessing.dedup.challenge"
+
+
+def file_open_content(file: File, first_byte: int = 0, last_byte: Optional[int] = None):
+    """
+    The stored bytes of `file`, [first_byte, last_byte] when given.
+    """
+    byte_range = None if first_byte == 0 and last_byte is None else (first_byte, last_byte)
+    body = storage_open_stream(file.file.name, byte_range)
+    body.raise_for_status()
+
+    return body
+
+
+def file_content_sha256(file: File) -> Optional[str]:
+    """
+    SHA-256 of the stored object, read back in one pass.
+
+    For uploads whose bytes never went through a single request in order (multipart parts,
+    presigned parts, tus PATCHes on several workers). None past FILE_DEDUP_READBACK_MAX_SIZE.
+    """
+    if not settings.FILE_DEDUP_ENABLED or file.file_size > settings.FILE_DEDUP_READBACK_MAX_SIZE:
+        return None
+
+    hasher = hashlib.sha256()
+    body = file_open_content(file)
+    try:
+        for chunk in FileStreamWrapper(body):
+            hasher.update(chunk)
+    finally:
+        body.close()
+
+    return hasher.hexdigest()
+
+
+def file_uploaded_sha256(file_obj) -> str:
+    """
+    SHA-256 of an upload received by Django, the streaming upload handler already computed it.
+    """
+    sha256 = getattr(file_obj, "sha256", None)
+    if sha256:
+        return sha256
+
+    hasher = hashlib.sha256()
+    for chunk in file_obj.chunks():
+        hasher.update(chunk)
+    file_obj.seek(0)
+
+    return hasher.hexdigest()
+
+
+def file_find_duplicate(sha256: str, file_size: int, exclude: Optional[str] = None) -> Optional[File]:
+    return (
+        File.objects.filter(sha256=sha256, file_size=file_size, upload_finished_at__isnull=False)
+        .exclude(fileID=exclude)
+        .first()
+    )
+
+
+def file_drop_content(file: File):
+    storage_get_backend().delete(file.file.name)
+
+
+def _file_record_sha256(file: File, sha256: str) -> Optional[File]:
+    """
+    Records the content hash of `file`, or returns the File with the same bytes when there is one.
+    """
+    duplicate = file_find_duplicate(sha256, file.file_size, exclude=file.fileID)
+
+    if duplicate is None:
+        try:
+            # Unique: of two identical uploads finishing together, the second one gets the IntegrityError.
+            with transaction.atomic():
+                File.objects.filter(fileID=file.fileID).update(sha256=sha256)
+            file.sha256 = sha256
+            return None
+        except IntegrityError:
+            duplicate = file_find_duplicate(sha256, file.file_size, exclude=file.fileID)
+
+    return duplicate
+
+
+def _file_replace(file: File, duplicate: File):
+    # Only once the new tokens are committed, a rollback keeps the File and its object.
+    transaction.on_commit(lambda: file_drop_content(file))
+    file.delete()
+    file_undelete(duplicate)
+
+
+def file_deduplicate(file: File, sha256: Optional[str]) -> File:
+    """
+    Records the content hash of a completed upload, or, when a File with the same bytes
+    exists already, drops the new object and File and returns that one instead.
+
+    Personal tokens are created afterwards and point at whatever this returns.
+    """
+    if not sha256 or not settings.FILE_DEDUP_ENABLED:
+        return file
+
+    duplicate = _file_record_sha256(file, sha256)
+    if duplicate is None:
+        return file
+
+    _file_replace(file, duplicate)
+
+    return duplicate
+
+
+def file_deduplicate_token(token: UserPersonalFileToken, sha256: Optional[str]) -> UserPersonalFileToken:
+    """
+    `file_deduplicate` for an upload committed with its token already: the tokens of the new File
+    move to the duplicate. A short transaction of its own, run once the content was hashed.
+    """
+    if not sha256 or not settings.FILE_DEDUP_ENABLED:
+        return token
+
+    with transaction.atomic():
+        # Deleted meanwhile, nothing to deduplicate
+        file = File.objects.select_for_update().filter(fileID=token.file_id_id).first()
+        if file is None:
+            return token
+
+        duplicate = _file_record_sha256(file, sha256)
+        if duplicate is None:
+            return token
+
+        tokens = UserPersonalFileToken.objects.filter(file_id=file)
+        if file.original_file_name != duplicate.original_file_name:
+            # They keep the name the file was uploaded under
+            tokens.filter(change_file_name__isnull=True).update(change_file_name=file.original_file_name)
+        tokens.update(file_id=duplicate)
+
+        _file_replace(file, duplicate)
+
+    token.refresh_from_db()
+
+    return token
+
+
+def file_undelete(file: File):
+    # Back from the recycle bin, somebody uploaded it again
+    if file.is_delete_init:
+        file.is_delete_init = False
+        file.delete_init_at = None
+        file.save(update_fields=["is_delete_init", "delete_init_at"])
+
+
+def dedup_challenge(file: File, user_id) -> Dict[str, Any]:
+    """
+    Proof of possession for an instant upload: the client hashes `nonce` + the bytes at
+    [offset, offset + length) of its copy. Knowing the hash alone does not give the file away.
+    """
+    length = min(settings.FILE_DEDUP_CHALLENGE_BYTES, file.file_size)
+    offset = secrets.randbelow(file.file_size - length + 1)
+    nonce = secrets.token_hex(16)
+
+    challenge = signing.dumps(
+        {"file": file.fileID, "user": str(user_id), "offset": offset, "length": length, "nonce": nonce},
+        salt=DEDUP_CHALLENGE_SALT,
+    )
+
+    return {"challenge": challenge, "offset": offset, "length": length, "nonce": nonce}
+
+
+def dedup_challenge_proof(nonce: str, data) -> str:
+    return hashlib.sha256(nonce.encode() + data).hexdigest()
+
+
+def dedup_verify_challenge(challenge: str, proof: str, user_id) -> File:
+    try:
+        claim = signing.loads(challenge, salt=DEDUP_CHALLENGE_SALT, max_age=settings.FILE_DEDUP_CHALLENGE_MAX_AGE)
+    except signing.BadSignature:
+        raise ValidationError("Invalid or expired challenge")
+
+    if claim["user"] != str(user_id):
+        raise ValidationError("Invalid or expired challenge")
+
+    try:
+        file = File.objects.get(fileID=claim["file"], upload_finished_at__isnull=False)
+    except File.DoesNotExist:
+        raise ValidationError("Invalid or expired challenge")
+
+    data = bytearray()
+    if claim["length"]:
+        body = file_open_content(file, claim["offset"], claim["offset"] + claim["length"] - 1)
+        try:
+            while len(data) < claim["length"]:
+                chunk = body.read(claim["length"] - len(data))
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            body.close()
+
+    if not hmac.compare_digest(dedup_challenge_proof(claim["nonce"], data), proof.lower()):
+        raise ValidationError("Proof does not match the file content")
+
+    return file
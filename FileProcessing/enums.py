@@ -9,3 +9,18 @@ class FileUploadStrategy(Enum):
 class FileUploadStorage(Enum):
     LOCAL = "local"
     S3 = "s3"
+    MEMORY = "memory"  # Tests and benchmarks
+
+
+class FileDeliveryMode(Enum):
+    PROXY = "proxy"
+    REDIRECT = "redirect"
+    X_ACCEL_REDIRECT = "x-accel-redirect"
+    X_SENDFILE = "x-sendfile"
+
+
+class FileImportStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
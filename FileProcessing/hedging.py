@@ -0,0 +1,410 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional
+
+from django.conf import settings
+
+from integrations.storage.base import ByteRange, StorageBackend, StorageError
+
+# First-byte latencies kept for the hedge percentile, and how many it needs before it is trusted
+HEDGE_LATENCY_WINDOW = 1000
+HEDGE_MIN_SAMPLES = 20
+# Hedges that can be saved up while reads are fast, spent by a burst of slow ones
+HEDGE_MAX_TOKENS = 10
+
+
+class StorageDeadlineExceeded(StorageError):
+    def __init__(self, deadline: float):
+        super().__init__("DeadlineExceeded", f"Storage did not answer within {deadline} s")
+
+
+class StorageUnavailable(StorageError):
+    """
+    Raised without calling storage while the circuit breaker is open.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__("ServiceUnavailable", f"Storage is failing, retry in {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails reads fast once storage is degraded.
+
+    `failures` consecutive failed reads open it: for `cooldown` seconds reads are refused without
+    calling storage. Then a single read probes storage (half-open), its success closes the breaker
+    and its failure opens it again. 0 `failures` disables it.
+    """
+
+    def __init__(self, *, failures: int, cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if self.probing or time.monotonic() >= self.opened_at + self.cooldown:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        """
+        Raises StorageUnavailable when the read must not reach storage.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+
+            retry_after = self.opened_at + self.cooldown - time.monotonic()
+            if retry_after > 0 or self.probing:
+                raise StorageUnavailable(max(retry_after, 1))
+
+            self.probing = True
+
+    def record(self, success: bool) -> bool:
+        """
+        Accounts for a finished read, True when it opened the breaker.
+        """
+        if not self.failures:
+            return False
+
+        with self._lock:
+            if success:
+                self.consecutive_failures = 0
+                self.opened_at = None
+                self.probing = False
+                return False
+
+            self.consecutive_failures += 1
+            if self.probing or (self.opened_at is None and self.consecutive_failures >= self.failures):
+                self.opened_at = time.monotonic()
+                self.probing = False
+                return True
+
+            return False
+
+
+class StorageReadStats:
+    """
+    Process wide counters of storage reads, hedges and the circuit breaker.
+    """
+
+    fields = (
+        "reads",
+        "failures",
+        "hedges_fired",
+        "hedges_won",
+        "hedges_over_budget",
+        "deadlines_exceeded",
+        "breaker_opened",
+        "breaker_rejected",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.fields, 0)
+
+    def record(self, field: str, amount: int = 1):
+        with self._lock:
+            self._counters[field] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+class HedgedReader:
+    """
+    Bounds how long opening a storage read may take, which is what stalls the start of a video.
+
+    - `deadline`: seconds until storage answers with headers, StorageDeadlineExceeded past it.
+    - `hedge`: a read still waiting for headers at the `hedge_percentile` of recent first-byte latencies
+      (clamped to [`hedge_min_delay`, `hedge_max_delay`]) gets a second, identical GET, and whichever
+      answers first is kept, the other one is dropped. Hedges are paid for by a budget:
+      `hedge_budget` hedges per read at most, so a slow storage is never sent twice the load.
+    - A CircuitBreaker refuses reads while storage keeps failing.
+
+    Only opening is covered, a body stalling once headers arrived is up to the upstream read timeout.
+    With neither a deadline nor hedging, reads are opened by the calling thread as before.
+    """
+
+    def __init__(
+        self,
+        *,
+        deadline: float = 0,
+        hedge: bool = False,
+        hedge_percentile: float = 95,
+        hedge_min_delay: float = 0,
+        hedge_max_delay: float = 1,
+        hedge_budget: float = 0.05,
+        breaker_failures: int = 0,
+        breaker_cooldown: float = 10,
+        threads: int = 32,
+    ):
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_budget = hedge_budget
+
+        self.breaker = CircuitBreaker(failures=breaker_failures, cooldown=breaker_cooldown)
+        self.stats = StorageReadStats()
+
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=HEDGE_LATENCY_WINDOW)
+        self._hedge_tokens = 1.0
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="storage-read")
+
+    def hedge_delay(self) -> float:
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return self.hedge_max_delay
+
+        latency = latencies[max(math.ceil(len(latencies) * self.hedge_percentile / 100) - 1, 0)]
+
+        return min(max(latency, self.hedge_min_delay), self.hedge_max_delay)
+
+    def _deposit(self, latency: Optional[float] = None):
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            self._hedge_tokens = min(self._hedge_tokens + self.hedge_budget, HEDGE_MAX_TOKENS)
+
+    def _withdraw(self) -> bool:
+        with self._lock:
+            if self._hedge_tokens < 1:
+                return False
+            self._hedge_tokens -= 1
+            return True
+
+    def _start(self):
+        try:
+            self.breaker.allow()
+        except StorageUnavailable:
+            self.stats.record("breaker_rejected")
+            raise
+
+        self.stats.record("reads")
+
+    def _finish(self, response=None, latency: Optional[float] = None):
+        """
+        Accounts for a read: answered with `response` after `latency` seconds, or failed.
+        """
+        success = response is not None and response.status_code < 500
+        if not success:
+            self.stats.record("failures")
+        if self.breaker.record(success):
+            self.stats.record("breaker_opened")
+
+        self._deposit(latency if success else None)
+
+    def _should_hedge(self) -> bool:
+        if self._withdraw():
+            self.stats.record("hedges_fired")
+            return True
+
+        self.stats.record("hedges_over_budget")
+        return False
+
+    def _wait_timeout(self, started: float, hedged: bool, hedge_delay: float) -> Optional[float]:
+        timeouts = []
+        if self.deadline:
+            timeouts.append(started + self.deadline - time.monotonic())
+        if self.hedge and not hedged:
+            timeouts.append(started + hedge_delay - time.monotonic())
+
+        return max(min(timeouts), 0) if timeouts else None
+
+    def open(self, backend: StorageBackend, key: str, byte_range: Optional[ByteRange] = None):
+        """
+        `backend.open(key, byte_range)`, within the deadline and hedged.
+        """
+        self._start()
+        started = time.monotonic()
+
+        if not self.deadline and not self.hedge:
+            try:
+                response = backend.open(key, byte_range)
+            except BaseException:
+                self._finish()
+                raise
+            self._finish(response, time.monotonic() - started)
+            return response
+
+        def timed_open():
+            attempt_started = time.monotonic()
+            response = backend.open(key, byte_range)
+            return response, time.monotonic() - attempt_started
+
+        attempts = [self._executor.submit(timed_open)]
+        hedged, hedge_delay = False, self.hedge_delay()
+        winner = None
+        try:
+            while True:
+                done, _ = wait(
+                    [attempt for attempt in attempts if attempt is not None],
+                    timeout=self._wait_timeout(started, hedged, hedge_delay),
+                    return_when=FIRST_COMPLETED,
+                )
+
+                for attempt in done:
+                    if attempt.exception() is None:
+                        winner = attempt
+                        break
+                    # Failed, the other attempt may still answer.
+                    attempts[attempts.index(attempt)] = None
+
+                if winner is not None:
+                    response, latency = winner.result()
+                    if attempts.index(winner) == 1:
+                        self.stats.record("hedges_won")
+                    self._finish(response, latency)
+                    return response
+
+                pending = [attempt for attempt in attempts if attempt is not None]
+                if not pending:
+                    failed = next(iter(done))
+                    self._finish()
+                    raise failed.exception()
+
+                if self.deadline and time.monotonic() >= started + self.deadline:
+                    self.stats.record("deadlines_exceeded")
+                    self._finish()
+                    raise StorageDeadlineExceeded(self.deadline)
+
+                if self.hedge and not hedged and time.monotonic() >= started + hedge_delay:
+                    hedged = True
+                    if self._should_hedge():
+                        attempts.append(self._executor.submit(timed_open))
+        finally:
+            for attempt in attempts:
+                if attempt is not None and attempt is not winner:
+                    attempt.cancel()
+                    _discard_attempt(attempt)
+
+    async def aopen(self, backend: StorageBackend, key: str, byte_range: Optional[ByteRange] = None):
+        """
+        `open` for the async views, with `backend.aopen`.
+        """
+        self._start()
+        started = time.monotonic()
+
+        async def timed_open():
+            attempt_started = time.monotonic()
+            response = await backend.aopen(key, byte_range)
+            return response, time.monotonic() - attempt_started
+
+        if not self.deadline and not self.hedge:
+            try:
+                response, latency = await timed_open()
+            except BaseException:
+                self._finish()
+                raise
+            self._finish(response, latency)
+            return response
+
+        attempts: List[Optional[asyncio.Task]] = [asyncio.ensure_future(timed_open())]
+        hedged, hedge_delay = False, self.hedge_delay()
+        winner = None
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    [attempt for attempt in attempts if attempt is not None],
+                    timeout=self._wait_timeout(started, hedged, hedge_delay),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                for attempt in done:
+                    if attempt.exception() is None:
+                        winner = attempt
+                        break
+                    attempts[attempts.index(attempt)] = None
+
+                if winner is not None:
+                    response, latency = winner.result()
+                    if attempts.index(winner) == 1:
+                        self.stats.record("hedges_won")
+                    self._finish(response, latency)
+                    return response
+
+                pending = [attempt for attempt in attempts if attempt is not None]
+                if not pending:
+                    failed = next(iter(done))
+                    self._finish()
+                    raise failed.exception()
+
+                if self.deadline and time.monotonic() >= started + self.deadline:
+                    self.stats.record("deadlines_exceeded")
+                    self._finish()
+                    raise StorageDeadlineExceeded(self.deadline)
+
+                if self.hedge and not hedged and time.monotonic() >= started + hedge_delay:
+                    hedged = True
+                    if self._should_hedge():
+                        attempts.append(asyncio.ensure_future(timed_open()))
+        finally:
+            for attempt in attempts:
+                if attempt is not None and attempt is not winner:
+                    attempt.cancel()
+                    _discard_attempt(attempt)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        return {
+            **self.stats.snapshot(),
+            "breaker_state": self.breaker.state,
+            "hedge_delay": self.hedge_delay(),
+            "first_byte_p50": latencies[len(latencies) // 2] if latencies else None,
+            "first_byte_p99": latencies[max(math.ceil(len(latencies) * 0.99) - 1, 0)] if latencies else None,
+        }
+
+
+def _discard_attempt(attempt):
+    """
+    Closes the response of an attempt that lost, whenever it arrives.
+    """
+
+    def close(attempt):
+        if not attempt.cancelled() and attempt.exception() is None:
+            attempt.result()[0].close()
+
+    attempt.add_done_callback(close)
+
+
+@lru_cache
+def hedged_reader_get() -> HedgedReader:
+    return HedgedReader(
+        deadline=settings.FILE_STORAGE_READ_DEADLINE,
+        hedge=settings.FILE_STORAGE_HEDGE_ENABLED,
+        hedge_percentile=settings.FILE_STORAGE_HEDGE_PERCENTILE,
+        hedge_min_delay=settings.FILE_STORAGE_HEDGE_MIN_DELAY,
+        hedge_max_delay=settings.FILE_STORAGE_HEDGE_MAX_DELAY,
+        hedge_budget=settings.FILE_STORAGE_HEDGE_BUDGET,
+        breaker_failures=settings.FILE_STORAGE_BREAKER_FAILURES,
+        breaker_cooldown=settings.FILE_STORAGE_BREAKER_COOLDOWN,
+        # Two attempts per read of every connection the upstream pool has
+        threads=2 * settings.UPSTREAM_POOL_MAXSIZE,
+    )
+
+
+# Locks and worker threads do not survive a fork.
+os.register_at_fork(after_in_child=hedged_reader_get.cache_clear)
@@ -0,0 +1,316 @@
+import ipaddress
+import logging
+import os
+import posixpath
+import re
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+from urllib import parse
+
+import requests
+from attrs import define
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, transaction
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import create_connection
+from urllib3.util.retry import Retry
+
+from integrations.upstream.client import UpstreamResponse, upstream_get_config
+
+logger = logging.getLogger(__name__)
+
+IMPORT_MAX_REDIRECTS = 5
+IMPORT_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+content_range_re = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class ImportFailed(Exception):
+    """
+    Why an import failed, as the user sees it on the job.
+    """
+
+
+@define
+class ImportSource:
+    url: str  # After redirects
+    size: int
+    ranged: bool
+    file_name: str
+    content_type: str
+    # For If-Range, so a source changing mid-import is not stitched together
+    validator: Optional[str]
+    # The whole body, when the source does not answer range requests
+    body: Optional[UpstreamResponse]
+
+
+def import_resolve(hostname: str, port: int) -> str:
+    """
+    The address to connect to for `hostname`, all of whose addresses must be public: users must not
+    make the server fetch from its own network (cloud metadata, internal services), unless FILE_IMPORT_ALLOW_PRIVATE_HOSTS.
+    """
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(hostname, port, type=socket.SOCK_STREAM)]
+    except (socket.gaierror, UnicodeError):
+        raise ValidationError(f"Could not resolve {hostname}")
+    if not addresses:
+        raise ValidationError(f"Could not resolve {hostname}")
+
+    if not settings.FILE_IMPORT_ALLOW_PRIVATE_HOSTS:
+        for address in addresses:
+            if not ipaddress.ip_address(address.split("%")[0]).is_global:
+                raise ValidationError(f"{hostname} is not a public host")
+
+    return addresses[0]
+
+
+def import_check_url(url: str):
+    """
+    Only http(s) URLs of public hosts, see `import_resolve`. Connections check again as they are made.
+    """
+    parsed = parse.urlsplit(url)
+
+    try:
+        port = parsed.port
+    except ValueError:
+        raise ValidationError("Invalid URL")
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValidationError("Only http and https URLs can be imported")
+
+    import_resolve(parsed.hostname, port or (443 if parsed.scheme == "https" else 80))
+
+
+class ImportConnectionMixin:
+    """
+    Connects to the address `import_resolve` checked, never resolving the host again: a host whose DNS
+    changes between the check and the connection (DNS rebinding) cannot point the import at a private address.
+    Host header, SNI and certificate checks still use the host name.
+    """
+
+    def _new_conn(self) -> socket.socket:
+        address = import_resolve(self.host, self.port)
+
+        try:
+            sock = create_connection(
+                (address, self.port), self.timeout, source_address=self.source_address, socket_options=self.socket_options
+            )
+        except socket.timeout as e:
+            raise ConnectTimeoutError(self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})") from e
+        except OSError as e:
+            raise NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+
+        return sock
+
+
+class ImportHTTPConnection(ImportConnectionMixin, HTTPConnection):
+    pass
+
+
+class ImportHTTPSConnection(ImportConnectionMixin, HTTPSConnection):
+    pass
+
+
+class ImportHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = ImportHTTPConnection
+
+
+class ImportHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = ImportHTTPSConnection
+
+
+class ImportHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": ImportHTTPConnectionPool,
+            "https": ImportHTTPSConnectionPool,
+        }
+
+
+@lru_cache
+def import_get_session() -> requests.Session:
+    """
+    The session imports fetch with, apart from the storage pools: sources are arbitrary hosts,
+    each kept alive for the range requests of its job.
+    """
+    config = upstream_get_config()
+
+    adapter = ImportHTTPAdapter(
+        pool_connections=settings.FILE_IMPORT_MAX_JOBS,
+        pool_maxsize=settings.FILE_IMPORT_CONCURRENCY,
+        max_retries=Retry(
+            total=config.max_retries,
+            backoff_factor=config.retry_backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        ),
+    )
+
+    session = requests.Session()
+    # A proxy from the environment would resolve the host itself.
+    session.trust_env = False
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+# Sockets must never be shared between gunicorn workers.
+os.register_at_fork(after_in_child=import_get_session.cache_clear)
+
+
+def _import_get(url: str, headers: Dict[str, str]) -> UpstreamResponse:
+    config = upstream_get_config()
+
+    response = import_get_session().get(
+        url, headers=headers, stream=True, timeout=(config.connect_timeout, config.read_timeout), allow_redirects=False
+    )
+
+    return UpstreamResponse(response)
+
+
+def import_open(url: str, headers: Dict[str, str]) -> Tuple[str, UpstreamResponse]:
+    """
+    GETs `url`, following redirects only to URLs that pass `import_check_url`. Returns the final URL too.
+    """
+    # Compressed bodies would be stored compressed, and ranges would apply to the compressed bytes.
+    headers = {"Accept-Encoding": "identity", **headers}
+
+    for _ in range(IMPORT_MAX_REDIRECTS + 1):
+        import_check_url(url)
+        response = _import_get(url, headers)
+
+        if response.status_code not in IMPORT_REDIRECT_STATUSES:
+            return url, response
+
+        location = response.headers.get("Location")
+        response.close()
+        if not location:
+            raise ImportFailed("The source redirected without a location")
+        url = parse.urljoin(url, location)
+
+    raise ImportFailed("The source redirected too many times")
+
+
+def import_probe(url: str) -> ImportSource:
+    """
+    Asks for the first byte: a 206 tells the size and that ranges can be fetched in parallel.
+    A 200 is the whole body instead, read in order.
+    """
+    url, response = import_open(url, {"Range": "bytes=0-0"})
+
+    if response.status_code == 416:
+        # Empty, there is no first byte
+        response.close()
+        url, response = import_open(url, {})
+
+    size = None
+    ranged = response.status_code == 206
+    if ranged:
+        match = content_range_re.match(response.headers.get("Content-Range", ""))
+        size = int(match.group(3)) if match else None
+        # The one byte, the connection goes back to the pool
+        response.read()
+        response.close()
+    elif response.status_code == 200:
+        size = response.headers.get("Content-Length")
+        size = int(size) if size and size.isdigit() else None
+    else:
+        response.close()
+        raise ImportFailed(f"The source answered {response.status_code}")
+
+    if size is None:
+        response.close()
+        raise ImportFailed("The source did not tell the file size")
+
+    disposition = Message()
+    disposition["Content-Disposition"] = response.headers.get("Content-Disposition", "")
+    file_name = disposition.get_filename() or parse.unquote(posixpath.basename(parse.urlsplit(url).path))
+
+    validator = response.headers.get("ETag")
+    if not validator or validator.startswith("W/"):
+        # If-Range needs a strong validator
+        validator = response.headers.get("Last-Modified")
+
+    return ImportSource(
+        url=url,
+        size=size,
+        ranged=ranged,
+        file_name=posixpath.basename(file_name.replace("\\", "/"))[:255] or "file",
+        content_type=response.headers.get("Content-Type", "").split(";")[0].strip()[:255],
+        validator=validator,
+        body=None if ranged else response,
+    )
+
+
+def import_open_range(source: ImportSource, first_byte: int, last_byte: int) -> UpstreamResponse:
+    headers = {"Accept-Encoding": "identity", "Range": f"bytes={first_byte}-{last_byte}"}
+    if source.validator:
+        headers["If-Range"] = source.validator
+
+    # Redirects there are not followed
+    response = _import_get(source.url, headers)
+
+    if response.status_code != 206:
+        response.close()
+        if response.status_code == 200:
+            raise ImportFailed("The source changed during the import")
+        raise ImportFailed(f"The source answered {response.status_code}")
+
+    return response
+
+
+def import_read(body, size: int, cancelled: Optional[Callable[[], bool]] = None) -> bytearray:
+    """
+    Exactly `size` bytes of `body`, into one buffer.
+    """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+
+    while received < size:
+        if cancelled is not None and cancelled():
+            raise ImportFailed("Import cancelled")
+
+        chunk = body.read(min(settings.FILE_STREAM_CHUNK_SIZE, size - received))
+        if not chunk:
+            raise ImportFailed(f"The source closed the connection after {received} of {size} bytes")
+
+        view[received:received + len(chunk)] = chunk
+        received += len(chunk)
+
+    return data
+
+
+@lru_cache
+def _import_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=settings.FILE_IMPORT_MAX_JOBS, thread_name_prefix="file-import")
+
+
+def _import_run(run: Callable[[str], None], job_id: str):
+    try:
+        run(job_id)
+    except Exception:
+        logger.exception("Import %s failed", job_id)
+    finally:
+        close_old_connections()
+
+
+def import_enqueue(run: Callable[[str], None], job_id: str):
+    """
+    Runs `run(job_id)` in a background thread of this process, once the current transaction committed.
+
+    At most FILE_IMPORT_MAX_JOBS run at once, the others wait in line. Jobs are lost with the process
+    (restart, crash): the upload reaper fails those without progress for FILE_UPLOAD_REAPER_TTL seconds,
+    and cleans up their upload.
+    """
+    transaction.on_commit(lambda: _import_executor().submit(_import_run, run, job_id))
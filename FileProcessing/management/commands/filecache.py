@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from FileProcessing.cache import file_cache_get
+
+
+class Command(BaseCommand):
+    help = "Inspect and purge the local disk cache of file content."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--list", action="store_true", help="List every cached entry.")
+        parser.add_argument("--purge", action="store_true", help="Remove every cached entry.")
+        parser.add_argument("--purge-file", metavar="FILE_ID", help="Remove the cached entries of one file.")
+        parser.add_argument("--evict", action="store_true", help="Evict least recently used entries down to the budget.")
+
+    def handle(self, *args, **options):
+        cache = file_cache_get()
+        if cache is None:
+            raise CommandError("The file cache is disabled, set FILE_CACHE_ENABLED=True.")
+
+        if options["purge"] or options["purge_file"]:
+            removed = cache.purge(file_id=options["purge_file"])
+            self.stdout.write(self.style.SUCCESS(f"Removed {removed} entries."))
+
+        if options["evict"]:
+            freed = cache.evict()
+            self.stdout.write(self.style.SUCCESS(f"Evicted {freed} bytes."))
+
+        entries = cache.entries()
+
+        if options["list"]:
+            for entry in sorted(entries, key=lambda entry: entry["last_used"], reverse=True):
+                self.stdout.write(f"{entry['kind']:<7} {entry['size']:>14} {entry['name']}")
+
+        used = sum(entry["size"] for entry in entries)
+        self.stdout.write(f"Directory: {cache.directory}")
+        self.stdout.write(
+            f"Entries: {len(entries)} "
+            f"({sum(entry['kind'] == 'full' for entry in entries)} full, "
+            f"{sum(entry['kind'] == 'prefix' for entry in entries)} prefix)"
+        )
+        self.stdout.write(f"Used: {used} of {cache.max_bytes} bytes ({used / cache.max_bytes:.1%})")
+
+        stats = cache.aggregated_stats()
+        lookups = stats["hits"] + stats["partial_hits"] + stats["misses"]
+        self.stdout.write(
+            "Hits: {hits}, partial hits: {partial_hits}, misses: {misses}, fills: {fills}, "
+            "aborted fills: {fill_aborts}, evictions: {evictions} ({evicted_bytes} bytes)".format(**stats)
+        )
+        if lookups:
+            self.stdout.write(f"Hit rate: {(stats['hits'] + stats['partial_hits']) / lookups:.1%}")
@@ -0,0 +1,66 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from FileProcessing.reaper import UploadReaper
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Clean up uploads started and never finished: their File rows, S3 multipart uploads and objects, and interrupted imports."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ttl", type=int, default=settings.FILE_UPLOAD_REAPER_TTL,
+            help="Seconds after which an unfinished upload counts as abandoned.",
+        )
+        parser.add_argument("--batch-size", type=int, default=settings.FILE_UPLOAD_REAPER_BATCH_SIZE)
+        parser.add_argument("--concurrency", type=int, default=settings.FILE_UPLOAD_REAPER_CONCURRENCY)
+        parser.add_argument(
+            "--no-sweep", action="store_true",
+            help="Skip listing the bucket for multipart uploads no session knows of.",
+        )
+        parser.add_argument(
+            "--interval", type=int, default=0,
+            help="Run again every this many seconds until stopped, instead of once. Run one such process per deployment.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                self.reap(options)
+            except Exception:
+                if not options["interval"]:
+                    raise
+                logger.exception("Upload reaper run failed")
+
+            if not options["interval"]:
+                return
+
+            close_old_connections()
+            time.sleep(options["interval"])
+
+    def reap(self, options):
+        stats = UploadReaper(
+            ttl=options["ttl"],
+            batch_size=options["batch_size"],
+            concurrency=options["concurrency"],
+            sweep=not options["no_sweep"],
+        ).run()
+
+        self.stdout.write(
+            "Files deleted: {files_deleted}, multipart uploads aborted: {uploads_aborted} "
+            "(+{uploads_swept} untracked), objects deleted: {objects_deleted}".format(**stats)
+        )
+        self.stdout.write(f"Reclaimed: {stats['bytes_reclaimed']} bytes")
+        if stats["imports_failed"]:
+            self.stdout.write(f"Interrupted imports failed: {stats['imports_failed']}")
+
+        if stats["errors"]:
+            self.stdout.write(self.style.WARNING(f"{stats['errors']} uploads could not be cleaned up, they are retried next run."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Done."))
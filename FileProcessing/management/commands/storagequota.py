@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from Account.models import User
+from FileProcessing.models import UserStorageUsage
+from FileProcessing.quota import storage_quota, storage_recount, storage_release_expired
+
+
+class Command(BaseCommand):
+    help = "Release expired upload reservations and recount per-user storage usage."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--release-expired", action="store_true", help="Give back the space held by abandoned uploads.")
+        parser.add_argument("--recount", action="store_true", help="Count every user's usage from their tokens again.")
+        parser.add_argument("--user", metavar="EMAIL", help="Only recount this user.")
+
+    def handle(self, *args, **options):
+        if options["release_expired"]:
+            released = storage_release_expired()
+            self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations."))
+
+        if options["recount"]:
+            users = User.objects.all()
+            if options["user"]:
+                users = users.filter(email=options["user"])
+
+            for user in users.iterator():
+                storage_recount(user)
+            self.stdout.write(self.style.SUCCESS("Usage recounted."))
+
+        quota = storage_quota()
+        for usage in UserStorageUsage.objects.select_related("user").order_by("-used")[:20]:
+            self.stdout.write(
+                f"{usage.user.email:<40} used {usage.used:>14} bin {usage.in_bin:>14} reserved {usage.reserved:>14}"
+                + ("" if quota is None else f" ({(usage.used + usage.reserved) / quota:.1%})")
+            )
@@ -1,8 +1,11 @@
+import uuid
+
 from django.conf import settings
 from django.db import models
+from django.utils.http import quote_etag
 
 # from DriveNow.common.models import BaseModel
-from FileProcessing.enums import FileUploadStorage
+from FileProcessing.enums import FileDeliveryMode, FileImportStatus, FileUploadStorage
 from FileProcessing.utils import file_generate_upload_path
 from Account.models import User
 
@@ -28,6 +31,13 @@ class File(models.Model):
     is_delete_init = models.BooleanField(default=False)
     delete_init_at = models.DateTimeField(blank=True, null=True)
 
+    # ETag reported by storage once the upload completed, without quotes
+    etag = models.CharField(max_length=255, blank=True, default="")
+    # Hex SHA-256 of the content, one File (and object) per distinct content
+    sha256 = models.CharField(max_length=64, blank=True, null=True, unique=True)
+    # S3 SHA-256 checksum of the object, base64, `-<parts>` for the composite one of a multipart upload
+    checksum = models.CharField(max_length=64, blank=True, default="")
+
 
     @property
     def is_valid(self):
@@ -36,6 +46,27 @@ class File(models.Model):
         """
         return bool(self.upload_finished_at)
 
+    @property
+    def strong_etag(self):
+        """
+        Strong validator of the stored bytes, resolvable from this row alone.
+        Falls back to fileID + upload time, which changes whenever the content does.
+        """
+        if self.etag:
+            return quote_etag(self.etag)
+
+        if not self.upload_finished_at:
+            return None
+
+        return quote_etag(f"{self.fileID}-{int(self.upload_finished_at.timestamp() * 1000000)}")
+
+    @property
+    def last_modified(self):
+        if not self.upload_finished_at:
+            return None
+
+        return int(self.upload_finished_at.timestamp())
+
     @property
     def url(self):
         if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.S3.value:
@@ -58,3 +89,127 @@ class UserPersonalFileToken(models.Model):
     favourite = models.BooleanField(default=False)
     change_file_name = models.TextField(blank=True, null=True)
     views = models.IntegerField(default=0)
+
+    # Overrides settings.FILE_DELIVERY_MODE for this token only
+    delivery_mode = models.CharField(
+        max_length=16,
+        blank=True,
+        null=True,
+        choices=[(mode.value, mode.name.title()) for mode in FileDeliveryMode],
+    )
+
+
+class MultipartUploadSession(models.Model):
+    """
+    S3 multipart upload in progress, shared by all workers.
+
+    Deleted (with its parts) once the upload is completed.
+    """
+    file = models.OneToOneField(File, primary_key=True, on_delete=models.CASCADE, related_name="upload_session")
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    bucket = models.CharField(max_length=255)
+    key = models.CharField(max_length=1024)
+    upload_id = models.CharField(max_length=1024)
+
+    # Declared by the client at start, checked against the parts at completion
+    file_size = models.BigIntegerField()
+    # Size of every part but the last one, for clients uploading straight to S3 with presigned URLs
+    part_size = models.BigIntegerField(blank=True, null=True)
+    # tus uploads: bytes received so far, the recorded parts plus the tail object (not a whole part yet)
+    offset = models.BigIntegerField(default=0)
+    # Set when the upload was created with a checksum algorithm: every part carries a checksum of it
+    checksum_algorithm = models.CharField(max_length=16, blank=True, default="")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def part_count(self):
+        if not self.part_size:
+            return None
+
+        return max(-(-self.file_size // self.part_size), 1)
+
+
+class MultipartUploadPart(models.Model):
+    session = models.ForeignKey(MultipartUploadSession, on_delete=models.CASCADE, related_name="parts")
+    part_number = models.PositiveIntegerField()
+
+    etag = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    # Base64 ChecksumSHA256 S3 verified the part against
+    checksum = models.CharField(max_length=255, blank=True, default="")
+
+    uploaded_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # A re-uploaded part replaces the previous one, like on S3
+            models.UniqueConstraint(fields=["session", "part_number"], name="unique_multipart_upload_part"),
+        ]
+
+
+class UserStorageUsage(models.Model):
+    """
+    Running totals of a user's storage, updated with F() expressions as tokens come and go,
+    so quota checks read one row instead of summing every token.
+    """
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.CASCADE, related_name="storage_usage")
+
+    # Bytes of the tokens not permanently deleted, the recycle bin included
+    used = models.BigIntegerField(default=0)
+    # Of which in the recycle bin
+    in_bin = models.BigIntegerField(default=0)
+    # Held for uploads in progress
+    reserved = models.BigIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class StorageReservation(models.Model):
+    """
+    Space held for an upload in progress, from its start until its token exists.
+
+    Keyed by the File id without a foreign key: the File can go (deduplication, termination)
+    while the reservation still has to be released.
+    """
+    file_id = models.CharField(primary_key=True, max_length=255)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="storage_reservations")
+
+    size = models.BigIntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Abandoned uploads give the space back after this
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class FileImportJob(models.Model):
+    """
+    A file the server fetches from a URL straight into storage (FileProcessing.imports),
+    instead of the user downloading and uploading it again.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="file_imports")
+
+    url = models.URLField(max_length=2048)
+    # Taken from the source when not given
+    file_name = models.CharField(max_length=255, blank=True, default="")
+
+    status = models.CharField(
+        max_length=16,
+        choices=[(status.value, status.name.title()) for status in FileImportStatus],
+        default=FileImportStatus.PENDING.value,
+    )
+    # Reported by the source, and bytes of it in storage so far
+    file_size = models.BigIntegerField(blank=True, null=True)
+    received = models.BigIntegerField(default=0)
+    # Whether the source answered range requests, fetched in parallel then
+    ranged = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default="")
+
+    file = models.ForeignKey(File, blank=True, null=True, on_delete=models.SET_NULL)
+    token = models.ForeignKey(UserPersonalFileToken, blank=True, null=True, on_delete=models.SET_NULL)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
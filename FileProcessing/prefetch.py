@@ -0,0 +1,110 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Optional, Tuple
+
+
+class PrefetchCancelled(Exception):
+    pass
+
+
+class ParallelRangeReader:
+    """
+    Reads bytes [first_byte, last_byte] of an object as `part_size` ranges,
+    `concurrency` of them in flight at once, and hands them out in order.
+
+    The reorder window holds at most `concurrency` parts: the next range is only
+    requested once the consumer took a part out, so a slow client slows storage
+    reads down instead of buffering the whole object. `close` (the client went away)
+    cancels queued parts and makes in-flight ones drop their connection.
+
+    `open_range(first_byte, last_byte)` returns an upstream response (read / close / raise_for_status),
+    `first_part` optionally is the already opened response of the first range.
+    """
+
+    read_size = 262144
+
+    def __init__(
+        self,
+        open_range: Callable[[int, int], object],
+        first_byte: int,
+        last_byte: int,
+        *,
+        part_size: int,
+        concurrency: int,
+        first_part=None,
+    ):
+        self.open_range = open_range
+        self.part_size = part_size
+        self.concurrency = concurrency
+
+        self.ranges: Deque[Tuple[int, int]] = deque(
+            (start, min(start + part_size - 1, last_byte)) for start in range(first_byte, last_byte + 1, part_size)
+        )
+        self.window: Deque[Future] = deque()
+        self.current: Optional[memoryview] = None
+        self.cancelled = threading.Event()
+
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="file-prefetch")
+
+        if first_part is not None:
+            self.window.append(self.executor.submit(self._fetch, *self.ranges.popleft(), first_part))
+        self._fill_window()
+
+    def _fill_window(self):
+        while self.ranges and len(self.window) < self.concurrency:
+            self.window.append(self.executor.submit(self._fetch, *self.ranges.popleft()))
+
+    def _fetch(self, first_byte: int, last_byte: int, upstream=None) -> bytes:
+        if self.cancelled.is_set():
+            raise PrefetchCancelled()
+
+        if upstream is None:
+            upstream = self.open_range(first_byte, last_byte)
+
+        try:
+            upstream.raise_for_status()
+
+            expected = last_byte - first_byte + 1
+            part = bytearray(expected)
+            view = memoryview(part)
+            received = 0
+
+            while received < expected:
+                if self.cancelled.is_set():
+                    raise PrefetchCancelled()
+
+                data = upstream.read(min(self.read_size, expected - received))
+                if not data:
+                    raise IOError(f"Storage closed range {first_byte}-{last_byte} after {received} bytes")
+
+                view[received:received + len(data)] = data
+                received += len(data)
+
+            return part
+        finally:
+            # Drops the connection when the part was not read through.
+            upstream.close()
+
+    def read(self, amt: Optional[int] = None):
+        while not self.current:
+            if not self.window:
+                return b""
+
+            part = self.window.popleft().result()
+            self.current = memoryview(part)
+            self._fill_window()
+
+        amt = len(self.current) if amt is None else amt
+        data, self.current = self.current[:amt], self.current[amt:]
+
+        return data
+
+    def close(self):
+        self.cancelled.set()
+        self.ranges.clear()
+
+        for future in self.window:
+            future.cancel()
+        self.window.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional, Set, Tuple
+
+from attrs import define
+from django.conf import settings
+
+from FileProcessing.storage import storage_get_backend
+
+# (object key, Content-Disposition, Content-Type, lifetime)
+PresignKey = Tuple[str, Optional[str], Optional[str], int]
+
+
+@define
+class PresignedUrl:
+    url: str
+    expires_at: float  # Unix time
+
+
+class PresignCache:
+    """
+    Presigned download URLs of this process, handed out again until `margin` seconds before they expire.
+
+    Bounded: past `max_entries` the least recently used go first, expired ones are dropped when looked up.
+    Entries are keyed by the Content-Disposition too, so a renamed file is never handed out under its old
+    name, and every entry of an object can be dropped at once (`invalidate`) when it is renamed or deleted.
+    """
+
+    def __init__(self, max_entries: int, margin: int):
+        self.max_entries = max_entries
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[PresignKey, PresignedUrl]" = OrderedDict()
+        self._object_keys: Dict[str, Set[PresignKey]] = {}
+        self._counters = dict.fromkeys(("hits", "misses", "expired", "evictions", "invalidations"), 0)
+
+    def get(self, key: PresignKey) -> Optional[PresignedUrl]:
+        with self._lock:
+            presigned = self._entries.get(key)
+            if presigned is None:
+                self._counters["misses"] += 1
+                return None
+
+            if presigned.expires_at - self.margin <= time.time():
+                self._pop(key)
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return presigned
+
+    def put(self, key: PresignKey, presigned: PresignedUrl):
+        if presigned.expires_at - self.margin <= time.time():
+            # Too short-lived to be handed out twice
+            return
+
+        with self._lock:
+            self._entries[key] = presigned
+            self._entries.move_to_end(key)
+            self._object_keys.setdefault(key[0], set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._pop(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def invalidate(self, object_key: str):
+        with self._lock:
+            for key in self._object_keys.get(object_key, set()).copy():
+                self._pop(key)
+                self._counters["invalidations"] += 1
+
+    def _pop(self, key: PresignKey):
+        self._entries.pop(key, None)
+
+        keys = self._object_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._object_keys[key[0]]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "hit_rate": self._counters["hits"] / lookups if lookups else 0.0,
+            }
+
+
+@lru_cache
+def presign_cache_get() -> Optional[PresignCache]:
+    if not settings.FILE_PRESIGN_CACHE_SIZE:
+        return None
+
+    return PresignCache(max_entries=settings.FILE_PRESIGN_CACHE_SIZE, margin=settings.FILE_PRESIGN_CACHE_MARGIN)
+
+
+# A lock held by another thread at fork time would never be released in the child.
+os.register_at_fork(after_in_child=presign_cache_get.cache_clear)
+
+
+def presign_download_url(
+    file_key: str,
+    *,
+    expires_in: int,
+    content_disposition: Optional[str] = None,
+    content_type: Optional[str] = None,
+) -> PresignedUrl:
+    """
+    A presigned GET of `file_key`, from the cache when one with enough lifetime left was signed already.
+    """
+    cache = presign_cache_get()
+    key = (file_key, content_disposition, content_type, expires_in)
+
+    presigned = cache.get(key) if cache is not None else None
+    if presigned is not None:
+        return presigned
+
+    # Taken before signing, the URL can only expire later than this says.
+    signed_at = time.time()
+    presigned = PresignedUrl(
+        url=storage_get_backend().presign_get(
+            file_key,
+            expires_in=expires_in,
+            content_disposition=content_disposition,
+            content_type=content_type,
+        ),
+        expires_at=signed_at + expires_in,
+    )
+
+    if cache is not None:
+        cache.put(key, presigned)
+
+    return presigned
+
+
+def presign_invalidate(file_key: str):
+    """
+    Drops the cached URLs of an object, when the file is renamed or deleted.
+
+    Only this process' cache: the other workers still check the token on every request,
+    and a renamed file has a different Content-Disposition, so they never hand out a stale name.
+    """
+    cache = presign_cache_get()
+    if cache is not None:
+        cache.invalidate(file_key)
@@ -0,0 +1,212 @@
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from FileProcessing.models import StorageReservation, UserPersonalFileToken, UserStorageUsage
+from FileProcessing.utils import bytes_to_mib
+
+# Per-user storage accounting against STORAGE_PER_USER.
+#
+# Counters move with single UPDATEs of the user's UserStorageUsage row, quota checks are conditional
+# UPDATEs of that row. The row is counted from the user's tokens the first time it is needed, so counters
+# are always moved *before* the tokens they account for change.
+
+
+class StorageQuotaExceeded(ValidationError):
+    pass
+
+
+def storage_quota() -> Optional[int]:
+    """
+    Bytes each user may store, None (no limit) when STORAGE_PER_USER is not set.
+    """
+    if not settings.STORAGE_PER_USER:
+        return None
+
+    return int(settings.STORAGE_PER_USER)
+
+
+def storage_usage_get(user) -> UserStorageUsage:
+    try:
+        return UserStorageUsage.objects.get(user=user)
+    except UserStorageUsage.DoesNotExist:
+        pass
+
+    usage, _ = UserStorageUsage.objects.get_or_create(user=user, defaults=_storage_count(user))
+
+    return usage
+
+
+def _storage_count(user):
+    totals = UserPersonalFileToken.objects.filter(uploaded_by=user, is_deleted=False).aggregate(
+        used=Sum("file_size"),
+        in_bin=Sum("file_size", filter=Q(is_delete_init=True)),
+    )
+
+    return {"used": totals["used"] or 0, "in_bin": totals["in_bin"] or 0}
+
+
+def _storage_update(user, condition: Optional[Q] = None, **deltas) -> bool:
+    """
+    Moves the user's counters by `deltas` in one UPDATE, only if `condition` holds.
+    """
+    queryset = UserStorageUsage.objects.filter(user=user)
+    if condition is not None:
+        queryset = queryset.filter(condition)
+
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if queryset.update(**changes):
+        return True
+
+    if UserStorageUsage.objects.filter(user=user).exists():
+        return False
+
+    # First time: counted from the tokens, then updated like any other time.
+    storage_usage_get(user)
+    return bool(queryset.update(**changes))
+
+
+def _storage_fits(size: int) -> Optional[Q]:
+    quota = storage_quota()
+    if quota is None:
+        return None
+
+    # used + reserved + size <= quota
+    return Q(used__lte=(quota - size) - F("reserved"))
+
+
+def _storage_exceeded(size: int) -> StorageQuotaExceeded:
+    return StorageQuotaExceeded(
+        f"Not enough storage left for {bytes_to_mib(size):.2f} MiB, the limit is {bytes_to_mib(storage_quota()):.2f} MiB"
+    )
+
+
+def storage_charge(user, size: int):
+    """
+    Adds `size` to the user's usage, if it fits in the quota.
+    """
+    if not _storage_update(user, _storage_fits(size), used=size):
+        raise _storage_exceeded(size)
+
+
+def storage_reserve(user, size: int, file_id: Optional[str] = None):
+    """
+    Holds `size` for an upload about to start, if it fits in the quota.
+
+    With a `file_id`, the reservation is recorded and released by `storage_release` or once it expires
+    (FILE_UPLOAD_RESERVATION_TTL). Otherwise the caller settles it with `storage_settle`.
+    """
+    if not _storage_update(user, _storage_fits(size), reserved=size):
+        raise _storage_exceeded(size)
+
+    if file_id is not None:
+        StorageReservation.objects.create(
+            file_id=file_id,
+            user=user,
+            size=size,
+            expires_at=timezone.now() + timedelta(seconds=settings.FILE_UPLOAD_RESERVATION_TTL),
+        )
+
+
+def storage_settle(user, *, reserved: int, used: int = 0):
+    """
+    Gives `reserved` back and charges what was actually stored.
+    """
+    _storage_update(user, reserved=-reserved, used=used)
+
+
+def _storage_reservation_pop(file_id: str) -> Optional[StorageReservation]:
+    reservation = StorageReservation.objects.select_related("user").filter(file_id=file_id).first()
+
+    # Whoever deletes the row gives the space back, once.
+    if reservation is None or not StorageReservation.objects.filter(file_id=file_id).delete()[0]:
+        return None
+
+    return reservation
+
+
+def storage_commit(user, file_id: str, size: int):
+    """
+    The upload `file_id` completed with `size` bytes: its reservation becomes usage.
+
+    Bytes beyond the reservation must fit in the quota like a new upload, otherwise StorageQuotaExceeded
+    is raised and the caller's transaction, rolled back, keeps the reservation.
+    """
+    reservation = _storage_reservation_pop(file_id)
+
+    if reservation is None:
+        # Expired meanwhile, charged like a new upload
+        storage_charge(user, size)
+        return
+
+    excess = size - reservation.size
+    if excess <= 0:
+        storage_settle(user, reserved=reservation.size, used=size)
+    elif not _storage_update(user, _storage_fits(excess), reserved=-reservation.size, used=size):
+        raise _storage_exceeded(excess)
+
+
+def storage_release(file_id: str):
+    reservation = _storage_reservation_pop(file_id)
+
+    if reservation is not None:
+        storage_settle(reservation.user, reserved=reservation.size)
+
+
+def storage_release_many(file_ids: Iterable[str]) -> int:
+    """
+    `storage_release` for many uploads at once, one UPDATE per user. Returns how many were released.
+    """
+    with transaction.atomic():
+        reservations = list(
+            StorageReservation.objects.select_for_update().select_related("user").filter(file_id__in=list(file_ids))
+        )
+        StorageReservation.objects.filter(file_id__in=[reservation.file_id for reservation in reservations]).delete()
+
+        per_user: Dict[int, list] = {}
+        for reservation in reservations:
+            per_user.setdefault(reservation.user_id, [reservation.user, 0])[1] += reservation.size
+        for user, size in per_user.values():
+            storage_settle(user, reserved=size)
+
+    return len(reservations)
+
+
+def storage_release_expired() -> int:
+    """
+    Gives back the space of abandoned uploads, returns how many reservations expired.
+    """
+    return storage_release_many(
+        StorageReservation.objects.filter(expires_at__lte=timezone.now()).values_list("file_id", flat=True)
+    )
+
+
+def storage_bin(user, size: int):
+    _storage_update(user, in_bin=size)
+
+
+def storage_unbin(user, size: int):
+    _storage_update(user, in_bin=-size)
+
+
+def storage_purge(user, size: int):
+    """
+    Tokens of `size` bytes in total leave the recycle bin for good.
+    """
+    _storage_update(user, used=-size, in_bin=-size)
+
+
+def storage_recount(user) -> UserStorageUsage:
+    """
+    Counts `used` and `in_bin` from the tokens again, reservations are kept.
+    """
+    usage = storage_usage_get(user)
+    UserStorageUsage.objects.filter(user=user).update(**_storage_count(user))
+    usage.refresh_from_db()
+
+    return usage
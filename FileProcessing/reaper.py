@@ -0,0 +1,168 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.utils import timezone
+
+from FileProcessing.enums import FileImportStatus
+from FileProcessing.models import File, FileImportJob, MultipartUploadSession
+from FileProcessing.quota import storage_release_many
+from FileProcessing.storage import storage_get_backend
+from FileProcessing.tus import tus_tail_key
+from integrations.storage.base import StorageError
+
+logger = logging.getLogger(__name__)
+
+# Keys the uploads are written under, the sweep leaves anything else in the bucket alone
+UPLOAD_KEY_PREFIX = "files/"
+# Import jobs whose thread may still be working on their File
+IMPORT_LIVE_STATUSES = (FileImportStatus.PENDING.value, FileImportStatus.RUNNING.value)
+
+
+class UploadReaper:
+    """
+    Cleans up uploads started more than `ttl` seconds ago and never finished:
+
+    1. File rows with no `upload_finished_at`, read in keyset batches of `batch_size`. Their
+       multipart upload (and tus tail) is aborted, or the object a presigned POST or local upload may
+       have written is deleted, by `concurrency` threads. Then the rows go, in bulk, and their reservations with them.
+    2. With `sweep`, the multipart uploads storage still holds under files/ that no session knows of
+       (ListMultipartUploads), left by requests that died before recording them.
+
+    Import jobs run in threads of the web process (FileProcessing.imports), a restarted or crashed worker
+    drops them. Pending or running jobs not updated for `ttl` seconds are failed first, their File is then
+    reaped like any other. The File of a job still making progress is kept, however old.
+
+    A File whose cleanup failed is kept for the next run. `run` reports what was reclaimed.
+    """
+
+    def __init__(self, *, ttl: int, batch_size: int = 500, concurrency: int = 8, sweep: bool = True):
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.sweep = sweep
+
+        self.backend = storage_get_backend()
+        self.stats = {
+            "imports_failed": 0,
+            "files_deleted": 0,
+            "uploads_aborted": 0,
+            "uploads_swept": 0,
+            "objects_deleted": 0,
+            "bytes_reclaimed": 0,
+            "errors": 0,
+        }
+
+    def _abort(self, key: str, upload_id: str) -> int:
+        """
+        Aborts the multipart upload, returns the bytes its parts held.
+        """
+        try:
+            parts = self.backend.multipart_list_parts(key, upload_id)
+            self.backend.multipart_abort(key, upload_id)
+        except StorageError as e:
+            # Aborted or completed meanwhile
+            if e.code == "NoSuchUpload":
+                return 0
+            raise
+
+        return sum(part.size for part in parts)
+
+    def _reap_file(self, file: File, session: Optional[MultipartUploadSession]) -> Dict[str, int]:
+        reclaimed = {"uploads_aborted": 0, "objects_deleted": 0, "bytes_reclaimed": 0}
+
+        if session is not None:
+            reclaimed["bytes_reclaimed"] += self._abort(session.key, session.upload_id)
+            reclaimed["uploads_aborted"] += 1
+
+            tail_size = session.offset % session.part_size if session.part_size else 0
+            if tail_size:
+                tail_key = tus_tail_key(session.key, session.offset // session.part_size + 1)
+                self.backend.delete(tail_key)
+                reclaimed["bytes_reclaimed"] += tail_size
+            return reclaimed
+
+        if not file.file:
+            return reclaimed
+
+        # A direct upload: the client may have written the object and never called finish.
+        head = self.backend.head(file.file.name)
+        if head is not None:
+            self.backend.delete(file.file.name)
+            reclaimed["objects_deleted"] += 1
+            reclaimed["bytes_reclaimed"] += head.size
+
+        return reclaimed
+
+    def _reap_batch(self, executor: ThreadPoolExecutor, files: List[File]):
+        sessions = {session.file_id: session for session in MultipartUploadSession.objects.filter(file__in=files)}
+        futures = [(file, executor.submit(self._reap_file, file, sessions.get(file.fileID))) for file in files]
+
+        reaped = []
+        for file, future in futures:
+            try:
+                reclaimed = future.result()
+            except Exception:
+                logger.exception("Could not clean up the upload of %s", file.fileID)
+                self.stats["errors"] += 1
+                continue
+
+            reaped.append(file.fileID)
+            for name, value in reclaimed.items():
+                self.stats[name] += value
+
+        # Finished meanwhile: the upload was completed, not abandoned.
+        _, deleted = File.objects.filter(fileID__in=reaped, upload_finished_at__isnull=True).delete()
+        self.stats["files_deleted"] += deleted.get(File._meta.label, 0)
+        storage_release_many(reaped)
+
+    def _sweep(self, executor: ThreadPoolExecutor, cutoff):
+        uploads = [upload for upload in self.backend.multipart_list(UPLOAD_KEY_PREFIX) if upload.initiated < cutoff]
+        known = set(
+            MultipartUploadSession.objects.filter(upload_id__in=[upload.upload_id for upload in uploads])
+            .values_list("upload_id", flat=True)
+        )
+        lost = [upload for upload in uploads if upload.upload_id not in known]
+
+        futures = [executor.submit(self._abort, upload.key, upload.upload_id) for upload in lost]
+        for upload, future in zip(lost, futures):
+            try:
+                self.stats["bytes_reclaimed"] += future.result()
+                self.stats["uploads_swept"] += 1
+            except Exception:
+                logger.exception("Could not abort the multipart upload %s of %s", upload.upload_id, upload.key)
+                self.stats["errors"] += 1
+
+    def _fail_stale_imports(self, cutoff):
+        now = timezone.now()
+        self.stats["imports_failed"] += FileImportJob.objects.filter(
+            status__in=IMPORT_LIVE_STATUSES, updated_at__lt=cutoff
+        ).update(status=FileImportStatus.FAILED.value, error="The import was interrupted", finished_at=now, updated_at=now)
+
+    def run(self) -> Dict[str, int]:
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        self._fail_stale_imports(cutoff)
+
+        abandoned = (
+            File.objects.filter(upload_finished_at__isnull=True, created_at__lt=cutoff)
+            .exclude(fileimportjob__status__in=IMPORT_LIVE_STATUSES)
+            .order_by("fileID")
+        )
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="upload-reaper") as executor:
+            last_file_id = ""
+            while True:
+                # Keyset pagination: the next batch starts after the last one, however many rows went.
+                files = list(abandoned.filter(fileID__gt=last_file_id)[:self.batch_size])
+                if not files:
+                    break
+
+                self._reap_batch(executor, files)
+                last_file_id = files[-1].fileID
+
+            if self.sweep:
+                self._sweep(executor, cutoff)
+
+        return self.stats
+
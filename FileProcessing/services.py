@@ -1,26 +1,86 @@
+import logging
 import mimetypes
-from typing import Any, Dict, Tuple
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone as dt_timezone
+from functools import partial
+from itertools import islice
+from urllib import parse
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.utils import timezone
+from django.utils.http import content_disposition_header
+from rest_framework import status
 from Account.serializers import UserFullProfileSerializer, UserReferralTokenSerializer
 from django.db.models import Sum,Q,Count,F
 
-from FileProcessing.enums import FileUploadStorage
-from FileProcessing.models import File, UserPersonalFileToken
+from FileProcessing.archive import archive_member_names
+from FileProcessing.batch import batch_store
+from FileProcessing.checksum import CHECKSUM_ALGORITHM, checksum_composite, checksum_file_part, checksum_part
+from FileProcessing.dedup import (
+    dedup_challenge,
+    dedup_verify_challenge,
+    file_content_sha256,
+    file_deduplicate,
+    file_deduplicate_token,
+    file_drop_content,
+    file_find_duplicate,
+    file_undelete,
+    file_uploaded_sha256,
+)
+from FileProcessing.enums import FileDeliveryMode, FileImportStatus, FileUploadStorage
+from FileProcessing.imports import (
+    ImportFailed,
+    ImportSource,
+    import_check_url,
+    import_enqueue,
+    import_open_range,
+    import_probe,
+    import_read,
+)
+from FileProcessing.models import File, FileImportJob, MultipartUploadPart, MultipartUploadSession, UserPersonalFileToken
+from FileProcessing.presign import presign_download_url, presign_invalidate
+from FileProcessing.quota import (
+    StorageQuotaExceeded,
+    storage_bin,
+    storage_charge,
+    storage_commit,
+    storage_purge,
+    storage_quota,
+    storage_release,
+    storage_reserve,
+    storage_settle,
+    storage_unbin,
+    storage_usage_get,
+)
+from FileProcessing.storage import storage_get_backend
 from FileProcessing.serializers import FileDetailsViewSerializer, FilesListSerializer, TokentoFileIdSerializer, UserFileTokenListSerializer
+from FileProcessing.upload_handlers import S3StreamedFile
 from FileProcessing.utils import (
     bytes_to_mib,
     file_generate_local_upload_url,
     file_generate_name,
     file_generate_upload_path,
+    multipart_part_size,
 )
-from integrations.aws.client import s3_generate_download_presigned_url, s3_generate_presigned_post, s3_multipart_upload_finish, s3_multipart_upload_init, s3_multipart_upload_data
+from FileProcessing.tus import (
+    TUS_CHECKSUM_MISMATCH,
+    TusError,
+    tus_checksum_hasher,
+    tus_content_hasher,
+    tus_content_hashers,
+    tus_tail_key,
+)
+from integrations.aws.client import s3_generate_presigned_post, s3_get_credentials
+from integrations.storage.base import StorageError, StorageObject, StoragePart
 from Account.models import User, UserReferral
 from FileProcessing.utils import Util
 
+logger = logging.getLogger(__name__)
+
 
 def _validate_file_size(file_obj):
     max_size = settings.FILE_MAX_SIZE
@@ -29,6 +89,28 @@ def _validate_file_size(file_obj):
         raise ValidationError(f"File is too large. It should not exceed {bytes_to_mib(max_size)} MiB")
 
 
+def _personal_token(user: User, file: File, file_name: str) -> UserPersonalFileToken:
+    """
+    The uploader's token for `file`, unsaved. A deduplicated upload keeps the name it was uploaded under.
+    """
+    return UserPersonalFileToken(
+        uploaded_by = user,
+        personalfiletoken = Util.GenratePersonalFileToken(user, file.fileID),
+        file_id = file,
+        file_size = file.file_size,
+        type = file.file_type,
+        change_file_name = None if file_name == file.original_file_name else file_name,
+    )
+
+
+def _personal_token_create(user: User, file: File, file_name: str) -> UserPersonalFileToken:
+    obj_ptoken = _personal_token(user, file, file_name)
+    obj_ptoken.full_clean()
+    obj_ptoken.save()
+
+    return obj_ptoken
+
+
 class FileStandardUploadService:
     """
     This also serves as an example of a service class,
@@ -77,23 +159,28 @@ class FileStandardUploadService:
             upload_finished_at=timezone.now(),
         )
 
+        if isinstance(self.file_obj, S3StreamedFile):
+            # Already in the bucket (S3MultipartUploadHandler), only the key is recorded.
+            obj.file = self.file_obj.storage_name
+            obj.file_name = self.file_obj.file_name
+            obj.fileID = self.file_obj.file_name.split(".")[0]
+            obj.file_type = self.file_obj.content_type
+            obj.etag = self.file_obj.etag
+            obj.checksum = self.file_obj.checksum
+            # Reserved by the handler before it streamed the body
+            storage_commit(self.user, obj.fileID, file_size)
+        else:
+            storage_charge(self.user, file_size)
+
+        sha256 = file_uploaded_sha256(self.file_obj)
+
         obj.full_clean()
         obj.save()
 
-        # Personal FIle Token
-        file_id = obj.fileID
-        personal_token = Util.GenratePersonalFileToken(self.user, file_id)
+        obj = file_deduplicate(obj, sha256)
 
-        obj_ptoken = UserPersonalFileToken(
-            uploaded_by = self.user,
-            personalfiletoken = personal_token,
-            file_id = File.objects.get(fileID = file_id),
-            type = file_type
-        )
-        obj_ptoken.full_clean()
-        obj_ptoken.save()
-
-        return obj_ptoken
+        # Personal FIle Token
+        return _personal_token_create(self.user, obj, file_name)
 
     @transaction.atomic
     def update(self, file: File, file_name: str = "", file_type: str = "") -> File:
@@ -114,6 +201,171 @@ class FileStandardUploadService:
         return file
 
 
+class FileBatchUploadService:
+    """
+    Many small files in one request. Objects are written to storage by a bounded pool of threads,
+    then every File and personal token is inserted with `bulk_create` in one transaction,
+    a handful of queries whatever the number of files.
+
+    Each file succeeds or fails on its own, `upload` reports which, in order.
+    """
+
+    def __init__(self, user: User):
+        self.user = user
+        self.reserved = 0
+
+    def _validate(self, file_obj) -> Optional[str]:
+        max_size = min(int(settings.FILE_MAX_SIZE), settings.FILE_BATCH_MAX_FILE_SIZE)
+
+        if not file_obj.name:
+            return "File name is missing"
+        if file_obj.size > max_size:
+            return f"File is too large. It should not exceed {bytes_to_mib(max_size)} MiB"
+
+        return None
+
+    def _new_file(self, file_obj, sha256: Optional[str]) -> File:
+        file_type = mimetypes.guess_type(file_obj.name)[0] or ""
+        encrypt_filename = file_generate_name(file_obj.name)
+
+        file = File(
+            original_file_name=file_obj.name,
+            file_name=encrypt_filename,
+            fileID=encrypt_filename.split(".")[0],
+            file_type=file_type,
+            file_size=file_obj.size,
+            uploaded_by=self.user,
+            upload_finished_at=timezone.now(),
+            sha256=sha256,
+        )
+        file.file = file_generate_upload_path(file, file.file_name)
+
+        return file
+
+    def _resolve(self, entries: List[Dict[str, Any]]) -> List[File]:
+        """
+        Points the entries at a File with the same content, committed already or earlier in the batch,
+        and gives the others a new one. Returns the new Files that turned out not to be needed.
+        """
+        hashes = {entry["sha256"] for entry in entries if entry["sha256"]}
+        files = {
+            file.sha256: file
+            for file in File.objects.filter(sha256__in=hashes, upload_finished_at__isnull=False)
+        } if hashes else {}
+
+        redundant = []
+        for entry in entries:
+            sha256 = entry["sha256"]
+            file = files.get(sha256) if sha256 else None
+
+            if file is None:
+                if entry["new"] is None:
+                    entry["new"] = self._new_file(entry["file_obj"], sha256)
+                file = entry["new"]
+                if sha256:
+                    files[sha256] = file
+            elif entry["new"] is not None and entry["new"] is not file:
+                redundant.append(entry["new"])
+                entry["new"] = None
+
+            entry["file"] = file
+
+        return redundant
+
+    def _store(self, entries: List[Dict[str, Any]]):
+        backend = storage_get_backend()
+        new_entries = [entry for entry in entries if entry["new"] is not None]
+
+        with ThreadPoolExecutor(max_workers=settings.FILE_BATCH_UPLOAD_CONCURRENCY, thread_name_prefix="file-batch") as executor:
+            futures = [executor.submit(batch_store, entry["new"], entry["file_obj"], backend) for entry in new_entries]
+
+        failed = set()
+        for entry, future in zip(new_entries, futures):
+            if future.exception() is not None:
+                failed.add(entry["new"].fileID)
+                entry["new"] = None
+            else:
+                entry["new"].etag = future.result()
+
+        # Copies of a file that failed fail with it
+        for entry in entries:
+            if entry["file"].fileID in failed:
+                entry["error"] = "File upload failed"
+
+    def _save(self, entries: List[Dict[str, Any]], redundant: List[File]):
+        for attempt in range(2):
+            saved = [entry for entry in entries if "error" not in entry]
+            for entry in saved:
+                entry["token"] = _personal_token(self.user, entry["file"], entry["file_obj"].name)
+
+            try:
+                with transaction.atomic():
+                    storage_settle(
+                        self.user,
+                        reserved=self.reserved,
+                        used=sum(entry["file_obj"].size for entry in saved),
+                    )
+                    File.objects.bulk_create([entry["new"] for entry in saved if entry["new"] is not None])
+                    # Back from the recycle bin, somebody uploaded them again
+                    File.objects.filter(
+                        pk__in={entry["file"].pk for entry in saved if entry["new"] is None}, is_delete_init=True
+                    ).update(is_delete_init=False, delete_init_at=None)
+                    UserPersonalFileToken.objects.bulk_create([entry["token"] for entry in saved])
+                return
+            except IntegrityError:
+                # Another upload of some of this content committed first (File.sha256 is unique)
+                if attempt or not settings.FILE_DEDUP_ENABLED:
+                    raise
+                redundant += self._resolve(saved)
+
+    def upload(self, files: Iterable) -> List[Dict[str, Any]]:
+        files = list(islice(files, settings.FILE_BATCH_MAX_FILES + 1))
+        if len(files) > settings.FILE_BATCH_MAX_FILES:
+            raise ValidationError(f"Too many files. A batch should not exceed {settings.FILE_BATCH_MAX_FILES} files")
+
+        entries = []
+        for file_obj in files:
+            entry = {"file_obj": file_obj, "new": None}
+            error = self._validate(file_obj)
+
+            if error is not None:
+                entry["error"] = error
+            else:
+                entry["sha256"] = file_uploaded_sha256(file_obj) if settings.FILE_DEDUP_ENABLED else None
+            entries.append(entry)
+
+        valid = [entry for entry in entries if "error" not in entry]
+        # The whole batch fits or none of it is stored
+        self.reserved = sum(entry["file_obj"].size for entry in valid)
+        storage_reserve(self.user, self.reserved)
+
+        try:
+            redundant = self._resolve(valid)
+            self._store(valid)
+        except BaseException:
+            storage_settle(self.user, reserved=self.reserved)
+            raise
+
+        try:
+            self._save(valid, redundant)
+        except BaseException:
+            storage_settle(self.user, reserved=self.reserved)
+            redundant += [entry["new"] for entry in valid if entry["new"] is not None]
+            for file in redundant:
+                file_drop_content(file)
+            raise
+
+        for file in redundant:
+            transaction.on_commit(partial(file_drop_content, file))
+
+        return [
+            {"file_name": entry["file_obj"].name, "errors": entry["error"]}
+            if "error" in entry else
+            {"file_name": entry["file_obj"].name, "id": entry["token"].personalfiletoken}
+            for entry in entries
+        ]
+
+
 class FileDirectUploadService:
     """
     This also serves as an example of a service class,
@@ -128,19 +380,22 @@ class FileDirectUploadService:
         self.user = user
 
     @transaction.atomic
-    def start(self, *, file_name: str, file_type: str) -> Dict[str, Any]:
+    def start(self, *, file_name: str, file_type: str, file_size: int) -> Dict[str, Any]:
         encrypt_filename =file_generate_name(file_name)
         file = File(
             original_file_name=file_name,
             file_name=encrypt_filename,
             fileID=encrypt_filename.split(".")[0],
             file_type=file_type,
+            file_size=file_size,
             uploaded_by=self.user,
             file=None,
         )
         file.full_clean()
         file.save()
 
+        storage_reserve(self.user, file_size, file.fileID)
+
         upload_path = file_generate_upload_path(file, file.file_name)
 
         """
@@ -152,7 +407,8 @@ class FileDirectUploadService:
         presigned_data: Dict[str, Any] = {}
 
         if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.S3.value:
-            presigned_data = s3_generate_presigned_post(file_path=upload_path, file_type=file.file_type)
+            # No bigger than what was reserved
+            presigned_data = s3_generate_presigned_post(file_path=upload_path, file_type=file.file_type, max_size=file_size)
         else:
             presigned_data = {
                 "url": file_generate_local_upload_url(file_id=str(file.fileID)),
@@ -161,19 +417,51 @@ class FileDirectUploadService:
         return {"id": file.fileID, **presigned_data}
 
     @transaction.atomic
-    def finish(self, *, file: File) -> File:
-        # Potentially, check against user
+    def finish(self, *, file: File) -> UserPersonalFileToken:
+        """
+        Raises File.DoesNotExist for uploads of other users and uploads finished already,
+        locked so two concurrent calls cannot both charge and tokenize the file.
+        """
+        file = File.objects.select_for_update().get(
+            fileID=file.fileID, uploaded_by=self.user, upload_finished_at__isnull=True
+        )
+
+        if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.S3.value:
+            # What the client wrote, not what it declared at start (the presigned POST only caps it)
+            head = storage_get_backend().head(file.file.name)
+            if head is None:
+                raise ValidationError("File was not uploaded")
+            file.file_size = head.size
+        else:
+            if not file.file.storage.exists(file.file.name):
+                raise ValidationError("File was not uploaded")
+            file.file_size = file.file.size
+
         file.upload_finished_at = timezone.now()
         file.full_clean()
         file.save()
 
-        return file
+        try:
+            storage_commit(self.user, file.fileID, file.file_size)
+        except StorageQuotaExceeded:
+            # Written past its reservation and over the quota: not kept
+            if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.S3.value:
+                storage_get_backend().delete(file.file.name)
+            else:
+                file.file.storage.delete(file.file.name)
+            raise
+
+        # Personal FIle Token
+        return _personal_token_create(self.user, file, file.original_file_name)
 
     @transaction.atomic
     def upload_local(self, *, file: File, file_obj) -> File:
         _validate_file_size(file_obj)
 
-        # Potentially, check against user
+        # The reservation made at start is what it may use
+        if file_obj.size > file.file_size:
+            raise ValidationError(f"File is larger than the {file.file_size} bytes declared at start")
+
         file.file = file_obj
         file.full_clean()
         file.save()
@@ -194,7 +482,14 @@ class FileMultipartUploadService:
         self.user = user
 
     @transaction.atomic
-    def start(self, *, file_name: str, file_type: str, file_size:int) -> Dict[str, Any]:
+    def create_upload(
+        self, *, file_name: str, file_type: str, file_size: int, checksum_algorithm: str = ""
+    ) -> Tuple[File, Optional[MultipartUploadSession]]:
+        """
+        The File, and unless storage is local the multipart upload session its parts go to.
+
+        With a `checksum_algorithm`, every part must be sent with a checksum of it.
+        """
         encrypt_filename =file_generate_name(file_name)
         file = File(
             original_file_name=file_name,
@@ -216,56 +511,705 @@ class FileMultipartUploadService:
         file.file = file.file.field.attr_class(file, file.file.field, upload_path)
         file.save()
 
-        upload_data: Dict[str, Any] = {}
+        storage_reserve(self.user, file_size, file.fileID)
 
-        if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.S3.value:
-            upload_data = s3_multipart_upload_init(file_path=upload_path)
-            settings.ON_GOING_UPLOADS[file.fileID] = dict(
-                Bucket=upload_data.get("Bucket", settings.AWS_STORAGE_BUCKET_NAME),
-                Key=upload_data['Key'],
-                UploadId=upload_data['UploadId'],
-                Parts=[]
-            )
+        # Local uploads are written by Django in one go
+        if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.LOCAL.value:
+            return file, None
 
-        return {"id": file.fileID}
+        backend = storage_get_backend()
+        upload_id = backend.multipart_init(upload_path, checksum_algorithm=checksum_algorithm or None)
 
-    @transaction.atomic
-    def upload(self, file_id: str, part_number: int, file_obj=None) -> File:
+        # In the database, so any worker can take the next part or the finish.
+        session = MultipartUploadSession(
+            file=file,
+            uploaded_by=self.user,
+            bucket=backend.name,
+            key=upload_path,
+            upload_id=upload_id,
+            file_size=file_size,
+            part_size=multipart_part_size(file_size),
+            checksum_algorithm=checksum_algorithm,
+        )
+        session.full_clean()
+        session.save()
+
+        return file, session
+
+    def start(self, *, file_name: str, file_type: str, file_size:int, checksum_algorithm: str = "") -> Dict[str, Any]:
+        file, session = self.create_upload(
+            file_name=file_name, file_type=file_type, file_size=file_size, checksum_algorithm=checksum_algorithm
+        )
+
+        if session is None:
+            return {"id": file.fileID}
+
+        part_count = session.part_count
+        upload_data = {
+            "id": file.fileID,
+            "part_size": session.part_size,
+            "part_count": part_count,
+        }
+        if storage_get_backend().presigned_urls:
+            # First batch of presigned URLs, the next ones come from x-req-type "presign"
+            upload_data["parts"] = self._presign(session, range(1, min(part_count, settings.FILE_MULTIPART_PRESIGN_BATCH) + 1))
+            upload_data["expires_in"] = settings.FILE_MULTIPART_PRESIGNED_EXPIRY
+        if session.checksum_algorithm:
+            # Parts PUT to the presigned URLs need `x-amz-sdk-checksum-algorithm` and `x-amz-checksum-sha256` headers
+            upload_data["checksum_algorithm"] = session.checksum_algorithm
+
+        return upload_data
+
+    def _presign(self, session: MultipartUploadSession, part_numbers) -> List[Dict[str, Any]]:
+        return [
+            {
+                "part_number": part_number,
+                "url": storage_get_backend().presign_upload_part(
+                    session.key,
+                    session.upload_id,
+                    part_number,
+                    expires_in=settings.FILE_MULTIPART_PRESIGNED_EXPIRY,
+                    checksum_algorithm=session.checksum_algorithm or None,
+                ),
+            }
+            for part_number in part_numbers
+        ]
+
+    def presign(self, file_id: str, part_numbers: List[int]) -> Dict[str, Any]:
+        """
+        (Re)issues presigned `upload_part` URLs, for the next batch or to replace expired ones.
+        """
+        session = self._get_session(file_id)
+
+        if not storage_get_backend().presigned_urls:
+            raise ValidationError("Presigned URLs need S3 storage")
+        if session.part_size is None or any(part_number > session.part_count for part_number in part_numbers):
+            raise ValidationError("Invalid part number")
+        if len(part_numbers) > settings.FILE_MULTIPART_PRESIGN_BATCH:
+            raise ValidationError(f"At most {settings.FILE_MULTIPART_PRESIGN_BATCH} parts per request")
+
+        return {
+            "id": file_id,
+            "parts": self._presign(session, part_numbers),
+            "expires_in": settings.FILE_MULTIPART_PRESIGNED_EXPIRY,
+        }
+
+    def _get_session(self, file_id: str) -> MultipartUploadSession:
+        return MultipartUploadSession.objects.get(file_id=file_id, uploaded_by=self.user)
+
+    def upload(self, file_id: str, part_number: int, file_obj=None, checksum_sha256: str = "") -> MultipartUploadPart:
+        """
+        `checksum_sha256` is the client's checksum of the part, so S3 checks the bytes against what the client sent.
+        Otherwise it is computed here, when the upload was started with checksums.
+        """
         # Multipart File Upload Logic
+        session = self._get_session(file_id)
+
+        if checksum_sha256 and not session.checksum_algorithm:
+            raise ValidationError("The upload was started without checksums")
+        if session.checksum_algorithm and not checksum_sha256:
+            checksum_sha256 = checksum_file_part(file_obj)
+
+        # Not in a transaction, the database connection is not held while the part goes to storage.
+        try:
+            part = storage_get_backend().multipart_upload_part(
+                session.key, session.upload_id, part_number, file_obj, checksum_sha256=checksum_sha256 or None
+            )
+        except StorageError as e:
+            if e.code in ("BadDigest", "InvalidDigest"):
+                raise ValidationError(f"Part {part_number} does not match its checksum")
+            raise
 
-        return s3_multipart_upload_data(file_object=file_obj, part_num=part_number, file_id=file_id)
+        return self._record_part(
+            session, part_number=part_number, etag=part.etag, size=file_obj.size, checksum=checksum_sha256
+        )
+
+    def _record_part(self, session: MultipartUploadSession, *, part_number: int, etag: str, size: int, checksum: str = "") -> MultipartUploadPart:
+        part = MultipartUploadPart(
+            session=session,
+            part_number=part_number,
+            etag=etag.strip('"'),
+            size=size,
+            checksum=checksum,
+            uploaded_at=timezone.now(),
+        )
+
+        # Upsert: parts land concurrently on any worker, a retried part replaces the previous one.
+        MultipartUploadPart.objects.bulk_create(
+            [part],
+            update_conflicts=True,
+            unique_fields=["session", "part_number"],
+            update_fields=["etag", "size", "checksum", "uploaded_at"],
+        )
+
+        return part
+
+    def status(self, file_id: str) -> Dict[str, Any]:
+        """
+        What a client needs to resume: the parts S3 has, the gaps, and how many bytes are left.
+        """
+        session = self._get_session(file_id)
+        # Parts sent straight to S3 are only known there.
+        self._sync_parts(session)
+        parts = list(session.parts.order_by("part_number").values("part_number", "size", "etag"))
+
+        numbers = {part["part_number"] for part in parts}
+        last_part_number = max(numbers, default=0)
+        # Presigned uploads follow the part layout given at start, other clients pick their own part sizes.
+        expected_parts = max(last_part_number, session.part_count or 0)
+        received = sum(part["size"] for part in parts)
+
+        return {
+            "id": file_id,
+            "file_size": session.file_size,
+            "part_size": session.part_size,
+            "part_count": session.part_count,
+            "received_bytes": received,
+            "remaining_bytes": max(session.file_size - received, 0),
+            "parts": parts,
+            "missing_parts": [number for number in range(1, expected_parts + 1) if number not in numbers],
+            "next_part_number": last_part_number + 1,
+        }
+
+    def _sync_parts(self, session: MultipartUploadSession, reported_parts: Optional[List[Dict[str, Any]]] = None):
+        """
+        Records the parts S3 holds for the upload. `reported_parts` (part_number / etag, as the client
+        got them from S3) must all be there with the same ETag.
+        """
+        listed = {
+            part.part_number: part for part in storage_get_backend().multipart_list_parts(session.key, session.upload_id)
+        }
+
+        for reported in reported_parts or []:
+            part = listed.get(reported["part_number"])
+            if part is None or part.etag != reported["etag"].strip('"'):
+                raise ValidationError(f"Part {reported['part_number']} does not match what S3 received")
+
+        for part_number, part in listed.items():
+            self._record_part(
+                session, part_number=part_number, etag=part.etag, size=part.size, checksum=part.checksum or ""
+            )
+
+    def _verify(self, session: MultipartUploadSession, checksum: str) -> StorageObject:
+        """
+        Checks the object storage assembled with one HeadObject: the declared size, and the composite
+        `checksum` of the parts when they had one (and storage keeps checksums). A mismatching object is deleted.
+        """
+        backend = storage_get_backend()
+        head = backend.head(session.key, checksum=bool(checksum))
+
+        if (
+            head is None
+            or head.size != session.file_size
+            or (checksum and (head.checksum or checksum) != checksum)
+        ):
+            if head is not None:
+                backend.delete(session.key)
+            raise ValidationError("The uploaded object does not match the upload")
+
+        return head
     
+    def finish(
+        self, file_id: str, file: File, parts: Optional[List[Dict[str, Any]]] = None, sha256: Optional[str] = None
+    ) -> UserPersonalFileToken:
+        """
+        `parts` are reported by clients which uploaded straight to S3, they are checked with ListParts.
+        Raises ValidationError (and StorageQuotaExceeded), nothing is kept of a finish that failed.
+
+        Deduplicated once the upload is committed, on `sha256` when the bytes were hashed as they
+        arrived, otherwise on the content read back from storage.
+        """
+        token = self._finish(file_id, file, parts)
+
+        # The parts went through several requests (or none), the content is hashed from storage.
+        # Not with the session locked: up to FILE_DEDUP_READBACK_MAX_SIZE is read.
+        try:
+            return file_deduplicate_token(token, sha256 or file_content_sha256(token.file_id))
+        except Exception:
+            # The upload is complete, only left out of deduplication
+            logger.exception("Could not deduplicate the upload of %s", file_id)
+            return token
+
     @transaction.atomic
-    def finish(self, file_id: str, file: File) -> Dict[str, str]:
+    def _finish(self, file_id: str, file: File, parts: Optional[List[Dict[str, Any]]]) -> UserPersonalFileToken:
         # Multipart File Finsih Logic
-        try:
-            s3_multipart_upload_finish(file_id=file_id)
+        # Locked, two concurrent finish calls must not both complete the upload.
+        session = MultipartUploadSession.objects.select_for_update().get(file_id=file_id, uploaded_by=self.user)
+        if parts:
+            self._sync_parts(session, parts)
 
-            # Updating in DB about File Upload Finished
-            file.upload_finished_at = timezone.now()
-            file.full_clean()
-            file.save()
+        parts = list(session.parts.order_by("part_number"))
 
-            # Personal FIle Token
-            personal_token = Util.GenratePersonalFileToken(self.user, file_id)
-            FileDetails = FileDetailsViewSerializer(File.objects.get(fileID = file_id)).data
+        if [part.part_number for part in parts] != list(range(1, len(parts) + 1)):
+            raise ValidationError("Missing parts")
+        if sum(part.size for part in parts) != session.file_size:
+            raise ValidationError("Uploaded parts do not add up to the declared file size")
 
+        # Charged before S3 assembles the object: over quota, the upload is left as it was.
+        storage_commit(self.user, file_id, session.file_size)
 
-            obj_ptoken = UserPersonalFileToken(
-                uploaded_by = self.user,
-                personalfiletoken = personal_token,
-                file_id = File.objects.get(fileID = file_id),
-                type = FileDetails['file_type'],
-                file_size =FileDetails['file_size'],
+        checksum = ""
+        if session.checksum_algorithm:
+            checksum = checksum_composite(part.checksum for part in parts)
+
+        try:
+            etag = storage_get_backend().multipart_complete(
+                session.key,
+                session.upload_id,
+                [
+                    StoragePart(part_number=part.part_number, etag=part.etag, size=part.size, checksum=part.checksum or None)
+                    for part in parts
+                ],
             )
-            obj_ptoken.full_clean()
-            obj_ptoken.save()
+        except StorageError as e:
+            if e.code in ("InvalidPart", "InvalidPartOrder", "EntityTooSmall", "NoSuchUpload"):
+                raise ValidationError(f"The upload could not be completed: {e.code}")
+            raise
+        self._verify(session, checksum)
+        session.delete()
+
+        # Updating in DB about File Upload Finished
+        file.etag = etag
+        file.checksum = checksum
+        file.upload_finished_at = timezone.now()
+        file.full_clean()
+        file.save()
 
-            return obj_ptoken
-        except Exception as e:
-            print(e)
-            return False
+        # Personal FIle Token
+        return _personal_token_create(self.user, file, file.original_file_name)
         
+class FileInstantUploadService:
+    """
+    Uploads without sending the bytes, when a File with the same content exists already.
+
+    `check` answers with a challenge, `claim` links a personal token to the File once the client
+    proved it has the content (see `dedup_challenge`).
+    """
+
+    def __init__(self, user: User):
+        self.user = user
+
+    def check(self, *, sha256: str, file_size: int) -> Dict[str, Any]:
+        file = file_find_duplicate(sha256.lower(), file_size) if settings.FILE_DEDUP_ENABLED else None
+
+        if file is None:
+            return {"exists": False}
+
+        return {"exists": True, **dedup_challenge(file, self.user.pk)}
+
+    @transaction.atomic
+    def claim(self, *, challenge: str, proof: str, file_name: str) -> UserPersonalFileToken:
+        file = dedup_verify_challenge(challenge, proof, self.user.pk)
+        storage_charge(self.user, file.file_size)
+        file_undelete(file)
+
+        return _personal_token_create(self.user, file, file_name)
+
+
+class FileTusUploadService:
+    """
+    tus 1.0.0 resumable uploads (creation, termination, checksum) on top of the S3 multipart uploads.
+
+    PATCH bodies are cut into `part_size` parts as they arrive. What is left past the last whole
+    part is kept in a tail object until the next PATCH. The offset is stored with the session,
+    so a client resuming after a drop only sends what the server did not get yet.
+    """
+
+    def __init__(self, user: User):
+        self.user = user
+
+    def create(self, *, upload_length: int, metadata: Dict[str, str]) -> File:
+        if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.LOCAL.value:
+            raise TusError(status.HTTP_501_NOT_IMPLEMENTED, "Resumable uploads are not available with local storage")
+
+        max_size = int(settings.FILE_MAX_SIZE)
+        if upload_length > max_size:
+            raise TusError(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"File is too large. It should not exceed {bytes_to_mib(max_size)} MiB",
+            )
+
+        file_name = metadata.get("filename") or metadata.get("name") or "file"
+        file_type = metadata.get("filetype") or metadata.get("type") or mimetypes.guess_type(file_name)[0] or ""
+
+        try:
+            # Parts only come through here, they are all sent with their checksum.
+            file, session = FileMultipartUploadService(self.user).create_upload(
+                file_name=file_name, file_type=file_type, file_size=upload_length, checksum_algorithm=CHECKSUM_ALGORITHM
+            )
+        except StorageQuotaExceeded as e:
+            raise TusError(status.HTTP_507_INSUFFICIENT_STORAGE, e.messages[0])
+        if upload_length == 0:
+            self._complete(file, session, bytearray(), part_number=0)
+
+        return file
+
+    def get(self, file_id: str) -> Tuple[File, Optional[MultipartUploadSession]]:
+        """
+        The upload, and its session while it is not complete.
+        """
+        file = File.objects.select_related("upload_session").get(fileID=file_id, uploaded_by=self.user)
+
+        try:
+            return file, file.upload_session
+        except MultipartUploadSession.DoesNotExist:
+            if file.upload_finished_at is None:
+                # Not a tus upload
+                raise File.DoesNotExist()
+
+            return file, None
+
+    def append(self, *, file_id: str, offset: int, body, checksum: Optional[Tuple[str, bytes]] = None) -> Tuple[File, Optional[MultipartUploadSession], Optional[UserPersonalFileToken]]:
+        """
+        Appends a PATCH body at `offset`, returns the upload and its token once complete.
+
+        Whole parts are recorded as they are uploaded, a dropped connection keeps what arrived.
+        With a checksum nothing is kept until the whole body was received and matched.
+        """
+        file, session = self.get(file_id)
+
+        if session is None or offset != session.offset:
+            raise TusError(status.HTTP_409_CONFLICT, f"Upload-Offset should be {file.file_size if session is None else session.offset}")
+
+        part_size = session.part_size
+        part_number, tail_size = divmod(offset, part_size)
+        buffer = bytearray()
+        if tail_size:
+            # A tail written by a request that failed before saving its offset may be longer.
+            buffer += storage_get_backend().get(tus_tail_key(session.key, part_number + 1))[:tail_size]
+
+        hasher = tus_checksum_hasher(checksum)
+        # Of the whole upload, when every byte before came through this process
+        content_hasher = tus_content_hasher(file.fileID, offset)
+        remaining = session.file_size - offset
+        received = 0
+        pending_parts = []
+
+        while True:
+            try:
+                data = body.read(settings.FILE_STREAM_CHUNK_SIZE) if body is not None else b""
+            except OSError:
+                # The client went away
+                if hasher is not None:
+                    return file, session, None
+                break
+
+            if not data:
+                break
+
+            received += len(data)
+            if received > remaining:
+                raise TusError(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Upload-Length exceeded")
+
+            if hasher is not None:
+                hasher.update(data)
+            if content_hasher is not None:
+                content_hasher.update(data)
+            buffer += data
+
+            while len(buffer) >= part_size and (part_number + 1) * part_size < session.file_size:
+                part_number += 1
+                part = self._upload_part(session, part_number, bytes(memoryview(buffer)[:part_size]))
+                del buffer[:part_size]
+
+                if hasher is None:
+                    self._save_parts(session, [part], part_number * part_size)
+                else:
+                    pending_parts.append(part)
+
+        if hasher is not None and hasher.digest() != checksum[1]:
+            raise TusError(TUS_CHECKSUM_MISMATCH, "Checksum Mismatch")
+
+        new_offset = part_number * part_size + len(buffer)
+
+        if new_offset == session.file_size:
+            if pending_parts:
+                self._save_parts(session, pending_parts, part_number * part_size)
+            sha256 = content_hasher.hexdigest() if content_hasher is not None else None
+            token = self._complete(file, session, buffer, part_number=part_number, sha256=sha256)
+            return file, None, token
+
+        if received:
+            if buffer:
+                storage_get_backend().put(tus_tail_key(session.key, part_number + 1), bytes(buffer))
+            self._save_parts(session, pending_parts, new_offset)
+
+        if content_hasher is not None:
+            tus_content_hashers().put(file.fileID, new_offset, content_hasher)
+
+        return file, session, None
+
+    def _upload_part(self, session: MultipartUploadSession, part_number: int, data: bytes) -> MultipartUploadPart:
+        checksum = checksum_part(data) if session.checksum_algorithm else ""
+        part = storage_get_backend().multipart_upload_part(
+            session.key, session.upload_id, part_number, data, checksum_sha256=checksum or None
+        )
+
+        return MultipartUploadPart(
+            session=session, part_number=part_number, etag=part.etag, size=len(data), checksum=checksum
+        )
+
+    def _save_parts(self, session: MultipartUploadSession, parts: List[MultipartUploadPart], offset: int):
+        service = FileMultipartUploadService(self.user)
+        for part in parts:
+            service._record_part(session, part_number=part.part_number, etag=part.etag, size=part.size, checksum=part.checksum)
+
+        if offset == session.offset:
+            return
+
+        # Only moves from the offset this request started at, a concurrent PATCH loses.
+        if not MultipartUploadSession.objects.filter(pk=session.pk, offset=session.offset).update(offset=offset):
+            raise TusError(status.HTTP_409_CONFLICT, "Upload changed by another request")
+
+        previous_tail = session.offset // session.part_size + 1
+        if session.offset % session.part_size and offset // session.part_size + 1 != previous_tail:
+            storage_get_backend().delete(tus_tail_key(session.key, previous_tail))
+
+        session.offset = offset
+
+    def _complete(
+        self, file: File, session: MultipartUploadSession, last_part: bytearray, *, part_number: int, sha256: Optional[str] = None
+    ) -> UserPersonalFileToken:
+        tail_part_number = session.offset // session.part_size + 1 if session.offset % session.part_size else None
+
+        # The last part can be under the S3 minimum, and an empty upload still needs one part.
+        if last_part or part_number == 0:
+            part = self._upload_part(session, part_number + 1, bytes(last_part))
+            FileMultipartUploadService(self.user)._record_part(
+                session, part_number=part.part_number, etag=part.etag, size=part.size, checksum=part.checksum
+            )
+
+        # Same finalization as the multipart API, the session goes with it.
+        try:
+            token = FileMultipartUploadService(self.user).finish(file_id=file.fileID, file=file, sha256=sha256)
+        except StorageQuotaExceeded as e:
+            raise TusError(status.HTTP_507_INSUFFICIENT_STORAGE, e.messages[0])
+        except ValidationError as e:
+            raise TusError(status.HTTP_400_BAD_REQUEST, e.messages[0])
+
+        if tail_part_number is not None:
+            storage_get_backend().delete(tus_tail_key(session.key, tail_part_number))
+
+        return token
+
+    def terminate(self, file_id: str):
+        file, session = self.get(file_id)
+
+        if session is None:
+            raise TusError(status.HTTP_409_CONFLICT, "Upload already completed, delete the file instead")
+
+        backend = storage_get_backend()
+        backend.multipart_abort(session.key, session.upload_id)
+        if session.offset % session.part_size:
+            backend.delete(tus_tail_key(session.key, session.offset // session.part_size + 1))
+
+        storage_release(file.fileID)
+        file.delete()
+
+
+class FileImportService:
+    """
+    Imports from a URL: the server fetches the file straight into an S3 multipart upload,
+    in a background job, instead of the user downloading and uploading it again.
+
+    A source answering range requests is fetched as FILE_IMPORT_CONCURRENCY ranges at once, each
+    uploaded as the part it is. Otherwise its body is read in order, parts uploaded while the next
+    is read. Either way at most FILE_IMPORT_CONCURRENCY parts are held in memory.
+    """
+
+    def __init__(self, user: User):
+        self.user = user
+
+    def start(self, *, url: str, file_name: str = "") -> Dict[str, Any]:
+        if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.LOCAL.value:
+            raise ValidationError("Imports are not available with local storage")
+
+        import_check_url(url)
+
+        job = FileImportJob(uploaded_by=self.user, url=url, file_name=file_name)
+        job.full_clean()
+        job.save()
+
+        import_enqueue(FileImportService.run, str(job.pk))
+
+        return self._status(job)
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        return self._status(FileImportJob.objects.select_related("token").get(pk=job_id, uploaded_by=self.user))
+
+    def _status(self, job: FileImportJob) -> Dict[str, Any]:
+        return {
+            "id": str(job.pk),
+            "url": job.url,
+            "status": job.status,
+            "file_name": job.file_name,
+            "file_size": job.file_size,
+            "received_bytes": job.received,
+            "progress": round(job.received / job.file_size, 4) if job.file_size else None,
+            "ranged": job.ranged,
+            "error": job.error or None,
+            # The personal file token, once completed
+            "file": job.token.personalfiletoken if job.token else None,
+        }
+
+    @staticmethod
+    def run(job_id: str):
+        """
+        Runs the job (FileProcessing.imports.import_enqueue calls it in the background), once.
+        """
+        job = FileImportJob.objects.select_related("uploaded_by").get(pk=job_id)
+
+        # Only moves from pending once, a job enqueued twice runs once.
+        if not FileImportJob.objects.filter(pk=job.pk, status=FileImportStatus.PENDING.value).update(
+            status=FileImportStatus.RUNNING.value, updated_at=timezone.now()
+        ):
+            return
+
+        FileImportService(job.uploaded_by)._run(job)
+
+    def _update(self, job: FileImportJob, **fields):
+        for name, value in fields.items():
+            setattr(job, name, value)
+        FileImportJob.objects.filter(pk=job.pk).update(updated_at=timezone.now(), **fields)
+
+    def _run(self, job: FileImportJob):
+        self.file: Optional[File] = None
+        self.session: Optional[MultipartUploadSession] = None
+        self.cancelled = threading.Event()
+
+        try:
+            source = import_probe(job.url)
+            try:
+                token = self._import(job, source)
+            finally:
+                if source.body is not None:
+                    source.body.close()
+        except (ImportFailed, ValidationError) as e:
+            self._discard()
+            self._update(
+                job,
+                status=FileImportStatus.FAILED.value,
+                error=e.messages[0] if isinstance(e, ValidationError) else str(e),
+                finished_at=timezone.now(),
+            )
+            return
+        except Exception:
+            logger.exception("Import %s failed", job.pk)
+            self._discard()
+            self._update(job, status=FileImportStatus.FAILED.value, error="The file could not be imported", finished_at=timezone.now())
+            return
+
+        self._update(job, status=FileImportStatus.COMPLETED.value, token=token, file=token.file_id, finished_at=timezone.now())
+
+    def _import(self, job: FileImportJob, source: ImportSource) -> UserPersonalFileToken:
+        max_size = int(settings.FILE_MAX_SIZE)
+        if source.size > max_size:
+            raise ImportFailed(f"File is too large. It should not exceed {bytes_to_mib(max_size)} MiB")
+
+        file_name = job.file_name or source.file_name
+        file_type = source.content_type or mimetypes.guess_type(file_name)[0] or ""
+
+        # Reserves the space, the parts are checked by S3 as they arrive.
+        service = FileMultipartUploadService(self.user)
+        self.file, self.session = service.create_upload(
+            file_name=file_name, file_type=file_type, file_size=source.size, checksum_algorithm=CHECKSUM_ALGORITHM
+        )
+        self._update(job, file=self.file, file_name=file_name, file_size=source.size, ranged=source.ranged)
+
+        part_size = self.session.part_size
+        if source.ranged:
+            tasks = (
+                partial(self._fetch_part, source, part_number, first_byte, min(first_byte + part_size, source.size) - 1)
+                for part_number, first_byte in enumerate(range(0, source.size, part_size), start=1)
+            )
+        else:
+            tasks = self._read_parts(source, part_size)
+        self._transfer(job, service, tasks)
+
+        try:
+            return service.finish(file_id=self.file.fileID, file=self.file)
+        except ValidationError as e:
+            # StorageQuotaExceeded too, the upload is discarded with the message.
+            raise ImportFailed(e.messages[0])
+
+    def _read_parts(self, source: ImportSource, part_size: int):
+        """
+        Uploads of the parts of a body read in order, read one at a time as they are taken.
+        """
+        # An empty file still needs one part.
+        part_count = max(-(-source.size // part_size), 1)
+        for part_number in range(1, part_count + 1):
+            data = import_read(source.body, min(part_size, source.size - (part_number - 1) * part_size), self.cancelled.is_set)
+            yield partial(self._upload_part, part_number, data)
+
+    def _fetch_part(self, source: ImportSource, part_number: int, first_byte: int, last_byte: int) -> MultipartUploadPart:
+        body = import_open_range(source, first_byte, last_byte)
+        try:
+            data = import_read(body, last_byte - first_byte + 1, self.cancelled.is_set)
+        finally:
+            body.close()
+
+        return self._upload_part(part_number, data)
+
+    def _upload_part(self, part_number: int, data: bytearray) -> MultipartUploadPart:
+        checksum = checksum_part(data)
+        part = storage_get_backend().multipart_upload_part(
+            self.session.key, self.session.upload_id, part_number, data, checksum_sha256=checksum
+        )
+
+        return MultipartUploadPart(
+            session=self.session, part_number=part_number, etag=part.etag, size=len(data), checksum=checksum
+        )
+
+    def _transfer(self, job: FileImportJob, service: "FileMultipartUploadService", tasks):
+        """
+        Runs the part `tasks`, FILE_IMPORT_CONCURRENCY at once. Parts are recorded, and the progress
+        saved, from this thread as they complete.
+        """
+        concurrency = settings.FILE_IMPORT_CONCURRENCY
+
+        def record(done):
+            for future in done:
+                part = future.result()
+                service._record_part(
+                    self.session, part_number=part.part_number, etag=part.etag, size=part.size, checksum=part.checksum
+                )
+                self._update(job, received=job.received + part.size)
+
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="file-import-part")
+        try:
+            pending = set()
+            for task in tasks:
+                pending.add(executor.submit(task))
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    record(done)
+
+            record(wait(pending).done)
+        except BaseException:
+            # Parts still reading from the source give up.
+            self.cancelled.set()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _discard(self):
+        """
+        Aborts the upload of a failed import and gives its space back. Whatever is left, the upload reaper removes.
+        """
+        if self.file is None:
+            return
+
+        try:
+            session = MultipartUploadSession.objects.filter(file_id=self.file.fileID).first()
+            if session is not None:
+                storage_get_backend().multipart_abort(session.key, session.upload_id)
+            storage_release(self.file.fileID)
+            File.objects.filter(fileID=self.file.fileID, upload_finished_at__isnull=True).delete()
+        except Exception:
+            logger.exception("Could not discard the upload of %s", self.file.fileID)
+
+
 class FileGetService:
     """
     This also serves as a file to stream,
@@ -279,11 +1223,144 @@ class FileGetService:
     def __init__(self, user: User):
         self.user = user
 
-    @transaction.atomic
-    def geturl(self, file_path: str) -> Dict[str, Any]:
-        
-        return s3_generate_download_presigned_url(file_key = file_path)
+    def geturl(self, file_path: str, file_name: str = "", file_type: str = "", as_attachment: bool = False) -> str:
+        content_disposition = content_disposition_header(as_attachment, file_name) if file_name else None
+
+        return presign_download_url(
+            file_path,
+            expires_in = settings.FILE_DELIVERY_PRESIGNED_EXPIRY,
+            content_disposition = content_disposition,
+            content_type = file_type or None,
+        ).url
+
+    def delivery_mode(self, usertoken: UserPersonalFileToken) -> FileDeliveryMode:
+        """
+        Per token override first, then the always-proxied content types, then the deployment default.
+        Redirects need presigned URLs and X-Sendfile a path on disk, otherwise we fall back to proxying.
+        """
+        if usertoken.delivery_mode:
+            mode = FileDeliveryMode(usertoken.delivery_mode)
+        elif any(usertoken.type.startswith(prefix) for prefix in settings.FILE_DELIVERY_PROXY_CONTENT_TYPES):
+            mode = FileDeliveryMode.PROXY
+        else:
+            mode = FileDeliveryMode(settings.FILE_DELIVERY_MODE)
+
+        if mode == FileDeliveryMode.REDIRECT and not storage_get_backend().presigned_urls:
+            return FileDeliveryMode.PROXY
+
+        if mode == FileDeliveryMode.X_SENDFILE and settings.FILE_UPLOAD_STORAGE != FileUploadStorage.LOCAL.value:
+            return FileDeliveryMode.PROXY
+
+        return mode
+
+    def offload_location(self, mode: FileDeliveryMode, *, file: File, file_name: str, file_type: str, as_attachment: bool = False) -> str:
+        """
+        Where the fronting web server picks the bytes up from.
+
+        X-Sendfile:        the absolute path on disk
+        X-Accel-Redirect:  <FILE_DELIVERY_ACCEL_LOCAL_PREFIX><file key> for local storage,
+                           <FILE_DELIVERY_ACCEL_S3_PREFIX><s3 host>/<key>?<presigned query> for S3
+        """
+        if mode == FileDeliveryMode.X_SENDFILE:
+            return file.file.path
+
+        if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.LOCAL.value:
+            # Where the key is under the storage root, sharded or not
+            return settings.FILE_DELIVERY_ACCEL_LOCAL_PREFIX + parse.quote(storage_get_backend().relative_path(file.file.name))
+
+        presigned_url = parse.urlsplit(self.geturl(
+            file_path = file.file.name,
+            file_name = file_name,
+            file_type = file_type,
+            as_attachment = as_attachment,
+        ))
+
+        return f"{settings.FILE_DELIVERY_ACCEL_S3_PREFIX}{presigned_url.netloc}{presigned_url.path}?{presigned_url.query}"
     
+class FilePresignService:
+    """
+    Presigned URLs of many files at once, e.g. the thumbnails of a gallery page:
+    one query authorizes all the tokens, the URLs are signed locally or come from the presign cache.
+    """
+
+    def __init__(self, user: User):
+        self.user = user
+
+    def presign(self, file_token: List[str], as_attachment: bool = False) -> Dict[str, Any]:
+        if not storage_get_backend().presigned_urls:
+            raise ValidationError("Presigned URLs need S3 storage")
+
+        expires_in = int(s3_get_credentials().presigned_expiry)
+        file_token = list(dict.fromkeys(file_token))
+        usertokens = UserPersonalFileToken.objects.select_related('file_id').filter(
+            personalfiletoken__in = file_token,
+            uploaded_by = self.user,
+            is_delete_init = False,
+            file_id__upload_finished_at__isnull = False,
+        )
+
+        urls = {}
+        for usertoken in usertokens:
+            file = usertoken.file_id
+            presigned = presign_download_url(
+                file.file.name,
+                expires_in = expires_in,
+                content_disposition = content_disposition_header(
+                    as_attachment, usertoken.change_file_name or file.original_file_name
+                ),
+                content_type = file.file_type or None,
+            )
+            urls[usertoken.personalfiletoken] = {
+                "url": presigned.url,
+                "expires_at": datetime.fromtimestamp(presigned.expires_at, tz=dt_timezone.utc).isoformat(),
+            }
+
+        return {
+            "urls": urls,
+            # Unknown, not owned, deleted or still uploading
+            "not_found": [token for token in file_token if token not in urls],
+        }
+
+class FileArchiveService:
+    """
+    This also serves as a file to stream,
+    which encapsulates a flow (start & finish) + one-off action (upload_local) into a namespace.
+
+    Meaning, we use the class here for:
+
+    1. The namespace
+    """
+
+    def __init__(self, user: User):
+        self.user = user
+
+    def archiveFiles(self, file_token: List[str]) -> Tuple[Any, bool]:
+        """
+        Resolves the tokens to (member name, File) pairs in the requested order,
+        checking ownership and soft deletion of all of them with a single query.
+        """
+        file_token = list(dict.fromkeys(file_token))
+        usertokens = {
+            usertoken.personalfiletoken: usertoken
+            for usertoken in UserPersonalFileToken.objects.select_related('file_id').filter(personalfiletoken__in = file_token)
+        }
+
+        files = []
+        for token in file_token:
+            usertoken = usertokens.get(token)
+            if usertoken is None or not usertoken.file_id.is_valid:
+                return "No File Found", 0
+            elif usertoken.uploaded_by_id != self.user.pk:
+                return "File is not owned by you", 0
+            elif usertoken.is_delete_init:
+                return "File Has Been Already Deleted by You", 0
+
+            files.append((usertoken.change_file_name or usertoken.file_id.original_file_name, usertoken.file_id))
+
+        names = archive_member_names(display_name for display_name, _ in files)
+
+        return [(name, file) for name, (_, file) in zip(names, files)], True
+
 class FileCopyService:
     """
     This also serves as a file to stream,
@@ -309,10 +1386,16 @@ class FileCopyService:
             FileDetails = FileDetailsViewSerializer(File.objects.get(fileID = file_id)).data
             personal_token = Util.GenratePersonalFileToken(self.user, file_id)
 
+            try:
+                storage_charge(self.user, FileDetails["file_size"])
+            except StorageQuotaExceeded as e:
+                return e.messages[0], 0
+
             obj_ptoken = UserPersonalFileToken(
                 uploaded_by = self.user,
                 personalfiletoken = personal_token,
                 file_id = File.objects.get(fileID = file_id),
+                file_size = FileDetails["file_size"],
                 type = FileDetails["file_type"],
                 is_copied = True
             )
@@ -343,10 +1426,13 @@ class FileDeleteService:
         elif file_info['is_delete_init']:
             return "File Has Been Already Deleted by You", 0
         else:
+            storage_bin(self.user, usertoken.file_size)
+
             usertoken.is_delete_init = True
             usertoken.delete_init_at = timezone.now()
             usertoken.full_clean()
             usertoken.save()
+            presign_invalidate(usertoken.file_id.file.name)
 
             if UserPersonalFileToken.objects.filter(file_id = file_info['file_id']).exclude(Q(is_delete_init = True)).exists():
                 pass
@@ -386,6 +1472,8 @@ class FileRestoreService:
                 elif file_info['is_deleted']:
                     return "File Has Been Permanently Deleted", 0
                 else:
+                    storage_unbin(self.user, usertoken.file_size)
+
                     usertoken.is_delete_init = False
                     usertoken.delete_init_at = None
                     usertoken.full_clean()
@@ -493,6 +1581,7 @@ class EmptyRecycleBinservice:
         try:
             user_id = UserFullProfileSerializer(self.user).data['userId']
             data= UserPersonalFileToken.objects.filter(Q(uploaded_by=user_id), Q(is_deleted = False)).exclude(Q(is_delete_init = False))
+            storage_purge(self.user, data.aggregate(Sum('file_size')).get('file_size__sum') or 0)
             serializer=UserFileTokenListSerializer(data, many=True)
             for i in serializer.data:
                 print(i)
@@ -500,6 +1589,7 @@ class EmptyRecycleBinservice:
                 file.is_deleted = True
                 file.full_clean()
                 file.save()
+                presign_invalidate(file.file_id.file.name)
             return True
         except UserPersonalFileToken.DoesNotExist:
             return False
@@ -522,8 +1612,9 @@ class UserService:
         try:
             user_id = UserFullProfileSerializer(self.user).data['userId']
             data= UserPersonalFileToken.objects
-            totalstorage = data.filter(uploaded_by=user_id).exclude(Q(is_deleted = True)).aggregate(Sum('file_size')).get('file_size__sum')
-            binusedstorage = data.filter(Q(uploaded_by=user_id), Q(is_delete_init = True)).exclude(Q(is_deleted = True)).aggregate(Sum('file_size')).get('file_size__sum')
+            # Running totals, instead of summing every token
+            usage = storage_usage_get(self.user)
+            quota = storage_quota()
             totalfileupload = data.filter(uploaded_by=user_id).exclude(Q(is_deleted = True)).count()
             totalrecyclebinfile = data.filter(Q(uploaded_by=user_id), Q(is_delete_init = True)).exclude(Q(is_deleted = True)).count()
 
@@ -536,10 +1627,12 @@ class UserService:
             totalfavouritefiles = data.filter(Q(uploaded_by=user_id)).exclude(is_delete_init = True).exclude(favourite = False).count()
 
             res={
-                "allocatedstorage" : int(settings.STORAGE_PER_USER),
-                "totalstorage" : totalstorage,
-                "binusedstorage" : binusedstorage,
-                "leftstorage" : int(settings.STORAGE_PER_USER) - totalstorage,
+                "allocatedstorage" : quota,
+                "totalstorage" : usage.used,
+                "binusedstorage" : usage.in_bin,
+                # Held for uploads in progress
+                "reservedstorage" : usage.reserved,
+                "leftstorage" : None if quota is None else quota - usage.used - usage.reserved,
                 "totalfileupload" : totalfileupload,
                 "totalrecyclebinfile" : totalrecyclebinfile,
                 "totalimagesupload" : totalimagesupload,
@@ -649,6 +1742,7 @@ class FileRenameservice:
                 usertoken.change_file_name = file_name_new
                 usertoken.full_clean()
                 usertoken.save()
+                presign_invalidate(usertoken.file_id.file.name)
                 return "File Name get Updated", True
         except UserPersonalFileToken.DoesNotExist:
             return "File not Found", False
@@ -0,0 +1,124 @@
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
+
+from FileProcessing.enums import FileUploadStorage
+from integrations.storage.base import StorageBackend
+from integrations.storage.local import LocalStorageBackend
+from integrations.storage.memory import MemoryStorageBackend
+from integrations.storage.s3 import S3StorageBackend
+
+# Set by `storage_use_backend`, takes precedence over FILE_UPLOAD_STORAGE
+_backend_override: Optional[StorageBackend] = None
+
+
+def _storage_object_url(key: str) -> str:
+    from FileProcessing.models import File
+
+    # A presigned URL with S3Boto3Storage, the fake S3 in tests
+    return File._meta.get_field("file").storage.url(key)
+
+
+def _storage_local_root() -> str:
+    from FileProcessing.models import File
+
+    # Wherever a FileSystemStorage on the field writes, so both agree on where files are.
+    location = getattr(File._meta.get_field("file").storage, "location", None)
+
+    return location or settings.FILE_STORAGE_LOCAL_ROOT
+
+
+@lru_cache
+def _storage_s3_backend() -> S3StorageBackend:
+    return S3StorageBackend(object_url=_storage_object_url)
+
+
+@lru_cache
+def _storage_local_backend(root: str, shard_depth: int) -> LocalStorageBackend:
+    return LocalStorageBackend(root, shard_depth=shard_depth)
+
+
+@lru_cache
+def _storage_memory_backend(latency: float, bandwidth: int, error_rate: float) -> MemoryStorageBackend:
+    return MemoryStorageBackend(latency=latency, bandwidth=bandwidth, error_rate=error_rate)
+
+
+def storage_get_backend() -> StorageBackend:
+    """
+    The storage backend of FILE_UPLOAD_STORAGE, one per process (and configuration).
+    """
+    if _backend_override is not None:
+        return _backend_override
+
+    storage = FileUploadStorage(settings.FILE_UPLOAD_STORAGE)
+
+    if storage == FileUploadStorage.LOCAL:
+        return _storage_local_backend(_storage_local_root(), settings.FILE_STORAGE_LOCAL_SHARD_DEPTH)
+
+    if storage == FileUploadStorage.MEMORY:
+        return _storage_memory_backend(
+            settings.FILE_STORAGE_MEMORY_LATENCY, settings.FILE_STORAGE_MEMORY_BANDWIDTH, settings.FILE_STORAGE_MEMORY_ERROR_RATE
+        )
+
+    return _storage_s3_backend()
+
+
+def storage_use_backend(backend: Optional[StorageBackend]):
+    """
+    Uses `backend` whatever FILE_UPLOAD_STORAGE says, None goes back to it. For benchmarks and load tests.
+    """
+    global _backend_override
+
+    _backend_override = backend
+
+
+@deconstructible
+class BackendFileStorage(Storage):
+    """
+    Django file storage writing through the storage backend, for the FileField of local and memory storage.
+
+    Standard and local uploads are saved by Django, this puts them where the rest of the application
+    reads: in the sharded layout of the local backend, or in memory.
+    """
+
+    def _open(self, name, mode="rb"):
+        backend = storage_get_backend()
+        if isinstance(backend, LocalStorageBackend):
+            return DjangoFile(open(backend.path(name), mode), name=name)
+
+        return ContentFile(backend.get(name), name=name)
+
+    def _save(self, name, content):
+        storage_get_backend().put(name, content)
+
+        return name
+
+    def exists(self, name):
+        return storage_get_backend().head(name) is not None
+
+    def size(self, name):
+        head = storage_get_backend().head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+
+        return head.size
+
+    def delete(self, name):
+        storage_get_backend().delete(name)
+
+    def path(self, name):
+        backend = storage_get_backend()
+        if not isinstance(backend, LocalStorageBackend):
+            return super().path(name)
+
+        return backend.path(name)
+
+    def url(self, name):
+        return urljoin(settings.MEDIA_URL, filepath_to_uri(name))
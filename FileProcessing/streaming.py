@@ -0,0 +1,617 @@
+import asyncio
+import os
+import re
+from typing import Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from FileProcessing.cache import FileContentCache, content_range_re, file_cache_get
+from FileProcessing.hedging import hedged_reader_get
+from FileProcessing.prefetch import ParallelRangeReader
+from FileProcessing.storage import storage_get_backend
+
+range_re = re.compile(r'^bytes\s*=\s*(\d*)\s*-\s*(\d*)$', re.I)
+
+ByteRange = Tuple[Optional[int], Optional[int]]
+
+
+def parse_range_header(range_header: str) -> Optional[ByteRange]:
+    """
+    Parses a single `Range: bytes=...` header into (first_byte, last_byte).
+
+    Either side may be None:
+
+    `bytes=500-999` -> (500, 999)
+    `bytes=500-`    -> (500, None)  open ended
+    `bytes=-500`    -> (None, 500)  the last 500 bytes
+
+    Malformed and multi-range headers return None, in which case the full body is served.
+    """
+    range_match = range_re.match(range_header.strip())
+    if not range_match:
+        return None
+
+    first_byte, last_byte = range_match.groups()
+    if not first_byte and not last_byte:
+        return None
+
+    first_byte = int(first_byte) if first_byte else None
+    last_byte = int(last_byte) if last_byte else None
+
+    if first_byte is not None and last_byte is not None and last_byte < first_byte:
+        return None
+
+    return first_byte, last_byte
+
+
+def set_validator_headers(response: HttpResponse, etag: Optional[str], last_modified: Optional[int]):
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+
+
+def file_conditional_response(request, *, etag: Optional[str], last_modified: Optional[int]) -> Optional[HttpResponse]:
+    """
+    Evaluates If-Match, If-Unmodified-Since, If-None-Match and If-Modified-Since
+    against the validators alone, so a revalidation never touches storage.
+
+    Returns the 304 / 412 response, or None when the file should be served.
+    """
+    validators = HttpResponse()
+    set_validator_headers(validators, etag, last_modified)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified, response=validators)
+
+    return None if response is validators else response
+
+
+def if_range_passes(if_range: str, etag: Optional[str], last_modified: Optional[int]) -> bool:
+    """
+    A range is only honoured when `If-Range` is absent or still matches the stored bytes,
+    otherwise the full body is served. Weak ETags never match.
+    """
+    if_range = if_range.strip()
+    if not if_range:
+        return True
+
+    if if_range.startswith('"'):
+        return etag is not None and if_range == etag
+
+    if if_range.startswith('W/'):
+        return False
+
+    if_range_date = parse_http_date_safe(if_range)
+
+    return if_range_date is not None and if_range_date == last_modified
+
+
+def storage_open_stream(storage_key: str, byte_range: Optional[ByteRange] = None):
+    """
+    Opens the object `storage_key` for streaming, from the storage backend.
+
+    The requested range is forwarded to storage (with S3 as a real HTTP Range request),
+    so only the bytes the client asked for ever leave it. Opening is bounded by FILE_STORAGE_READ_DEADLINE
+    and hedged (see HedgedReader).
+    """
+    return hedged_reader_get().open(storage_get_backend(), storage_key, byte_range)
+
+
+async def astorage_open_stream(storage_key: str, byte_range: Optional[ByteRange] = None):
+    """
+    `storage_open_stream` for async views: the response is read with `aiter_chunks`, without holding a thread.
+    """
+    return await hedged_reader_get().aopen(storage_get_backend(), storage_key, byte_range)
+
+
+class FileStreamWrapper:
+    """
+    Iterates a file-like in large chunks, optionally stopping after `length` bytes.
+
+    File-likes with a native `readinto` (local files) are read into a single reused buffer.
+    Yielding views of that buffer is safe, because StreamingHttpResponse turns each chunk
+    into bytes before it asks for the next one.
+    """
+
+    def __init__(self, filelike, chunk_size=None, length=None):
+        self.filelike = filelike
+        self.chunk_size = chunk_size or settings.FILE_STREAM_CHUNK_SIZE
+        self.remaining = length
+
+        self.buffer = None
+        if hasattr(filelike, 'readinto'):
+            self.buffer = memoryview(bytearray(self.chunk_size))
+
+    def close(self):
+        # Upstream responses need to be explicitly closed, to free their pool slot
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        size = self.chunk_size if self.remaining is None else min(self.chunk_size, self.remaining)
+        if size <= 0:
+            raise StopIteration
+
+        if self.buffer is not None:
+            data = self.buffer[:self.filelike.readinto(self.buffer[:size]) or 0]
+        else:
+            data = self.filelike.read(size)
+
+        if not data:
+            raise StopIteration
+
+        if self.remaining is not None:
+            self.remaining -= len(data)
+
+        return data
+
+
+class AsyncFileStreamWrapper:
+    """
+    Async iteration of a storage response opened with `astorage_open_stream`, in large chunks,
+    optionally stopping after `length` bytes.
+
+    Under ASGI, StreamingHttpResponse needs an async iterator: a sync one is read to the end,
+    into memory, before the first byte is sent.
+    """
+
+    def __init__(self, body, chunk_size=None, length=None):
+        self.body = body
+        self.chunk_size = chunk_size or settings.FILE_STREAM_CHUNK_SIZE
+        self.length = length
+
+    def close(self):
+        self.body.close()
+
+    async def __aiter__(self):
+        remaining = self.length
+        try:
+            async for data in self.body.aiter_chunks(self.chunk_size):
+                if remaining is not None:
+                    data = data[:remaining]
+                    remaining -= len(data)
+                if data:
+                    yield data
+                if remaining == 0:
+                    return
+        finally:
+            await self.body.aclose()
+
+
+async def _aiterate_in_threads(iterator):
+    """
+    Async iteration of a sync iterator, each step in a worker thread.
+    """
+    done = object()
+
+    while True:
+        data = await asyncio.to_thread(next, iterator, done)
+        if data is done:
+            return
+        yield data
+
+
+class ChainedStream:
+    """
+    Reads `head_length` bytes from `head` (a cached prefix), then continues with the rest
+    from storage. The storage request is only made once the prefix has been sent.
+    """
+
+    def __init__(self, head, head_length: int, open_tail):
+        self.head = head
+        self.head_remaining = head_length
+        self.open_tail = open_tail
+        self.tail = None
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        if self.head_remaining > 0:
+            data = self.head.read(self.head_remaining if amt is None else min(amt, self.head_remaining))
+            if data:
+                self.head_remaining -= len(data)
+                return data
+            self.head_remaining = 0
+
+        if self.tail is None:
+            self.tail = self.open_tail()
+            self.tail.raise_for_status()
+
+        return self.tail.read(amt)
+
+    def close(self):
+        self.head.close()
+        if self.tail is not None:
+            self.tail.close()
+
+
+def resolve_byte_range(byte_range: ByteRange, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Turns a parsed range into absolute (first_byte, last_byte), None when unsatisfiable.
+    """
+    first_byte, last_byte = byte_range
+
+    if first_byte is None:
+        if last_byte == 0:
+            return None
+        return max(size - last_byte, 0), size - 1
+
+    if first_byte >= size:
+        return None
+
+    if last_byte is None or last_byte >= size:
+        last_byte = size - 1
+
+    return first_byte, last_byte
+
+
+def cache_open_body(cache: FileContentCache, key: str, *, storage_key: str, byte_range: Optional[ByteRange], file_size: int):
+    """
+    Serves the request from the disk cache when it holds the bytes,
+    or from the cached prefix of a video followed by storage for the rest.
+
+    Returns (body, first_byte, last_byte, total), None on a miss.
+    """
+    entry = cache.lookup(key, file_size)
+    if entry is None or entry.total <= 0:
+        return None
+
+    resolved = resolve_byte_range(byte_range, entry.total) if byte_range else (0, entry.total - 1)
+    if resolved is None:
+        return None
+
+    first_byte, last_byte = resolved
+    if first_byte >= entry.size:
+        return None
+
+    fp = cache.open_entry(entry)
+    if fp is None:
+        return None
+
+    fp.seek(first_byte)
+
+    if last_byte < entry.size:
+        cache.stats.record("hits")
+        return fp, first_byte, last_byte, entry.total
+
+    cache.stats.record("partial_hits")
+    body = ChainedStream(fp, entry.size - first_byte, lambda: storage_open_stream(storage_key, (entry.size, last_byte)))
+
+    return body, first_byte, last_byte, entry.total
+
+
+class RangeFile:
+    """
+    Exposes `length` bytes of an open file, from its current position.
+
+    `fileno` is passed through, so a `wsgi.file_wrapper` with sendfile support
+    (gunicorn) sends the range with a single offset / count `sendfile` from the
+    fd position and our Content-Length. Servers without it iterate `read`,
+    which never goes past the range.
+    """
+
+    def __init__(self, fp, length: int):
+        self.fp = fp
+        self.remaining = length
+
+    def fileno(self) -> int:
+        return self.fp.fileno()
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if size <= 0:
+            return b""
+
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+def local_file_response(
+    *,
+    path: str,
+    content_type: str,
+    filename: str,
+    disposition: str,
+    range_header: str = "",
+    if_range: str = "",
+    etag: Optional[str] = None,
+    last_modified: Optional[int] = None,
+) -> HttpResponse:
+    """
+    Zero-copy delivery of files on local storage.
+
+    FileResponse hands the open file to the server's `wsgi.file_wrapper`, which
+    sendfile()s it without the bytes ever going through Python. Single ranges
+    are served by seeking to the first byte and capping the length.
+    """
+    fp = open(path, 'rb')
+    size = os.fstat(fp.fileno()).st_size
+
+    byte_range = None
+    if if_range_passes(if_range, etag, last_modified):
+        byte_range = parse_range_header(range_header)
+
+    if byte_range is None:
+        response = FileResponse(fp, content_type=content_type)
+        response.block_size = settings.FILE_STREAM_CHUNK_SIZE
+        return _set_file_headers(response, size, disposition, filename, etag, last_modified)
+
+    resolved = resolve_byte_range(byte_range, size)
+    if resolved is None:
+        fp.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    first_byte, last_byte = resolved
+    length = last_byte - first_byte + 1
+    fp.seek(first_byte)
+
+    response = FileResponse(RangeFile(fp, length), status=206, content_type=content_type)
+    response.block_size = settings.FILE_STREAM_CHUNK_SIZE
+    response['Content-Range'] = f'bytes {first_byte}-{last_byte}/{size}'
+
+    return _set_file_headers(response, length, disposition, filename, etag, last_modified)
+
+
+def file_offload_response(
+    *,
+    header: str,
+    location: str,
+    content_type: str,
+    filename: str,
+    disposition: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[int] = None,
+) -> HttpResponse:
+    """
+    Empty response handing the transfer over to the fronting web server
+    through `X-Accel-Redirect` or `X-Sendfile`, so no worker is held while the bytes flow.
+
+    The web server serves ranges itself and keeps the headers set here. Example nginx locations:
+
+        location /protected/ { internal; alias /srv/drivenow/media/; }
+        location ~ ^/s3-proxy/(?<s3_host>[^/]+)/(?<s3_key>.*)$ {
+            internal;
+            resolver 1.1.1.1;
+            proxy_set_header Host $s3_host;
+            proxy_pass https://$s3_host/$s3_key$is_args$args;
+        }
+    """
+    response = HttpResponse(content_type=content_type)
+    response[header] = location
+    response['Access-Control-Expose-Headers'] = 'Content-Disposition,Content-Length,Content-Range,Content-Type'
+    response['Content-Disposition'] = f'{disposition}; filename={filename}'
+    response['Accept-Ranges'] = 'bytes'
+    # Relay storage as it arrives, nginx would otherwise spool big files to disk first.
+    response['X-Accel-Buffering'] = 'no'
+    set_validator_headers(response, etag, last_modified)
+
+    return response
+
+
+def parallel_streaming_response(
+    *,
+    storage_key: str,
+    content_type: str,
+    filename: str,
+    file_size: int,
+    disposition: str,
+    byte_range: Optional[ByteRange],
+    etag: Optional[str] = None,
+    last_modified: Optional[int] = None,
+) -> Optional[HttpResponse]:
+    """
+    Download engine for big objects: FILE_PARALLEL_DOWNLOAD_CONCURRENCY range requests
+    of FILE_PARALLEL_DOWNLOAD_PART_SIZE in flight, reassembled in order.
+
+    The first range is opened here, so a missing object still fails before the response starts.
+    Returns None when the download is under FILE_PARALLEL_DOWNLOAD_MIN_SIZE,
+    or storage does not agree with `file_size`, to stream it with a single request instead.
+    """
+    resolved = resolve_byte_range(byte_range, file_size) if byte_range else (0, file_size - 1)
+    if file_size <= 0 or resolved is None:
+        return None
+
+    first_byte, last_byte = resolved
+    length = last_byte - first_byte + 1
+    if length < settings.FILE_PARALLEL_DOWNLOAD_MIN_SIZE:
+        return None
+
+    part_size = settings.FILE_PARALLEL_DOWNLOAD_PART_SIZE
+
+    first_part = storage_open_stream(storage_key, (first_byte, min(first_byte + part_size - 1, last_byte)))
+    content_range_match = content_range_re.match(first_part.headers.get('Content-Range', ''))
+    if first_part.status_code != 206 or not content_range_match or int(content_range_match.group(3)) != file_size:
+        first_part.close()
+        return None
+
+    body = ParallelRangeReader(
+        lambda first, last: storage_open_stream(storage_key, (first, last)),
+        first_byte,
+        last_byte,
+        part_size=part_size,
+        concurrency=settings.FILE_PARALLEL_DOWNLOAD_CONCURRENCY,
+        first_part=first_part,
+    )
+
+    if byte_range is not None:
+        response = StreamingHttpResponse(FileStreamWrapper(body, length=length), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {first_byte}-{last_byte}/{file_size}'
+    else:
+        response = StreamingHttpResponse(FileStreamWrapper(body, length=length), content_type=content_type)
+
+    return _set_file_headers(response, length, disposition, filename, etag, last_modified)
+
+
+def file_streaming_response(
+    *,
+    storage_key: str,
+    content_type: str,
+    filename: str,
+    file_size: int,
+    disposition: str,
+    range_header: str = "",
+    if_range: str = "",
+    etag: Optional[str] = None,
+    last_modified: Optional[int] = None,
+    cache_key: Optional[str] = None,
+    parallel: bool = False,
+) -> HttpResponse:
+    """
+    Shared streaming implementation of `get/<token>/` and `get/d/<token>/`.
+
+    Storage resolves the range (including open ended and suffix ranges),
+    we relay its `Content-Range` and `Content-Length` as-is.
+    With FILE_CACHE_ENABLED, `cache_key` enables the local disk read-through cache.
+    With FILE_PARALLEL_DOWNLOAD_ENABLED, `parallel` lets big cache misses use parallel range requests.
+    """
+    byte_range = None
+    if if_range_passes(if_range, etag, last_modified):
+        byte_range = parse_range_header(range_header)
+
+    cache = file_cache_get() if cache_key else None
+    cached = cache_open_body(cache, cache_key, storage_key=storage_key, byte_range=byte_range, file_size=file_size) if cache else None
+
+    if cached is not None:
+        body, first_byte, last_byte, total = cached
+        length = last_byte - first_byte + 1
+
+        if byte_range is not None:
+            response = StreamingHttpResponse(
+                FileStreamWrapper(body, length=length), status=206, content_type=content_type
+            )
+            response['Content-Range'] = f'bytes {first_byte}-{last_byte}/{total}'
+        else:
+            response = StreamingHttpResponse(FileStreamWrapper(body, length=length), content_type=content_type)
+
+        return _set_file_headers(response, length, disposition, filename, etag, last_modified)
+
+    if parallel and settings.FILE_PARALLEL_DOWNLOAD_ENABLED:
+        response = parallel_streaming_response(
+            storage_key=storage_key,
+            content_type=content_type,
+            filename=filename,
+            file_size=file_size,
+            disposition=disposition,
+            byte_range=byte_range,
+            etag=etag,
+            last_modified=last_modified,
+        )
+        if response is not None:
+            return response
+
+    streaming_body = storage_open_stream(storage_key, byte_range)
+
+    if streaming_body.status_code == 416:
+        streaming_body.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = streaming_body.headers.get('Content-Range', f'bytes */{file_size}')
+        return response
+
+    streaming_body.raise_for_status()
+
+    length = int(streaming_body.headers["Content-Length"])
+
+    body = streaming_body
+    if cache is not None:
+        cache.stats.record("misses")
+        body = cache.filler(cache_key, streaming_body, content_type=content_type)
+
+    if streaming_body.status_code == 206:
+        response = StreamingHttpResponse(
+            FileStreamWrapper(body, length=length), status=206, content_type=content_type
+        )
+        response['Content-Range'] = streaming_body.headers['Content-Range']
+    else:
+        # Storage is allowed to ignore the range and answer with the full body.
+        response = StreamingHttpResponse(FileStreamWrapper(body), content_type=content_type)
+
+    return _set_file_headers(response, length, disposition, filename, etag, last_modified)
+
+
+async def afile_streaming_response(
+    *,
+    storage_key: str,
+    content_type: str,
+    filename: str,
+    file_size: int,
+    disposition: str,
+    range_header: str = "",
+    if_range: str = "",
+    etag: Optional[str] = None,
+    last_modified: Optional[int] = None,
+    cache_key: Optional[str] = None,
+    parallel: bool = False,
+) -> HttpResponse:
+    """
+    `file_streaming_response` for the async views: storage is read with the async client,
+    so a download in flight holds its sockets and buffers, but no thread.
+
+    The disk cache and the parallel download engine are thread based: with them enabled the response
+    comes from `file_streaming_response`, its chunks read in worker threads.
+    """
+    if (cache_key and file_cache_get()) or (parallel and settings.FILE_PARALLEL_DOWNLOAD_ENABLED):
+        response = await sync_to_async(file_streaming_response, thread_sensitive=False)(
+            storage_key=storage_key,
+            content_type=content_type,
+            filename=filename,
+            file_size=file_size,
+            disposition=disposition,
+            range_header=range_header,
+            if_range=if_range,
+            etag=etag,
+            last_modified=last_modified,
+            cache_key=cache_key,
+            parallel=parallel,
+        )
+        if response.streaming:
+            response.streaming_content = _aiterate_in_threads(response.streaming_content)
+        return response
+
+    byte_range = None
+    if if_range_passes(if_range, etag, last_modified):
+        byte_range = parse_range_header(range_header)
+
+    streaming_body = await astorage_open_stream(storage_key, byte_range)
+
+    if streaming_body.status_code == 416:
+        await streaming_body.aclose()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = streaming_body.headers.get('Content-Range', f'bytes */{file_size}')
+        return response
+
+    await streaming_body.araise_for_status()
+
+    length = int(streaming_body.headers["Content-Length"])
+
+    if streaming_body.status_code == 206:
+        response = StreamingHttpResponse(
+            AsyncFileStreamWrapper(streaming_body, length=length), status=206, content_type=content_type
+        )
+        response['Content-Range'] = streaming_body.headers['Content-Range']
+    else:
+        response = StreamingHttpResponse(AsyncFileStreamWrapper(streaming_body), content_type=content_type)
+
+    return _set_file_headers(response, length, disposition, filename, etag, last_modified)
+
+
+def _set_file_headers(response, length, disposition, filename, etag, last_modified):
+    response['Content-Length'] = str(length)
+    response['Access-Control-Expose-Headers'] = 'Content-Disposition,Content-Length,Content-Range,Content-Type'
+    response['Content-Disposition'] = f'{disposition}; filename={filename}'
+    response['Accept-Ranges'] = 'bytes'
+    set_validator_headers(response, etag, last_modified)
+
+    return response
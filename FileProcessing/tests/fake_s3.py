@@ -0,0 +1,53 @@
+from django.core.files.storage import FileSystemStorage
+from django.test import override_settings
+
+from FileProcessing.models import File
+from FileProcessing.presign import presign_cache_get
+from FileProcessing.tests.fake_storage import FakeStorageServer
+from integrations.aws.client import s3_get_credentials
+
+
+class FakeS3TestMixin:
+    """
+    Points boto3 (AWS_S3_ENDPOINT_URL) and the file storage `base_url` at a FakeStorageServer.
+
+    The multipart minimum part size is lowered to 1 KiB, so tests can use small parts.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.storage_server = FakeStorageServer().start()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.storage_server.stop()
+
+    def setUp(self):
+        super().setUp()
+
+        self.storage_server.reset()
+        self.storage_server.min_part_size = 1024
+
+        settings_override = override_settings(
+            FILE_UPLOAD_STORAGE="s3",
+            AWS_S3_ACCESS_KEY_ID="AKIAEXAMPLE",
+            AWS_S3_SECRET_ACCESS_KEY="secret",
+            AWS_S3_REGION_NAME="eu-central-1",
+            AWS_STORAGE_BUCKET_NAME=self.storage_server.bucket,
+            AWS_S3_ENDPOINT_URL=self.storage_server.url.rstrip("/"),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        s3_get_credentials.cache_clear()
+        self.addCleanup(s3_get_credentials.cache_clear)
+        # URLs signed for another test's fake server must not be handed out.
+        presign_cache_get.cache_clear()
+        self.addCleanup(presign_cache_get.cache_clear)
+
+        field = File._meta.get_field("file")
+        original_storage = field.storage
+        field.storage = FileSystemStorage(base_url=self.storage_server.url)
+        self.addCleanup(setattr, field, "storage", original_storage)
@@ -0,0 +1,461 @@
+import base64
+import hashlib
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Union
+from urllib import parse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class SyntheticObject:
+    """
+    A deterministic object of any size (byte i is i % 256) that never lives in memory,
+    for multi-GB transfers.
+    """
+
+    pattern = bytes(range(256)) * 4096
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, item: slice) -> bytes:
+        start, stop, _ = item.indices(self.size)
+        offset = start % 256
+        length = max(stop - start, 0)
+
+        if offset + length <= len(self.pattern):
+            return self.pattern[offset:offset + length]
+
+        repeats = (offset + length) // len(self.pattern) + 1
+        return (self.pattern * repeats)[offset:offset + length]
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-body is part of what we test.
+        pass
+
+
+class FakeStorageServer:
+    """
+    A tiny S3 stand-in, serving objects over HTTP with single range support.
+
+    It keeps track of how many body bytes it has sent,
+    so tests can assert that seeking does not download the skipped part.
+    Statuses queued in `errors` are answered, in order, before serving objects again.
+
+    `latency` (seconds before the response starts) and `bandwidth` (bytes per second,
+    per connection) make it behave like a remote object store. Without `ranges` it ignores
+    Range headers, like a plain web server. A Range whose If-Range does not match the ETag
+    is answered with the whole object.
+
+    Under `/<bucket>/` it also speaks the part of the S3 API we use, so boto3 can be pointed at it
+    with AWS_S3_ENDPOINT_URL: head / put / delete object, multipart uploads (create, upload part,
+    list parts, complete, abort) and listing in-progress multipart uploads. Multipart uploads created
+    with the SHA256 checksum algorithm check each part's checksum, and heads of their objects
+    report the composite checksum. Presigned URLs are accepted without checking their signature.
+    """
+
+    bucket = "drivenow-test"
+
+    def __init__(self, latency: float = 0, bandwidth: Optional[int] = None):
+        self.objects: Dict[str, Union[bytes, SyntheticObject]] = {}
+        self.etags: Dict[str, str] = {}
+        self.checksums: Dict[str, str] = {}
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+        self.min_part_size = 5 * 1024 * 1024
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ranges = True
+        self.errors = []
+        # Extra seconds before the next GETs answer, one per GET: a slow first byte on some requests only
+        self.delays = []
+        self.requests = []
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        self.httpd = QuietHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def put(self, key: str, body: Union[bytes, SyntheticObject]):
+        self.objects[key] = body
+        self.etags[key] = hashlib.md5(body).hexdigest() if isinstance(body, bytes) else uuid.uuid4().hex
+        self.checksums.pop(key, None)
+
+    def reset(self):
+        with self._lock:
+            self.objects.clear()
+            self.etags.clear()
+            self.checksums.clear()
+            self.uploads.clear()
+            self.errors.clear()
+            self.delays.clear()
+            self.requests.clear()
+            self.bytes_sent = 0
+            self.ranges = True
+
+    def _record(self, method, path, headers, sent):
+        with self._lock:
+            self.requests.append({"method": method, "path": path, "headers": dict(headers)})
+            self.bytes_sent += sent
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _parse_path(self):
+                """
+                Returns (s3 api call, key, query). Plain `/<key>` paths are object downloads.
+                """
+                path, _, query = self.path.partition("?")
+                query = {name: values[-1] for name, values in parse.parse_qs(query, keep_blank_values=True).items()}
+
+                prefix = f"/{server.bucket}"
+                if path == prefix or path.startswith(prefix + "/"):
+                    return True, parse.unquote(path[len(prefix) + 1:]), query
+
+                return False, parse.unquote(path.lstrip("/")), query
+
+            def _read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def _send(self, status, body=b"", headers=None):
+                if isinstance(body, str):
+                    body = body.encode()
+
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_xml(self, status, root, content):
+                self._send(
+                    status,
+                    f'<?xml version="1.0" encoding="UTF-8"?>'
+                    f'<{root} xmlns="http://s3.amazonaws.com/doc/2006-03-01/">{content}</{root}>',
+                    {"Content-Type": "application/xml"},
+                )
+
+            def _send_error(self, status, code, message=""):
+                # Unlike the results, S3 errors come without the namespace.
+                self._send(
+                    status,
+                    f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>',
+                    {"Content-Type": "application/xml"},
+                )
+
+            def _queued_error(self, method, key):
+                with server._lock:
+                    error = server.errors.pop(0) if server.errors else None
+
+                if error is not None:
+                    server._record(method, key, self.headers, 0)
+                    self._send(error)
+
+                return error is not None
+
+            def do_HEAD(self):
+                _, key, _ = self._parse_path()
+                server._record("HEAD", key, self.headers, 0)
+
+                body = server.objects.get(key)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", f'"{server.etags[key]}"')
+                if self.headers.get("x-amz-checksum-mode") == "ENABLED" and key in server.checksums:
+                    self.send_header("x-amz-checksum-sha256", server.checksums[key])
+                self.end_headers()
+
+            def do_PUT(self):
+                _, key, query = self._parse_path()
+                data = self._read_body()
+                server._record("PUT", key, self.headers, 0)
+
+                if "uploadId" in query:
+                    upload = server.uploads.get(query["uploadId"])
+                    if upload is None:
+                        return self._send_error(404, "NoSuchUpload")
+
+                    checksum = self.headers.get("x-amz-checksum-sha256", "")
+                    if bool(checksum) != (upload["checksum_algorithm"] == "SHA256"):
+                        return self._send_error(400, "InvalidRequest", "Checksum type mismatch")
+                    if checksum and checksum != base64.b64encode(hashlib.sha256(data).digest()).decode():
+                        return self._send_error(400, "BadDigest")
+
+                    etag = hashlib.md5(data).hexdigest()
+                    with server._lock:
+                        upload["parts"][int(query["partNumber"])] = {"etag": etag, "data": data, "checksum": checksum}
+
+                    headers = {"ETag": f'"{etag}"'}
+                    if checksum:
+                        headers["x-amz-checksum-sha256"] = checksum
+                    return self._send(200, headers=headers)
+
+                server.put(key, data)
+                self._send(200, headers={"ETag": f'"{server.etags[key]}"'})
+
+            def do_POST(self):
+                api, key, query = self._parse_path()
+                data = self._read_body()
+                server._record("POST", key, self.headers, 0)
+
+                if "uploads" in query:
+                    upload_id = uuid.uuid4().hex
+                    with server._lock:
+                        server.uploads[upload_id] = {
+                            "key": key,
+                            "parts": {},
+                            "initiated": time.time(),
+                            "checksum_algorithm": self.headers.get("x-amz-checksum-algorithm", "").upper(),
+                        }
+                    return self._send_xml(
+                        200, "InitiateMultipartUploadResult",
+                        f"<Bucket>{server.bucket}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>",
+                    )
+
+                if "uploadId" in query:
+                    return self._complete(key, query["uploadId"], data)
+
+                if "delete" in query:
+                    keys = [element.text for element in _iter_local(ElementTree.fromstring(data), "Key")]
+                    with server._lock:
+                        for deleted in keys:
+                            server.objects.pop(deleted, None)
+                    return self._send_xml(
+                        200, "DeleteResult", "".join(f"<Deleted><Key>{escape(deleted)}</Key></Deleted>" for deleted in keys)
+                    )
+
+                self._send_error(400, "InvalidRequest")
+
+            def _complete(self, key, upload_id, data):
+                upload = server.uploads.get(upload_id)
+                if upload is None:
+                    return self._send_error(404, "NoSuchUpload")
+
+                requested = [
+                    (
+                        int(_find_local(part, "PartNumber").text),
+                        _find_local(part, "ETag").text.strip('"'),
+                        next((element.text for element in _iter_local(part, "ChecksumSHA256")), ""),
+                    )
+                    for part in _iter_local(ElementTree.fromstring(data), "Part")
+                ]
+                numbers = [number for number, _, _ in requested]
+                if not requested or numbers != sorted(set(numbers)):
+                    return self._send_error(400, "InvalidPartOrder")
+
+                parts = []
+                for index, (number, etag, checksum) in enumerate(requested):
+                    part = upload["parts"].get(number)
+                    if part is None or part["etag"] != etag or part["checksum"] != checksum:
+                        return self._send_error(400, "InvalidPart", f"Part {number}")
+                    if index < len(requested) - 1 and len(part["data"]) < server.min_part_size:
+                        return self._send_error(400, "EntityTooSmall", f"Part {number}")
+                    parts.append(part)
+
+                body = b"".join(part["data"] for part in parts)
+                etag = hashlib.md5(b"".join(bytes.fromhex(part["etag"]) for part in parts)).hexdigest()
+
+                checksum = ""
+                if upload["checksum_algorithm"] == "SHA256":
+                    digest = hashlib.sha256(b"".join(base64.b64decode(part["checksum"]) for part in parts)).digest()
+                    checksum = f"{base64.b64encode(digest).decode()}-{len(parts)}"
+
+                with server._lock:
+                    server.objects[key] = body
+                    server.etags[key] = f"{etag}-{len(parts)}"
+                    server.checksums.pop(key, None)
+                    if checksum:
+                        server.checksums[key] = checksum
+                    del server.uploads[upload_id]
+
+                self._send_xml(
+                    200, "CompleteMultipartUploadResult",
+                    f"<Bucket>{server.bucket}</Bucket><Key>{escape(key)}</Key><ETag>&quot;{etag}-{len(parts)}&quot;</ETag>"
+                    + (f"<ChecksumSHA256>{checksum}</ChecksumSHA256>" if checksum else ""),
+                )
+
+            def do_DELETE(self):
+                _, key, query = self._parse_path()
+                server._record("DELETE", key, self.headers, 0)
+
+                if "uploadId" in query:
+                    with server._lock:
+                        upload = server.uploads.pop(query["uploadId"], None)
+                    if upload is None:
+                        return self._send_error(404, "NoSuchUpload")
+                    return self._send(204)
+
+                with server._lock:
+                    server.objects.pop(key, None)
+                    server.checksums.pop(key, None)
+                self._send(204)
+
+            def _list_parts(self, key, upload_id):
+                upload = server.uploads.get(upload_id)
+                if upload is None:
+                    return self._send_error(404, "NoSuchUpload")
+
+                with server._lock:
+                    parts = sorted(upload["parts"].items())
+
+                self._send_xml(
+                    200, "ListPartsResult",
+                    f"<Bucket>{server.bucket}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>"
+                    "<IsTruncated>false</IsTruncated>"
+                    + "".join(
+                        f"<Part><PartNumber>{number}</PartNumber><ETag>&quot;{part['etag']}&quot;</ETag>"
+                        f"<Size>{len(part['data'])}</Size>"
+                        + (f"<ChecksumSHA256>{part['checksum']}</ChecksumSHA256>" if part["checksum"] else "")
+                        + "</Part>"
+                        for number, part in parts
+                    ),
+                )
+
+            def _list_uploads(self, prefix=""):
+                with server._lock:
+                    uploads = sorted(
+                        (item for item in server.uploads.items() if item[1]["key"].startswith(prefix)),
+                        key=lambda item: item[1]["initiated"],
+                    )
+
+                self._send_xml(
+                    200, "ListMultipartUploadsResult",
+                    f"<Bucket>{server.bucket}</Bucket><IsTruncated>false</IsTruncated>"
+                    + "".join(
+                        f"<Upload><Key>{escape(upload['key'])}</Key><UploadId>{upload_id}</UploadId>"
+                        f"<Initiated>{time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(upload['initiated']))}</Initiated></Upload>"
+                        for upload_id, upload in uploads
+                    ),
+                )
+
+            def do_GET(self):
+                with server._lock:
+                    delay = server.delays.pop(0) if server.delays else 0
+                if server.latency or delay:
+                    time.sleep(server.latency + delay)
+
+                api, key, query = self._parse_path()
+
+                if self._queued_error("GET", key):
+                    return
+
+                if api and "uploadId" in query:
+                    server._record("GET", key, self.headers, 0)
+                    return self._list_parts(key, query["uploadId"])
+
+                if api and "uploads" in query:
+                    server._record("GET", key, self.headers, 0)
+                    return self._list_uploads(query.get("prefix", ""))
+
+                body = server.objects.get(key)
+
+                if body is None:
+                    server._record("GET", key, self.headers, 0)
+                    if api:
+                        return self._send_error(404, "NoSuchKey")
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                size = len(body)
+                status = 200
+                first_byte, last_byte = 0, size - 1
+
+                range_match = range_re.match(self.headers.get("Range", "")) if server.ranges else None
+                if_range = self.headers.get("If-Range")
+                if if_range is not None and if_range != f'"{server.etags.get(key, "")}"':
+                    range_match = None
+                if range_match:
+                    first, last = range_match.groups()
+                    if first == "":
+                        first_byte = max(size - int(last), 0)
+                    else:
+                        first_byte = int(first)
+                        if last != "":
+                            last_byte = min(int(last), size - 1)
+
+                    if first_byte >= size:
+                        server._record("GET", key, self.headers, 0)
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+
+                    status = 206
+
+                length = last_byte - first_byte + 1
+
+                self.send_response(status)
+                self.send_header("Content-Length", str(length))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", f'"{server.etags.get(key, "")}"')
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {first_byte}-{last_byte}/{size}")
+                self.end_headers()
+
+                server._record("GET", key, self.headers, length)
+                self._write_throttled(body, first_byte, last_byte + 1)
+
+            def _write_throttled(self, body, start, stop):
+                piece_size = 1048576 if server.bandwidth is None else 65536
+                started = time.perf_counter()
+
+                for offset in range(start, stop, piece_size):
+                    self.wfile.write(body[offset:min(offset + piece_size, stop)])
+
+                    if server.bandwidth is not None:
+                        ahead = (offset + piece_size - start) / server.bandwidth - (time.perf_counter() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+
+        return Handler
+
+
+def _iter_local(element, name):
+    # S3 XML comes with or without the namespace.
+    return (child for child in element.iter() if child.tag.rsplit("}", 1)[-1] == name)
+
+
+def _find_local(element, name):
+    return next(_iter_local(element, name))
+
@@ -0,0 +1,162 @@
+import hashlib
+import io
+import tarfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.models import File, UserPersonalFileToken
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+
+
+def tar_body(files, mode="w"):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        directory = tarfile.TarInfo("photos")
+        directory.type = tarfile.DIRTYPE  # Not a regular file, skipped
+        archive.addfile(directory)
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+    return buffer.getvalue()
+
+
+class BatchUploadTests(FakeS3TestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def photos(self, count):
+        return [(f"photo-{i}.jpg", f"photo {i}".encode() * 100) for i in range(count)]
+
+    def upload(self, files):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("upload:batch"),
+                {"files": [SimpleUploadedFile(name, data) for name, data in files]},
+                format="multipart",
+            )
+
+    def upload_tar(self, body, content_type="application/x-tar"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.generic("POST", reverse("upload:batch"), body, content_type=content_type)
+
+    def assertUploaded(self, result, name, data):
+        token = UserPersonalFileToken.objects.select_related("file_id").get(personalfiletoken=result["id"])
+
+        self.assertEqual(result["file_name"], name)
+        self.assertEqual((token.uploaded_by, token.file_size), (self.user, len(data)))
+        self.assertEqual(token.file_id.original_file_name, name)
+        self.assertEqual(token.file_id.file.name, f"files/image/jpeg/{token.file_id.file_name}")
+        self.assertEqual(self.storage_server.objects[token.file_id.file.name], data)
+        self.assertIsNotNone(token.file_id.upload_finished_at)
+
+    def test_multipart_files(self):
+        files = self.photos(5)
+
+        response = self.upload(files)
+
+        self.assertEqual(response.status_code, 201)
+        for result, (name, data) in zip(response.data["files"], files):
+            self.assertUploaded(result, name, data)
+        self.assertEqual(File.objects.count(), 5)
+
+    def test_tar_stream(self):
+        files = self.photos(3)
+
+        response = self.upload_tar(tar_body([(f"holiday/{name}", data) for name, data in files]))
+
+        self.assertEqual(response.status_code, 201)
+        for result, (name, data) in zip(response.data["files"], files):
+            self.assertUploaded(result, name, data)
+
+    def test_compressed_tar_stream(self):
+        files = self.photos(2)
+
+        response = self.upload_tar(tar_body(files, mode="w:gz"), content_type="application/gzip")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data["files"]), 2)
+
+    def test_invalid_tar_stream(self):
+        response = self.upload_tar(b"not a tar archive" * 100)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        # The storage counters are set up by the first upload
+        self.upload([("first.jpg", b"first")])
+
+        with CaptureQueriesContext(connection) as few:
+            self.upload(self.photos(2))
+        with CaptureQueriesContext(connection) as many:
+            self.upload([(f"more-{name}", data + b"more") for name, data in self.photos(40)])
+
+        self.assertEqual(len(many), len(few))
+
+    @override_settings(FILE_BATCH_MAX_FILE_SIZE=1024)
+    def test_failures_are_reported_per_file(self):
+        files = [("small.jpg", b"small"), ("big.jpg", b"0" * 2048), ("other.jpg", b"other")]
+
+        response = self.upload(files)
+
+        self.assertEqual(response.status_code, 207)
+        results = response.data["files"]
+        self.assertUploaded(results[0], *files[0])
+        self.assertEqual(results[1]["file_name"], "big.jpg")
+        self.assertIn("too large", results[1]["errors"])
+        self.assertUploaded(results[2], *files[2])
+        self.assertEqual(File.objects.count(), 2)
+
+    @override_settings(FILE_BATCH_MAX_FILE_SIZE=1024)
+    def test_oversized_tar_members_are_skipped(self):
+        response = self.upload_tar(tar_body([("big.jpg", b"0" * 2048), ("small.jpg", b"small")]))
+
+        self.assertEqual(response.status_code, 207)
+        self.assertIn("errors", response.data["files"][0])
+        self.assertUploaded(response.data["files"][1], "small.jpg", b"small")
+
+    @override_settings(FILE_BATCH_MAX_FILES=3)
+    def test_too_many_files(self):
+        response = self.upload_tar(tar_body(self.photos(4)))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.storage_server.objects, {})
+
+    def test_failed_object_upload(self):
+        with mock.patch("integrations.storage.s3.s3_put_object", side_effect=ConnectionError):
+            response = self.upload(self.photos(1))
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data["files"][0]["errors"], "File upload failed")
+        self.assertFalse(File.objects.exists())
+
+    def test_no_files(self):
+        self.assertEqual(self.client.post(reverse("upload:batch"), {}, format="multipart").status_code, 404)
+
+    def test_same_content_is_stored_once(self):
+        existing = self.upload([("existing.jpg", b"existing")]).data["files"][0]
+
+        response = self.upload([("a.jpg", b"same"), ("b.jpg", b"same"), ("existing-copy.jpg", b"existing")])
+
+        self.assertEqual(response.status_code, 201)
+        a, b, copy = (
+            UserPersonalFileToken.objects.get(personalfiletoken=result["id"]) for result in response.data["files"]
+        )
+        self.assertEqual(a.file_id, b.file_id)
+        self.assertEqual(b.change_file_name, "b.jpg")
+        self.assertEqual(a.file_id.sha256, hashlib.sha256(b"same").hexdigest())
+        self.assertEqual(copy.file_id, UserPersonalFileToken.objects.get(personalfiletoken=existing["id"]).file_id)
+        self.assertEqual(len(self.storage_server.objects), 2)
@@ -0,0 +1,235 @@
+import requests
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.models import File, MultipartUploadPart, MultipartUploadSession, UserPersonalFileToken
+from FileProcessing.services import FileMultipartUploadService
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+from FileProcessing.utils import multipart_part_size
+
+MiB = 1024 * 1024
+
+
+class MultipartPartSizeTests(SimpleTestCase):
+    def test_configured_part_size(self):
+        self.assertEqual(multipart_part_size(100 * MiB), 8 * MiB)
+
+    @override_settings(FILE_MULTIPART_PART_SIZE=MiB)
+    def test_never_under_the_s3_minimum(self):
+        self.assertEqual(multipart_part_size(100 * MiB), 5 * MiB)
+
+    def test_grown_to_fit_in_ten_thousand_parts(self):
+        part_size = multipart_part_size(100 * 1024 * MiB)
+
+        self.assertEqual(part_size, 11 * MiB)
+        self.assertLessEqual(-(-100 * 1024 * MiB // part_size), 10000)
+
+
+class MultipartUploadApiTests(FakeS3TestMixin, TestCase):
+    body = bytes(range(256)) * 12  # 3 KiB, three parts of 1 KiB
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def request(self, req_type, data, format="json"):
+        return self.client.post(reverse("upload:MultiPartUpload"), data, format=format, HTTP_X_REQ_TYPE=req_type)
+
+    def start(self, size=None):
+        response = self.request("start", {"file_name": "notes.bin", "file_type": "application/octet-stream", "file_size": size or len(self.body)})
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def upload_part(self, file_id, part_number):
+        part = self.body[(part_number - 1) * 1024:part_number * 1024]
+        return self.request(
+            "upload",
+            {"file_id": file_id, "part_number": part_number, "file": SimpleUploadedFile("part", part)},
+            format="multipart",
+        )
+
+    def test_upload_session_is_stored_in_the_database(self):
+        file_id = self.start()
+
+        session = MultipartUploadSession.objects.get(file_id=file_id)
+        self.assertEqual(session.uploaded_by, self.user)
+        self.assertEqual(session.file_size, len(self.body))
+        self.assertIn(session.upload_id, self.storage_server.uploads)
+
+    def test_parts_out_of_order_are_completed_sorted(self):
+        file_id = self.start()
+
+        for part_number in (3, 1, 2):
+            self.assertEqual(self.upload_part(file_id, part_number).status_code, 202)
+
+        response = self.request("finish", {"file_id": file_id})
+
+        self.assertEqual(response.status_code, 200)
+        file = File.objects.get(fileID=file_id)
+        self.assertEqual(self.storage_server.objects[file.file.name], self.body)
+        self.assertTrue(file.etag.endswith("-3"))
+        self.assertIsNotNone(file.upload_finished_at)
+        self.assertTrue(UserPersonalFileToken.objects.filter(personalfiletoken=response.data["id"]).exists())
+        self.assertFalse(MultipartUploadSession.objects.filter(file_id=file_id).exists())
+        self.assertFalse(MultipartUploadPart.objects.exists())
+
+    def test_status_reports_missing_parts(self):
+        file_id = self.start()
+        self.upload_part(file_id, 1)
+        self.upload_part(file_id, 3)
+
+        response = self.request("status", {"file_id": file_id})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["missing_parts"], [2])
+        self.assertEqual(response.data["next_part_number"], 4)
+        self.assertEqual(response.data["received_bytes"], 2048)
+        self.assertEqual(response.data["remaining_bytes"], 1024)
+        self.assertEqual([part["part_number"] for part in response.data["parts"]], [1, 3])
+
+    def test_finish_with_missing_parts_fails_and_keeps_the_session(self):
+        file_id = self.start()
+        self.upload_part(file_id, 1)
+        self.upload_part(file_id, 3)
+
+        response = self.request("finish", {"file_id": file_id})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["errors"], ["Missing parts"])
+        self.assertTrue(MultipartUploadSession.objects.filter(file_id=file_id).exists())
+        self.assertEqual(len(self.storage_server.uploads), 1)
+
+    def test_retried_part_replaces_the_previous_one(self):
+        file_id = self.start()
+        self.upload_part(file_id, 1)
+        self.upload_part(file_id, 1)
+
+        self.assertEqual(MultipartUploadPart.objects.filter(session_id=file_id, part_number=1).count(), 1)
+
+    def test_parts_can_land_on_any_worker(self):
+        # Nothing is kept in the process: a fresh service instance per call, like separate workers.
+        file_id = self.start()
+        for part_number in (1, 2, 3):
+            part = SimpleUploadedFile("part", self.body[(part_number - 1) * 1024:part_number * 1024])
+            FileMultipartUploadService(self.user).upload(file_id=file_id, part_number=part_number, file_obj=part)
+
+        token = FileMultipartUploadService(self.user).finish(file_id=file_id, file=File.objects.get(fileID=file_id))
+
+        self.assertTrue(token)
+
+    def test_finish_of_an_unknown_upload_is_not_found(self):
+        file_id = self.start()
+        self.upload_part(file_id, 1)
+
+        other = User.objects.create_user(email="other@example.com", name="Other", password="password")
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.request("finish", {"file_id": file_id}).status_code, 404)
+
+    def test_part_number_is_validated(self):
+        file_id = self.start()
+
+        self.assertEqual(self.upload_part(file_id, 0).status_code, 400)
+        self.assertEqual(self.request("upload", {"file_id": file_id, "part_number": 10001}).status_code, 400)
+
+    def test_uploads_of_other_users_are_not_found(self):
+        file_id = self.start()
+
+        other = User.objects.create_user(email="other@example.com", name="Other", password="password")
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.upload_part(file_id, 1).status_code, 404)
+        self.assertEqual(self.request("status", {"file_id": file_id}).status_code, 404)
+
+
+class PresignedMultipartUploadTests(FakeS3TestMixin, TestCase):
+    """
+    Clients PUT the parts straight to S3 with presigned URLs, Django only sees start, presign and finish.
+    """
+
+    size = 2 * 5 * MiB + 100
+
+    def setUp(self):
+        super().setUp()
+
+        self.body = bytes(range(256)) * (self.size // 256) + bytes(self.size % 256)
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def request(self, req_type, data):
+        return self.client.post(reverse("upload:MultiPartUpload"), data, format="json", HTTP_X_REQ_TYPE=req_type)
+
+    def start(self):
+        response = self.request("start", {"file_name": "movie.mp4", "file_type": "video/mp4", "file_size": self.size})
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def put_part(self, url, part_number, part_size):
+        response = requests.put(url, data=self.body[(part_number - 1) * part_size:part_number * part_size])
+        response.raise_for_status()
+        return {"part_number": part_number, "etag": response.headers["ETag"]}
+
+    def test_parts_go_straight_to_s3(self):
+        upload = self.start()
+
+        self.assertEqual((upload["part_size"], upload["part_count"]), (8 * MiB, 2))
+        self.assertEqual([part["part_number"] for part in upload["parts"]], [1, 2])
+
+        parts = [self.put_part(part["url"], part["part_number"], upload["part_size"]) for part in upload["parts"]]
+        response = self.request("finish", {"file_id": upload["id"], "parts": parts})
+
+        self.assertEqual(response.status_code, 200)
+        file = File.objects.get(fileID=upload["id"])
+        self.assertEqual(self.storage_server.objects[file.file.name], self.body)
+        self.assertTrue(file.etag.endswith("-2"))
+
+    @override_settings(FILE_MULTIPART_PART_SIZE=5 * MiB, FILE_MULTIPART_PRESIGN_BATCH=2)
+    def test_presigned_urls_come_in_batches(self):
+        upload = self.start()
+
+        self.assertEqual(upload["part_count"], 3)
+        self.assertEqual([part["part_number"] for part in upload["parts"]], [1, 2])
+
+        response = self.request("presign", {"file_id": upload["id"], "part_numbers": [3]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([part["part_number"] for part in response.data["parts"]], [3])
+
+        # Past the last part, or over the batch size
+        self.assertEqual(self.request("presign", {"file_id": upload["id"], "part_numbers": [4]}).status_code, 400)
+        self.assertEqual(self.request("presign", {"file_id": upload["id"], "part_numbers": [1, 2, 3]}).status_code, 400)
+
+    @override_settings(FILE_MULTIPART_PART_SIZE=5 * MiB)
+    def test_status_lists_the_parts_s3_received(self):
+        upload = self.start()
+        self.put_part(upload["parts"][1]["url"], 2, upload["part_size"])
+
+        response = self.request("status", {"file_id": upload["id"]})
+
+        self.assertEqual(response.data["part_count"], 3)
+        self.assertEqual([part["part_number"] for part in response.data["parts"]], [2])
+        self.assertEqual(response.data["missing_parts"], [1, 3])
+
+    def test_reported_etags_are_checked_with_list_parts(self):
+        upload = self.start()
+        parts = [self.put_part(part["url"], part["part_number"], upload["part_size"]) for part in upload["parts"]]
+        parts[1]["etag"] = '"0123456789abcdef0123456789abcdef"'
+
+        response = self.request("finish", {"file_id": upload["id"], "parts": parts})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(MultipartUploadSession.objects.filter(file_id=upload["id"]).exists())
+
+    def test_finish_fails_when_a_part_never_reached_s3(self):
+        upload = self.start()
+        parts = [self.put_part(upload["parts"][0]["url"], 1, upload["part_size"])]
+
+        response = self.request("finish", {"file_id": upload["id"], "parts": parts})
+
+        self.assertEqual(response.status_code, 400)
@@ -1,4 +1,23 @@
-from django.test import TestCase
+import threading
+import time
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.test import TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.models import File, UserPersonalFileToken
+from FileProcessing.services import FileStandardUploadService
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+from FileProcessing.upload_handlers import S3MultipartWriter
+from integrations.aws.client import s3_multipart_upload_data
+
+MiB = 1024 * 1024
 
 
 class StandardUploadApiTests(TestCase):
@@ -24,3 +43,104 @@ class StandardUploadAdminTests(TestCase):
     1. Create a new file via the Django admin, assert error, nothing gets created.
     2. Update an existing fila via the Django admin, assert error, nothing gets created.
     """
+
+
+class StandardUploadStreamingTests(FakeS3TestMixin, TestCase):
+    """
+    The file part of the request body is streamed into an S3 multipart upload as it arrives.
+    """
+
+    size = 11 * MiB + 100
+
+    def setUp(self):
+        super().setUp()
+
+        self.body = bytes(range(256)) * (self.size // 256) + bytes(self.size % 256)
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, body=None):
+        return self.client.post(
+            reverse("upload:standard"), {"file": SimpleUploadedFile("movie.mp4", body or self.body)}, format="multipart"
+        )
+
+    def test_file_is_streamed_to_s3(self):
+        # Neither buffered in memory nor in a temporary file
+        with mock.patch.object(TemporaryFileUploadHandler, "receive_data_chunk") as temporary, \
+                mock.patch.object(MemoryFileUploadHandler, "receive_data_chunk") as memory:
+            response = self.upload()
+
+        self.assertEqual(response.status_code, 201)
+        temporary.assert_not_called()
+        memory.assert_not_called()
+
+        file = UserPersonalFileToken.objects.get(personalfiletoken=response.data["id"]).file_id
+        self.assertEqual(self.storage_server.objects[file.file.name], self.body)
+        self.assertEqual(file.file.name, f"files/video/mp4/{file.file_name}")
+        self.assertEqual((file.file_type, file.file_size, file.original_file_name), ("video/mp4", self.size, "movie.mp4"))
+        self.assertTrue(file.etag.endswith("-2"))
+        self.assertEqual(self.storage_server.uploads, {})
+
+    @override_settings(FILE_MAX_SIZE=6 * MiB)
+    def test_upload_over_the_size_limit_is_aborted(self):
+        response = self.upload()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.storage_server.uploads, {})
+        self.assertEqual(self.storage_server.objects, {})
+
+    def test_body_cut_short_aborts_the_upload(self):
+        body = encode_multipart(BOUNDARY, {"file": SimpleUploadedFile("movie.mp4", self.body)})
+
+        response = self.client.generic(
+            "POST", reverse("upload:standard"), body[:9 * MiB], content_type=MULTIPART_CONTENT
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.storage_server.uploads, {})
+
+    def test_object_is_removed_when_the_file_is_not_recorded(self):
+        with mock.patch.object(FileStandardUploadService, "create", side_effect=ValidationError("Nope")):
+            with self.assertRaises(ValidationError):
+                self.upload()
+
+        self.assertEqual(self.storage_server.objects, {})
+
+    def test_parts_in_flight_are_bounded(self):
+        in_flight, peak = [], []
+        lock = threading.Lock()
+
+        def upload_part(**kwargs):
+            with lock:
+                in_flight.append(kwargs["part_num"])
+                peak.append(len(in_flight))
+            time.sleep(0.05)
+            try:
+                return s3_multipart_upload_data(**kwargs)
+            finally:
+                with lock:
+                    in_flight.remove(kwargs["part_num"])
+
+        writer = S3MultipartWriter("files/test.bin", part_size=1024, concurrency=2)
+        with mock.patch("integrations.storage.s3.s3_multipart_upload_data", side_effect=upload_part):
+            for offset in range(0, 10 * 1024, 128):
+                writer.write(self.body[offset:offset + 128])
+            writer.complete()
+
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(self.storage_server.objects["files/test.bin"], self.body[:10 * 1024])
+
+    def test_failed_part_stops_the_writer(self):
+        writer = S3MultipartWriter("files/test.bin", part_size=1024, concurrency=2)
+
+        with mock.patch("integrations.storage.s3.s3_multipart_upload_data", side_effect=IOError("reset")):
+            with self.assertRaises(IOError):
+                for offset in range(0, 10 * 1024, 1024):
+                    writer.write(self.body[offset:offset + 1024])
+                    time.sleep(0.01)
+
+        writer.abort()
+        self.assertEqual(self.storage_server.uploads, {})
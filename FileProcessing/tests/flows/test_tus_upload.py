@@ -0,0 +1,240 @@
+import base64
+import hashlib
+import io
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.models import File, MultipartUploadSession, UserPersonalFileToken
+from FileProcessing.services import FileTusUploadService
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+from FileProcessing.tus import tus_content_hashers, tus_parse_metadata
+
+MiB = 1024 * 1024
+
+
+class DroppedStream(io.BytesIO):
+    """
+    Request body of a client that goes away after `data`.
+    """
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if not data:
+            raise OSError("Connection reset by peer")
+        return data
+
+
+@override_settings(FILE_MULTIPART_PART_SIZE=5 * MiB)
+class TusUploadTests(FakeS3TestMixin, TestCase):
+    size = 12 * MiB + 100
+
+    def setUp(self):
+        super().setUp()
+
+        self.body = bytes(range(256)) * (self.size // 256) + bytes(self.size % 256)
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        tus_content_hashers.cache_clear()
+        self.addCleanup(tus_content_hashers.cache_clear)
+
+    def create(self, size=None, **headers):
+        metadata = f"filename {base64.b64encode(b'movie.mp4').decode()},filetype {base64.b64encode(b'video/mp4').decode()}"
+        response = self.client.post(
+            reverse("upload:tus"),
+            HTTP_TUS_RESUMABLE="1.0.0",
+            HTTP_UPLOAD_LENGTH=str(self.size if size is None else size),
+            HTTP_UPLOAD_METADATA=metadata,
+            **headers,
+        )
+        return response
+
+    def patch(self, location, offset, data, **headers):
+        return self.client.generic(
+            "PATCH",
+            location,
+            data,
+            content_type="application/offset+octet-stream",
+            HTTP_TUS_RESUMABLE="1.0.0",
+            HTTP_UPLOAD_OFFSET=str(offset),
+            **headers,
+        )
+
+    def head(self, location):
+        return self.client.head(location, HTTP_TUS_RESUMABLE="1.0.0")
+
+    def test_options_advertises_the_protocol(self):
+        response = APIClient().options(reverse("upload:tus"))
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response["Tus-Version"], "1.0.0")
+        self.assertEqual(response["Tus-Extension"], "creation,termination,checksum")
+        self.assertIn("sha1", response["Tus-Checksum-Algorithm"])
+
+    def test_upload_in_uneven_chunks(self):
+        response = self.create()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Tus-Resumable"], "1.0.0")
+        location = response["Location"]
+
+        file = File.objects.get(fileID=location.rstrip("/").rsplit("/", 1)[1])
+        self.assertEqual((file.original_file_name, file.file_type, file.file_size), ("movie.mp4", "video/mp4", self.size))
+
+        offset = 0
+        for chunk_size in (3 * MiB, 4 * MiB, 1 * MiB, 5 * MiB):
+            response = self.patch(location, offset, self.body[offset:offset + chunk_size])
+            self.assertEqual(response.status_code, 204)
+            offset = min(offset + chunk_size, self.size)
+            self.assertEqual(response["Upload-Offset"], str(offset))
+            self.assertEqual(self.head(location)["Upload-Offset"], str(offset))
+
+        file.refresh_from_db()
+        self.assertEqual(self.storage_server.objects[file.file.name], self.body)
+        self.assertTrue(file.etag.endswith("-3"))
+        self.assertIsNotNone(file.upload_finished_at)
+        self.assertEqual(response["X-File-Token"], UserPersonalFileToken.objects.get(file_id=file).personalfiletoken)
+        # Tail objects are cleaned up
+        self.assertEqual(list(self.storage_server.objects), [file.file.name])
+
+        response = self.head(location)
+        self.assertEqual((response["Upload-Offset"], response["Upload-Length"]), (str(self.size), str(self.size)))
+
+    def test_wrong_offset_conflicts(self):
+        location = self.create()["Location"]
+        self.patch(location, 0, self.body[:MiB])
+
+        response = self.patch(location, 0, self.body[:MiB])
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.head(location)["Upload-Offset"], str(MiB))
+
+    def test_tus_resumable_is_required(self):
+        response = self.client.post(reverse("upload:tus"), HTTP_UPLOAD_LENGTH="10")
+
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response["Tus-Version"], "1.0.0")
+
+    def test_patch_content_type_is_checked(self):
+        location = self.create()["Location"]
+
+        response = self.client.generic(
+            "PATCH", location, b"data", content_type="application/octet-stream",
+            HTTP_TUS_RESUMABLE="1.0.0", HTTP_UPLOAD_OFFSET="0",
+        )
+
+        self.assertEqual(response.status_code, 415)
+
+    @override_settings(FILE_MAX_SIZE=10 * MiB)
+    def test_upload_length_over_the_limit(self):
+        response = self.create()
+
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(File.objects.exists())
+
+    def test_checksum(self):
+        location = self.create()["Location"]
+        chunk = self.body[:6 * MiB]
+        digest = base64.b64encode(hashlib.sha1(chunk).digest()).decode()
+
+        response = self.patch(location, 0, chunk, HTTP_UPLOAD_CHECKSUM=f"sha1 {base64.b64encode(b'0' * 20).decode()}")
+        self.assertEqual(response.status_code, 460)
+        self.assertEqual(self.head(location)["Upload-Offset"], "0")
+
+        response = self.patch(location, 0, chunk, HTTP_UPLOAD_CHECKSUM=f"sha1 {digest}")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response["Upload-Offset"], str(6 * MiB))
+
+        response = self.patch(location, 0, chunk, HTTP_UPLOAD_CHECKSUM="crc32 AAAA")
+        self.assertEqual(response.status_code, 400)
+
+    def test_dropped_connection_keeps_what_arrived(self):
+        location = self.create()["Location"]
+        file_id = location.rstrip("/").rsplit("/", 1)[1]
+        service = FileTusUploadService(self.user)
+
+        _, session, _ = service.append(file_id=file_id, offset=0, body=DroppedStream(self.body[:7 * MiB]))
+        self.assertEqual(session.offset, 7 * MiB)
+
+        # Resumed from the offset, only the rest is sent
+        response = self.patch(location, 7 * MiB, self.body[7 * MiB:])
+
+        self.assertEqual(response.status_code, 204)
+        file = File.objects.get(fileID=file_id)
+        self.assertEqual(self.storage_server.objects[file.file.name], self.body)
+
+    def test_dropped_checksummed_patch_keeps_nothing(self):
+        location = self.create()["Location"]
+        file_id = location.rstrip("/").rsplit("/", 1)[1]
+
+        _, session, _ = FileTusUploadService(self.user).append(
+            file_id=file_id, offset=0, body=DroppedStream(self.body[:7 * MiB]), checksum=("sha1", b"0" * 20)
+        )
+
+        self.assertEqual(session.offset, 0)
+
+    def test_content_is_hashed_as_it_arrives(self):
+        location = self.create()["Location"]
+
+        with mock.patch("FileProcessing.services.file_content_sha256") as readback:
+            self.patch(location, 0, self.body[:7 * MiB])
+            response = self.patch(location, 7 * MiB, self.body[7 * MiB:])
+
+        self.assertEqual(response.status_code, 204)
+        readback.assert_not_called()
+        file = File.objects.get(fileID=location.rstrip("/").rsplit("/", 1)[1])
+        self.assertEqual(file.sha256, hashlib.sha256(self.body).hexdigest())
+
+    def test_content_is_read_back_after_patches_elsewhere(self):
+        location = self.create()["Location"]
+        self.patch(location, 0, self.body[:7 * MiB])
+
+        # The next PATCH lands on another process
+        tus_content_hashers.cache_clear()
+        response = self.patch(location, 7 * MiB, self.body[7 * MiB:])
+
+        self.assertEqual(response.status_code, 204)
+        file = File.objects.get(fileID=location.rstrip("/").rsplit("/", 1)[1])
+        self.assertEqual(file.sha256, hashlib.sha256(self.body).hexdigest())
+
+    def test_termination(self):
+        location = self.create()["Location"]
+        self.patch(location, 0, self.body[:MiB])
+
+        response = self.client.delete(location, HTTP_TUS_RESUMABLE="1.0.0")
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(MultipartUploadSession.objects.exists())
+        self.assertEqual(self.storage_server.uploads, {})
+        self.assertEqual(self.storage_server.objects, {})
+        self.assertEqual(self.head(location).status_code, 404)
+
+    def test_empty_upload_completes_at_creation(self):
+        response = self.create(size=0)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Upload-Offset"], "0")
+        self.assertIn("X-File-Token", response)
+
+    def test_uploads_of_other_users_are_not_found(self):
+        location = self.create()["Location"]
+
+        other = User.objects.create_user(email="other@example.com", name="Other", password="password")
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.head(location).status_code, 404)
+        self.assertEqual(self.patch(location, 0, b"data").status_code, 404)
+
+
+class TusMetadataTests(TestCase):
+    def test_metadata_is_decoded(self):
+        self.assertEqual(
+            tus_parse_metadata("filename d29ybGQucGRm,is_confidential"),
+            {"filename": "world.pdf", "is_confidential": ""},
+        )
@@ -0,0 +1,189 @@
+import io
+import tracemalloc
+import zipfile
+import zlib
+from collections import deque
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.archive import archive_member_names
+from FileProcessing.models import File, UserPersonalFileToken
+from FileProcessing.tests.fake_storage import SyntheticObject
+from FileProcessing.tests.test_streaming import FileStreamingTestMixin
+
+
+class TailFile(io.RawIOBase):
+    """
+    Read-only view of a stream of which only the last bytes were kept,
+    enough for zipfile to read the central directory of a huge archive.
+    """
+
+    def __init__(self, size: int, tail: bytes):
+        self.size = size
+        self.tail = tail
+        self.position = 0
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence] + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        tail_start = self.size - len(self.tail)
+        assert self.position >= tail_start, "read before the kept tail"
+
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        data = self.tail[self.position - tail_start:end - tail_start]
+        self.position = end
+
+        return data
+
+
+class ArchiveMemberNameTests(TestCase):
+    def test_duplicates_are_numbered(self):
+        self.assertEqual(
+            archive_member_names(["a.txt", "b.txt", "a.txt", "A.txt", "a (1).txt"]),
+            ["a.txt", "b.txt", "a (1).txt", "A (2).txt", "a (1) (1).txt"],
+        )
+
+    def test_paths_are_flattened(self):
+        self.assertEqual(archive_member_names(["../etc/passwd", ""]), [".._etc_passwd", "file"])
+
+
+class FileArchiveDownloadTests(FileStreamingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(self.user)
+
+    def add_file(self, file_id, name, file_type, body, user=None, **token_fields):
+        user = user or self.user
+        file = File.objects.create(
+            fileID=file_id,
+            file=f"files/{file_id}",
+            original_file_name=name,
+            file_name=file_id,
+            file_type=file_type,
+            file_size=len(body),
+            uploaded_by=user,
+            upload_finished_at=timezone.now(),
+        )
+        token = UserPersonalFileToken.objects.create(
+            uploaded_by=user,
+            personalfiletoken=file_id * 2,
+            file_id=file,
+            file_size=len(body),
+            type=file_type,
+            **token_fields,
+        )
+        self.storage_server.put(file.file.name, body)
+
+        return token
+
+    def archive(self, *tokens):
+        return self.api_client.post(
+            reverse("FileArchiveDownload"), {"file_token": [token.personalfiletoken for token in tokens]}, format="json"
+        )
+
+    def test_archive_round_trip(self):
+        notes = self.add_file("b" * 32, "notes.txt", "text/plain", b"hello world\n" * 10000)
+        copy = self.add_file("c" * 32, "other.mp4", "video/mp4", b"\x00\x01" * 1000, change_file_name="movie.mp4")
+
+        response = self.archive(self.token, notes, copy)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertTrue(response["Content-Disposition"].startswith("attachment; filename=DriveNow-"))
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ["movie.mp4", "notes.txt", "movie (1).mp4"])
+        self.assertEqual(
+            [member.compress_type for member in archive.infolist()],
+            [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED],
+        )
+        self.assertEqual(archive.read("movie.mp4"), self.body)
+        self.assertEqual(archive.read("notes.txt"), b"hello world\n" * 10000)
+        self.assertEqual(archive.read("movie (1).mp4"), b"\x00\x01" * 1000)
+
+    def test_tokens_are_checked_with_one_query(self):
+        notes = self.add_file("b" * 32, "notes.txt", "text/plain", b"notes")
+
+        with self.assertNumQueries(1):
+            response = self.archive(self.token, notes)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_files_of_other_users_are_refused(self):
+        other = User.objects.create_user(email="other@example.com", name="Other", password="password")
+        foreign = self.add_file("b" * 32, "secret.txt", "text/plain", b"secret", user=other)
+
+        response = self.archive(self.token, foreign)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.storage_server.requests, [])
+
+    def test_deleted_files_are_refused(self):
+        deleted = self.add_file("b" * 32, "old.txt", "text/plain", b"old", is_delete_init=True)
+
+        response = self.archive(self.token, deleted)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_tokens_are_refused(self):
+        response = self.api_client.post(reverse("FileArchiveDownload"), {"file_token": ["nope"]}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_multi_gigabyte_archive_in_flat_memory(self):
+        # Three members just under 2 GiB (the largest `file_size` fits), the last one starts past 4 GiB.
+        size = 2 ** 31 - 1
+        tokens = [
+            self.add_file(letter * 32, f"{letter}.mkv", "video/x-matroska", b"") for letter in ("b", "c", "d")
+        ]
+        for token in tokens:
+            self.storage_server.put(token.file_id.file.name, SyntheticObject(size))
+
+        tracemalloc.start()
+        try:
+            response = self.archive(*tokens)
+
+            archive_size, tail, tail_size = 0, deque(), 0
+            for chunk in response.streaming_content:
+                archive_size += len(chunk)
+                tail.append(chunk)
+                tail_size += len(chunk)
+                while tail_size - len(tail[0]) >= 1048576:
+                    tail_size -= len(tail.popleft())
+
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(peak, 32 * 1024 * 1024)
+        self.assertGreater(archive_size, 3 * size)
+
+        archive = zipfile.ZipFile(TailFile(archive_size, b"".join(tail)))
+        members = archive.infolist()
+
+        self.assertEqual([member.filename for member in members], ["b.mkv", "c.mkv", "d.mkv"])
+        self.assertEqual([member.file_size for member in members], [size] * 3)
+        self.assertGreater(members[2].header_offset, 2 ** 32 - 1)
+
+        crc = 0
+        for offset in range(0, size, len(SyntheticObject.pattern)):
+            crc = zlib.crc32(SyntheticObject(size)[offset:offset + len(SyntheticObject.pattern)], crc)
+        self.assertEqual([member.CRC for member in members], [crc] * 3)
@@ -0,0 +1,127 @@
+import fcntl
+import io
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from FileProcessing.cache import file_cache_get, file_cache_key
+from FileProcessing.tests.test_streaming import FileStreamingTestMixin
+
+
+class FileCacheTests(FileStreamingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        settings_override = override_settings(
+            FILE_CACHE_ENABLED=True,
+            FILE_CACHE_DIR=directory.name,
+            FILE_CACHE_MAX_BYTES=4 * len(self.body),
+            FILE_CACHE_MAX_FILE_BYTES=2 * len(self.body),
+            FILE_CACHE_PREFIX_BYTES=65536,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        file_cache_get.cache_clear()
+        self.addCleanup(file_cache_get.cache_clear)
+
+        self.cache = file_cache_get()
+        self.key = file_cache_key(self.file.fileID, self.file.strong_etag)
+
+    def test_second_read_is_served_from_disk(self):
+        _, content = self.stream("FileGet")
+        self.assertEqual(content, self.body)
+        self.assertEqual(len(self.storage_server.requests), 1)
+
+        response, content = self.stream("FileGet")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.body)
+        self.assertEqual(response["Content-Length"], str(len(self.body)))
+
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=-100")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[-100:])
+        self.assertEqual(
+            response["Content-Range"], f"bytes {len(self.body) - 100}-{len(self.body) - 1}/{len(self.body)}"
+        )
+
+        self.assertEqual(len(self.storage_server.requests), 1)
+        self.assertEqual(self.cache.stats.snapshot()["hits"], 2)
+
+    @override_settings(FILE_CACHE_MAX_FILE_BYTES=1024)
+    def test_video_prefix_is_cached_and_stitched_to_storage(self):
+        file_cache_get.cache_clear()
+        self.cache = file_cache_get()
+
+        self.stream("FileGet", HTTP_RANGE="bytes=0-")
+        entry = self.cache.lookup(self.key, len(self.body))
+        self.assertEqual((entry.kind, entry.size), ("prefix", 65536))
+
+        self.storage_server.requests.clear()
+
+        # Playback start is served from disk only.
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=0-65535")
+        self.assertEqual(content, self.body[:65536])
+        self.assertEqual(self.storage_server.requests, [])
+
+        # The rest comes from storage, after the cached prefix.
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=60000-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[60000:])
+        self.assertEqual(self.storage_server.requests[-1]["headers"]["Range"], f"bytes=65536-{len(self.body) - 1}")
+        self.assertEqual(self.cache.stats.snapshot()["partial_hits"], 1)
+
+    def test_client_disconnect_discards_the_fill(self):
+        response = self.client.get(reverse("FileGet", kwargs={"token": self.token.personalfiletoken}))
+        next(iter(response.streaming_content))
+        response.close()
+
+        self.assertIsNone(self.cache.lookup(self.key, len(self.body)))
+        self.assertEqual(os.listdir(os.path.join(self.cache.directory, "tmp")), [])
+
+        # The fill lock was released, the next request fills the cache.
+        self.stream("FileGet")
+        self.assertIsNotNone(self.cache.lookup(self.key, len(self.body)))
+
+    def test_one_filler_per_key(self):
+        lock_fd = os.open(os.path.join(self.cache.directory, "locks", f"{self.key}.lock"), os.O_CREAT | os.O_RDWR)
+        self.addCleanup(os.close, lock_fd)
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        _, content = self.stream("FileGet")
+
+        self.assertEqual(content, self.body)
+        self.assertIsNone(self.cache.lookup(self.key, len(self.body)))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for index in range(5):
+            path = os.path.join(self.cache.directory, f"old{index}.0000000000000000.full")
+            with open(path, "wb") as fp:
+                fp.write(self.body)
+            os.utime(path, (index, index))
+
+        self.stream("FileGet")
+
+        names = {entry["name"] for entry in self.cache.entries()}
+        self.assertEqual(
+            names,
+            {"old2.0000000000000000.full", "old3.0000000000000000.full", "old4.0000000000000000.full", f"{self.key}.full"},
+        )
+        self.assertEqual(self.cache.stats.snapshot()["evictions"], 2)
+
+    def test_management_command(self):
+        self.stream("FileGet")
+
+        out = io.StringIO()
+        call_command("filecache", "--list", stdout=out)
+        self.assertIn("Entries: 1 (1 full, 0 prefix)", out.getvalue())
+        self.assertIn(f"{self.key}.full", out.getvalue())
+
+        call_command("filecache", "--purge-file", self.file.fileID, stdout=out)
+        self.assertEqual(self.cache.entries(), [])
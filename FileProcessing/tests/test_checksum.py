@@ -0,0 +1,173 @@
+import base64
+import hashlib
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.checksum import checksum_composite, checksum_file_part, checksum_part
+from FileProcessing.models import File, MultipartUploadPart, MultipartUploadSession, UserPersonalFileToken
+from FileProcessing.services import FileDirectUploadService
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+from integrations.storage.base import StorageObject
+from integrations.storage.s3 import S3StorageBackend
+
+MiB = 1024 * 1024
+
+
+def sha256_base64(data: bytes) -> str:
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+class ChecksumTests(SimpleTestCase):
+    def test_part_checksum_of_any_buffer(self):
+        data = bytearray(b"x" * 3000)
+
+        self.assertEqual(checksum_part(data), sha256_base64(bytes(data)))
+        self.assertEqual(checksum_part(memoryview(data)[:1000]), sha256_base64(b"x" * 1000))
+
+    def test_file_part_is_rewound(self):
+        file_obj = SimpleUploadedFile("part", b"x" * 3000)
+
+        self.assertEqual(checksum_file_part(file_obj), sha256_base64(b"x" * 3000))
+        self.assertEqual(file_obj.read(), b"x" * 3000)
+
+    def test_composite(self):
+        digests = hashlib.sha256(b"a").digest() + hashlib.sha256(b"b").digest()
+
+        self.assertEqual(
+            checksum_composite([sha256_base64(b"a"), sha256_base64(b"b")]),
+            f"{base64.b64encode(hashlib.sha256(digests).digest()).decode()}-2",
+        )
+
+
+class MultipartChecksumTests(FakeS3TestMixin, TestCase):
+    body = bytes(range(256)) * 12  # 3 KiB, three parts of 1 KiB
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def request(self, req_type, data, format="json"):
+        return self.client.post(reverse("upload:MultiPartUpload"), data, format=format, HTTP_X_REQ_TYPE=req_type)
+
+    def start(self, **data):
+        response = self.request(
+            "start", {"file_name": "notes.bin", "file_type": "application/octet-stream", "file_size": len(self.body), **data}
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def upload_part(self, file_id, part_number, **data):
+        part = self.body[(part_number - 1) * 1024:part_number * 1024]
+        return self.request(
+            "upload",
+            {"file_id": file_id, "part_number": part_number, "file": SimpleUploadedFile("part", part), **data},
+            format="multipart",
+        )
+
+    def test_parts_carry_checksums(self):
+        upload_data = self.start(checksum_algorithm="SHA256")
+        self.assertEqual(upload_data["checksum_algorithm"], "SHA256")
+        self.assertIn("x-amz-sdk-checksum-algorithm", upload_data["parts"][0]["url"])
+
+        for part_number in (1, 2, 3):
+            self.assertEqual(self.upload_part(upload_data["id"], part_number).status_code, 202)
+        response = self.request("finish", {"file_id": upload_data["id"]})
+
+        self.assertEqual(response.status_code, 200)
+        file = File.objects.get(fileID=upload_data["id"])
+        part_checksums = [sha256_base64(self.body[i:i + 1024]) for i in range(0, len(self.body), 1024)]
+        self.assertEqual(file.checksum, checksum_composite(part_checksums))
+        self.assertEqual(self.storage_server.checksums[file.file.name], file.checksum)
+
+    def test_client_checksum_is_checked_by_s3(self):
+        file_id = self.start(checksum_algorithm="SHA256")["id"]
+
+        response = self.upload_part(file_id, 1, checksum_sha256=sha256_base64(b"something else"))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MultipartUploadPart.objects.exists())
+        self.assertEqual(self.upload_part(file_id, 1, checksum_sha256=sha256_base64(self.body[:1024])).status_code, 202)
+
+    def test_checksum_needs_an_upload_started_with_checksums(self):
+        file_id = self.start()["id"]
+
+        response = self.upload_part(file_id, 1, checksum_sha256=sha256_base64(self.body[:1024]))
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_object_is_verified_with_one_head(self):
+        file_id = self.start()["id"]
+        for part_number in (1, 2, 3):
+            self.upload_part(file_id, part_number)
+        self.storage_server.requests.clear()
+
+        self.assertEqual(self.request("finish", {"file_id": file_id}).status_code, 200)
+
+        self.assertEqual(sum(request["method"] == "HEAD" for request in self.storage_server.requests), 1)
+        self.assertEqual(File.objects.get(fileID=file_id).checksum, "")
+
+    def test_object_not_matching_the_upload_is_deleted(self):
+        file_id = self.start(checksum_algorithm="SHA256")["id"]
+        for part_number in (1, 2, 3):
+            self.upload_part(file_id, part_number)
+
+        with mock.patch.object(S3StorageBackend, "head", return_value=StorageObject(size=1000, etag="")):
+            response = self.request("finish", {"file_id": file_id})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["errors"], ["The uploaded object does not match the upload"])
+        self.assertEqual(self.storage_server.objects, {})
+        self.assertIsNone(File.objects.get(fileID=file_id).upload_finished_at)
+        self.assertFalse(UserPersonalFileToken.objects.exists())
+
+    @override_settings(FILE_MULTIPART_PART_SIZE=5 * MiB)
+    def test_tus_parts_carry_checksums(self):
+        body = bytes(range(256)) * (6 * MiB // 256)
+        metadata = f"filename {base64.b64encode(b'movie.mp4').decode()}"
+        location = self.client.post(
+            reverse("upload:tus"), HTTP_TUS_RESUMABLE="1.0.0", HTTP_UPLOAD_LENGTH=str(len(body)), HTTP_UPLOAD_METADATA=metadata
+        )["Location"]
+        self.assertEqual(MultipartUploadSession.objects.get().checksum_algorithm, "SHA256")
+
+        self.client.generic(
+            "PATCH", location, body, content_type="application/offset+octet-stream",
+            HTTP_TUS_RESUMABLE="1.0.0", HTTP_UPLOAD_OFFSET="0",
+        )
+
+        file = File.objects.get()
+        self.assertIsNotNone(file.upload_finished_at)
+        self.assertEqual(file.checksum, checksum_composite([sha256_base64(body[:5 * MiB]), sha256_base64(body[5 * MiB:])]))
+
+    def test_streamed_standard_upload_checksum(self):
+        body = bytes(range(256)) * (11 * MiB // 256)
+
+        response = self.client.post(
+            reverse("upload:standard"), {"file": SimpleUploadedFile("movie.mp4", body)}, format="multipart"
+        )
+
+        self.assertEqual(response.status_code, 201)
+        file = UserPersonalFileToken.objects.get(personalfiletoken=response.data["id"]).file_id
+        self.assertTrue(file.checksum.endswith("-2"))
+        self.assertEqual(self.storage_server.checksums[file.file.name], file.checksum)
+
+    def test_direct_upload_records_the_size_written(self):
+        service = FileDirectUploadService(self.user)
+        with mock.patch("FileProcessing.services.s3_generate_presigned_post", return_value={}):
+            file_id = service.start(file_name="notes.txt", file_type="text/plain", file_size=5000)["id"]
+
+        with self.assertRaisesMessage(ValidationError, "File was not uploaded"):
+            service.finish(file=File.objects.get(fileID=file_id))
+
+        self.storage_server.put(File.objects.get(fileID=file_id).file.name, b"notes")
+        service.finish(file=File.objects.get(fileID=file_id))
+
+        self.assertEqual(File.objects.get(fileID=file_id).file_size, 5)
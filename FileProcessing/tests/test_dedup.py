@@ -0,0 +1,173 @@
+import hashlib
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.dedup import dedup_challenge_proof, file_content_sha256
+from FileProcessing.models import File, MultipartUploadSession, UserPersonalFileToken
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+
+
+class DeduplicationTestMixin(FakeS3TestMixin):
+    body = bytes(range(256)) * 300
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, name="notes.bin", body=None):
+        # Redundant objects are dropped once the transaction commits.
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("upload:standard"), {"file": SimpleUploadedFile(name, body or self.body)}, format="multipart"
+            )
+        self.assertEqual(response.status_code, 201)
+        return UserPersonalFileToken.objects.select_related("file_id").get(personalfiletoken=response.data["id"])
+
+    def multipart_upload(self, name="notes.bin"):
+        def request(req_type, data, format="json"):
+            return self.client.post(reverse("upload:MultiPartUpload"), data, format=format, HTTP_X_REQ_TYPE=req_type)
+
+        file_id = request("start", {"file_name": name, "file_type": "application/octet-stream", "file_size": len(self.body)}).data["id"]
+        request("upload", {"file_id": file_id, "part_number": 1, "file": SimpleUploadedFile("part", self.body)}, format="multipart")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = request("finish", {"file_id": file_id})
+        self.assertEqual(response.status_code, 200)
+
+        return UserPersonalFileToken.objects.select_related("file_id").get(personalfiletoken=response.data["id"])
+
+
+class DeduplicationTests(DeduplicationTestMixin, TestCase):
+    def test_hash_is_recorded(self):
+        token = self.upload()
+
+        self.assertEqual(token.file_id.sha256, hashlib.sha256(self.body).hexdigest())
+
+    def test_same_content_links_to_the_existing_file(self):
+        first = self.upload()
+        second = self.upload(name="copy.bin")
+
+        self.assertEqual(second.file_id, first.file_id)
+        self.assertEqual(second.change_file_name, "copy.bin")
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(list(self.storage_server.objects), [first.file_id.file.name])
+
+    def test_other_content_is_kept_apart(self):
+        first = self.upload()
+        second = self.upload(body=b"other")
+
+        self.assertNotEqual(second.file_id, first.file_id)
+        self.assertEqual(len(self.storage_server.objects), 2)
+
+    def test_multipart_uploads_are_hashed_from_storage(self):
+        first = self.upload()
+        second = self.multipart_upload(name="notes.bin")
+
+        self.assertEqual(second.file_id, first.file_id)
+        self.assertIsNone(second.change_file_name)
+        self.assertEqual(len(self.storage_server.objects), 1)
+
+    def test_multipart_content_is_read_back_after_the_finish_committed(self):
+        first = self.upload(name="first.bin")
+
+        def readback(file):
+            # Not with the session locked
+            self.assertFalse(MultipartUploadSession.objects.filter(file_id=file.fileID).exists())
+            return file_content_sha256(file)
+
+        with mock.patch("FileProcessing.services.file_content_sha256", side_effect=readback) as patched:
+            second = self.multipart_upload(name="second.bin")
+
+        patched.assert_called_once()
+        self.assertEqual(second.file_id, first.file_id)
+        self.assertEqual(second.change_file_name, "second.bin")
+        self.assertEqual(File.objects.count(), 1)
+
+    def test_deleted_file_is_restored_when_uploaded_again(self):
+        first = self.upload()
+        File.objects.filter(pk=first.file_id.pk).update(is_delete_init=True)
+
+        second = self.upload()
+
+        self.assertFalse(File.objects.get(pk=second.file_id.pk).is_delete_init)
+
+    @override_settings(FILE_DEDUP_ENABLED=False)
+    def test_disabled(self):
+        self.upload()
+        self.upload()
+
+        self.assertEqual(File.objects.count(), 2)
+
+
+@override_settings(FILE_DEDUP_CHALLENGE_BYTES=1024)
+class InstantUploadTests(DeduplicationTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.existing = self.upload()
+        self.other = User.objects.create_user(email="other@example.com", name="Other", password="password")
+        self.client.force_authenticate(self.other)
+
+    def check(self, sha256=None, file_size=None):
+        return self.client.post(
+            reverse("upload:instant"),
+            {"sha256": sha256 or hashlib.sha256(self.body).hexdigest(), "file_size": len(self.body) if file_size is None else file_size},
+            format="json",
+            HTTP_X_REQ_TYPE="check",
+        )
+
+    def claim(self, challenge, proof, file_name="mine.bin"):
+        return self.client.post(
+            reverse("upload:instant"),
+            {"challenge": challenge, "proof": proof, "file_name": file_name},
+            format="json",
+            HTTP_X_REQ_TYPE="claim",
+        )
+
+    def test_unknown_content(self):
+        self.assertEqual(self.check(sha256="0" * 64).data, {"exists": False})
+        self.assertEqual(self.check(file_size=1).data, {"exists": False})
+
+    def test_instant_upload(self):
+        challenge = self.check().data
+        self.assertTrue(challenge["exists"])
+        self.assertEqual(challenge["length"], 1024)
+
+        data = self.body[challenge["offset"]:challenge["offset"] + challenge["length"]]
+        response = self.claim(challenge["challenge"], dedup_challenge_proof(challenge["nonce"], data))
+
+        self.assertEqual(response.status_code, 201)
+        token = UserPersonalFileToken.objects.get(personalfiletoken=response.data["id"])
+        self.assertEqual((token.uploaded_by, token.file_id, token.change_file_name), (self.other, self.existing.file_id, "mine.bin"))
+        # Nothing was uploaded
+        self.assertEqual(self.storage_server.uploads, {})
+        self.assertEqual(len(self.storage_server.objects), 1)
+
+    def test_hash_alone_is_not_enough(self):
+        challenge = self.check().data
+
+        response = self.claim(challenge["challenge"], dedup_challenge_proof(challenge["nonce"], b"guess"))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UserPersonalFileToken.objects.filter(uploaded_by=self.other).count(), 0)
+
+    def test_challenge_is_bound_to_the_user(self):
+        challenge = self.check().data
+        data = self.body[challenge["offset"]:challenge["offset"] + challenge["length"]]
+
+        self.client.force_authenticate(self.user)
+        response = self.claim(challenge["challenge"], dedup_challenge_proof(challenge["nonce"], data))
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_tampered_challenge(self):
+        challenge = self.check().data
+
+        self.assertEqual(self.claim(challenge["challenge"] + "x", "0" * 64).status_code, 400)
@@ -0,0 +1,183 @@
+import time
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from FileProcessing.hedging import HedgedReader, StorageDeadlineExceeded, StorageUnavailable, hedged_reader_get
+from FileProcessing.tests.fake_storage import FakeStorageServer
+from FileProcessing.tests.test_streaming import FileStreamingTestMixin
+from integrations.storage.s3 import S3StorageBackend
+
+
+class HedgedReaderTests(SimpleTestCase):
+    """
+    Reads of the fake S3, with `delays` making single GETs slow to answer.
+    """
+
+    body = b"x" * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.storage_server = FakeStorageServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.storage_server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.storage_server.reset()
+        self.storage_server.put("files/object.bin", self.body)
+        self.storage_server.requests.clear()
+        self.backend = S3StorageBackend(object_url=lambda key: self.storage_server.url + key)
+
+    def read(self, reader, byte_range=None):
+        started = time.monotonic()
+        response = reader.open(self.backend, "files/object.bin", byte_range)
+        try:
+            return response.read(), time.monotonic() - started
+        finally:
+            response.close()
+
+    def test_slow_first_byte_is_hedged(self):
+        reader = HedgedReader(hedge=True, hedge_max_delay=0.05, hedge_budget=1)
+        self.storage_server.delays.append(2)
+
+        content, elapsed = self.read(reader)
+
+        self.assertEqual(content, self.body)
+        self.assertLess(elapsed, 1)
+        stats = reader.stats.snapshot()
+        self.assertEqual((stats["reads"], stats["hedges_fired"], stats["hedges_won"]), (1, 1, 1))
+
+    def test_fast_reads_are_not_hedged(self):
+        reader = HedgedReader(hedge=True, hedge_max_delay=1, hedge_budget=1)
+
+        for _ in range(3):
+            self.assertEqual(self.read(reader, (0, 99))[0], self.body[:100])
+
+        stats = reader.stats.snapshot()
+        self.assertEqual((stats["reads"], stats["hedges_fired"]), (3, 0))
+
+    def test_hedge_delay_follows_the_latency_percentile(self):
+        reader = HedgedReader(hedge=True, hedge_percentile=50, hedge_min_delay=0.001, hedge_max_delay=1)
+        # Not enough reads timed yet
+        self.assertEqual(reader.hedge_delay(), 1)
+
+        for _ in range(20):
+            self.read(reader)
+
+        self.assertLess(reader.hedge_delay(), 0.5)
+        self.assertIsNotNone(reader.snapshot()["first_byte_p50"])
+
+    def test_hedges_are_limited_by_the_budget(self):
+        reader = HedgedReader(hedge=True, hedge_max_delay=0.05, hedge_budget=0)
+        # The first read and its hedge, then the second read, which cannot be hedged any more
+        self.storage_server.delays.extend([0.5, 0, 0.5])
+
+        self.assertLess(self.read(reader)[1], 0.4)
+        self.assertGreaterEqual(self.read(reader)[1], 0.5)
+
+        stats = reader.stats.snapshot()
+        self.assertEqual((stats["hedges_fired"], stats["hedges_over_budget"]), (1, 1))
+
+    def test_deadline(self):
+        reader = HedgedReader(deadline=0.1)
+        self.storage_server.delays.append(1)
+
+        started = time.monotonic()
+        with self.assertRaises(StorageDeadlineExceeded) as raised:
+            self.read(reader)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(raised.exception.code, "DeadlineExceeded")
+        self.assertEqual(reader.stats.snapshot()["deadlines_exceeded"], 1)
+
+    def test_breaker_fails_fast_then_probes_storage(self):
+        reader = HedgedReader(deadline=0.05, breaker_failures=2, breaker_cooldown=0.3)
+        self.storage_server.delays.extend([1, 1])
+
+        for _ in range(2):
+            with self.assertRaises(StorageDeadlineExceeded):
+                self.read(reader)
+        self.assertEqual(reader.breaker.state, "open")
+
+        # Refused without calling storage: the delay of the next GET is still there.
+        self.storage_server.delays.append(1)
+        with self.assertRaises(StorageUnavailable) as raised:
+            self.read(reader)
+        self.assertEqual(raised.exception.code, "ServiceUnavailable")
+        self.assertEqual(self.storage_server.delays, [1])
+        self.storage_server.delays.clear()
+
+        time.sleep(0.3)
+        self.assertEqual(reader.breaker.state, "half-open")
+        self.assertEqual(self.read(reader)[0], self.body)
+        self.assertEqual(reader.breaker.state, "closed")
+
+        stats = reader.stats.snapshot()
+        self.assertEqual((stats["failures"], stats["breaker_opened"], stats["breaker_rejected"]), (2, 1, 1))
+
+    def test_failed_probe_opens_the_breaker_again(self):
+        reader = HedgedReader(deadline=0.05, breaker_failures=1, breaker_cooldown=0.1)
+        self.storage_server.delays.extend([1, 1])
+
+        with self.assertRaises(StorageDeadlineExceeded):
+            self.read(reader)
+        time.sleep(0.1)
+        with self.assertRaises(StorageDeadlineExceeded):
+            self.read(reader)
+
+        self.assertEqual(reader.breaker.state, "open")
+        self.assertEqual(reader.stats.snapshot()["breaker_opened"], 2)
+
+    async def test_async_reads_are_hedged_and_bounded(self):
+        reader = HedgedReader(hedge=True, hedge_max_delay=0.05, hedge_budget=1, deadline=0.5)
+        self.storage_server.delays.append(2)
+
+        started = time.monotonic()
+        response = await reader.aopen(self.backend, "files/object.bin")
+        content = b"".join([chunk async for chunk in response.aiter_chunks(256)])
+
+        self.assertEqual(content, self.body)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(reader.stats.snapshot()["hedges_won"], 1)
+
+        self.storage_server.delays.extend([2, 2])
+        with self.assertRaises(StorageDeadlineExceeded):
+            await reader.aopen(self.backend, "files/object.bin")
+
+
+class FileGetStorageDeadlineTests(FileStreamingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        hedged_reader_get.cache_clear()
+        self.addCleanup(hedged_reader_get.cache_clear)
+
+    @override_settings(FILE_STORAGE_READ_DEADLINE=0.1)
+    def test_storage_past_the_deadline_is_a_gateway_timeout(self):
+        self.storage_server.delays.append(1)
+
+        response, _ = self.stream("FileGet")
+
+        self.assertEqual(response.status_code, 504)
+
+    @override_settings(FILE_STORAGE_READ_DEADLINE=0.1, FILE_STORAGE_BREAKER_FAILURES=1, FILE_STORAGE_BREAKER_COOLDOWN=30)
+    def test_open_breaker_is_service_unavailable(self):
+        self.storage_server.delays.append(1)
+        self.stream("FileGet")
+
+        response, _ = self.stream("FileGet")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "30")
+
+    @override_settings(FILE_STORAGE_HEDGE_ENABLED=True, FILE_STORAGE_HEDGE_MAX_DELAY=0.05, FILE_STORAGE_HEDGE_BUDGET=1)
+    def test_slow_storage_is_hedged(self):
+        self.storage_server.delays.append(2)
+
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=0-99")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[:100])
+        self.assertEqual(hedged_reader_get().stats.snapshot()["hedges_won"], 1)
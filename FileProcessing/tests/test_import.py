@@ -0,0 +1,191 @@
+import socket
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.imports import import_check_url, import_get_session, import_open, import_probe
+from FileProcessing.models import File, FileImportJob, StorageReservation, UserPersonalFileToken
+from FileProcessing.quota import storage_usage_get
+from FileProcessing.services import FileImportService
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+from FileProcessing.tests.fake_storage import FakeStorageServer
+
+MiB = 1024 * 1024
+
+
+class ImportUrlCheckTests(SimpleTestCase):
+    def resolve(self, address):
+        return mock.patch("socket.getaddrinfo", return_value=[(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, 80))])
+
+    def test_public_host(self):
+        with self.resolve("93.184.216.34"):
+            import_check_url("https://example.com/movie.mp4")
+
+    def test_private_hosts_are_refused(self):
+        for address in ("127.0.0.1", "10.0.0.5", "169.254.169.254", "::1"):
+            with self.subTest(address=address), self.resolve(address), self.assertRaises(ValidationError):
+                import_check_url("http://example.com/movie.mp4")
+
+    def test_only_http(self):
+        with self.assertRaises(ValidationError):
+            import_check_url("ftp://example.com/movie.mp4")
+
+
+class ImportConnectionTests(SimpleTestCase):
+    """
+    Connections go to the address that was checked, whatever the host resolves to afterwards.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.storage_server = FakeStorageServer().start()
+        cls.storage_server.put("source/movie.mp4", b"movie")
+        cls.port = cls.storage_server.httpd.server_address[1]
+        cls.url = f"http://files.example:{cls.port}/source/movie.mp4"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.storage_server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        import_get_session.cache_clear()
+        self.addCleanup(import_get_session.cache_clear)
+        self.storage_server.requests.clear()
+
+    def resolve(self, *addresses):
+        """
+        files.example resolves to each of `addresses` in turn.
+        """
+        answers = iter(addresses)
+        getaddrinfo = socket.getaddrinfo
+
+        def resolve(host, port, *args, **kwargs):
+            if host != "files.example":
+                return getaddrinfo(host, port, *args, **kwargs)
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (next(answers), port))]
+
+        return mock.patch("socket.getaddrinfo", side_effect=resolve)
+
+    def test_host_rebinding_to_a_private_address_is_refused(self):
+        # Public when checked, loopback by the time the connection is made
+        with self.resolve("93.184.216.34", "127.0.0.1"), self.assertRaises(ValidationError):
+            import_open(self.url, {})
+
+        self.assertEqual(self.storage_server.requests, [])
+
+    @override_settings(FILE_IMPORT_ALLOW_PRIVATE_HOSTS=True)
+    def test_connection_goes_to_the_checked_address_with_the_host_name(self):
+        with self.resolve("127.0.0.1", "127.0.0.1"):
+            url, response = import_open(self.url, {})
+
+        self.assertEqual(response.read(), b"movie")
+        response.close()
+        self.assertEqual(self.storage_server.requests[0]["headers"]["Host"], f"files.example:{self.port}")
+
+
+@override_settings(FILE_IMPORT_ALLOW_PRIVATE_HOSTS=True, FILE_MULTIPART_PART_SIZE=5 * MiB, FILE_IMPORT_CONCURRENCY=2)
+class FileImportTests(FakeS3TestMixin, TestCase):
+    size = 12 * MiB + 100
+
+    def setUp(self):
+        super().setUp()
+
+        self.body = bytes(range(256)) * (self.size // 256) + bytes(self.size % 256)
+        self.storage_server.put("source/movie.mp4", self.body)
+        self.url = self.storage_server.url + "source/movie.mp4"
+
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def start(self, **data):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse("upload:import"), {"url": self.url, **data}, format="json")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["status"], "pending")
+        # Enqueued once the job is committed, run here instead of in the background
+        self.assertEqual(len(callbacks), 1)
+        FileImportService.run(response.data["id"])
+
+        return self.client.get(reverse("upload:import-detail", args=[response.data["id"]])).data
+
+    def test_ranged_import(self):
+        job = self.start()
+
+        self.assertEqual(job["status"], "completed")
+        self.assertTrue(job["ranged"])
+        self.assertEqual((job["file_size"], job["received_bytes"], job["progress"]), (self.size, self.size, 1))
+        file = UserPersonalFileToken.objects.get(personalfiletoken=job["file"]).file_id
+        self.assertEqual(self.storage_server.objects[file.file.name], self.body)
+        self.assertEqual((file.original_file_name, file.file_size), ("movie.mp4", self.size))
+        self.assertTrue(file.checksum.endswith("-3"))
+        self.assertEqual(storage_usage_get(self.user).used, self.size)
+
+        ranges = [request["headers"].get("Range") for request in self.storage_server.requests if request["path"] == "source/movie.mp4"]
+        self.assertEqual(
+            sorted(ranges),
+            ["bytes=0-0", "bytes=0-5242879", "bytes=10485760-12583011", "bytes=5242880-10485759"],
+        )
+
+    def test_source_without_ranges(self):
+        self.storage_server.ranges = False
+
+        job = self.start(file_name="film.mp4")
+
+        self.assertEqual(job["status"], "completed")
+        self.assertFalse(job["ranged"])
+        file = UserPersonalFileToken.objects.get(personalfiletoken=job["file"]).file_id
+        self.assertEqual(self.storage_server.objects[file.file.name], self.body)
+        self.assertEqual(file.original_file_name, "film.mp4")
+
+    def test_source_changed_during_the_import(self):
+        def probe_then_change(url):
+            source = import_probe(url)
+            self.storage_server.put("source/movie.mp4", self.body[::-1])
+            return source
+
+        with mock.patch("FileProcessing.services.import_probe", side_effect=probe_then_change):
+            job = self.start()
+
+        self.assertEqual((job["status"], job["error"]), ("failed", "The source changed during the import"))
+        # Nothing is left behind
+        self.assertEqual(self.storage_server.uploads, {})
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(StorageReservation.objects.exists())
+        self.assertEqual(storage_usage_get(self.user).reserved, 0)
+
+    @override_settings(FILE_MAX_SIZE=10 * MiB)
+    def test_too_large(self):
+        job = self.start()
+
+        self.assertEqual(job["status"], "failed")
+        self.assertIn("too large", job["error"])
+        self.assertFalse(File.objects.exists())
+
+    def test_missing_source(self):
+        self.url = self.storage_server.url + "source/missing.mp4"
+
+        job = self.start()
+
+        self.assertEqual((job["status"], job["error"]), ("failed", "The source answered 404"))
+
+    @override_settings(FILE_IMPORT_ALLOW_PRIVATE_HOSTS=False)
+    def test_private_source_is_refused(self):
+        response = self.client.post(reverse("upload:import"), {"url": self.url}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(FileImportJob.objects.exists())
+
+    def test_jobs_of_other_users(self):
+        job = FileImportJob.objects.create(uploaded_by=User.objects.create_user(email="other@example.com", name="Other", password="password"), url=self.url)
+
+        response = self.client.get(reverse("upload:import-detail", args=[job.pk]))
+
+        self.assertEqual(response.status_code, 404)
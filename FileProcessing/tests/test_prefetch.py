@@ -0,0 +1,167 @@
+import threading
+import time
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from FileProcessing.prefetch import ParallelRangeReader
+from FileProcessing.tests.test_streaming import FileStreamingTestMixin
+
+
+class FakeRange:
+    def __init__(self, data: bytes, delay: float = 0, release: threading.Event = None):
+        self.data = data
+        self.delay = delay
+        self.release = release
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def read(self, amt):
+        if self.release is not None:
+            self.release.wait(5)
+        time.sleep(self.delay)
+        data, self.data = self.data[:amt], self.data[amt:]
+        return data
+
+    def close(self):
+        self.closed = True
+
+
+class ParallelRangeReaderTests(SimpleTestCase):
+    body = bytes(range(256)) * 64  # 16 KiB
+
+    def setUp(self):
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def open_range(self, delay_for=lambda first: 0, release=None, truncate=False):
+        def open_range(first, last):
+            data = self.body[first:last + 1]
+            upstream = FakeRange(data[:-1] if truncate else data, delay_for(first), release)
+            with self.lock:
+                self.opened.append((first, upstream))
+            return upstream
+        return open_range
+
+    def read_all(self, reader):
+        chunks = []
+        while True:
+            data = reader.read(1000)
+            if not data:
+                return b"".join(chunks)
+            chunks.append(bytes(data))
+
+    def test_parts_are_reassembled_in_order(self):
+        # Earlier parts are the slowest to arrive.
+        reader = ParallelRangeReader(
+            self.open_range(lambda first: (len(self.body) - first) / len(self.body) / 20),
+            0, len(self.body) - 1, part_size=1024, concurrency=4,
+        )
+
+        self.assertEqual(self.read_all(reader), self.body)
+        self.assertEqual(sorted(first for first, _ in self.opened), list(range(0, len(self.body), 1024)))
+        reader.close()
+
+    def test_sub_range(self):
+        reader = ParallelRangeReader(self.open_range(), 1000, 9999, part_size=1024, concurrency=3)
+
+        self.assertEqual(self.read_all(reader), self.body[1000:10000])
+        reader.close()
+
+    def test_window_applies_backpressure(self):
+        reader = ParallelRangeReader(self.open_range(), 0, len(self.body) - 1, part_size=1024, concurrency=4)
+        time.sleep(0.1)
+
+        # Nothing consumed yet, only the window was requested.
+        self.assertEqual(len(self.opened), 4)
+
+        reader.read(1024)
+        time.sleep(0.1)
+        self.assertEqual(len(self.opened), 5)
+        reader.close()
+
+    def test_close_cancels_outstanding_ranges(self):
+        release = threading.Event()
+        reader = ParallelRangeReader(
+            self.open_range(release=release), 0, len(self.body) - 1, part_size=1024, concurrency=4,
+        )
+        time.sleep(0.1)
+
+        reader.close()
+        release.set()
+        reader.executor.shutdown(wait=True)
+
+        self.assertEqual(len(self.opened), 4)
+        self.assertTrue(all(upstream.closed for _, upstream in self.opened))
+
+    def test_truncated_part_fails_the_read(self):
+        reader = ParallelRangeReader(
+            self.open_range(truncate=True), 0, len(self.body) - 1, part_size=1024, concurrency=2,
+        )
+
+        with self.assertRaises(IOError):
+            self.read_all(reader)
+        reader.close()
+
+
+@override_settings(
+    FILE_PARALLEL_DOWNLOAD_ENABLED=True,
+    FILE_PARALLEL_DOWNLOAD_MIN_SIZE=262144,
+    FILE_PARALLEL_DOWNLOAD_PART_SIZE=131072,
+    FILE_PARALLEL_DOWNLOAD_CONCURRENCY=4,
+)
+class ParallelDownloadTests(FileStreamingTestMixin, TestCase):
+    def ranges_requested(self):
+        return sorted(request["headers"].get("Range") for request in self.storage_server.requests)
+
+    def test_download_is_fetched_in_parallel_ranges(self):
+        response, content = self.stream("FileDownload")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.body)
+        self.assertEqual(response["Content-Length"], str(len(self.body)))
+        self.assertEqual(
+            self.ranges_requested(),
+            sorted(f"bytes={first}-{first + 131071}" for first in range(0, len(self.body), 131072)),
+        )
+
+    def test_range_download(self):
+        response, content = self.stream("FileDownload", HTTP_RANGE="bytes=100000-")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[100000:])
+        self.assertEqual(response["Content-Range"], f"bytes 100000-{len(self.body) - 1}/{len(self.body)}")
+        self.assertEqual(self.storage_server.requests[0]["headers"]["Range"], "bytes=100000-231071")
+
+    def test_small_ranges_use_a_single_request(self):
+        response, content = self.stream("FileDownload", HTTP_RANGE="bytes=0-9999")
+
+        self.assertEqual(content, self.body[:10000])
+        self.assertEqual(len(self.storage_server.requests), 1)
+
+    def test_inline_views_use_a_single_request(self):
+        self.stream("FileGet")
+
+        self.assertEqual(len(self.storage_server.requests), 1)
+
+    def test_size_mismatch_falls_back_to_a_single_request(self):
+        self.file.file_size = len(self.body) + 1
+        self.file.save()
+
+        response, content = self.stream("FileDownload")
+
+        self.assertEqual(content, self.body)
+        self.assertIsNone(self.storage_server.requests[-1]["headers"].get("Range"))
+
+    def test_client_disconnect_stops_fetching(self):
+        self.storage_server.latency = 0.05
+        self.addCleanup(setattr, self.storage_server, "latency", 0)
+
+        response = self.client.get(reverse("FileDownload", kwargs={"token": self.token.personalfiletoken}))
+        next(iter(response.streaming_content))
+        response.close()
+        time.sleep(0.2)
+
+        self.assertLess(len(self.storage_server.requests), len(self.body) // 131072)
@@ -0,0 +1,141 @@
+from unittest import mock
+from urllib import parse
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.models import File, UserPersonalFileToken
+from FileProcessing.presign import PresignCache, PresignedUrl, presign_cache_get
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+
+
+class PresignCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = PresignCache(max_entries=2, margin=60)
+
+    def key(self, name, disposition=None):
+        return (f"files/{name}", disposition, None, 3600)
+
+    @mock.patch("FileProcessing.presign.time.time", return_value=1000)
+    def test_reused_until_the_margin(self, time_mock):
+        presigned = PresignedUrl(url="https://s3/a", expires_at=1000 + 3600)
+        self.cache.put(self.key("a"), presigned)
+
+        time_mock.return_value = 1000 + 3600 - 61
+        self.assertIs(self.cache.get(self.key("a")), presigned)
+        time_mock.return_value = 1000 + 3600 - 60
+        self.assertIsNone(self.cache.get(self.key("a")))
+        self.assertEqual(self.cache.snapshot()["entries"], 0)
+
+    def test_short_lived_urls_are_not_kept(self):
+        self.cache.put(self.key("a"), PresignedUrl(url="https://s3/a", expires_at=0))
+
+        self.assertIsNone(self.cache.get(self.key("a")))
+
+    def test_least_recently_used_go_first(self):
+        presigned = PresignedUrl(url="https://s3", expires_at=float("inf"))
+        self.cache.put(self.key("a"), presigned)
+        self.cache.put(self.key("b"), presigned)
+        self.cache.get(self.key("a"))
+
+        self.cache.put(self.key("c"), presigned)
+
+        self.assertIsNotNone(self.cache.get(self.key("a")))
+        self.assertIsNone(self.cache.get(self.key("b")))
+        self.assertEqual(self.cache.snapshot()["evictions"], 1)
+
+    def test_invalidate_every_disposition_of_an_object(self):
+        presigned = PresignedUrl(url="https://s3", expires_at=float("inf"))
+        self.cache.put(self.key("a", "inline"), presigned)
+        self.cache.put(self.key("a", "attachment"), presigned)
+
+        self.cache.invalidate("files/a")
+
+        self.assertEqual(self.cache.snapshot()["entries"], 0)
+
+
+@override_settings(AWS_PRESIGNED_EXPIRY=3600)
+class FilePresignTests(FakeS3TestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user(email="gallery@example.com", name="Gallery", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.tokens = [self.create_token(index) for index in range(3)]
+
+    def create_token(self, index, user=None):
+        file = File.objects.create(
+            fileID=f"{index}" * 32,
+            file=f"files/image/jpeg/{index}.jpg",
+            original_file_name=f"photo-{index}.jpg",
+            file_name=f"{index}.jpg",
+            file_type="image/jpeg",
+            file_size=100,
+            uploaded_by=self.user,
+            upload_finished_at=timezone.now(),
+        )
+        return UserPersonalFileToken.objects.create(
+            uploaded_by=user or self.user, personalfiletoken=f"t{index}", file_id=file, file_size=100, type="image/jpeg"
+        )
+
+    def presign(self, tokens, **data):
+        return self.client.post(reverse("FilePresign"), {"file_token": tokens, **data}, format="json")
+
+    def test_one_query_for_all_tokens(self):
+        with self.assertNumQueries(1):
+            response = self.presign([token.pk for token in self.tokens] + ["unknown"])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "private, no-store")
+        self.assertEqual(response.data["not_found"], ["unknown"])
+        url = parse.urlsplit(response.data["urls"]["t1"]["url"])
+        query = parse.parse_qs(url.query)
+        self.assertEqual(url.path, f"/{self.storage_server.bucket}/files/image/jpeg/1.jpg")
+        self.assertEqual(query["X-Amz-Expires"], ["3600"])
+        self.assertEqual(query["response-content-disposition"], ['inline; filename="photo-1.jpg"'])
+        # Signed locally
+        self.assertEqual(self.storage_server.requests, [])
+
+    def test_urls_are_reused(self):
+        first = self.presign(["t0", "t1"]).data["urls"]
+
+        with mock.patch("integrations.storage.s3.s3_generate_download_presigned_url") as sign:
+            second = self.presign(["t0", "t1"]).data["urls"]
+
+        sign.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_rename_invalidates(self):
+        url = self.presign(["t0"]).data["urls"]["t0"]["url"]
+
+        response = self.client.post(
+            reverse("FileRename"), {"file_token": "t0", "file_name": "photo-0.jpg", "file_name_new": "beach.jpg"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(presign_cache_get().snapshot()["invalidations"], 1)
+
+        new_url = self.presign(["t0"]).data["urls"]["t0"]["url"]
+        self.assertNotEqual(new_url, url)
+        self.assertIn("beach.jpg", parse.unquote(new_url))
+
+    def test_deleted_and_other_users_files_are_refused(self):
+        other = User.objects.create_user(email="other@example.com", name="Other", password="password")
+        self.create_token(3, user=other)
+        self.presign(["t0"])
+
+        response = self.client.post(reverse("FileDelete"), {"file_token": ["t0"]}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.presign(["t0", "t3"])
+        self.assertEqual(response.data, {"urls": {}, "not_found": ["t0", "t3"]})
+
+    def test_batch_size_is_bounded(self):
+        response = self.presign([f"t{index}" for index in range(settings.FILE_PRESIGN_BATCH_MAX + 1)])
+
+        self.assertEqual(response.status_code, 400)
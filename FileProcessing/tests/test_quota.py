@@ -0,0 +1,232 @@
+import base64
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.models import File, MultipartUploadSession, StorageReservation, UserPersonalFileToken, UserStorageUsage
+from FileProcessing.quota import StorageQuotaExceeded, storage_release_expired, storage_usage_get
+from FileProcessing.services import EmptyRecycleBinservice, FileDirectUploadService, FileDeleteService, FileRestoreService, UserService
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+
+
+@override_settings(STORAGE_PER_USER="10000", FILE_DEDUP_ENABLED=False)
+class StorageQuotaTests(FakeS3TestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def usage(self):
+        usage = storage_usage_get(self.user)
+        return usage.used, usage.in_bin, usage.reserved
+
+    def upload(self, size, name="notes.bin"):
+        return self.client.post(
+            reverse("upload:standard"), {"file": SimpleUploadedFile(name, b"x" * size)}, format="multipart"
+        )
+
+    def start(self, size):
+        return self.client.post(
+            reverse("upload:MultiPartUpload"),
+            {"file_name": "movie.mp4", "file_type": "video/mp4", "file_size": size},
+            format="json",
+            HTTP_X_REQ_TYPE="start",
+        )
+
+    def test_standard_uploads_are_charged(self):
+        self.assertEqual(self.upload(6000).status_code, 201)
+        self.assertEqual(self.usage(), (6000, 0, 0))
+
+        self.storage_server.requests.clear()
+        response = self.upload(5000)
+
+        self.assertEqual(response.status_code, 507)
+        self.assertEqual(self.usage(), (6000, 0, 0))
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(len(self.storage_server.objects), 1)
+        # Refused before the body was streamed to storage
+        self.assertFalse(StorageReservation.objects.exists())
+        self.assertEqual(self.storage_server.requests, [])
+
+    def test_multipart_start_reserves(self):
+        file_id = self.start(6000).data["id"]
+        self.assertEqual(self.usage(), (0, 0, 6000))
+
+        # The reservation counts against the quota
+        self.assertEqual(self.start(5000).status_code, 507)
+        self.assertEqual(self.upload(5000).status_code, 507)
+
+        self.client.post(
+            reverse("upload:MultiPartUpload"),
+            {"file_id": file_id, "part_number": 1, "file": SimpleUploadedFile("part", b"x" * 6000)},
+            format="multipart",
+            HTTP_X_REQ_TYPE="upload",
+        )
+        response = self.client.post(reverse("upload:MultiPartUpload"), {"file_id": file_id}, format="json", HTTP_X_REQ_TYPE="finish")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.usage(), (6000, 0, 0))
+        self.assertFalse(StorageReservation.objects.exists())
+
+    def test_tus_termination_releases(self):
+        metadata = f"filename {base64.b64encode(b'movie.mp4').decode()}"
+        location = self.client.post(
+            reverse("upload:tus"), HTTP_TUS_RESUMABLE="1.0.0", HTTP_UPLOAD_LENGTH="6000", HTTP_UPLOAD_METADATA=metadata
+        )["Location"]
+        self.assertEqual(self.usage(), (0, 0, 6000))
+
+        self.client.delete(location, HTTP_TUS_RESUMABLE="1.0.0")
+
+        self.assertEqual(self.usage(), (0, 0, 0))
+
+    def test_tus_creation_over_quota(self):
+        metadata = f"filename {base64.b64encode(b'movie.mp4').decode()}"
+        response = self.client.post(
+            reverse("upload:tus"), HTTP_TUS_RESUMABLE="1.0.0", HTTP_UPLOAD_LENGTH="20000", HTTP_UPLOAD_METADATA=metadata
+        )
+
+        self.assertEqual(response.status_code, 507)
+        self.assertFalse(File.objects.exists())
+
+    def test_abandoned_uploads_are_released(self):
+        self.start(6000)
+        self.start(1000)
+        StorageReservation.objects.filter(size=6000).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(storage_release_expired(), 1)
+        self.assertEqual(self.usage(), (0, 0, 1000))
+
+    def test_finish_after_expiry_is_charged_again(self):
+        file_id = self.start(6000).data["id"]
+        StorageReservation.objects.update(expires_at=timezone.now())
+        storage_release_expired()
+        self.upload(5000)
+
+        self.client.post(
+            reverse("upload:MultiPartUpload"),
+            {"file_id": file_id, "part_number": 1, "file": SimpleUploadedFile("part", b"x" * 6000)},
+            format="multipart",
+            HTTP_X_REQ_TYPE="upload",
+        )
+        response = self.client.post(reverse("upload:MultiPartUpload"), {"file_id": file_id}, format="json", HTTP_X_REQ_TYPE="finish")
+
+        # The space went to another upload meanwhile, the upload is kept as it was.
+        self.assertEqual(response.status_code, 507)
+        self.assertEqual(self.usage(), (5000, 0, 0))
+        self.assertTrue(MultipartUploadSession.objects.filter(file_id=file_id).exists())
+        self.assertIsNone(File.objects.get(fileID=file_id).upload_finished_at)
+        self.assertEqual(len(self.storage_server.uploads), 1)
+        self.assertFalse(UserPersonalFileToken.objects.filter(file_id=file_id).exists())
+
+    def test_direct_upload_is_finished_and_charged_once(self):
+        service = FileDirectUploadService(self.user)
+        with mock.patch("FileProcessing.services.s3_generate_presigned_post", return_value={}):
+            file_id = service.start(file_name="notes.bin", file_type="application/octet-stream", file_size=3000)["id"]
+        self.storage_server.put(File.objects.get(fileID=file_id).file.name, b"x" * 3000)
+
+        # Not the upload of another user
+        other = User.objects.create_user(email="other@example.com", name="Other", password="password")
+        with self.assertRaises(File.DoesNotExist):
+            FileDirectUploadService(other).finish(file=File.objects.get(fileID=file_id))
+
+        service.finish(file=File.objects.get(fileID=file_id))
+        with self.assertRaises(File.DoesNotExist):
+            service.finish(file=File.objects.get(fileID=file_id))
+
+        self.assertEqual(self.usage(), (3000, 0, 0))
+        self.assertEqual(UserPersonalFileToken.objects.filter(file_id=file_id).count(), 1)
+        self.assertEqual(storage_usage_get(other).used, 0)
+
+    def test_direct_upload_past_its_reservation(self):
+        service = FileDirectUploadService(self.user)
+        with mock.patch("FileProcessing.services.s3_generate_presigned_post", return_value={}):
+            file_id = service.start(file_name="notes.bin", file_type="application/octet-stream", file_size=3000)["id"]
+        key = File.objects.get(fileID=file_id).file.name
+
+        # More than declared and more than the quota has left
+        self.storage_server.put(key, b"x" * 12000)
+        with self.assertRaises(StorageQuotaExceeded):
+            service.finish(file=File.objects.get(fileID=file_id))
+
+        self.assertNotIn(key, self.storage_server.objects)
+        self.assertEqual(self.usage(), (0, 0, 3000))
+
+        # More than declared, but it fits
+        self.storage_server.put(key, b"x" * 5000)
+        service.finish(file=File.objects.get(fileID=file_id))
+
+        self.assertEqual(self.usage(), (5000, 0, 0))
+
+    @override_settings(FILE_UPLOAD_STORAGE="local")
+    def test_local_direct_upload_is_charged_what_was_stored(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with mock.patch.object(File._meta.get_field("file"), "storage", FileSystemStorage(location=directory.name)):
+            service = FileDirectUploadService(self.user)
+            with mock.patch("FileProcessing.services.file_generate_local_upload_url", return_value=""):
+                file_id = service.start(file_name="notes.bin", file_type="application/octet-stream", file_size=3000)["id"]
+
+            with self.assertRaises(ValidationError):
+                service.finish(file=File.objects.get(fileID=file_id))
+            with self.assertRaises(ValidationError):
+                service.upload_local(file=File.objects.get(fileID=file_id), file_obj=SimpleUploadedFile("notes.bin", b"x" * 4000))
+
+            service.upload_local(file=File.objects.get(fileID=file_id), file_obj=SimpleUploadedFile("notes.bin", b"x" * 1000))
+            service.finish(file=File.objects.get(fileID=file_id))
+
+        self.assertEqual(self.usage(), (1000, 0, 0))
+
+    def test_batch_is_reserved_as_a_whole(self):
+        response = self.client.post(
+            reverse("upload:batch"),
+            {"files": [SimpleUploadedFile(f"{i}.bin", bytes([i]) * 4000) for i in range(3)]},
+            format="multipart",
+        )
+
+        self.assertEqual(response.status_code, 507)
+        self.assertEqual(self.usage(), (0, 0, 0))
+        self.assertEqual(self.storage_server.objects, {})
+
+    def test_recycle_bin(self):
+        token = UserPersonalFileToken.objects.get(personalfiletoken=self.upload(3000).data["id"])
+        self.upload(2000)
+
+        FileDeleteService(self.user).deleteFile([token.personalfiletoken])
+        self.assertEqual(self.usage(), (5000, 3000, 0))
+
+        FileRestoreService(self.user).restoreFile([token.personalfiletoken])
+        self.assertEqual(self.usage(), (5000, 0, 0))
+
+        FileDeleteService(self.user).deleteFile([token.personalfiletoken])
+        EmptyRecycleBinservice(self.user).emptybin()
+        self.assertEqual(self.usage(), (2000, 0, 0))
+
+        stats, _ = UserService(self.user).getStats()
+        self.assertEqual(
+            (stats["allocatedstorage"], stats["totalstorage"], stats["binusedstorage"], stats["leftstorage"]),
+            (10000, 2000, 0, 8000),
+        )
+
+    def test_counted_from_existing_tokens(self):
+        self.upload(3000)
+        self.upload(2000)
+        UserPersonalFileToken.objects.filter(file_size=3000).update(is_delete_init=True)
+        UserStorageUsage.objects.all().delete()
+
+        self.assertEqual(self.usage(), (5000, 3000, 0))
+
+    @override_settings(STORAGE_PER_USER=None)
+    def test_no_limit(self):
+        self.assertEqual(self.upload(20000).status_code, 201)
+        self.assertEqual(self.usage(), (20000, 0, 0))
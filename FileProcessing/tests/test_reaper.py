@@ -0,0 +1,197 @@
+import base64
+import io
+import time
+from datetime import timedelta
+from unittest import mock
+
+from botocore.exceptions import ClientError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.enums import FileImportStatus
+from FileProcessing.models import File, FileImportJob, MultipartUploadSession, StorageReservation
+from FileProcessing.quota import storage_usage_get
+from FileProcessing.reaper import UploadReaper
+from FileProcessing.services import FileDirectUploadService, FileMultipartUploadService
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+from integrations.aws.client import s3_multipart_upload_init
+
+HOUR = 3600
+
+
+@override_settings(FILE_MULTIPART_PART_SIZE=5 * 1024 * 1024)
+class UploadReaperTests(FakeS3TestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user(email="upload@example.com", name="Upload", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def multipart(self, request_type, data, format="json"):
+        return self.client.post(reverse("upload:MultiPartUpload"), data, format=format, HTTP_X_REQ_TYPE=request_type)
+
+    def start(self, size=3000, parts=1):
+        file_id = self.multipart("start", {"file_name": "movie.mp4", "file_type": "video/mp4", "file_size": size}).data["id"]
+        for part_number in range(1, parts + 1):
+            self.multipart(
+                "upload",
+                {"file_id": file_id, "part_number": part_number, "file": SimpleUploadedFile("part", b"x" * 1000)},
+                format="multipart",
+            )
+        return file_id
+
+    def age(self, *file_ids, hours=2):
+        File.objects.filter(fileID__in=file_ids).update(created_at=timezone.now() - timedelta(hours=hours))
+
+    def reap(self, **kwargs):
+        return UploadReaper(ttl=HOUR, **kwargs).run()
+
+    def test_abandoned_multipart_upload(self):
+        file_id = self.start(parts=2)
+        self.age(file_id)
+
+        stats = self.reap()
+
+        self.assertEqual((stats["files_deleted"], stats["uploads_aborted"], stats["bytes_reclaimed"]), (1, 1, 2000))
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(MultipartUploadSession.objects.exists())
+        self.assertEqual(self.storage_server.uploads, {})
+        # The space it held is back
+        self.assertFalse(StorageReservation.objects.exists())
+        self.assertEqual(storage_usage_get(self.user).reserved, 0)
+
+    def test_recent_and_finished_uploads_are_kept(self):
+        recent = self.start()
+        finished = self.start(size=1000)
+        self.multipart("finish", {"file_id": finished})
+        self.age(finished)
+
+        stats = self.reap()
+
+        self.assertEqual(stats["files_deleted"], 0)
+        self.assertEqual(set(File.objects.values_list("fileID", flat=True)), {recent, finished})
+        self.assertEqual(len(self.storage_server.uploads), 1)
+
+    def test_in_keyset_batches(self):
+        file_ids = [self.start(parts=0) for _ in range(5)]
+        self.age(*file_ids)
+
+        stats = self.reap(batch_size=2)
+
+        self.assertEqual((stats["files_deleted"], stats["uploads_aborted"]), (5, 5))
+        self.assertEqual(self.storage_server.uploads, {})
+
+    def test_tus_tail_is_deleted(self):
+        metadata = f"filename {base64.b64encode(b'movie.mp4').decode()}"
+        location = self.client.post(
+            reverse("upload:tus"), HTTP_TUS_RESUMABLE="1.0.0", HTTP_UPLOAD_LENGTH=str(10 * 1024 * 1024), HTTP_UPLOAD_METADATA=metadata
+        )["Location"]
+        self.client.generic(
+            "PATCH", location, b"x" * 1000, content_type="application/offset+octet-stream",
+            HTTP_TUS_RESUMABLE="1.0.0", HTTP_UPLOAD_OFFSET="0",
+        )
+        self.assertEqual(len(self.storage_server.objects), 1)
+        self.age(*File.objects.values_list("fileID", flat=True))
+
+        stats = self.reap()
+
+        self.assertEqual(stats["bytes_reclaimed"], 1000)
+        self.assertEqual(self.storage_server.objects, {})
+
+    def test_unfinished_direct_upload_object_is_deleted(self):
+        with mock.patch("FileProcessing.services.s3_generate_presigned_post", return_value={}):
+            file_id = FileDirectUploadService(self.user).start(file_name="notes.txt", file_type="text/plain", file_size=5)["id"]
+        # The client uploaded the object, and never called finish
+        self.storage_server.put(File.objects.get(fileID=file_id).file.name, b"notes")
+        self.age(file_id)
+
+        stats = self.reap()
+
+        self.assertEqual((stats["files_deleted"], stats["objects_deleted"], stats["bytes_reclaimed"]), (1, 1, 5))
+        self.assertEqual(self.storage_server.objects, {})
+
+    def test_sweep_aborts_untracked_uploads(self):
+        lost = s3_multipart_upload_init(file_path="files/video/mp4/lost.mp4")["UploadId"]
+        recent = s3_multipart_upload_init(file_path="files/video/mp4/recent.mp4")["UploadId"]
+        elsewhere = s3_multipart_upload_init(file_path="backups/db.dump")["UploadId"]
+        tracked = MultipartUploadSession.objects.get(file_id=self.start()).upload_id
+        for upload_id in (lost, elsewhere, tracked):
+            self.storage_server.uploads[upload_id]["initiated"] = time.time() - 2 * HOUR
+
+        stats = self.reap()
+
+        self.assertEqual(stats["uploads_swept"], 1)
+        self.assertEqual(set(self.storage_server.uploads), {recent, elsewhere, tracked})
+
+        self.assertEqual(self.reap(sweep=False)["uploads_swept"], 0)
+
+    def test_failed_cleanup_is_retried_next_run(self):
+        file_id = self.start()
+        self.age(file_id)
+        error = ClientError({"Error": {"Code": "InternalError"}}, "AbortMultipartUpload")
+
+        with mock.patch("integrations.storage.s3.s3_multipart_upload_abort", side_effect=error), self.assertLogs("FileProcessing.reaper"):
+            stats = self.reap(sweep=False)
+
+        self.assertEqual((stats["errors"], stats["files_deleted"]), (1, 0))
+        self.assertTrue(File.objects.filter(fileID=file_id).exists())
+
+        self.assertEqual(self.reap()["files_deleted"], 1)
+
+    def import_job(self, *, stale):
+        file, _ = FileMultipartUploadService(self.user).create_upload(file_name="movie.mp4", file_type="video/mp4", file_size=3000)
+        job = FileImportJob.objects.create(
+            uploaded_by=self.user, url="https://example.com/movie.mp4", status=FileImportStatus.RUNNING.value, file=file
+        )
+        self.age(file.fileID)
+        if stale:
+            FileImportJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=2))
+        return job
+
+    def test_interrupted_import_is_failed_and_reaped(self):
+        job = self.import_job(stale=True)
+
+        stats = self.reap()
+
+        self.assertEqual((stats["imports_failed"], stats["files_deleted"], stats["uploads_aborted"]), (1, 1, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ("failed", "The import was interrupted"))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(self.storage_server.uploads, {})
+        self.assertEqual(storage_usage_get(self.user).reserved, 0)
+
+    def test_running_import_is_kept_however_old(self):
+        job = self.import_job(stale=False)
+
+        stats = self.reap()
+
+        self.assertEqual((stats["imports_failed"], stats["files_deleted"]), (0, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "running")
+        self.assertTrue(File.objects.filter(fileID=job.file_id).exists())
+        self.assertEqual(len(self.storage_server.uploads), 1)
+
+    def test_management_command(self):
+        self.age(self.start(parts=1))
+        out = io.StringIO()
+
+        call_command("reapuploads", "--ttl", str(HOUR), stdout=out)
+
+        self.assertIn("Files deleted: 1, multipart uploads aborted: 1 (+0 untracked)", out.getvalue())
+        self.assertIn("Reclaimed: 1000 bytes", out.getvalue())
+
+    def test_management_command_repeats_with_an_interval(self):
+        out = io.StringIO()
+
+        # Stopped on its third sleep
+        with mock.patch("time.sleep", side_effect=[None, None, KeyboardInterrupt]) as sleep, self.assertRaises(KeyboardInterrupt):
+            call_command("reapuploads", "--interval", "60", stdout=out)
+
+        self.assertEqual(out.getvalue().count("Done."), 3)
+        sleep.assert_called_with(60)
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase, override_settings
+
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+from integrations.aws.client import (
+    s3_client_reset,
+    s3_get_client,
+    s3_get_client_config,
+    s3_get_credentials,
+    s3_head_object_size,
+    s3_pool_stats,
+)
+
+
+class S3ClientTests(FakeS3TestMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+
+        s3_client_reset()
+        s3_pool_stats.reset()
+        self.addCleanup(s3_client_reset)
+        self.addCleanup(s3_get_client_config.cache_clear)
+
+    def test_one_client_per_process(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = set(executor.map(lambda _: id(s3_get_client()), range(32)))
+
+        self.assertEqual(clients, {id(s3_get_client())})
+
+    @override_settings(AWS_S3_MAX_POOL_CONNECTIONS=7, AWS_S3_RETRY_MODE="adaptive", AWS_S3_MAX_ATTEMPTS=5)
+    def test_client_config(self):
+        s3_get_client_config.cache_clear()
+
+        config = s3_get_client().meta.config
+
+        self.assertEqual(config.max_pool_connections, 7)
+        self.assertEqual(config.retries, {"mode": "adaptive", "total_max_attempts": 5})
+        self.assertTrue(config.tcp_keepalive)
+
+    def test_new_credentials_get_a_new_client(self):
+        s3_client = s3_get_client()
+
+        with override_settings(AWS_S3_REGION_NAME="us-east-1"):
+            s3_get_credentials.cache_clear()
+            self.assertEqual(s3_get_client().meta.region_name, "us-east-1")
+
+        s3_get_credentials.cache_clear()
+        self.assertIs(s3_get_client(), s3_client)
+
+    def test_connections_are_kept_alive(self):
+        self.storage_server.put("notes.txt", b"notes")
+
+        for _ in range(3):
+            self.assertEqual(s3_head_object_size(bucket=self.storage_server.bucket, key="notes.txt"), 5)
+
+        stats = s3_pool_stats.snapshot()
+        self.assertEqual((stats["checkouts"], stats["hits"], stats["connections_created"]), (3, 2, 1))
+
+    def test_reset_after_fork(self):
+        s3_client = s3_get_client()
+
+        s3_client_reset()
+
+        self.assertIsNot(s3_get_client(), s3_client)
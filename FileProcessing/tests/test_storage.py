@@ -0,0 +1,246 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from Account.models import User
+from FileProcessing.models import File
+from FileProcessing.storage import BackendFileStorage, storage_get_backend
+from FileProcessing.tests.fake_s3 import FakeS3TestMixin
+from integrations.storage.base import StorageError, StoragePart, storage_checksum_sha256
+from integrations.storage.local import LocalStorageBackend
+from integrations.storage.memory import MemoryStorageBackend
+from integrations.storage.s3 import S3StorageBackend
+
+
+class StorageBackendTestsMixin:
+    """
+    What every backend must do the same way, `make_backend` builds the one under test.
+    """
+
+    body = bytes(range(256)) * 16  # 4 KiB
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        super().setUp()
+        self.backend = self.make_backend()
+
+    def read(self, byte_range=None, key="files/object.bin"):
+        response = self.backend.open(key, byte_range)
+        try:
+            return response.status_code, response.headers, response.read()
+        finally:
+            response.close()
+
+    def multipart_upload(self, key, checksum=False):
+        upload_id = self.backend.multipart_init(key, checksum_algorithm="SHA256" if checksum else None)
+        parts = []
+        for part_number, start in enumerate(range(0, len(self.body), 2048), start=1):
+            data = self.body[start:start + 2048]
+            parts.append(
+                self.backend.multipart_upload_part(
+                    key, upload_id, part_number, data, checksum_sha256=storage_checksum_sha256(data) if checksum else None
+                )
+            )
+        return upload_id, parts
+
+    def test_put_head_and_get(self):
+        etag = self.backend.put("files/object.bin", self.body)
+
+        head = self.backend.head("files/object.bin")
+        self.assertEqual(head.size, len(self.body))
+        self.assertEqual(head.etag, etag)
+        self.assertEqual(self.backend.get("files/object.bin"), self.body)
+
+    def test_ranged_reads(self):
+        self.backend.put("files/object.bin", self.body)
+
+        status_code, headers, content = self.read()
+        self.assertEqual((status_code, content), (200, self.body))
+
+        status_code, headers, content = self.read((100, 199))
+        self.assertEqual((status_code, content), (206, self.body[100:200]))
+        self.assertEqual(headers["Content-Range"], f"bytes 100-199/{len(self.body)}")
+
+        self.assertEqual(self.read((None, 500))[2], self.body[-500:])
+        self.assertEqual(self.read((4000, None))[2], self.body[4000:])
+        self.assertEqual(self.read((len(self.body), None))[0], 416)
+
+    def test_missing_objects(self):
+        self.assertEqual(self.read(key="files/missing.bin")[0], 404)
+        self.assertIsNone(self.backend.head("files/missing.bin"))
+
+        with self.assertRaises(StorageError) as raised:
+            self.backend.get("files/missing.bin")
+        self.assertEqual(raised.exception.code, "NoSuchKey")
+
+    def test_delete_many_ignores_missing_objects(self):
+        self.backend.put("files/a.bin", b"a")
+        self.backend.put("files/b.bin", b"b")
+
+        self.backend.delete_many(["files/a.bin", "files/b.bin", "files/missing.bin"])
+
+        self.assertIsNone(self.backend.head("files/a.bin"))
+        self.assertIsNone(self.backend.head("files/b.bin"))
+
+    def test_multipart_upload_with_checksums(self):
+        upload_id, parts = self.multipart_upload("files/object.bin", checksum=True)
+
+        self.assertEqual(
+            [(part.part_number, part.size) for part in self.backend.multipart_list_parts("files/object.bin", upload_id)],
+            [(1, 2048), (2, 2048)],
+        )
+        etag = self.backend.multipart_complete("files/object.bin", upload_id, parts)
+
+        head = self.backend.head("files/object.bin", checksum=True)
+        self.assertEqual(head.etag, etag)
+        self.assertEqual(self.backend.get("files/object.bin"), self.body)
+        if head.checksum is not None:
+            self.assertTrue(head.checksum.endswith("-2"))
+
+    def test_part_not_matching_its_checksum_is_refused(self):
+        upload_id = self.backend.multipart_init("files/object.bin", checksum_algorithm="SHA256")
+
+        with self.assertRaises(StorageError) as raised:
+            self.backend.multipart_upload_part(
+                "files/object.bin", upload_id, 1, self.body, checksum_sha256=storage_checksum_sha256(b"other")
+            )
+        self.assertEqual(raised.exception.code, "BadDigest")
+
+    def test_complete_checks_the_parts(self):
+        upload_id, parts = self.multipart_upload("files/object.bin")
+        parts[1] = StoragePart(part_number=2, etag="0" * 32, size=2048)
+
+        with self.assertRaises(StorageError) as raised:
+            self.backend.multipart_complete("files/object.bin", upload_id, parts)
+        self.assertEqual(raised.exception.code, "InvalidPart")
+        self.assertIsNone(self.backend.head("files/object.bin"))
+
+    def test_uploads_are_listed_until_aborted(self):
+        upload_id = self.backend.multipart_init("files/a.bin")
+        self.backend.multipart_init("other/b.bin")
+
+        self.assertEqual([upload.upload_id for upload in self.backend.multipart_list("files/")], [upload_id])
+
+        self.backend.multipart_abort("files/a.bin", upload_id)
+
+        self.assertEqual(list(self.backend.multipart_list("files/")), [])
+        with self.assertRaises(StorageError) as raised:
+            self.backend.multipart_list_parts("files/a.bin", upload_id)
+        self.assertEqual(raised.exception.code, "NoSuchUpload")
+
+
+class LocalStorageBackendTests(StorageBackendTestsMixin, SimpleTestCase):
+    def make_backend(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        return LocalStorageBackend(root)
+
+    def test_keys_are_sharded(self):
+        backend = LocalStorageBackend(self.backend.root, shard_depth=2)
+        backend.put("files/object.bin", self.body)
+
+        relative_path = backend.relative_path("files/object.bin")
+        self.assertRegex(relative_path, r"^[0-9a-f]{2}/[0-9a-f]{2}/files/object.bin$")
+        self.assertTrue(os.path.isfile(os.path.join(backend.root, relative_path)))
+        self.assertEqual(backend.get("files/object.bin"), self.body)
+
+    def test_keys_cannot_leave_the_root(self):
+        for key in ("/etc/passwd", "files/../../escape", ".uploads/upload.json"):
+            with self.assertRaises(StorageError):
+                self.backend.put(key, b"x")
+
+
+class MemoryStorageBackendTests(StorageBackendTestsMixin, SimpleTestCase):
+    def make_backend(self):
+        return MemoryStorageBackend(min_part_size=1024)
+
+    def test_queued_errors_fail_the_next_calls(self):
+        self.backend.errors.extend(["SlowDown", "InternalError"])
+
+        for code in ("SlowDown", "InternalError"):
+            with self.assertRaises(StorageError) as raised:
+                self.backend.put("files/object.bin", self.body)
+            self.assertEqual(raised.exception.code, code)
+
+        self.backend.put("files/object.bin", self.body)
+        self.assertEqual(self.backend.calls["put"], 3)
+
+    def test_error_rate(self):
+        backend = MemoryStorageBackend(error_rate=1)
+
+        with self.assertRaises(StorageError) as raised:
+            backend.head("files/object.bin")
+        self.assertEqual(raised.exception.code, "SlowDown")
+
+    def test_parts_under_the_minimum_size_are_refused(self):
+        upload_id = self.backend.multipart_init("files/object.bin")
+        parts = [self.backend.multipart_upload_part("files/object.bin", upload_id, 1, b"x" * 100)]
+        parts.append(self.backend.multipart_upload_part("files/object.bin", upload_id, 2, b"y" * 100))
+
+        with self.assertRaises(StorageError) as raised:
+            self.backend.multipart_complete("files/object.bin", upload_id, parts)
+        self.assertEqual(raised.exception.code, "EntityTooSmall")
+
+
+class S3StorageBackendTests(StorageBackendTestsMixin, FakeS3TestMixin, SimpleTestCase):
+    def make_backend(self):
+        return S3StorageBackend(object_url=lambda key: self.storage_server.url + key)
+
+
+@override_settings(FILE_UPLOAD_STORAGE="memory")
+class MemoryStorageFlowTests(TestCase):
+    """
+    An upload and its download with everything in memory, no S3 (fake or not) involved.
+    """
+
+    body = bytes(range(256)) * 12  # 3 KiB, three parts of 1 KiB
+
+    def setUp(self):
+        self.backend = storage_get_backend()
+        self.backend.reset()
+        self.addCleanup(self.backend.reset)
+
+        storage_patch = mock.patch.object(File._meta.get_field("file"), "storage", BackendFileStorage())
+        storage_patch.start()
+        self.addCleanup(storage_patch.stop)
+
+        self.user = User.objects.create_user(email="memory@example.com", name="Memory", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def request(self, req_type, data, format="json"):
+        return self.client.post(reverse("upload:MultiPartUpload"), data, format=format, HTTP_X_REQ_TYPE=req_type)
+
+    def test_multipart_upload_then_ranged_download(self):
+        response = self.request(
+            "start", {"file_name": "notes.bin", "file_type": "application/octet-stream", "file_size": len(self.body)}
+        )
+        self.assertEqual(response.status_code, 201)
+        file_id = response.data["id"]
+
+        for part_number in (1, 2, 3):
+            part = self.body[(part_number - 1) * 1024:part_number * 1024]
+            response = self.request(
+                "upload",
+                {"file_id": file_id, "part_number": part_number, "file": SimpleUploadedFile("part", part)},
+                format="multipart",
+            )
+            self.assertEqual(response.status_code, 202)
+
+        response = self.request("finish", {"file_id": file_id})
+        self.assertEqual(response.status_code, 200)
+
+        file = File.objects.get(fileID=file_id)
+        self.assertEqual(self.backend.objects[file.file.name], self.body)
+
+        response = self.client.get(reverse("FileGet", kwargs={"token": response.data["id"]}), HTTP_RANGE="bytes=1000-1099")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.body[1000:1100])
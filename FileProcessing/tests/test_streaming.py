@@ -0,0 +1,521 @@
+import os
+import tempfile
+from unittest import mock
+from urllib import parse
+from wsgiref.util import setup_testing_defaults
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.storage import FileSystemStorage
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from Account.models import User
+from FileProcessing.enums import FileDeliveryMode
+from FileProcessing.models import File, UserPersonalFileToken
+from FileProcessing.presign import presign_cache_get
+from FileProcessing.storage import storage_get_backend
+from FileProcessing.streaming import parse_range_header
+from FileProcessing.tests.fake_storage import FakeStorageServer
+from FileProcessing.views import FileDownloadAsyncView, FileGetAsyncView
+from integrations.aws.client import s3_get_credentials
+
+
+class RangeHeaderParsingTests(SimpleTestCase):
+    def test_closed_range(self):
+        self.assertEqual(parse_range_header("bytes=500-999"), (500, 999))
+
+    def test_open_ended_range(self):
+        self.assertEqual(parse_range_header("bytes=500-"), (500, None))
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_range_header("bytes=-500"), (None, 500))
+
+    def test_invalid_ranges_are_ignored(self):
+        self.assertIsNone(parse_range_header(""))
+        self.assertIsNone(parse_range_header("bytes=-"))
+        self.assertIsNone(parse_range_header("bytes=10-5"))
+        self.assertIsNone(parse_range_header("bytes=0-1,5-6"))
+        self.assertIsNone(parse_range_header("items=0-10"))
+
+
+class FileStreamingTestMixin:
+    """
+    Serves `File` rows from a local fake S3, by pointing the file storage `base_url` at it.
+    """
+
+    body = bytes(range(256)) * 4096  # 1 MiB
+
+    @classmethod
+    def setUpClass(cls):
+        cls.storage_server = FakeStorageServer().start()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.storage_server.stop()
+
+    def setUp(self):
+        storage_patch = mock.patch.object(
+            File._meta.get_field("file"), "storage", FileSystemStorage(base_url=self.storage_server.url)
+        )
+        storage_patch.start()
+        self.addCleanup(storage_patch.stop)
+
+        self.user = User.objects.create_user(email="streaming@example.com", name="Streaming", password="password")
+        self.file = File.objects.create(
+            fileID="a" * 32,
+            file="files/video/mp4/" + "a" * 32 + ".mp4",
+            original_file_name="movie.mp4",
+            file_name="a" * 32 + ".mp4",
+            file_type="video/mp4",
+            file_size=len(self.body),
+            uploaded_by=self.user,
+            upload_finished_at=timezone.now(),
+        )
+        self.token = UserPersonalFileToken.objects.create(
+            uploaded_by=self.user,
+            personalfiletoken="t" * 64,
+            file_id=self.file,
+            file_size=len(self.body),
+            type="video/mp4",
+        )
+
+        self.storage_server.put(self.file.file.name, self.body)
+        self.storage_server.requests.clear()
+        self.storage_server.bytes_sent = 0
+
+    def stream(self, url_name, **headers):
+        response = self.client.get(reverse(url_name, kwargs={"token": self.token.personalfiletoken}), **headers)
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+
+class FileGetRangeTests(FileStreamingTestMixin, TestCase):
+    def test_full_body(self):
+        response, content = self.stream("FileGet")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.body)
+        self.assertEqual(response["Content-Length"], str(len(self.body)))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_range_is_forwarded_to_storage(self):
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=1000000-1000099")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[1000000:1000100])
+        self.assertEqual(response["Content-Range"], f"bytes 1000000-1000099/{len(self.body)}")
+        self.assertEqual(response["Content-Length"], "100")
+
+        # Only the requested bytes left storage, nothing was read and discarded.
+        self.assertEqual(self.storage_server.requests[-1]["headers"]["Range"], "bytes=1000000-1000099")
+        self.assertEqual(self.storage_server.bytes_sent, 100)
+
+    def test_open_ended_range(self):
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=1048000-")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[1048000:])
+        self.assertEqual(response["Content-Range"], f"bytes 1048000-{len(self.body) - 1}/{len(self.body)}")
+
+    def test_suffix_range(self):
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=-500")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[-500:])
+        self.assertEqual(
+            response["Content-Range"], f"bytes {len(self.body) - 500}-{len(self.body) - 1}/{len(self.body)}"
+        )
+        self.assertEqual(self.storage_server.bytes_sent, 500)
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.stream("FileGet", HTTP_RANGE=f"bytes={len(self.body) + 10}-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.body)}")
+
+    def test_download_supports_ranges(self):
+        response, content = self.stream("FileDownload", HTTP_RANGE="bytes=10-19")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[10:20])
+        self.assertEqual(response["Content-Disposition"], "attachment; filename=movie.mp4")
+
+
+class FileAsyncStreamingTests(FileStreamingTestMixin, TestCase):
+    """
+    The views of FILE_STREAM_ASYNC, called directly since the URLconf picks them when it is imported.
+    """
+
+    async def astream(self, view, headers=None):
+        request = AsyncRequestFactory().get("/", headers=headers)
+        # Set by AuthenticationMiddleware, which the factory skips
+        request.user = AnonymousUser()
+        response = await view.as_view()(request, token=self.token.personalfiletoken)
+        content = b"".join([chunk async for chunk in response]) if response.streaming else response.content
+        return response, content
+
+    async def test_full_body_is_streamed_asynchronously(self):
+        response, content = await self.astream(FileGetAsyncView)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(content, self.body)
+        self.assertEqual(response["Content-Length"], str(len(self.body)))
+        self.assertEqual(response["Content-Disposition"], "inline; filename=movie.mp4")
+
+    async def test_range_is_forwarded_to_storage(self):
+        response, content = await self.astream(FileDownloadAsyncView, headers={"Range": "bytes=1000000-1000099"})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[1000000:1000100])
+        self.assertEqual(response["Content-Range"], f"bytes 1000000-1000099/{len(self.body)}")
+        self.assertEqual(response["Content-Disposition"], "attachment; filename=movie.mp4")
+        self.assertEqual(self.storage_server.requests[-1]["headers"]["Range"], "bytes=1000000-1000099")
+        self.assertEqual(self.storage_server.bytes_sent, 100)
+
+    async def test_unsatisfiable_range(self):
+        response, _ = await self.astream(FileGetAsyncView, headers={"Range": f"bytes={len(self.body) + 10}-"})
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.body)}")
+
+    async def test_revalidation_never_touches_storage(self):
+        response, _ = await self.astream(FileGetAsyncView, headers={"If-None-Match": self.file.strong_etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.storage_server.requests, [])
+
+    async def test_unknown_tokens_are_not_found(self):
+        request = AsyncRequestFactory().get("/")
+        response = await FileGetAsyncView.as_view()(request, token="u" * 64)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.content, b'{"msg": "File Not Found"}')
+
+    @override_settings(FILE_UPLOAD_STORAGE="memory")
+    async def test_backends_without_async_reads_are_read_in_threads(self):
+        backend = storage_get_backend()
+        backend.reset()
+        self.addCleanup(backend.reset)
+        backend.put(self.file.file.name, self.body)
+
+        response, content = await self.astream(FileGetAsyncView, headers={"Range": "bytes=-500"})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[-500:])
+        self.assertEqual(self.storage_server.requests, [])
+
+
+@override_settings(
+    FILE_UPLOAD_STORAGE="s3",
+    FILE_DELIVERY_MODE="redirect",
+    AWS_S3_ACCESS_KEY_ID="AKIAEXAMPLE",
+    AWS_S3_SECRET_ACCESS_KEY="secret",
+    AWS_S3_REGION_NAME="eu-central-1",
+    AWS_STORAGE_BUCKET_NAME="drivenow-test",
+)
+class FileDeliveryModeTests(FileStreamingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        s3_get_credentials.cache_clear()
+        self.addCleanup(s3_get_credentials.cache_clear)
+        presign_cache_get.cache_clear()
+        self.addCleanup(presign_cache_get.cache_clear)
+
+    def test_redirects_to_presigned_url_under_the_users_file_name(self):
+        self.token.change_file_name = "holiday.mp4"
+        self.token.save()
+
+        response, _ = self.stream("FileDownload")
+
+        self.assertEqual(response.status_code, 302)
+        location = parse.urlparse(response["Location"])
+        query = parse.parse_qs(location.query)
+        self.assertEqual(location.path, "/" + self.file.file.name)
+        self.assertEqual(query["response-content-disposition"], ['attachment; filename="holiday.mp4"'])
+        self.assertEqual(query["response-content-type"], ["video/mp4"])
+        self.assertEqual(query["X-Amz-Expires"], ["300"])
+        # Nothing was fetched through the worker.
+        self.assertEqual(self.storage_server.requests, [])
+
+    def test_token_can_stay_proxied(self):
+        self.token.delivery_mode = FileDeliveryMode.PROXY.value
+        self.token.save()
+
+        response, content = self.stream("FileGet")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.body)
+
+    @override_settings(FILE_DELIVERY_PROXY_CONTENT_TYPES=["video/"])
+    def test_content_type_can_stay_proxied(self):
+        response, _ = self.stream("FileGet")
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_deleted_tokens_are_not_redirected(self):
+        self.token.is_delete_init = True
+        self.token.save()
+
+        response, _ = self.stream("FileGet")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class FileConditionalGetTests(FileStreamingTestMixin, TestCase):
+    def test_validators_are_sent(self):
+        response, _ = self.stream("FileGet")
+
+        self.assertEqual(response["ETag"], self.file.strong_etag)
+        self.assertEqual(response["Last-Modified"], http_date(self.file.last_modified))
+
+    def test_storage_etag_is_preferred(self):
+        self.file.etag = "9b2cf535f27731c974343645a3985328-3"
+        self.file.save()
+
+        response, _ = self.stream("FileGet")
+
+        self.assertEqual(response["ETag"], '"9b2cf535f27731c974343645a3985328-3"')
+
+    def test_if_none_match_revalidates_with_one_query_and_no_storage_fetch(self):
+        with self.assertNumQueries(1):
+            response, _ = self.stream("FileGet", HTTP_IF_NONE_MATCH=self.file.strong_etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], self.file.strong_etag)
+        self.assertEqual(self.storage_server.requests, [])
+
+    def test_if_modified_since(self):
+        response, _ = self.stream("FileGet", HTTP_IF_MODIFIED_SINCE=http_date(self.file.last_modified))
+        self.assertEqual(response.status_code, 304)
+
+        response, _ = self.stream("FileGet", HTTP_IF_MODIFIED_SINCE=http_date(self.file.last_modified - 60))
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_match_failure(self):
+        response, _ = self.stream("FileGet", HTTP_IF_MATCH='"something-else"')
+
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.storage_server.requests, [])
+
+    def test_if_range_matching_serves_the_range(self):
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=self.file.strong_etag)
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[:10])
+
+    def test_if_range_stale_serves_the_full_body(self):
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.body)
+        self.assertNotIn("Range", self.storage_server.requests[-1]["headers"])
+
+    def test_if_range_date(self):
+        response, _ = self.stream(
+            "FileGet", HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=http_date(self.file.last_modified)
+        )
+        self.assertEqual(response.status_code, 206)
+
+        response, _ = self.stream(
+            "FileGet", HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=http_date(self.file.last_modified - 60)
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(FILE_UPLOAD_STORAGE="local")
+class LocalStorageStreamingTests(FileStreamingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        storage_patch = mock.patch.object(
+            File._meta.get_field("file"), "storage", FileSystemStorage(location=directory.name)
+        )
+        storage_patch.start()
+        self.addCleanup(storage_patch.stop)
+
+        path = os.path.join(directory.name, self.file.file.name)
+        os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as fp:
+            fp.write(self.body)
+
+    def wsgi_get(self, url_name, **headers):
+        """
+        Runs the request through the WSGI handler with a `wsgi.file_wrapper`,
+        returning what a sendfile capable server would send.
+        """
+        wrapped = []
+
+        def file_wrapper(filelike, block_size):
+            wrapped.append(filelike)
+            return [b""]
+
+        environ = {
+            "PATH_INFO": reverse(url_name, kwargs={"token": self.token.personalfiletoken}),
+            "wsgi.file_wrapper": file_wrapper,
+            **headers,
+        }
+        setup_testing_defaults(environ)
+
+        started = {}
+        WSGIHandler()(environ, lambda status, response_headers: started.update(status=status, headers=dict(response_headers)))
+
+        filelike = wrapped[0]
+        self.addCleanup(filelike.close)
+        count = int(started["headers"]["Content-Length"])
+        offset = os.lseek(filelike.fileno(), 0, os.SEEK_CUR)
+
+        return started, os.pread(filelike.fileno(), count, offset)
+
+    def test_full_body(self):
+        response, content = self.stream("FileGet")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.body)
+        self.assertEqual(response["Content-Length"], str(len(self.body)))
+        self.assertEqual(response["Content-Disposition"], "inline; filename=movie.mp4")
+        self.assertEqual(self.storage_server.requests, [])
+
+    def test_range(self):
+        response, content = self.stream("FileGet", HTTP_RANGE="bytes=1000000-1000099")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[1000000:1000100])
+        self.assertEqual(response["Content-Range"], f"bytes 1000000-1000099/{len(self.body)}")
+        self.assertEqual(response["Content-Length"], "100")
+
+    def test_suffix_range_and_renamed_download(self):
+        self.token.change_file_name = "holiday.mp4"
+        self.token.save()
+
+        response, content = self.stream("FileDownload", HTTP_RANGE="bytes=-10")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[-10:])
+        self.assertEqual(response["Content-Disposition"], "attachment; filename=holiday.mp4")
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.stream("FileGet", HTTP_RANGE=f"bytes={len(self.body)}-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.body)}")
+
+    def test_file_is_handed_to_the_server_file_wrapper(self):
+        started, content = self.wsgi_get("FileGet")
+
+        self.assertEqual(started["status"], "200 OK")
+        self.assertEqual(content, self.body)
+
+    def test_range_is_handed_to_the_server_as_offset_and_count(self):
+        started, content = self.wsgi_get("FileGet", HTTP_RANGE="bytes=500000-500999")
+
+        self.assertEqual(started["status"], "206 Partial Content")
+        self.assertEqual(content, self.body[500000:501000])
+
+
+@override_settings(FILE_UPLOAD_STORAGE="local", FILE_DELIVERY_MODE="x-accel-redirect")
+class FileOffloadTests(FileStreamingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        storage_patch = mock.patch.object(
+            File._meta.get_field("file"), "storage", FileSystemStorage(location="/srv/drivenow/media")
+        )
+        storage_patch.start()
+        self.addCleanup(storage_patch.stop)
+
+    def test_x_accel_redirect_to_the_internal_location(self):
+        self.token.change_file_name = "holiday.mp4"
+        self.token.save()
+
+        response, content = self.stream("FileDownload", HTTP_RANGE="bytes=0-9")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b"")
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/" + self.file.file.name)
+        self.assertEqual(response["Content-Type"], "video/mp4")
+        self.assertEqual(response["Content-Disposition"], "attachment; filename=holiday.mp4")
+        self.assertEqual(response["ETag"], self.file.strong_etag)
+        self.assertEqual(response["Last-Modified"], http_date(self.file.last_modified))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertNotIn("X-Sendfile", response)
+
+    @override_settings(FILE_DELIVERY_MODE="x-sendfile")
+    def test_x_sendfile_with_the_path_on_disk(self):
+        response, content = self.stream("FileGet")
+
+        self.assertEqual(response["X-Sendfile"], "/srv/drivenow/media/" + self.file.file.name)
+        self.assertEqual(response["Content-Disposition"], "inline; filename=movie.mp4")
+        self.assertNotIn("X-Accel-Redirect", response)
+
+    def test_revalidation_is_answered_before_offloading(self):
+        response, _ = self.stream("FileGet", HTTP_IF_NONE_MATCH=self.file.strong_etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn("X-Accel-Redirect", response)
+
+    def test_deleted_tokens_are_not_offloaded(self):
+        self.token.is_delete_init = True
+        self.token.save()
+
+        response, _ = self.stream("FileGet")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("X-Accel-Redirect", response)
+
+
+@override_settings(
+    FILE_UPLOAD_STORAGE="s3",
+    FILE_DELIVERY_MODE="x-accel-redirect",
+    AWS_S3_ACCESS_KEY_ID="AKIAEXAMPLE",
+    AWS_S3_SECRET_ACCESS_KEY="secret",
+    AWS_S3_REGION_NAME="eu-central-1",
+    AWS_STORAGE_BUCKET_NAME="drivenow-test",
+)
+class FileS3OffloadTests(FileStreamingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        s3_get_credentials.cache_clear()
+        self.addCleanup(s3_get_credentials.cache_clear)
+        presign_cache_get.cache_clear()
+        self.addCleanup(presign_cache_get.cache_clear)
+
+    def test_x_accel_redirect_through_the_internal_s3_proxy(self):
+        response, _ = self.stream("FileGet")
+
+        location = parse.urlsplit(response["X-Accel-Redirect"])
+        host, key = location.path[len("/s3-proxy/"):].split("/", 1)
+        query = parse.parse_qs(location.query)
+
+        self.assertTrue(location.path.startswith("/s3-proxy/"))
+        self.assertIn("drivenow-test", host)
+        self.assertEqual(key, self.file.file.name)
+        self.assertIn("X-Amz-Signature", query)
+        self.assertEqual(query["response-content-disposition"], ['inline; filename="movie.mp4"'])
+        self.assertEqual(response["X-Accel-Buffering"], "no")
+        self.assertEqual(self.storage_server.requests, [])
+
+    @override_settings(FILE_DELIVERY_MODE="x-sendfile")
+    def test_x_sendfile_falls_back_to_proxying(self):
+        response, content = self.stream("FileGet")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.body)
+        self.assertNotIn("X-Sendfile", response)
+
+    def test_token_override(self):
+        self.token.delivery_mode = FileDeliveryMode.PROXY.value
+        self.token.save()
+
+        response, content = self.stream("FileGet")
+
+        self.assertEqual(content, self.body)
+        self.assertNotIn("X-Accel-Redirect", response)
@@ -0,0 +1,71 @@
+from django.test import SimpleTestCase, override_settings
+
+from FileProcessing.tests.fake_storage import FakeStorageServer
+from integrations.upstream.client import (
+    upstream_aget,
+    upstream_get,
+    upstream_get_async_session,
+    upstream_get_config,
+    upstream_get_session,
+    upstream_pool_stats,
+)
+
+
+@override_settings(UPSTREAM_POOL_MAXSIZE=1, UPSTREAM_POOL_TIMEOUT=2, UPSTREAM_RETRY_BACKOFF=0)
+class UpstreamSessionTests(SimpleTestCase):
+    body = b"x" * 65536
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.storage_server = FakeStorageServer().start()
+        cls.storage_server.put("object", cls.body)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.storage_server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        upstream_get_config.cache_clear()
+        upstream_get_session.cache_clear()
+        upstream_pool_stats.reset()
+        self.addCleanup(upstream_get_config.cache_clear)
+        self.addCleanup(upstream_get_session.cache_clear)
+
+    def test_fully_read_responses_reuse_the_connection(self):
+        for _ in range(3):
+            response = upstream_get(self.storage_server.url + "object")
+            self.assertEqual(response.read(), self.body)
+
+        stats = upstream_pool_stats.snapshot()
+        self.assertEqual(stats["checkouts"], 3)
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["connections_created"], 1)
+
+    def test_closing_mid_stream_frees_the_pool_slot(self):
+        response = upstream_get(self.storage_server.url + "object")
+        response.read(1024)
+        # The client went away, with a single connection pool the next fetch would block without this.
+        response.close()
+
+        response = upstream_get(self.storage_server.url + "object")
+        self.assertEqual(response.read(), self.body)
+        self.assertLess(upstream_pool_stats.snapshot()["max_wait_seconds"], 1)
+
+    def test_retries_idempotent_reads(self):
+        self.storage_server.errors.extend([503, 502])
+
+        response = upstream_get(self.storage_server.url + "object")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.read(), self.body)
+
+    async def test_async_reads_retry_and_stream_the_body(self):
+        self.storage_server.errors.extend([503, 502])
+
+        response = await upstream_aget(self.storage_server.url + "object", headers={"Range": "bytes=0-1023"})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join([chunk async for chunk in response.aiter_chunks(256)]), self.body[:1024])
+        self.assertEqual(upstream_get_async_session(), upstream_get_async_session())
@@ -0,0 +1,152 @@
+import base64
+import binascii
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# https://tus.io/protocols/resumable-upload
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,termination,checksum"
+TUS_CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256")
+TUS_PATCH_CONTENT_TYPE = "application/offset+octet-stream"
+
+# Status codes the protocol adds
+TUS_CHECKSUM_MISMATCH = 460
+
+# Uploads whose content hash is carried over between PATCHes, per process
+TUS_CONTENT_HASHERS_MAX = 1024
+
+
+class TusError(APIException):
+    """
+    Protocol errors, answered with the status code tus expects.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+def tus_check_version(tus_resumable: Optional[str]):
+    if tus_resumable != TUS_VERSION:
+        raise TusError(status.HTTP_412_PRECONDITION_FAILED, f"Unsupported Tus-Resumable, expected {TUS_VERSION}")
+
+
+def tus_parse_int(value: Optional[str], header: str) -> int:
+    try:
+        parsed = int(value)
+    except (TypeError, ValueError):
+        raise TusError(status.HTTP_400_BAD_REQUEST, f"Invalid {header}")
+
+    if parsed < 0:
+        raise TusError(status.HTTP_400_BAD_REQUEST, f"Invalid {header}")
+
+    return parsed
+
+
+def tus_parse_metadata(upload_metadata: Optional[str]) -> Dict[str, str]:
+    """
+    `Upload-Metadata: filename d29ybGRfZG9taW5hdGlvbl9wbGFuLnBkZg==,is_confidential` as a dict,
+    values base64 decoded (keys without a value map to "").
+    """
+    metadata = {}
+
+    for pair in (upload_metadata or "").split(","):
+        pair = pair.strip()
+        if not pair:
+            continue
+
+        key, _, value = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(value.strip(), validate=True).decode()
+        except (binascii.Error, UnicodeDecodeError):
+            raise TusError(status.HTTP_400_BAD_REQUEST, f"Invalid Upload-Metadata value for {key}")
+
+    return metadata
+
+
+def tus_parse_checksum(upload_checksum: Optional[str]) -> Optional[Tuple[str, bytes]]:
+    """
+    `Upload-Checksum: sha1 Kq5sNclPz7QV2+lfQIuc6R7oRu0=` as (algorithm, digest).
+    """
+    if not upload_checksum:
+        return None
+
+    algorithm, _, digest = upload_checksum.strip().partition(" ")
+    if algorithm not in TUS_CHECKSUM_ALGORITHMS:
+        raise TusError(status.HTTP_400_BAD_REQUEST, f"Unsupported checksum algorithm {algorithm}")
+
+    try:
+        return algorithm, base64.b64decode(digest.strip(), validate=True)
+    except binascii.Error:
+        raise TusError(status.HTTP_400_BAD_REQUEST, "Invalid Upload-Checksum")
+
+
+def tus_checksum_hasher(checksum: Optional[Tuple[str, bytes]]):
+    if checksum is None:
+        return None
+
+    return hashlib.new(checksum[0])
+
+
+def tus_tail_key(key: str, part_number: int) -> str:
+    """
+    Where the start of part `part_number` is kept until it is a whole part, S3 parts have a 5 MiB minimum.
+    """
+    return f"{key}.tus-tail-{part_number}"
+
+
+class TusContentHashers:
+    """
+    SHA-256 of what each upload received so far, with the offset it got to.
+
+    PATCHes of an upload handled by this process in order carry it on, the content is then not
+    read back from storage to be deduplicated. Least recently used ones are forgotten first.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[int, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def pop(self, file_id: str, offset: int):
+        with self._lock:
+            entry = self._entries.pop(file_id, None)
+
+        return entry[1] if entry is not None and entry[0] == offset else None
+
+    def put(self, file_id: str, offset: int, hasher):
+        with self._lock:
+            self._entries[file_id] = (offset, hasher)
+            self._entries.move_to_end(file_id)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@lru_cache
+def tus_content_hashers() -> TusContentHashers:
+    return TusContentHashers(TUS_CONTENT_HASHERS_MAX)
+
+
+# A lock held by another thread at fork time would never be released in the child.
+os.register_at_fork(after_in_child=tus_content_hashers.cache_clear)
+
+
+def tus_content_hasher(file_id: str, offset: int):
+    """
+    The SHA-256 of the upload up to `offset`, None when dedup is off or this process did not see it all.
+    """
+    if not settings.FILE_DEDUP_ENABLED:
+        return None
+    if offset == 0:
+        return hashlib.sha256()
+
+    return tus_content_hashers().pop(file_id, offset)
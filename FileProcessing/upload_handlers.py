@@ -0,0 +1,259 @@
+import hashlib
+import mimetypes
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+
+from FileProcessing.checksum import CHECKSUM_ALGORITHM, checksum_composite, checksum_part
+from FileProcessing.models import File
+from FileProcessing.quota import StorageQuotaExceeded, storage_release, storage_reserve
+from FileProcessing.utils import bytes_to_mib, file_generate_name, file_generate_upload_path, multipart_part_size
+from FileProcessing.storage import storage_get_backend
+from integrations.storage.base import StoragePart
+
+
+class S3StreamedFile(UploadedFile):
+    """
+    A file the upload handler already wrote to the bucket, under `storage_name`.
+
+    There is nothing to read back, `FileStandardUploadService.create` only records it.
+    """
+
+    def __init__(
+        self, *, name: str, content_type: str, size: int, file_name: str, storage_name: str, etag: str, sha256: str, checksum: str
+    ):
+        super().__init__(file=None, name=name, content_type=content_type, size=size)
+        self.file_name = file_name
+        self.storage_name = storage_name
+        self.etag = etag
+        self.sha256 = sha256
+        self.checksum = checksum
+
+    def open(self, mode=None):
+        raise ValueError("The file was streamed to S3 and cannot be reopened")
+
+    def close(self):
+        pass
+
+
+class S3MultipartWriter:
+    """
+    Writes a stream into a multipart upload of the storage backend (S3, or the memory one), `part_size` at a time.
+
+    Parts are uploaded by `concurrency` threads while the next one is received. Once they
+    are all busy `write` blocks, so at most `concurrency + 1` parts are held in memory.
+
+    Each part is sent with its SHA-256, hashed by the thread uploading it, and the object
+    storage assembled is checked against their composite checksum.
+    """
+
+    def __init__(self, key: str, *, part_size: int, concurrency: int):
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.size = 0
+
+        self.backend = storage_get_backend()
+        self.key = key
+        self.upload_id = self.backend.multipart_init(key, checksum_algorithm=CHECKSUM_ALGORITHM)
+
+        self.completed = False
+        self.futures: Dict[int, Future] = {}
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="file-upload")
+
+    def _upload_part(self, part_number: int, data: bytes) -> StoragePart:
+        try:
+            # hashlib lets go of the GIL on big buffers, parts are hashed in parallel.
+            return self.backend.multipart_upload_part(
+                self.key, self.upload_id, part_number, data, checksum_sha256=checksum_part(data)
+            )
+        finally:
+            self.slots.release()
+
+    def _submit(self, data: bytes):
+        # Fails fast instead of streaming the rest of the body for nothing.
+        for future in self.futures.values():
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+        self.slots.acquire()
+        part_number = len(self.futures) + 1
+        self.futures[part_number] = self.executor.submit(self._upload_part, part_number, data)
+
+    def write(self, data: bytes):
+        self.buffer += data
+        self.size += len(data)
+
+        while len(self.buffer) >= self.part_size:
+            # One copy out of the buffer, slicing the bytearray first would make two.
+            self._submit(bytes(memoryview(self.buffer)[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+    def complete(self) -> Tuple[str, str]:
+        """
+        Uploads what is left as the last part and completes the upload, returns the object ETag and checksum.
+        """
+        if self.buffer or not self.futures:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+
+        parts = [future.result() for _, future in sorted(self.futures.items())]
+        self.executor.shutdown()
+
+        etag = self.backend.multipart_complete(self.key, self.upload_id, parts)
+        self.completed = True
+
+        checksum = checksum_composite(part.checksum for part in parts)
+        # The object storage assembled, checked once: all the bytes received, from the parts that were sent.
+        head = self.backend.head(self.key, checksum=True)
+        if head is None or head.size != self.size or (head.checksum or checksum) != checksum:
+            self.backend.delete(self.key)
+            raise ValueError("The uploaded object does not match what was received")
+
+        return etag, checksum
+
+    def abort(self):
+        self.buffer = bytearray()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+        if not self.completed:
+            self.backend.multipart_abort(self.key, self.upload_id)
+
+
+class S3MultipartUploadHandler(FileUploadHandler):
+    """
+    Streams the `file` field of a request into an S3 multipart upload as it arrives,
+    instead of buffering it in memory or in a temporary file first.
+
+    Over FILE_MAX_SIZE, or when a part fails to upload, the upload is aborted and the rest of
+    the request body is not read. `error` and `error_status` then tell why. A body cut short (the
+    client went away) aborts it too. `discard` removes whatever was written when the request fails later on.
+
+    With a `user` (set by the view once authenticated), the request's size is reserved from their quota
+    before anything is written, and the upload is stopped past it. `FileStandardUploadService.create`
+    commits the reservation, a failed upload releases it.
+    """
+
+    field_name = "file"
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.writer: Optional[S3MultipartWriter] = None
+        self.uploaded_file: Optional[S3StreamedFile] = None
+        self.error: Optional[str] = None
+        self.error_status = 400
+        self.request_size: Optional[int] = None
+        self.user = None
+        self.reserved: Optional[int] = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.request_size = content_length
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+
+        if field_name != self.field_name or self.writer is not None:
+            return
+
+        self.max_size = int(settings.FILE_MAX_SIZE)
+        self.file_type = mimetypes.guess_type(file_name)[0] or ""
+        self.generated_file_name = file_generate_name(file_name)
+        self.storage_name = file_generate_upload_path(
+            File(file_type=self.file_type, file_name=self.generated_file_name), self.generated_file_name
+        )
+        self.file_id = self.generated_file_name.split(".")[0]
+
+        if self.user is not None:
+            # The whole body, a little more than the file it carries
+            reserved = min(self.request_size or self.max_size, self.max_size)
+            try:
+                storage_reserve(self.user, reserved, self.file_id)
+            except StorageQuotaExceeded as e:
+                self._stop(e.messages[0], status=507)
+            self.reserved = reserved
+
+        self.hasher = hashlib.sha256()
+        self.writer = S3MultipartWriter(
+            self.storage_name,
+            part_size=multipart_part_size(min(self.request_size or self.max_size, self.max_size)),
+            concurrency=settings.FILE_UPLOAD_STREAM_CONCURRENCY,
+        )
+
+        raise StopFutureHandlers()
+
+    def _stop(self, error: str, status: int = 400):
+        self.error = error
+        self.error_status = status
+        self.upload_interrupted()
+
+        raise StopUpload(connection_reset=True)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None or self.uploaded_file is not None:
+            return raw_data
+
+        if self.writer.size + len(raw_data) > self.max_size:
+            self._stop(f"File is too large. It should not exceed {bytes_to_mib(self.max_size)} MiB")
+        if self.reserved is not None and self.writer.size + len(raw_data) > self.reserved:
+            self._stop(f"Not enough storage left, {bytes_to_mib(self.reserved):.2f} MiB were reserved", status=507)
+
+        self.hasher.update(raw_data)
+        try:
+            self.writer.write(raw_data)
+        except Exception:
+            self._stop("File upload failed")
+
+    def file_complete(self, file_size):
+        if self.writer is None or self.uploaded_file is not None:
+            return None
+
+        try:
+            etag, checksum = self.writer.complete()
+        except Exception:
+            self._stop("File upload failed")
+
+        self.uploaded_file = S3StreamedFile(
+            name=self.file_name,
+            content_type=self.file_type,
+            size=file_size,
+            file_name=self.generated_file_name,
+            storage_name=self.storage_name,
+            etag=etag,
+            sha256=self.hasher.hexdigest(),
+            checksum=checksum,
+        )
+
+        return self.uploaded_file
+
+    def _release(self):
+        if self.reserved is not None:
+            self.reserved = None
+            storage_release(self.file_id)
+
+    def upload_interrupted(self):
+        if self.writer is not None and self.uploaded_file is None:
+            writer, self.writer = self.writer, None
+            writer.abort()
+        if self.uploaded_file is None:
+            self._release()
+
+    def upload_complete(self):
+        # The `file` field never completed
+        self.upload_interrupted()
+
+    def discard(self):
+        """
+        Removes the upload, finished or not, when the request fails after the body was read.
+        """
+        if self.uploaded_file is not None:
+            self.writer.backend.delete(self.writer.key)
+            self.uploaded_file = None
+            self.writer = None
+            self._release()
+        else:
+            self.upload_interrupted()
+
@@ -1,21 +1,33 @@
+from django.conf import settings
 from django.urls import include, path
 from FileProcessing.folder_views import FolderCreationView
 
 from FileProcessing.views import (
     EmptyRecycleBinView,
+    FileArchiveDownloadView,
+    FileBatchUploadApi,
     FileCopyView,
     FileDeleteView,
     FileDirectUploadFinishApi,
     FileDirectUploadLocalApi,
     FileDirectUploadStartApi,
     FileFavouriteView,
+    FileGetAsyncView,
     FileGetView,
+    FileImportApi,
+    FileImportDetailApi,
+    FileInstantUploadView,
+    FileDownloadAsyncView,
     FileDownloadView,
     FileMoveView,
     FileMultipartUploadView,
+    FilePresignView,
     FileRenameView,
     FileRestoreView,
     FileStandardUploadApi,
+    FileStreamingStatsView,
+    FileTusUploadDetailView,
+    FileTusUploadView,
     FileDetailsView,
     FileUnFavouriteView,
     FileUpdateFileViewsView,
@@ -32,7 +44,13 @@ urlpatterns = [
             (
                 [
                     path("standard/", FileStandardUploadApi.as_view(), name="standard"),
+                    path("batch/", FileBatchUploadApi.as_view(), name="batch"),
                     path('multipart/', FileMultipartUploadView.as_view(), name='MultiPartUpload'),
+                    path('instant/', FileInstantUploadView.as_view(), name='instant'),
+                    path('tus/', FileTusUploadView.as_view(), name='tus'),
+                    path('tus/<str:file_id>/', FileTusUploadDetailView.as_view(), name='tus-detail'),
+                    path('import/', FileImportApi.as_view(), name='import'),
+                    path('import/<uuid:job_id>/', FileImportDetailApi.as_view(), name='import-detail'),
                 ],
                 "upload",
             )
@@ -48,7 +66,12 @@ urlpatterns = [
     path('favourite/', FileFavouriteView.as_view(), name='FileFavourite'),
     path('unfavourite/', FileUnFavouriteView.as_view(), name='FileUnFavourite'),
     path('rename/', FileRenameView.as_view(), name='FileRename'),
-    path('get/<token>/', FileGetView.as_view(), name='FileGet'),
-    path('get/d/<token>/', FileDownloadView.as_view(), name='FileDownload'),
+    # Before get/<token>/, which would match it too
+    path('get/zip/', FileArchiveDownloadView.as_view(), name='FileArchiveDownload'),
+    path('get/presign/', FilePresignView.as_view(), name='FilePresign'),
+    # Async views hold no thread while a download is in flight, for ASGI deployments
+    path('get/<token>/', (FileGetAsyncView if settings.FILE_STREAM_ASYNC else FileGetView).as_view(), name='FileGet'),
+    path('get/d/<token>/', (FileDownloadAsyncView if settings.FILE_STREAM_ASYNC else FileDownloadView).as_view(), name='FileDownload'),
     path('updated/fileviews/', FileUpdateFileViewsView.as_view(), name='UpdatedFileViews'),
+    path('stats/streaming/', FileStreamingStatsView.as_view(), name='FileStreamingStats'),
 ]
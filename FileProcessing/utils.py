@@ -9,6 +9,8 @@ from uuid import uuid4
 from django.conf import settings
 from django.urls import reverse
 
+from integrations.aws.client import S3_MAX_PARTS, S3_MIN_PART_SIZE
+
 
 def file_generate_name(original_file_name):
     extension = pathlib.Path(original_file_name).suffix
@@ -16,6 +18,17 @@ def file_generate_name(original_file_name):
     return f"{uuid4().hex}{extension}"
 
 
+def multipart_part_size(file_size: int) -> int:
+    """
+    FILE_MULTIPART_PART_SIZE, grown (in whole MiB) when the file would not fit in S3's 10,000 parts,
+    and never under S3's 5 MiB minimum.
+    """
+    mib = 1024 * 1024
+    part_size = max(settings.FILE_MULTIPART_PART_SIZE, S3_MIN_PART_SIZE, -(-file_size // S3_MAX_PARTS))
+
+    return -(-part_size // mib) * mib
+
+
 def file_generate_upload_path(instance, filename):
     return f"files/{instance.file_type}/{instance.file_name}"
 
@@ -1,46 +1,147 @@
-import re
-import requests
-from urllib import parse
-from urllib.parse import unquote
-
-from django.http import HttpResponse, StreamingHttpResponse
+import math
+import os
+from typing import Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views import View
 from rest_framework import serializers, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.utils import timezone
 from Account.serializers import UserFullProfileSerializer
 
-from FileProcessing.models import File, UserPersonalFileToken
-from rest_framework.permissions import IsAuthenticated
+from FileProcessing.archive import zip_stream
+from FileProcessing.batch import BATCH_TAR_CONTENT_TYPES, batch_read_tar
+from FileProcessing.cache import file_cache_get, file_cache_key
+from FileProcessing.checksum import CHECKSUM_ALGORITHM
+from FileProcessing.enums import FileDeliveryMode, FileUploadStorage
+from FileProcessing.hedging import StorageDeadlineExceeded, StorageUnavailable, hedged_reader_get
+from FileProcessing.models import File, FileImportJob, MultipartUploadSession, UserPersonalFileToken
+from FileProcessing.presign import presign_cache_get
+from FileProcessing.quota import StorageQuotaExceeded
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from FileProcessing.renderers import FileRenderer
-from FileProcessing.serializers import FileDetailsSerializer, FileDetailsViewSerializer, FilesListSerializer, TokentoFileIdSerializer
+from FileProcessing.serializers import FileDetailsViewSerializer, FilesListSerializer, TokentoFileIdSerializer
 from FileProcessing.services import (
     EmptyRecycleBinservice,
+    FileArchiveService,
+    FileBatchUploadService,
     FileCopyService,
     FileDeleteService,
     FileDirectUploadService,
     FileFavouriteservice,
     FileGetService,
+    FileImportService,
+    FileInstantUploadService,
     FileMultipartUploadService,
+    FilePresignService,
     FileRenameservice,
     FileRestoreService,
     FileStandardUploadService,
+    FileTusUploadService,
     FileUpdateViewsservice,
 )
+from FileProcessing.streaming import (
+    afile_streaming_response,
+    file_conditional_response,
+    file_offload_response,
+    file_streaming_response,
+    local_file_response,
+)
+from FileProcessing.tus import (
+    TUS_CHECKSUM_ALGORITHMS,
+    TUS_EXTENSIONS,
+    TUS_PATCH_CONTENT_TYPE,
+    TUS_VERSION,
+    TusError,
+    tus_check_version,
+    tus_parse_checksum,
+    tus_parse_int,
+    tus_parse_metadata,
+)
+from FileProcessing.upload_handlers import S3MultipartUploadHandler
+from integrations.aws.client import S3_MAX_PARTS, s3_pool_stats
+from integrations.upstream.client import upstream_pool_stats
 
 class FileStandardUploadApi(APIView):
     renderer_classes = [FileRenderer]
     permission_classes = [IsAuthenticated]
-    
+
+    upload_handler = None
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Before the body is parsed: the file goes straight to storage instead of memory or a temporary file.
+        # Local storage is a disk too, Django's temporary file is as good.
+        if request.method == "POST" and settings.FILE_UPLOAD_STORAGE != FileUploadStorage.LOCAL.value:
+            self.upload_handler = S3MultipartUploadHandler(request)
+            request.upload_handlers.insert(0, self.upload_handler)
+
+        return super().initialize_request(request, *args, **kwargs)
+
     def post(self, request):
-        if 'file' not in request.FILES:
-            return Response({'errors': "File Not Found"}, status=status.HTTP_404_NOT_FOUND)
-        service = FileStandardUploadService(user=request.user, file_obj=request.FILES["file"])
-        file = service.create()
+        try:
+            if self.upload_handler is not None:
+                # Authenticated now, the body is read below
+                self.upload_handler.user = request.user
+            files = request.FILES
+            if self.upload_handler is not None and self.upload_handler.error:
+                return Response({'errors': self.upload_handler.error}, status=self.upload_handler.error_status)
+            if 'file' not in files:
+                return Response({'errors': "File Not Found"}, status=status.HTTP_404_NOT_FOUND)
+            service = FileStandardUploadService(user=request.user, file_obj=files["file"])
+            file = service.create()
+        except StorageQuotaExceeded as e:
+            if self.upload_handler is not None:
+                self.upload_handler.discard()
+            return Response({'errors': e.messages}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+        except BaseException:
+            if self.upload_handler is not None:
+                self.upload_handler.discard()
+            raise
 
         return Response(data={"id": file.personalfiletoken}, status=status.HTTP_201_CREATED)
 
 
+class FileBatchUploadApi(APIView):
+    """
+    Many small files at once: `files` fields of a multipart body, or a tar stream as the body.
+
+    Answers with a result per file, in order: its personal file token, or why it failed.
+    """
+    renderer_classes = [FileRenderer]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        service = FileBatchUploadService(request.user)
+
+        try:
+            if request.content_type.split(";")[0].strip() in BATCH_TAR_CONTENT_TYPES:
+                results = service.upload(batch_read_tar(request.stream))
+            else:
+                files = request.FILES.getlist("files")
+                if not files:
+                    return Response({'errors': "File Not Found"}, status=status.HTTP_404_NOT_FOUND)
+                results = service.upload(files)
+        except StorageQuotaExceeded as e:
+            return Response({'errors': e.messages}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+        except ValidationError as e:
+            return Response({'errors': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not results:
+            return Response({'errors': "File Not Found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Some files failed, the others were uploaded
+        if any("errors" in result for result in results):
+            return Response(data={"files": results}, status=status.HTTP_207_MULTI_STATUS)
+
+        return Response(data={"files": results}, status=status.HTTP_201_CREATED)
+
+
 class FileDirectUploadStartApi(APIView):
     renderer_classes = [FileRenderer]
     permission_classes = [IsAuthenticated]
@@ -48,13 +149,17 @@ class FileDirectUploadStartApi(APIView):
     class InputSerializer(serializers.Serializer):
         file_name = serializers.CharField()
         file_type = serializers.CharField()
+        file_size = serializers.IntegerField(min_value=1)
 
     def post(self, request, *args, **kwargs):
         serializer = self.InputSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         service = FileDirectUploadService(request.user)
-        presigned_data = service.start(**serializer.validated_data)
+        try:
+            presigned_data = service.start(**serializer.validated_data)
+        except StorageQuotaExceeded as e:
+            return Response({'errors': e.messages}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
 
         return Response(data=presigned_data)
 
@@ -64,12 +169,15 @@ class FileDirectUploadLocalApi(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request, file_id):
-        file = get_object_or_404(File, fileID=file_id)
+        file = get_object_or_404(File, fileID=file_id, uploaded_by=request.user, upload_finished_at__isnull=True)
 
         file_obj = request.FILES["file"]
 
         service = FileDirectUploadService(request.user)
-        file = service.upload_local(file=file, file_obj=file_obj)
+        try:
+            file = service.upload_local(file=file, file_obj=file_obj)
+        except ValidationError as e:
+            return Response({'errors': e.messages}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({"id": file.fileID})
 
@@ -87,12 +195,20 @@ class FileDirectUploadFinishApi(APIView):
 
         file_id = serializer.validated_data["file_id"]
 
-        file = get_object_or_404(File, fileID=file_id)
+        file = get_object_or_404(File, fileID=file_id, uploaded_by=request.user, upload_finished_at__isnull=True)
 
         service = FileDirectUploadService(request.user)
-        service.finish(file=file)
-
-        return Response({"id": file.fileID})
+        try:
+            token = service.finish(file=file)
+        except File.DoesNotExist:
+            # Finished by a concurrent request
+            return Response({'errors': "Upload Not Found"}, status=status.HTTP_404_NOT_FOUND)
+        except StorageQuotaExceeded as e:
+            return Response({'errors': e.messages}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+        except ValidationError as e:
+            return Response({'errors': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"id": token.personalfiletoken})
     
 class FileDetailsView(APIView):
     renderer_classes = [FileRenderer]
@@ -169,12 +285,32 @@ class FileMultipartUploadView(APIView):
         file_name = serializers.CharField()
         file_type = serializers.CharField()
         file_size = serializers.IntegerField()
+        # Every part is then sent with a checksum, S3 verifies each and the assembled object
+        checksum_algorithm = serializers.ChoiceField(choices=[CHECKSUM_ALGORITHM], required=False)
 
     class FileUploadSerializer(serializers.Serializer):
         file_id = serializers.CharField()
-        part_number = serializers.IntegerField()
+        part_number = serializers.IntegerField(min_value=1, max_value=S3_MAX_PARTS)
+        # Base64 SHA-256 of the part, as the client computed it
+        checksum_sha256 = serializers.RegexField(r"^[A-Za-z0-9+/]{43}=$", required=False)
 
     class FileFinishSerializer(serializers.Serializer):
+        class FilePartSerializer(serializers.Serializer):
+            part_number = serializers.IntegerField(min_value=1, max_value=S3_MAX_PARTS)
+            etag = serializers.CharField()
+
+        file_id = serializers.CharField()
+        # Reported by clients which uploaded the parts straight to S3
+        parts = serializers.ListField(child=FilePartSerializer(), required=False)
+
+    class FilePresignSerializer(serializers.Serializer):
+        file_id = serializers.CharField()
+        part_numbers = serializers.ListField(
+            child=serializers.IntegerField(min_value=1, max_value=S3_MAX_PARTS),
+            min_length=1,
+        )
+
+    class FileStatusSerializer(serializers.Serializer):
         file_id = serializers.CharField()
 
     def post(self, request, *args, **kwargs):
@@ -183,7 +319,10 @@ class FileMultipartUploadView(APIView):
             serializer.is_valid(raise_exception=True)
 
             service = FileMultipartUploadService(request.user)
-            fileID = service.start(**serializer.validated_data)
+            try:
+                fileID = service.start(**serializer.validated_data)
+            except StorageQuotaExceeded as e:
+                return Response({'errors': e.messages}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
 
             return Response(data=fileID, status=status.HTTP_201_CREATED)
         
@@ -194,9 +333,40 @@ class FileMultipartUploadView(APIView):
                 return Response({'errors': "File Not Found"}, status=status.HTTP_404_NOT_FOUND)
 
             service = FileMultipartUploadService(user=request.user)
-            service.upload(**serializer.validated_data, file_obj=request.FILES['file'])
+            try:
+                service.upload(**serializer.validated_data, file_obj=request.FILES['file'])
+            except MultipartUploadSession.DoesNotExist:
+                return Response({'errors': "Upload Not Found"}, status=status.HTTP_404_NOT_FOUND)
+            except ValidationError as e:
+                return Response({'errors': e.messages}, status=status.HTTP_400_BAD_REQUEST)
 
             return Response(status=status.HTTP_202_ACCEPTED)
+
+        elif request.headers['x-req-type'] == "presign":
+            serializer = self.FilePresignSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+
+            service = FileMultipartUploadService(user=request.user)
+            try:
+                presigned_data = service.presign(**serializer.validated_data)
+            except MultipartUploadSession.DoesNotExist:
+                return Response({'errors': "Upload Not Found"}, status=status.HTTP_404_NOT_FOUND)
+            except ValidationError as e:
+                return Response({'errors': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response(data=presigned_data, status=status.HTTP_200_OK)
+
+        elif request.headers['x-req-type'] == "status":
+            serializer = self.FileStatusSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+
+            service = FileMultipartUploadService(user=request.user)
+            try:
+                upload_status = service.status(**serializer.validated_data)
+            except MultipartUploadSession.DoesNotExist:
+                return Response({'errors': "Upload Not Found"}, status=status.HTTP_404_NOT_FOUND)
+
+            return Response(data=upload_status, status=status.HTTP_200_OK)
         
         elif request.headers['x-req-type'] == "finish":
             serializer = self.FileFinishSerializer(data=request.data)
@@ -207,176 +377,431 @@ class FileMultipartUploadView(APIView):
             file = get_object_or_404(File, fileID=file_id)
 
             service = FileMultipartUploadService(user=request.user)
-            finish_status = service.finish(**serializer.validated_data, file=file)
-
-            if finish_status:
-                return Response(data={"id": finish_status.personalfiletoken}, status=status.HTTP_200_OK)
-            else :
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-
-class RangeFileWrapper:
-    def __init__(self, response, blksize=8192, offset=0, length=None):
-        self.response = response
-        self.blksize = blksize
-        self.offset = offset
-        self.remaining = length
-
-        # Move to the specified offset
-        response.read(offset)
-
-    def close(self):
-        # HTTPResponse objects need to be explicitly closed
-        self.response.close()
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.remaining is None:
-            # If remaining is None, we're reading the entire file.
-            data = self.response.read(self.blksize)
-            if data:
-                return data
-            raise StopIteration()
-        else:
-            if self.remaining <= 0:
-                raise StopIteration()
-            data = self.response.read(min(self.blksize, self.remaining))
-            if not data:
-                raise StopIteration()
-            self.remaining -= len(data)
-            return data
+            try:
+                token = service.finish(**serializer.validated_data, file=file)
+            except MultipartUploadSession.DoesNotExist:
+                return Response({'errors': "Upload Not Found"}, status=status.HTTP_404_NOT_FOUND)
+            except StorageQuotaExceeded as e:
+                return Response({'errors': e.messages}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+            except ValidationError as e:
+                return Response({'errors': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response(data={"id": token.personalfiletoken}, status=status.HTTP_200_OK)
+
+class FileInstantUploadView(APIView):
+    """
+    Upload by content hash: "check" whether the content is here already, then "claim" it
+    with the proof of possession, without sending the bytes.
+    """
+    renderer_classes = [FileRenderer]
+    permission_classes = [IsAuthenticated]
 
+    class FileCheckSerializer(serializers.Serializer):
+        sha256 = serializers.RegexField(r"^[0-9a-fA-F]{64}$")
+        file_size = serializers.IntegerField(min_value=0)
 
-class FileWrapper:
-    """Wrapper to convert file-like objects to iterables"""
+    class FileClaimSerializer(serializers.Serializer):
+        challenge = serializers.CharField()
+        proof = serializers.CharField()
+        file_name = serializers.CharField()
 
-    def __init__(self, filelike, blksize=8192):
-        self.filelike = filelike
-        self.blksize = blksize
-        if hasattr(filelike, 'close'):
-            self.close = filelike.close
+    def post(self, request, *args, **kwargs):
+        req_type = request.headers.get('x-req-type')
 
-    def __iter__(self):
-        return self
+        if req_type == "check":
+            serializer = self.FileCheckSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
 
-    def __next__(self):
-        data = self.filelike.read(self.blksize)
-        if data:
-            return data
-        raise StopIteration
+            service = FileInstantUploadService(request.user)
+            return Response(data=service.check(**serializer.validated_data), status=status.HTTP_200_OK)
 
-    def close(self):
-        if hasattr(self.filelike, 'close'):
-            self.filelike.close()
+        elif req_type == "claim":
+            serializer = self.FileClaimSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
 
-range_re = re.compile(r'bytes\s*=\s*(\d+)\s*-\s*(\d*)', re.I)
+            service = FileInstantUploadService(request.user)
+            try:
+                token = service.claim(**serializer.validated_data)
+            except StorageQuotaExceeded as e:
+                return Response({'errors': e.messages}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+            except ValidationError as e:
+                return Response({'errors': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response(data={"id": token.personalfiletoken}, status=status.HTTP_201_CREATED)
+
+        return Response({'errors': "Unknown x-req-type"}, status=status.HTTP_400_BAD_REQUEST)
+
+class FileTusUploadMixin:
+    """
+    tus 1.0.0 (https://tus.io/protocols/resumable-upload): protocol headers on every response,
+    Tus-Resumable checked on every request but OPTIONS.
+    """
 
-class FileGetView(APIView):
     renderer_classes = [FileRenderer]
+    permission_classes = [IsAuthenticated]
 
-    def get(self, request, token):
+    def get_permissions(self):
+        # Clients discover what the server supports before authenticating.
+        if self.request.method == "OPTIONS":
+            return []
+
+        return super().get_permissions()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        if request.method != "OPTIONS":
+            tus_check_version(request.headers.get("Tus-Resumable"))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        response["Tus-Resumable"] = TUS_VERSION
+        if response.status_code == status.HTTP_412_PRECONDITION_FAILED:
+            response["Tus-Version"] = TUS_VERSION
+
+        return response
+
+    def options(self, request, *args, **kwargs):
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT, headers={
+            "Tus-Version": TUS_VERSION,
+            "Tus-Extension": TUS_EXTENSIONS,
+            "Tus-Max-Size": str(settings.FILE_MAX_SIZE),
+            "Tus-Checksum-Algorithm": ",".join(TUS_CHECKSUM_ALGORITHMS),
+        })
+
+    def upload_headers(self, file: File, session: Optional[MultipartUploadSession], token=None) -> Dict[str, str]:
+        headers = {
+            "Upload-Offset": str(file.file_size if session is None else session.offset),
+            "Upload-Length": str(file.file_size),
+            "Cache-Control": "no-store",
+        }
+
+        # Complete: the personal file token, like the other upload APIs answer with
+        if session is None:
+            if token is None:
+                token = UserPersonalFileToken.objects.filter(file_id=file, uploaded_by=self.request.user).first()
+            if token is not None:
+                headers["X-File-Token"] = token.personalfiletoken
+
+        return headers
+
+
+class FileTusUploadView(FileTusUploadMixin, APIView):
+    """
+    Creation: `Upload-Length` and `Upload-Metadata` (filename, filetype), answers with the upload Location.
+    """
+
+    def post(self, request):
+        if "Upload-Defer-Length" in request.headers:
+            raise TusError(status.HTTP_400_BAD_REQUEST, "Upload-Defer-Length is not supported")
+
+        service = FileTusUploadService(request.user)
+        file = service.create(
+            upload_length=tus_parse_int(request.headers.get("Upload-Length"), "Upload-Length"),
+            metadata=tus_parse_metadata(request.headers.get("Upload-Metadata")),
+        )
+        file, session = service.get(file.fileID)
+
+        location = request.build_absolute_uri(reverse("upload:tus-detail", kwargs={"file_id": file.fileID}))
+        return HttpResponse(status=status.HTTP_201_CREATED, headers={"Location": location, **self.upload_headers(file, session)})
+
+
+class FileTusUploadDetailView(FileTusUploadMixin, APIView):
+    """
+    HEAD for the offset to resume from, PATCH to append, DELETE to terminate.
+    """
+
+    def head(self, request, file_id):
+        try:
+            file, session = FileTusUploadService(request.user).get(file_id)
+        except File.DoesNotExist:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+        return HttpResponse(status=status.HTTP_200_OK, headers=self.upload_headers(file, session))
+
+    def patch(self, request, file_id):
+        if request.content_type != TUS_PATCH_CONTENT_TYPE:
+            raise TusError(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type should be {TUS_PATCH_CONTENT_TYPE}")
+
+        try:
+            file, session, token = FileTusUploadService(request.user).append(
+                file_id=file_id,
+                offset=tus_parse_int(request.headers.get("Upload-Offset"), "Upload-Offset"),
+                body=request.stream,
+                checksum=tus_parse_checksum(request.headers.get("Upload-Checksum")),
+            )
+        except File.DoesNotExist:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT, headers=self.upload_headers(file, session, token))
+
+    def delete(self, request, file_id):
+        try:
+            FileTusUploadService(request.user).terminate(file_id)
+        except File.DoesNotExist:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+class FileImportApi(APIView):
+    """
+    Imports a file from a URL: the server fetches it in the background, poll the job for progress.
+    """
+    renderer_classes = [FileRenderer]
+    permission_classes = [IsAuthenticated]
+
+    class InputSerializer(serializers.Serializer):
+        url = serializers.URLField(max_length=2048)
+        file_name = serializers.CharField(max_length=255, required=False)
+
+    def post(self, request):
+        serializer = self.InputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            job = FileImportService(request.user).start(**serializer.validated_data)
+        except ValidationError as e:
+            return Response({'errors': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(data=job, status=status.HTTP_202_ACCEPTED)
+
+
+class FileImportDetailApi(APIView):
+    renderer_classes = [FileRenderer]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = FileImportService(request.user).status(job_id)
+        except FileImportJob.DoesNotExist:
+            return Response({'errors': "Import Not Found"}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(data=job, status=status.HTTP_200_OK)
+
+class FileStreamMixin:
+    """
+    Token checks, validators and delivery shared by `get/<token>/` and `get/d/<token>/`.
+    """
+
+    as_attachment = False
+
+    def stream(self, request, token):
         # onhold
         # file_id = request.headers["x-header-token"]
         try:
-            file = TokentoFileIdSerializer(UserPersonalFileToken.objects.get(personalfiletoken=token)).data
+            # One indexed lookup resolves the token, the file and its validators.
+            usertoken = UserPersonalFileToken.objects.select_related('file_id').get(personalfiletoken=token)
+            file = TokentoFileIdSerializer(usertoken).data
             if file['is_delete_init']:
                 return Response({'msg': "File Deleted by Owner"}, status=status.HTTP_400_BAD_REQUEST)
             else:
-                data = File.objects.get(fileID=file['file_id'])
-                filedetails = FileDetailsSerializer(data).data
-
-                if file['change_file_name'] == None:
-                    filename=filedetails["original_file_name"]
-                else:
-                    filename=file["change_file_name"]
-
-                range_header = request.META.get('HTTP_RANGE', '').strip()
-                range_match = range_re.match(range_header)
-
-                # service = FileGetService(user=request.user)
-                # url = service.geturl(file_path= filedetails['file'])
-
-                # url = unquote(url.split("/", 3)[-1])
-
-                # __parsed = parse.urlparse(unquote(url.split("/", 3)[-1]))
-                # _parsed = parse.urlparse(url)
-                # final = f"{_parsed.scheme}://{_parsed.netloc}/{__parsed.path.lstrip('/')}?{_parsed.query}"
-
-                streaming_body = requests.get(url=filedetails['file'], stream=True)
-                streaming_body.raise_for_status()
-
-                if streaming_body is None:
-                    return Response({'Error': "Error Retreiving the File"}, status=500)
-
-                size = int(streaming_body.headers["Content-length"])
-                if range_match:
-                    first_byte, last_byte = range_match.groups()
-                    first_byte = int(first_byte) if first_byte else 0
-                    last_byte = int(last_byte) if last_byte else size - 1
-                    if last_byte >= size:
-                        last_byte = size - 1
-                    length = last_byte - first_byte + 1
-                    response = StreamingHttpResponse(RangeFileWrapper(streaming_body.raw, offset=first_byte, length=length), status=206, content_type=filedetails['file_type'])
-                    response['Content-Length'] = str(length)
-                    response['Content-Range'] = 'bytes %s-%s/%s' % (first_byte, last_byte, size)
-                else:
-                    response = StreamingHttpResponse(FileWrapper(streaming_body.raw), content_type=filedetails['file_type'])
-                    response['Content-Length'] = str(size)
-
-                response['Access-Control-Expose-Headers'] = 'Content-Disposition,Content-Length,Content-Type'
-                response['Content-Disposition'] = f'inline; filename={filename}'
-                response['Accept-Ranges'] = 'bytes'
+                response = self.deliver(request, usertoken)
+                if response is not None:
+                    return response
+
+                return file_streaming_response(**self.streaming_options(request, usertoken))
+        except StorageDeadlineExceeded:
+            return Response({'msg': "Storage Timed Out"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except StorageUnavailable as e:
+            response = Response({'msg': "Storage Unavailable"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = str(math.ceil(e.retry_after))
+            return response
+        except Exception as e:
+            return Response({'msg': "File Not Found"}, status=status.HTTP_404_NOT_FOUND)
+
+    def file_name(self, usertoken: UserPersonalFileToken) -> str:
+        if usertoken.change_file_name == None:
+            return usertoken.file_id.original_file_name
+
+        return usertoken.change_file_name
+
+    def deliver(self, request, usertoken: UserPersonalFileToken) -> Optional[HttpResponse]:
+        """
+        Every response but proxying storage: revalidations, redirects, offloading and local files.
+        None when the bytes have to be proxied, see `streaming_options`.
+        """
+        data = usertoken.file_id
+        filename = self.file_name(usertoken)
+        etag, last_modified = data.strong_etag, data.last_modified
+
+        conditional_response = file_conditional_response(request, etag=etag, last_modified=last_modified)
+        if conditional_response is not None:
+            return conditional_response
+
+        service = FileGetService(user=request.user)
+        delivery_mode = service.delivery_mode(usertoken)
+
+        if delivery_mode == FileDeliveryMode.REDIRECT:
+            url = service.geturl(
+                file_path=data.file.name,
+                file_name=filename,
+                file_type=data.file_type,
+                as_attachment=self.as_attachment,
+            )
+            response = HttpResponseRedirect(url)
+            # The presigned URL expires, the redirect must not outlive it in any cache.
+            response['Cache-Control'] = 'private, no-store'
+            return response
+
+        if delivery_mode in (FileDeliveryMode.X_ACCEL_REDIRECT, FileDeliveryMode.X_SENDFILE):
+            # Checks and headers are done here, the web server moves the bytes.
+            return file_offload_response(
+                header='X-Accel-Redirect' if delivery_mode == FileDeliveryMode.X_ACCEL_REDIRECT else 'X-Sendfile',
+                location=service.offload_location(
+                    delivery_mode,
+                    file=data,
+                    file_name=filename,
+                    file_type=data.file_type,
+                    as_attachment=self.as_attachment,
+                ),
+                content_type=data.file_type,
+                filename=filename,
+                disposition='attachment' if self.as_attachment else 'inline',
+                etag=etag,
+                last_modified=last_modified,
+            )
+
+        if settings.FILE_UPLOAD_STORAGE == FileUploadStorage.LOCAL.value:
+            # Served straight from disk with sendfile, no cache or storage request involved.
+            return local_file_response(
+                path=data.file.path,
+                content_type=data.file_type,
+                filename=filename,
+                disposition='attachment' if self.as_attachment else 'inline',
+                range_header=request.META.get('HTTP_RANGE', ''),
+                if_range=request.META.get('HTTP_IF_RANGE', ''),
+                etag=etag,
+                last_modified=last_modified,
+            )
+
+        return None
+
+    def streaming_options(self, request, usertoken: UserPersonalFileToken) -> Dict:
+        """
+        Arguments of `file_streaming_response` (and `afile_streaming_response`) proxying the file.
+        """
+        data = usertoken.file_id
+        etag = data.strong_etag
+
+        return dict(
+            storage_key=data.file.name,
+            content_type=data.file_type,
+            filename=self.file_name(usertoken),
+            file_size=data.file_size,
+            disposition='attachment' if self.as_attachment else 'inline',
+            range_header=request.META.get('HTTP_RANGE', ''),
+            if_range=request.META.get('HTTP_IF_RANGE', ''),
+            etag=etag,
+            last_modified=data.last_modified,
+            cache_key=file_cache_key(data.fileID, etag),
+            # Downloads are the long sequential reads worth splitting into parallel ranges.
+            parallel=self.as_attachment,
+        )
+
+class FileAsyncStreamMixin(FileStreamMixin):
+    """
+    `get/<token>/` and `get/d/<token>/` for ASGI deployments (FILE_STREAM_ASYNC).
+
+    The token is resolved with the async ORM and storage is proxied with async reads, so a slow
+    download holds a socket and a chunk of memory, but no thread: one event loop serves thousands.
+    Other deliveries are quick and run `deliver` in a worker thread.
+    """
+
+    async def stream(self, request, token):
+        try:
+            usertoken = await UserPersonalFileToken.objects.select_related('file_id').aget(personalfiletoken=token)
+            if usertoken.is_delete_init:
+                return JsonResponse({'msg': "File Deleted by Owner"}, status=status.HTTP_400_BAD_REQUEST)
 
+            response = await sync_to_async(self.deliver, thread_sensitive=False)(request, usertoken)
+            if response is not None:
                 return response
+
+            return await afile_streaming_response(**self.streaming_options(request, usertoken))
+        except StorageDeadlineExceeded:
+            return JsonResponse({'msg': "Storage Timed Out"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except StorageUnavailable as e:
+            return JsonResponse(
+                {'msg': "Storage Unavailable"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(math.ceil(e.retry_after))},
+            )
         except Exception as e:
-            return Response({'msg': "File Not Found"}, status=status.HTTP_404_NOT_FOUND)
+            return JsonResponse({'msg': "File Not Found"}, status=status.HTTP_404_NOT_FOUND)
 
-class FileDownloadView(APIView):
+class FileGetView(FileStreamMixin, APIView):
     renderer_classes = [FileRenderer]
 
     def get(self, request, token):
-        # onhold
-        # file_id = request.headers["x-header-token"]
-        try:
-            file = TokentoFileIdSerializer(UserPersonalFileToken.objects.get(personalfiletoken=token)).data
-            if file['is_delete_init']:
-                return Response({'msg': "File Deleted by Owner"}, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                data = File.objects.get(fileID=file['file_id'])
-                filedetails = FileDetailsSerializer(data).data
+        return self.stream(request, token)
 
-                if file['change_file_name'] == None:
-                    filename=filedetails["original_file_name"]
-                else:
-                    filename=file["change_file_name"]
+class FileDownloadView(FileStreamMixin, APIView):
+    renderer_classes = [FileRenderer]
+    as_attachment = True
 
-                # service = FileGetService(user=request.user)
-                # url = service.geturl(file_path= filedetails['file'])
+    def get(self, request, token):
+        return self.stream(request, token)
 
-                # url = unquote(url.split("/", 3)[-1])
+class FileGetAsyncView(FileAsyncStreamMixin, View):
+    async def get(self, request, token):
+        return await self.stream(request, token)
 
-                # __parsed = parse.urlparse(unquote(url.split("/", 3)[-1]))
-                # _parsed = parse.urlparse(url)
-                # final = f"{_parsed.scheme}://{_parsed.netloc}/{__parsed.path.lstrip('/')}?{_parsed.query}"
+class FileDownloadAsyncView(FileAsyncStreamMixin, View):
+    as_attachment = True
 
-                streaming_body = requests.get(url=filedetails['file'], stream=True)
-                streaming_body.raise_for_status()
+    async def get(self, request, token):
+        return await self.stream(request, token)
+    
+class FilePresignView(APIView):
+    """
+    Presigned URLs of many files in one request, for pages showing lots of them at once.
+    """
+    renderer_classes = [FileRenderer]
+    permission_classes = [IsAuthenticated]
 
-                if streaming_body is None:
-                    return Response({'Error': "Error Retreiving the File"}, status=500)
+    class FilePresignSerializer(serializers.Serializer):
+        file_token = serializers.ListField(
+            child=serializers.CharField(), min_length=1, max_length=settings.FILE_PRESIGN_BATCH_MAX
+        )
+        as_attachment = serializers.BooleanField(default=False)
 
-                response = StreamingHttpResponse(streaming_body, status=200, content_type=filedetails['file_type'])
-            
-                response['Content-Length'] = streaming_body.headers["Content-length"]
-                response['Access-Control-Expose-Headers'] = 'Content-Disposition,Content-Length,Content-Type'
-                response['Content-Disposition'] = f'attachment; filename={filename}'
-                response['Accept-Ranges'] = 'bytes'
+    def post(self, request, format=None):
+        serializer = self.FilePresignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            data = FilePresignService(user=request.user).presign(**serializer.validated_data)
+        except ValidationError as e:
+            return Response({'errors': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = Response(data=data, status=status.HTTP_200_OK)
+        # The URLs expire, and are only for this user.
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+class FileArchiveDownloadView(APIView):
+    renderer_classes = [FileRenderer]
+    permission_classes = [IsAuthenticated]
+
+    class FileArchiveSerializer(serializers.Serializer):
+        file_token = serializers.ListField(child=serializers.CharField(), min_length=1)
+
+    def post(self, request, format=None):
+        serializer = self.FileArchiveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        service = FileArchiveService(user=request.user)
+        data, archive_status = service.archiveFiles(**serializer.validated_data)
+        if not archive_status:
+            return Response(data={"error": data}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Built while it streams, the length is unknown up front.
+        response = StreamingHttpResponse(zip_stream(data), content_type='application/zip')
+        response['Access-Control-Expose-Headers'] = 'Content-Disposition,Content-Type'
+        response['Content-Disposition'] = f'attachment; filename=DriveNow-{timezone.localtime():%Y%m%d-%H%M%S}.zip'
+        return response
 
-                return response
-        except Exception as e:
-            return Response({'msg': "File Not Found"}, status=status.HTTP_404_NOT_FOUND)
-    
 class FileDeleteView(APIView):
     renderer_classes = [FileRenderer]
     permission_classes = [IsAuthenticated]
@@ -513,4 +938,19 @@ class FileRenameView(APIView):
         if rename_status:
             return Response(data={"msg": data},status=status.HTTP_200_OK)
         else:
-            return Response(data={"error": data},status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response(data={"error": data},status=status.HTTP_400_BAD_REQUEST)
+
+class FileStreamingStatsView(APIView):
+    renderer_classes = [FileRenderer]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        # Counters are per worker process, the pid tells which worker answered.
+        return Response(data={
+            "pid": os.getpid(),
+            "upstream_pool": upstream_pool_stats.snapshot(),
+            "s3_pool": s3_pool_stats.snapshot(),
+            "presign_cache": presign_cache_get().snapshot() if presign_cache_get() else None,
+            "file_cache": file_cache_get().stats.snapshot() if file_cache_get() else None,
+            "storage_reads": hedged_reader_get().snapshot(),
+        }, status=status.HTTP_200_OK)
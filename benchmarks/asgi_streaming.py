@@ -0,0 +1,177 @@
+"""
+Concurrent slow downloads one worker process holds: the sync views of a WSGI gthread worker
+vs the async views (FILE_STREAM_ASYNC) on an ASGI event loop.
+
+Storage is a separate asyncio process sending every object at a fixed rate per connection,
+so each download lasts `size / rate` seconds however many run at once, like a slow client would.
+The WSGI worker is a pool of `threads` threads running file_streaming_response to the end,
+the ASGI one a single event loop running afile_streaming_response for every client at once.
+
+    python benchmarks/asgi_streaming.py [clients, default 500] [KiB per download, default 64] [KiB/s per stream, default 64] [WSGI threads, default 32]
+"""
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def serve_storage(size, rate):
+    """The storage process: every GET gets `size` bytes, at `rate` bytes per second."""
+    tick = 0.25
+    chunk = b"x" * max(int(rate * tick), 1)
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                writer.write(
+                    f"HTTP/1.1 200 OK\r\nContent-Length: {size}\r\nContent-Type: application/octet-stream\r\n\r\n".encode()
+                )
+                for start in range(0, size, len(chunk)):
+                    writer.write(chunk[:size - start])
+                    await writer.drain()
+                    await asyncio.sleep(tick)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=4096)
+    print(server.sockets[0].getsockname()[1], flush=True)
+    await server.serve_forever()
+
+
+if len(sys.argv) > 1 and sys.argv[1] == "--storage":
+    asyncio.run(serve_storage(int(sys.argv[2]), int(sys.argv[3])))
+    sys.exit()
+
+clients = int(sys.argv[1] if len(sys.argv) > 1 else 500)
+size = int(sys.argv[2] if len(sys.argv) > 2 else 64) * 1024
+rate = int(sys.argv[3] if len(sys.argv) > 3 else 64) * 1024
+threads = int(sys.argv[4] if len(sys.argv) > 4 else 32)
+
+import django
+from django.conf import settings
+
+settings.configure(
+    FILE_STREAM_CHUNK_SIZE=262144,
+    FILE_PARALLEL_DOWNLOAD_ENABLED=False,
+    UPSTREAM_POOL_CONNECTIONS=1,
+    UPSTREAM_POOL_MAXSIZE=threads,
+    UPSTREAM_POOL_TIMEOUT=600,
+    UPSTREAM_CONNECT_TIMEOUT=10,
+    UPSTREAM_READ_TIMEOUT=30,
+    UPSTREAM_MAX_RETRIES=0,
+    UPSTREAM_RETRY_BACKOFF=0,
+    UPSTREAM_ASYNC_MAX_CONNECTIONS=clients,
+)
+django.setup()
+
+from FileProcessing.storage import storage_use_backend
+from FileProcessing.streaming import afile_streaming_response, file_streaming_response
+from integrations.storage.s3 import S3StorageBackend
+
+RESPONSE_OPTIONS = dict(
+    storage_key="object", content_type="application/octet-stream", filename="bench.bin", file_size=size, disposition="inline"
+)
+
+
+class Streams:
+    """Downloads in flight, the threads running them, and when each one got its first byte."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.max_threads = 0
+        self.first_bytes = []
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.max_threads = max(self.max_threads, threading.active_count())
+
+    def first_byte(self, waited):
+        with self._lock:
+            self.first_bytes.append(waited)
+
+    def done(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def wsgi(streams, started):
+    def download():
+        streams.start()
+        response = file_streaming_response(**RESPONSE_OPTIONS)
+        transferred = 0
+        for chunk in response:
+            if not transferred:
+                streams.first_byte(time.perf_counter() - started)
+            transferred += len(chunk)
+        response.close()
+        streams.done()
+        assert transferred == size
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(download) for _ in range(clients)]:
+            future.result()
+
+
+def asgi(streams, started):
+    async def download():
+        streams.start()
+        response = await afile_streaming_response(**RESPONSE_OPTIONS)
+        transferred = 0
+        async for chunk in response:
+            if not transferred:
+                streams.first_byte(time.perf_counter() - started)
+            transferred += len(chunk)
+        streams.done()
+        assert transferred == size
+
+    async def main():
+        await asyncio.gather(*(download() for _ in range(clients)))
+
+    asyncio.run(main())
+
+
+def run(name, worker):
+    streams = Streams()
+    started = time.perf_counter()
+
+    worker(streams, started)
+
+    wall = time.perf_counter() - started
+    first_bytes = sorted(streams.first_bytes)
+    print(
+        f"{name:<6} {clients / wall:>8.1f} downloads/s {streams.max_in_flight:>6} max concurrent streams"
+        f" {statistics.median(first_bytes):>7.2f} s p50 / {first_bytes[int(len(first_bytes) * 0.99) - 1]:>6.2f} s p99 first byte"
+        f" {streams.max_threads:>4} threads"
+    )
+
+
+def main():
+    storage = subprocess.Popen(
+        [sys.executable, __file__, "--storage", str(size), str(rate)], stdout=subprocess.PIPE, text=True
+    )
+    try:
+        port = int(storage.stdout.readline())
+        storage_use_backend(S3StorageBackend(object_url=lambda key: f"http://127.0.0.1:{port}/{key}"))
+
+        print(f"{clients} clients, {size // 1024} KiB at {rate // 1024} KiB/s each ({size / rate:.1f} s per download)")
+        run("wsgi", wsgi)
+        run("asgi", asgi)
+    finally:
+        storage.terminate()
+
+
+if __name__ == "__main__":
+    main()
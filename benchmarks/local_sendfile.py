@@ -0,0 +1,106 @@
+"""
+CPU cost of serving local-storage files: the Python iterator path vs sendfile.
+
+Each response is written to a TCP socket drained by a separate process, the way
+a WSGI server would. The sendfile path mimics gunicorn's `wsgi.file_wrapper`:
+offset from the fd position, count from Content-Length, one `socket.sendfile`.
+
+    python benchmarks/local_sendfile.py [total MiB, default 2048]
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+settings.configure(FILE_STREAM_CHUNK_SIZE=262144)
+django.setup()
+
+from django.http import StreamingHttpResponse
+
+from FileProcessing.streaming import FileStreamWrapper, local_file_response
+
+FILE_SIZE = 256 * 1024 * 1024
+
+DRAIN = """
+import socket, sys
+server = socket.create_server(("127.0.0.1", 0))
+print(server.getsockname()[1], flush=True)
+conn, _ = server.accept()
+while conn.recv_into(bytearray(1048576)):
+    pass
+"""
+
+
+def iterator_path(path, range_header):
+    # What local files went through before: the generic wrapper, chunk by chunk.
+    return StreamingHttpResponse(FileStreamWrapper(open(path, "rb")))
+
+
+def sendfile_path(path, range_header):
+    return local_file_response(
+        path=path, content_type="application/octet-stream", filename="bench.bin",
+        disposition="attachment", range_header=range_header,
+    )
+
+
+def write_response(sock, response):
+    filelike = getattr(response, "file_to_stream", None)
+
+    if filelike is None:
+        sent = 0
+        for chunk in response:
+            sock.sendall(chunk)
+            sent += len(chunk)
+        response.close()
+        return sent
+
+    fileno = filelike.fileno()
+    offset = os.lseek(fileno, 0, os.SEEK_CUR)
+    count = int(response["Content-Length"])
+    sent = sock.sendfile(filelike, offset=offset, count=count)
+    response.close()
+    return sent
+
+
+def run(name, open_response, path, sock, total, range_header=""):
+    transferred = 0
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+
+    while transferred < total:
+        transferred += write_response(sock, open_response(path, range_header))
+
+    wall, cpu = time.perf_counter() - wall_started, time.process_time() - cpu_started
+    gib = transferred / 1024 ** 3
+    print(f"{name:<32} {transferred / 1024 ** 2 / wall:>9.1f} MB/s {cpu / gib:>9.3f} CPU s/GB")
+
+
+def main():
+    total = int(sys.argv[1] if len(sys.argv) > 1 else 2048) * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "object")
+        with open(path, "wb") as fp:
+            fp.write(os.urandom(1024 * 1024) * (FILE_SIZE // (1024 * 1024)))
+
+        drain = subprocess.Popen([sys.executable, "-c", DRAIN], stdout=subprocess.PIPE, text=True)
+        try:
+            sock = socket.create_connection(("127.0.0.1", int(drain.stdout.readline())))
+
+            run("before: iterator (256 KiB)", iterator_path, path, sock, total)
+            run("after: sendfile, full body", sendfile_path, path, sock, total)
+            run("after: sendfile, 64 MiB range", sendfile_path, path, sock, total, "bytes=67108864-134217727")
+
+            sock.close()
+        finally:
+            drain.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Throughput of big downloads: one storage stream vs parallel range requests.
+
+Storage is the test fake S3, with a per-request latency and a per-connection
+bandwidth cap, which is what limits a single S3 GET stream in production.
+
+    python benchmarks/parallel_download.py [object MiB, default 256] [latency ms, default 30] [MB/s per connection, default 50]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+settings.configure(
+    FILE_STREAM_CHUNK_SIZE=262144,
+    FILE_PARALLEL_DOWNLOAD_ENABLED=True,
+    FILE_PARALLEL_DOWNLOAD_MIN_SIZE=0,
+    FILE_PARALLEL_DOWNLOAD_PART_SIZE=8388608,
+    FILE_PARALLEL_DOWNLOAD_CONCURRENCY=4,
+    UPSTREAM_POOL_CONNECTIONS=1,
+    UPSTREAM_POOL_MAXSIZE=32,
+    UPSTREAM_POOL_TIMEOUT=10,
+    UPSTREAM_CONNECT_TIMEOUT=3,
+    UPSTREAM_READ_TIMEOUT=30,
+    UPSTREAM_MAX_RETRIES=0,
+    UPSTREAM_RETRY_BACKOFF=0,
+    UPSTREAM_ASYNC_MAX_CONNECTIONS=1,
+)
+django.setup()
+
+from FileProcessing.storage import storage_use_backend
+from FileProcessing.streaming import file_streaming_response
+from FileProcessing.tests.fake_storage import FakeStorageServer, SyntheticObject
+from integrations.storage.s3 import S3StorageBackend
+
+
+def run(name, storage_key, size, parallel, concurrency=None, part_size=None):
+    if concurrency is not None:
+        settings.FILE_PARALLEL_DOWNLOAD_CONCURRENCY = concurrency
+        settings.FILE_PARALLEL_DOWNLOAD_PART_SIZE = part_size
+
+    started = time.perf_counter()
+    response = file_streaming_response(
+        storage_key=storage_key, content_type="application/octet-stream", filename="bench.bin",
+        file_size=size, disposition="attachment", parallel=parallel,
+    )
+    transferred = sum(len(chunk) for chunk in response)
+    response.close()
+    elapsed = time.perf_counter() - started
+
+    assert transferred == size
+    print(f"{name:<36} {size / 1024 ** 2 / elapsed:>9.1f} MB/s")
+
+
+def main():
+    size = int(sys.argv[1] if len(sys.argv) > 1 else 256) * 1024 * 1024
+    latency = int(sys.argv[2] if len(sys.argv) > 2 else 30) / 1000
+    bandwidth = int(sys.argv[3] if len(sys.argv) > 3 else 50) * 1024 * 1024
+
+    server = FakeStorageServer(latency=latency, bandwidth=bandwidth).start()
+    server.put("object", SyntheticObject(size))
+    storage_use_backend(S3StorageBackend(object_url=lambda key: server.url + key))
+
+    try:
+        run("before: single stream", "object", size, parallel=False)
+        for concurrency, part_size in ((2, 8388608), (4, 8388608), (8, 8388608), (8, 16777216)):
+            run(f"after: {concurrency} x {part_size // 1048576} MiB ranges", "object", size, True, concurrency, part_size)
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
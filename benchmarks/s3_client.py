@@ -0,0 +1,94 @@
+"""
+Latency per S3 call: a boto3 client built for every call vs the process' cached client.
+
+Calls go to the test fake S3: a presigned URL (no request, only signing) and a HeadObject,
+which with the cached client reuses a kept-alive connection.
+
+    python benchmarks/s3_client.py [calls, default 200]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import boto3
+import django
+from django.conf import settings
+
+from FileProcessing.tests.fake_storage import FakeStorageServer
+
+server = FakeStorageServer().start()
+
+settings.configure(
+    AWS_S3_ACCESS_KEY_ID="AKIAEXAMPLE",
+    AWS_S3_SECRET_ACCESS_KEY="secret",
+    AWS_S3_REGION_NAME="eu-central-1",
+    AWS_STORAGE_BUCKET_NAME=server.bucket,
+    AWS_DEFAULT_ACL="private",
+    AWS_PRESIGNED_EXPIRY=3600,
+    FILE_MAX_SIZE=1073741824,
+    AWS_S3_ENDPOINT_URL=server.url.rstrip("/"),
+    AWS_S3_MAX_POOL_CONNECTIONS=32,
+    AWS_S3_CONNECT_TIMEOUT=3,
+    AWS_S3_READ_TIMEOUT=60,
+    AWS_S3_RETRY_MODE="standard",
+    AWS_S3_MAX_ATTEMPTS=3,
+    AWS_S3_TCP_KEEPALIVE=True,
+)
+django.setup()
+
+from integrations.aws.client import s3_get_client, s3_get_credentials, s3_pool_stats
+
+
+def uncached_client():
+    """
+    What s3_get_client did before: a new client, and so a new connection pool, every call.
+    """
+    credentials = s3_get_credentials()
+
+    return boto3.client(
+        service_name="s3",
+        aws_access_key_id=credentials.access_key_id,
+        aws_secret_access_key=credentials.secret_access_key,
+        region_name=credentials.region_name,
+        endpoint_url=credentials.endpoint_url,
+    )
+
+
+def presign(get_client):
+    get_client().generate_presigned_url(
+        ClientMethod="get_object", Params={"Bucket": server.bucket, "Key": "object"}, ExpiresIn=300
+    )
+
+
+def head(get_client):
+    get_client().head_object(Bucket=server.bucket, Key="object")
+
+
+def run(name, calls, function, get_client):
+    started = time.perf_counter()
+    for _ in range(calls):
+        function(get_client)
+    elapsed = time.perf_counter() - started
+
+    print(f"{name:<36} {elapsed / calls * 1000:>8.2f} ms/call")
+
+
+def main():
+    calls = int(sys.argv[1] if len(sys.argv) > 1 else 200)
+    server.put("object", b"x" * 1024)
+
+    try:
+        run("before: presign, client per call", calls, presign, uncached_client)
+        run("after: presign, cached client", calls, presign, s3_get_client)
+        run("before: head_object, client per call", calls, head, uncached_client)
+        s3_pool_stats.reset()
+        run("after: head_object, cached client", calls, head, s3_get_client)
+        print(f"cached client pool: {s3_pool_stats.snapshot()}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
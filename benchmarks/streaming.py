@@ -0,0 +1,123 @@
+"""
+Throughput and CPU cost of proxying a storage object through the streaming views.
+
+Storage is a separate `python -m http.server` process serving a temp file,
+so the CPU time measured here is the Django worker's share only.
+
+    python benchmarks/streaming.py [total MiB, default 512]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+settings.configure(
+    FILE_STREAM_CHUNK_SIZE=262144,
+    UPSTREAM_POOL_CONNECTIONS=1,
+    UPSTREAM_POOL_MAXSIZE=1,
+    UPSTREAM_POOL_TIMEOUT=10,
+    UPSTREAM_CONNECT_TIMEOUT=3,
+    UPSTREAM_READ_TIMEOUT=30,
+    UPSTREAM_MAX_RETRIES=0,
+    UPSTREAM_RETRY_BACKOFF=0,
+    UPSTREAM_ASYNC_MAX_CONNECTIONS=1,
+)
+django.setup()
+
+import requests
+from django.http import StreamingHttpResponse
+
+from FileProcessing.storage import storage_use_backend
+from FileProcessing.streaming import file_streaming_response
+from integrations.storage.s3 import S3StorageBackend
+
+OBJECT_SIZE = 128 * 1024 * 1024
+
+
+class LegacyFileWrapper:
+    """The pre-engine FileGetView wrapper: 8 KiB reads of the raw response"""
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.blksize)
+        if data:
+            return data
+        raise StopIteration
+
+
+def legacy_get(url):
+    streaming_body = requests.get(url=url, stream=True)
+    return StreamingHttpResponse(LegacyFileWrapper(streaming_body.raw))
+
+
+def legacy_download(url):
+    # The pre-engine FileDownloadView handed the Response over, iterated in 128 byte chunks.
+    streaming_body = requests.get(url=url, stream=True)
+    return StreamingHttpResponse(streaming_body)
+
+
+def engine(chunk_size):
+    def open_response(url):
+        settings.FILE_STREAM_CHUNK_SIZE = chunk_size
+        # The storage backend reads `url`, see main
+        return file_streaming_response(
+            storage_key="object", content_type="application/octet-stream", filename="bench.bin",
+            file_size=OBJECT_SIZE, disposition="attachment",
+        )
+    return open_response
+
+
+def run(name, open_response, url, total):
+    transferred = 0
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+
+    while transferred < total:
+        response = open_response(url)
+        for chunk in response:
+            transferred += len(chunk)
+        response.close()
+
+    wall, cpu = time.perf_counter() - wall_started, time.process_time() - cpu_started
+    gib = transferred / 1024 ** 3
+    print(f"{name:<28} {transferred / 1024 ** 2 / wall:>9.1f} MB/s {cpu / gib:>9.2f} CPU s/GB")
+
+
+def main():
+    total = int(sys.argv[1] if len(sys.argv) > 1 else 512) * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "object"), "wb") as fp:
+            fp.write(os.urandom(1024 * 1024) * (OBJECT_SIZE // (1024 * 1024)))
+
+        server = subprocess.Popen(
+            [sys.executable, "-m", "http.server", "0", "--bind", "127.0.0.1", "--directory", directory],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        try:
+            port = server.stdout.readline().split("port ")[1].split(" ")[0]
+            url = f"http://127.0.0.1:{port}/object"
+            storage_use_backend(S3StorageBackend(object_url=lambda key: f"http://127.0.0.1:{port}/{key}"))
+            time.sleep(0.2)
+
+            run("before: get (8 KiB)", legacy_get, url, total)
+            run("before: download (128 B)", legacy_download, url, total)
+            for chunk_size in (65536, 262144, 1048576):
+                run(f"after: engine ({chunk_size // 1024} KiB)", engine(chunk_size), url, total)
+        finally:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Overhead per GiB of the SHA-256 checksum every uploaded part now carries.
+
+Parts are cut from a receive buffer the way S3MultipartWriter does it, then hashed, on one
+thread and on several at once like the writer's upload threads (hashlib lets go of the GIL).
+
+    python benchmarks/upload_checksum.py [total MiB, default 1024] [part MiB, default 8]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FileProcessing.checksum import checksum_composite, checksum_part
+
+CHUNK_SIZE = 65536  # What Django hands the upload handler at a time
+
+
+def receive(total, part_size, cut):
+    """
+    Fills a buffer chunk by chunk and cuts parts out of it, returns the parts.
+    """
+    chunk = bytes(range(256)) * (CHUNK_SIZE // 256)
+    buffer = bytearray()
+    parts = []
+
+    for _ in range(total // CHUNK_SIZE):
+        buffer += chunk
+        while len(buffer) >= part_size:
+            parts.append(cut(buffer, part_size))
+            del buffer[:part_size]
+
+    return parts
+
+
+def run(name, gib, function):
+    started = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - started
+
+    print(f"{name:<44} {elapsed / gib * 1000:>8.1f} ms/GiB")
+    return result
+
+
+def main():
+    total = int(sys.argv[1] if len(sys.argv) > 1 else 1024) * 1024 * 1024
+    part_size = int(sys.argv[2] if len(sys.argv) > 2 else 8) * 1024 * 1024
+    gib = total / 1024 ** 3
+
+    run("before: receive, parts cut by slicing", gib, lambda: receive(total, part_size, lambda b, n: bytes(b[:n])))
+    parts = run("after: receive, parts cut through a memoryview", gib, lambda: receive(total, part_size, lambda b, n: bytes(memoryview(b)[:n])))
+
+    run("sha256 per part, 1 thread", gib, lambda: [checksum_part(part) for part in parts])
+    for concurrency in (4, 8):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            run(f"sha256 per part, {concurrency} threads", gib, lambda: list(executor.map(checksum_part, parts)))
+
+    checksums = [checksum_part(part) for part in parts]
+    run("composite checksum", gib, lambda: checksum_composite(checksums))
+
+
+if __name__ == "__main__":
+    main()
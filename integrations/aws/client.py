@@ -1,14 +1,24 @@
+import os
+import threading
 from functools import lru_cache
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, List, Optional
 
 import boto3
-from attrs import define
+from botocore.awsrequest import AWSHTTPConnectionPool, AWSHTTPSConnectionPool
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from attrs import define, frozen
 from django.conf import settings
 
 from integrations.aws.utils import assert_settings
+from integrations.upstream.client import InstrumentedPoolMixin, UpstreamPoolStats
 
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+S3_MAX_PARTS = 10000
+S3_MIN_PART_SIZE = 5 * 1024 * 1024  # Except for the last part
 
-@define
+
+@frozen
 class S3Credentials:
     access_key_id: str
     secret_access_key: str
@@ -17,6 +27,7 @@ class S3Credentials:
     default_acl: str
     presigned_expiry: int
     max_size: int
+    endpoint_url: Optional[str]
 
 
 @lru_cache
@@ -30,6 +41,7 @@ def s3_get_credentials() -> S3Credentials:
             "AWS_DEFAULT_ACL",
             "AWS_PRESIGNED_EXPIRY",
             "FILE_MAX_SIZE",
+            "AWS_S3_ENDPOINT_URL",
         ],
         "S3 credentials not found.",
     )
@@ -42,26 +54,131 @@ def s3_get_credentials() -> S3Credentials:
         default_acl=required_config["AWS_DEFAULT_ACL"],
         presigned_expiry=required_config["AWS_PRESIGNED_EXPIRY"],
         max_size=required_config["FILE_MAX_SIZE"],
+        endpoint_url=required_config["AWS_S3_ENDPOINT_URL"],
     )
 
 
-def s3_get_client():
-    credentials = s3_get_credentials()
+@frozen
+class S3ClientConfig:
+    max_pool_connections: int
+    connect_timeout: float
+    read_timeout: float
+    retry_mode: str
+    max_attempts: int
+    tcp_keepalive: bool
+
+
+@lru_cache
+def s3_get_client_config() -> S3ClientConfig:
+    required_config = assert_settings(
+        [
+            "AWS_S3_MAX_POOL_CONNECTIONS",
+            "AWS_S3_CONNECT_TIMEOUT",
+            "AWS_S3_READ_TIMEOUT",
+            "AWS_S3_RETRY_MODE",
+            "AWS_S3_MAX_ATTEMPTS",
+            "AWS_S3_TCP_KEEPALIVE",
+        ],
+        "S3 client settings not found.",
+    )
+
+    return S3ClientConfig(
+        max_pool_connections=int(required_config["AWS_S3_MAX_POOL_CONNECTIONS"]),
+        connect_timeout=float(required_config["AWS_S3_CONNECT_TIMEOUT"]),
+        read_timeout=float(required_config["AWS_S3_READ_TIMEOUT"]),
+        retry_mode=required_config["AWS_S3_RETRY_MODE"],
+        max_attempts=int(required_config["AWS_S3_MAX_ATTEMPTS"]),
+        tcp_keepalive=bool(required_config["AWS_S3_TCP_KEEPALIVE"]),
+    )
+
+
+# Process wide counters of the S3 clients' connection pools, next to the upstream ones.
+s3_pool_stats = UpstreamPoolStats()
+
+
+class S3PoolMixin(InstrumentedPoolMixin):
+    stats = s3_pool_stats
+
+    def pool_timeout(self):
+        # botocore pools do not block, a checkout past max_pool_connections opens a throwaway connection.
+        return None
+
+
+class S3HTTPConnectionPool(S3PoolMixin, AWSHTTPConnectionPool):
+    pass
+
+
+class S3HTTPSConnectionPool(S3PoolMixin, AWSHTTPSConnectionPool):
+    pass
+
+
+# boto3 sessions are not thread-safe, and neither is creating clients from them. Clients are,
+# once created: a single one per process is shared by every request and upload thread.
+_s3_client_lock = threading.Lock()
 
-    return boto3.client(
+
+@lru_cache
+def s3_get_session() -> boto3.session.Session:
+    return boto3.session.Session()
+
+
+@lru_cache(maxsize=4)
+def _s3_build_client(credentials: S3Credentials, config: S3ClientConfig):
+    s3_client = s3_get_session().client(
         service_name="s3",
         aws_access_key_id=credentials.access_key_id,
         aws_secret_access_key=credentials.secret_access_key,
         region_name=credentials.region_name,
+        endpoint_url=credentials.endpoint_url,
+        config=Config(
+            max_pool_connections=config.max_pool_connections,
+            connect_timeout=config.connect_timeout,
+            read_timeout=config.read_timeout,
+            retries={"mode": config.retry_mode, "total_max_attempts": config.max_attempts},
+            tcp_keepalive=config.tcp_keepalive,
+        ),
     )
 
+    # botocore has no hook for the pool classes, its http session picks them from this attribute.
+    http_session = s3_client._endpoint.http_session
+    http_session._pool_classes_by_scheme = {"http": S3HTTPConnectionPool, "https": S3HTTPSConnectionPool}
+    http_session._manager.pool_classes_by_scheme = http_session._pool_classes_by_scheme
+
+    return s3_client
+
 
-def s3_generate_presigned_post(*, file_path: str, file_type: str) -> Dict[str, Any]:
+def s3_get_client():
+    """
+    The process' S3 client, built once (loading the service model and opening a connection pool
+    is tens of milliseconds) and rebuilt only when the credentials or client settings change.
+    """
+    credentials = s3_get_credentials()
+    config = s3_get_client_config()
+
+    with _s3_client_lock:
+        return _s3_build_client(credentials, config)
+
+
+def s3_client_reset():
+    global _s3_client_lock
+
+    # A lock held by another thread at fork time would never be released in the child.
+    _s3_client_lock = threading.Lock()
+    _s3_build_client.cache_clear()
+    s3_get_session.cache_clear()
+
+
+# Sockets must never be shared between gunicorn workers.
+os.register_at_fork(after_in_child=s3_client_reset)
+
+
+def s3_generate_presigned_post(*, file_path: str, file_type: str, max_size: Optional[int] = None) -> Dict[str, Any]:
     credentials = s3_get_credentials()
     s3_client = s3_get_client()
 
     acl = credentials.default_acl
     expires_in = credentials.presigned_expiry
+    max_size = min(int(credentials.max_size), max_size) if max_size is not None else credentials.max_size
 
     """
     TODO: Create a type for the presigned_data
@@ -91,66 +208,206 @@ def s3_generate_presigned_post(*, file_path: str, file_type: str) -> Dict[str, A
             # As an example, allow file size up to 10 MiB
             # More on conditions, here:
             # https://docs.aws.amazon.com/AmazonS3/latest/API/sigv4-HTTPPOSTConstructPolicy.html
-            ["content-length-range", 1, credentials.max_size],
+            ["content-length-range", 1, max_size],
         ],
         ExpiresIn=expires_in,
     )
 
     return presigned_data
 
-def s3_multipart_upload_init(file_path: str) -> Dict[str, Any]:
+def s3_multipart_upload_init(file_path: str, checksum_algorithm: Optional[str] = None) -> Dict[str, Any]:
     credentials = s3_get_credentials()
     s3_client = s3_get_client()
 
+    params = {}
+    # Every part must then carry a checksum of this algorithm, S3 verifies them.
+    if checksum_algorithm:
+        params['ChecksumAlgorithm'] = checksum_algorithm
+
     response = s3_client.create_multipart_upload(
         Bucket=credentials.bucket_name,
         Key=file_path,
+        **params,
     )
 
     return response
 
-def s3_multipart_upload_data(file_object, part_num: int, file_id: str) -> None:
-    s3_client = s3_get_client()
+def s3_multipart_upload_data(
+    *, file_object, bucket: str, key: str, upload_id: str, part_num: int, checksum_sha256: Optional[str] = None, s3_client=None
+) -> Dict[str, Any]:
+    s3_client = s3_client or s3_get_client()
 
-    file_details = settings.ON_GOING_UPLOADS[file_id]
+    params = {}
+    # Base64 SHA-256 of the part, S3 answers BadDigest when the bytes it got do not match.
+    if checksum_sha256:
+        params['ChecksumSHA256'] = checksum_sha256
 
     response = s3_client.upload_part(
         Body=file_object,
-        Bucket=file_details['Bucket'],
-        Key=file_details['Key'],
+        Bucket=bucket,
+        Key=key,
         PartNumber=part_num,
-        UploadId=file_details['UploadId'],
+        UploadId=upload_id,
+        **params,
     )
 
-    settings.ON_GOING_UPLOADS[file_id]['Parts'].append({'ETag': response['ETag'], 'PartNumber': part_num})
+    return response
 
-def s3_multipart_upload_finish(file_id: str) -> Dict[str, str]:
+def s3_generate_upload_part_presigned_url(
+    *, bucket: str, key: str, upload_id: str, part_num: int, expires_in: int, checksum_algorithm: Optional[str] = None
+) -> str:
     s3_client = s3_get_client()
 
-    file_details = settings.ON_GOING_UPLOADS[file_id]
+    params = {
+        'Bucket': bucket,
+        'Key': key,
+        'UploadId': upload_id,
+        'PartNumber': part_num,
+    }
+    # The client then sends the part's checksum, e.g. in an `x-amz-checksum-sha256` header.
+    if checksum_algorithm:
+        params['ChecksumAlgorithm'] = checksum_algorithm
+
+    return s3_client.generate_presigned_url(
+        ClientMethod='upload_part',
+        Params=params,
+        ExpiresIn=expires_in,
+    )
+
+def s3_multipart_upload_list_parts(*, bucket: str, key: str, upload_id: str, s3_client=None) -> List[Dict[str, Any]]:
+    s3_client = s3_client or s3_get_client()
+
+    parts = []
+    paginator = s3_client.get_paginator('list_parts')
+    for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        parts.extend(page.get('Parts', []))
+
+    return parts
+
+def s3_multipart_upload_finish(*, bucket: str, key: str, upload_id: str, parts: List[Dict[str, Any]]) -> Dict[str, str]:
+    s3_client = s3_get_client()
 
     response = s3_client.complete_multipart_upload(
-        Bucket=file_details['Bucket'],
-        Key=file_details['Key'],
-        MultipartUpload={'Parts': file_details['Parts']},
-        UploadId=file_details['UploadId'],
+        Bucket=bucket,
+        Key=key,
+        MultipartUpload={'Parts': parts},
+        UploadId=upload_id,
     )
 
-    del settings.ON_GOING_UPLOADS[file_id]
+    return response
+
+def s3_multipart_upload_abort(*, bucket: str, key: str, upload_id: str, s3_client=None) -> None:
+    s3_client = s3_client or s3_get_client()
+
+    s3_client.abort_multipart_upload(
+        Bucket=bucket,
+        Key=key,
+        UploadId=upload_id,
+    )
+
+def s3_multipart_upload_list(*, bucket: str, prefix: str = "", s3_client=None) -> Iterator[Dict[str, Any]]:
+    """
+    Multipart uploads in progress under `prefix` (Key, UploadId, Initiated), oldest first per key.
+    """
+    s3_client = s3_client or s3_get_client()
+
+    paginator = s3_client.get_paginator('list_multipart_uploads')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        yield from page.get('Uploads', [])
+
+def s3_put_object(*, bucket: str, key: str, body: bytes, s3_client=None) -> Dict[str, Any]:
+    s3_client = s3_client or s3_get_client()
+
+    response = s3_client.put_object(
+        Body=body,
+        Bucket=bucket,
+        Key=key,
+    )
 
     return response
 
-def s3_generate_download_presigned_url(file_key: str) -> Dict[str, str]:
+def s3_get_object_data(*, bucket: str, key: str) -> bytes:
+    s3_client = s3_get_client()
+
+    response = s3_client.get_object(
+        Bucket=bucket,
+        Key=key,
+    )
+
+    return response['Body'].read()
+
+def s3_head_object(*, bucket: str, key: str, checksum: bool = False, s3_client=None) -> Optional[Dict[str, Any]]:
+    """
+    The object's metadata (ContentLength, ETag, and with `checksum` its ChecksumSHA256...), None when there is none.
+    """
+    s3_client = s3_client or s3_get_client()
+
+    params = {}
+    if checksum:
+        params['ChecksumMode'] = 'ENABLED'
+
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key, **params)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+def s3_head_object_size(*, bucket: str, key: str, s3_client=None) -> Optional[int]:
+    """
+    Size of the object, None when there is none.
+    """
+    response = s3_head_object(bucket=bucket, key=key, s3_client=s3_client)
+
+    return None if response is None else response['ContentLength']
+
+def s3_delete_object(*, bucket: str, key: str, s3_client=None) -> None:
+    s3_client = s3_client or s3_get_client()
+
+    s3_client.delete_object(
+        Bucket=bucket,
+        Key=key,
+    )
+
+def s3_delete_objects(*, bucket: str, keys: List[str], s3_client=None) -> List[Dict[str, Any]]:
+    """
+    Deletes up to 1000 objects with one request, returns the errors of those that could not be.
+    """
+    s3_client = s3_client or s3_get_client()
+
+    response = s3_client.delete_objects(
+        Bucket=bucket,
+        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True},
+    )
+
+    return response.get('Errors', [])
+
+def s3_generate_download_presigned_url(
+    file_key: str,
+    *,
+    expires_in: int = 3600,
+    content_disposition: Optional[str] = None,
+    content_type: Optional[str] = None,
+) -> str:
     credentials = s3_get_credentials()
     s3_client = s3_get_client()
 
+    params = {
+        'Bucket': credentials.bucket_name,
+        'Key': file_key
+    }
+
+    # S3 answers with these headers instead of the stored ones,
+    # which is how a renamed file still downloads under its new name.
+    if content_disposition:
+        params['ResponseContentDisposition'] = content_disposition
+    if content_type:
+        params['ResponseContentType'] = content_type
+
     response = s3_client.generate_presigned_url(
         ClientMethod='get_object',
-        Params={
-            'Bucket': credentials.bucket_name,
-            'Key': file_key
-        },
-        ExpiresIn=3600
+        Params=params,
+        ExpiresIn=expires_in
     )
 
-    return response
\ No newline at end of file
+    return response
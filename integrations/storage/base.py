@@ -0,0 +1,318 @@
+import asyncio
+import base64
+import hashlib
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from attrs import define
+
+# (first_byte, last_byte) as in a Range header, either side may be None: `bytes=500-`, `bytes=-500`
+ByteRange = Tuple[Optional[int], Optional[int]]
+
+
+class StorageError(Exception):
+    """
+    A failed storage call. `code` is the S3 error code (NoSuchKey, NoSuchUpload, BadDigest, SlowDown...),
+    whatever the backend.
+    """
+
+    def __init__(self, code: str, message: str = ""):
+        super().__init__(message or code)
+        self.code = code
+
+
+@define
+class StorageObject:
+    size: int
+    etag: str  # Without quotes
+    # Base64 SHA-256, `-<parts>` for the composite one of a multipart upload. Only asked for with `checksum`.
+    checksum: Optional[str] = None
+
+
+@define
+class StoragePart:
+    part_number: int
+    etag: str  # Without quotes
+    size: int
+    checksum: Optional[str] = None
+
+
+@define
+class StorageUpload:
+    key: str
+    upload_id: str
+    initiated: datetime
+
+
+def storage_data_size(data) -> int:
+    """
+    Size of what is written: bytes-likes, or file-likes with a `size` (Django uploaded files).
+    """
+    if isinstance(data, memoryview):
+        return data.nbytes
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+
+    return data.size
+
+
+def storage_data_bytes(data) -> bytes:
+    """
+    What is written, as bytes. Django uploaded files are read chunk by chunk from their start.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytes(data)
+
+    if hasattr(data, "chunks"):
+        return b"".join(data.chunks())
+
+    return data.read()
+
+
+def storage_checksum_sha256(data: bytes) -> str:
+    """
+    Base64 SHA-256, as S3 expects it in `x-amz-checksum-sha256`.
+    """
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+def storage_composite_etag(parts: List[StoragePart]) -> str:
+    """
+    The ETag S3 gives an object assembled from `parts`: MD5 of their MD5s, `-<parts>`.
+    """
+    digest = hashlib.md5(b"".join(bytes.fromhex(part.etag) for part in parts)).hexdigest()
+
+    return f"{digest}-{len(parts)}"
+
+
+def storage_composite_checksum(parts: List[StoragePart]) -> Optional[str]:
+    """
+    The composite SHA-256 of a multipart upload, None unless every part had a checksum.
+    """
+    if not parts or not all(part.checksum for part in parts):
+        return None
+
+    digest = hashlib.sha256(b"".join(base64.b64decode(part.checksum) for part in parts)).digest()
+
+    return f"{base64.b64encode(digest).decode()}-{len(parts)}"
+
+
+def storage_resolve_range(byte_range: ByteRange, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (first_byte, last_byte) of an object of `size` bytes, None when unsatisfiable (a 416).
+    """
+    first_byte, last_byte = byte_range
+
+    if first_byte is None:
+        if not last_byte or not size:
+            return None
+        return max(size - last_byte, 0), size - 1
+
+    if first_byte >= size:
+        return None
+
+    return first_byte, size - 1 if last_byte is None else min(last_byte, size - 1)
+
+
+class StorageRangeBody:
+    """
+    `length` bytes of an open file-like, from its current position.
+    """
+
+    def __init__(self, fp, length: int):
+        self.fp = fp
+        self.remaining = length
+
+    def read(self, amt: int = -1) -> bytes:
+        if amt is None or amt < 0 or amt > self.remaining:
+            amt = self.remaining
+        if amt <= 0:
+            return b""
+
+        data = self.fp.read(amt)
+        self.remaining -= len(data)
+
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+class StorageResponse:
+    """
+    An object, or a range of it, being read.
+
+    It has the surface of the upstream HTTP responses S3 reads return (`status_code` 200 / 206 / 404 / 416,
+    Content-Length and Content-Range headers, `read`, `close`, `raise_for_status`), so the streaming code
+    reads every backend the same way.
+    """
+
+    def __init__(self, status_code: int, headers: Dict[str, str], body=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    @classmethod
+    def for_range(cls, size: int, byte_range: Optional[ByteRange], open_body: Callable[[int, int], object]) -> "StorageResponse":
+        """
+        The 200, 206 or 416 a ranged GET of an object of `size` bytes gets, `open_body(first_byte, length)` opens the bytes.
+        """
+        if byte_range is None:
+            return cls(200, {"Content-Length": str(size)}, open_body(0, size))
+
+        resolved = storage_resolve_range(byte_range, size)
+        if resolved is None:
+            return cls(416, {"Content-Range": f"bytes */{size}"})
+
+        first_byte, last_byte = resolved
+        length = last_byte - first_byte + 1
+
+        return cls(
+            206,
+            {"Content-Length": str(length), "Content-Range": f"bytes {first_byte}-{last_byte}/{size}"},
+            open_body(first_byte, length),
+        )
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        if self.body is None:
+            return b""
+
+        return self.body.read(-1 if amt is None else amt)
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+
+    release = close
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            self.close()
+            raise StorageError("NoSuchKey" if self.status_code == 404 else str(self.status_code))
+
+
+class AsyncStorageResponse:
+    """
+    Async surface (`aiter_chunks`, `aclose`, `araise_for_status`) over a blocking read, whose reads run in
+    the event loop's worker threads. What `StorageBackend.aopen` returns unless a backend reads natively.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    async def aiter_chunks(self, chunk_size: int) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                data = await asyncio.to_thread(self.response.read, chunk_size)
+                if not data:
+                    return
+                yield data
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        await asyncio.to_thread(self.response.close)
+
+    def close(self):
+        self.response.close()
+
+    async def araise_for_status(self):
+        self.response.raise_for_status()
+
+
+class StorageBackend(ABC):
+    """
+    Where file content lives: ranged reads, single and multipart writes, heads, deletes and presigned URLs.
+
+    Keys are object keys (`File.file.name`). Implementations are shared by all the threads of a process.
+    """
+
+    # Bucket (or its equivalent) recorded with multipart upload sessions
+    name: str = ""
+    # Whether clients can be handed URLs to read and write storage directly
+    presigned_urls: bool = False
+
+    @abstractmethod
+    def open(self, key: str, byte_range: Optional[ByteRange] = None) -> StorageResponse:
+        """
+        Reads the object, or `byte_range` of it, as a ranged HTTP GET would.
+        """
+
+    async def aopen(self, key: str, byte_range: Optional[ByteRange] = None):
+        """
+        `open` for async views, returns an AsyncStorageResponse (or a response with the same surface).
+        """
+        return AsyncStorageResponse(await asyncio.to_thread(self.open, key, byte_range))
+
+    @abstractmethod
+    def head(self, key: str, checksum: bool = False) -> Optional[StorageObject]:
+        """
+        The object's size and ETag (and with `checksum` its checksum), None when there is none.
+        """
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def put(self, key: str, data) -> str:
+        """
+        Writes the whole object, returns its ETag.
+        """
+
+    @abstractmethod
+    def delete_many(self, keys: Iterable[str]):
+        """
+        Deletes the objects, missing ones are not an error.
+        """
+
+    def delete(self, key: str):
+        self.delete_many([key])
+
+    @abstractmethod
+    def multipart_init(self, key: str, checksum_algorithm: Optional[str] = None) -> str:
+        """
+        Starts a multipart upload, returns its id. With a `checksum_algorithm` every part must come with a checksum.
+        """
+
+    @abstractmethod
+    def multipart_upload_part(
+        self, key: str, upload_id: str, part_number: int, data, checksum_sha256: Optional[str] = None
+    ) -> StoragePart:
+        """
+        Raises StorageError("BadDigest") when the part does not match `checksum_sha256`.
+        """
+
+    @abstractmethod
+    def multipart_list_parts(self, key: str, upload_id: str) -> List[StoragePart]:
+        ...
+
+    @abstractmethod
+    def multipart_complete(self, key: str, upload_id: str, parts: List[StoragePart]) -> str:
+        """
+        Assembles the object from `parts`, in order, returns its ETag.
+        """
+
+    @abstractmethod
+    def multipart_abort(self, key: str, upload_id: str):
+        ...
+
+    @abstractmethod
+    def multipart_list(self, prefix: str = "") -> Iterator[StorageUpload]:
+        """
+        Multipart uploads in progress under `prefix`.
+        """
+
+    def presign_get(
+        self, key: str, *, expires_in: int, content_disposition: Optional[str] = None, content_type: Optional[str] = None
+    ) -> str:
+        raise StorageError("NotImplemented", f"{type(self).__name__} has no presigned URLs")
+
+    def presign_upload_part(
+        self, key: str, upload_id: str, part_number: int, *, expires_in: int, checksum_algorithm: Optional[str] = None
+    ) -> str:
+        raise StorageError("NotImplemented", f"{type(self).__name__} has no presigned URLs")
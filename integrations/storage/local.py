@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Optional
+
+from integrations.storage.base import (
+    ByteRange,
+    StorageBackend,
+    StorageError,
+    StorageObject,
+    StoragePart,
+    StorageRangeBody,
+    StorageResponse,
+    StorageUpload,
+    storage_checksum_sha256,
+    storage_data_bytes,
+)
+
+# Multipart uploads in progress, one directory each, next to the objects
+UPLOADS_DIR = ".uploads"
+
+
+def _stat_etag(stat: os.stat_result) -> str:
+    # What nginx uses too: it changes with every write, without reading the bytes.
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Objects as files under `root`.
+
+    With a `shard_depth`, keys are spread over 256^shard_depth directories named after the SHA-1 of
+    the key (`ab/cd/files/...`), so no directory grows past what the filesystem lists quickly.
+    0 keeps Django's FileSystemStorage layout, `root/<key>`.
+
+    Writes go to a temporary file renamed over the object, readers never see half an object.
+    Multipart uploads keep their parts under `root/.uploads/<upload id>/` until completed.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, shard_depth: int = 0):
+        self.root = os.path.abspath(root)
+        self.shard_depth = shard_depth
+
+    def relative_path(self, key: str) -> str:
+        if not key or os.path.isabs(key) or ".." in key.split("/") or key.split("/")[0] == UPLOADS_DIR:
+            raise StorageError("InvalidKey", f"Invalid key {key!r}")
+
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        shards = [digest[2 * level:2 * level + 2] for level in range(self.shard_depth)]
+
+        return os.path.join(*shards, key)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, self.relative_path(key))
+
+    def _write(self, path: str, chunks: Iterable[bytes]):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                for chunk in chunks:
+                    fp.write(chunk)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def open(self, key: str, byte_range: Optional[ByteRange] = None) -> StorageResponse:
+        try:
+            fp = open(self.path(key), "rb")
+        except FileNotFoundError:
+            return StorageResponse(404, {})
+
+        def open_body(first_byte: int, length: int):
+            fp.seek(first_byte)
+            return StorageRangeBody(fp, length)
+
+        response = StorageResponse.for_range(os.fstat(fp.fileno()).st_size, byte_range, open_body)
+        if response.body is None:
+            fp.close()
+
+        return response
+
+    def head(self, key: str, checksum: bool = False) -> Optional[StorageObject]:
+        # No checksums are kept on disk, parts are checked as they are written.
+        try:
+            stat = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+
+        return StorageObject(size=stat.st_size, etag=_stat_etag(stat))
+
+    def get(self, key: str) -> bytes:
+        try:
+            with open(self.path(key), "rb") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            raise StorageError("NoSuchKey", key)
+
+    def put(self, key: str, data) -> str:
+        path = self.path(key)
+
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self._write(path, [data])
+        else:
+            self._write(path, data.chunks() if hasattr(data, "chunks") else iter(lambda: data.read(1024 * 1024), b""))
+
+        return _stat_etag(os.stat(path))
+
+    def delete_many(self, keys: Iterable[str]):
+        for key in keys:
+            try:
+                os.unlink(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def _upload_dir(self, upload_id: str) -> str:
+        if not upload_id.isalnum():
+            raise StorageError("NoSuchUpload", upload_id)
+
+        return os.path.join(self.root, UPLOADS_DIR, upload_id)
+
+    def _upload(self, key: str, upload_id: str) -> dict:
+        try:
+            with open(os.path.join(self._upload_dir(upload_id), "upload.json")) as fp:
+                upload = json.load(fp)
+        except FileNotFoundError:
+            raise StorageError("NoSuchUpload", upload_id)
+
+        if upload["key"] != key:
+            raise StorageError("NoSuchUpload", upload_id)
+
+        return upload
+
+    def multipart_init(self, key: str, checksum_algorithm: Optional[str] = None) -> str:
+        self.relative_path(key)
+        upload_id = uuid.uuid4().hex
+        upload = {"key": key, "initiated": time.time(), "checksum_algorithm": checksum_algorithm or ""}
+
+        self._write(os.path.join(self._upload_dir(upload_id), "upload.json"), [json.dumps(upload).encode()])
+
+        return upload_id
+
+    def multipart_upload_part(
+        self, key: str, upload_id: str, part_number: int, data, checksum_sha256: Optional[str] = None
+    ) -> StoragePart:
+        upload = self._upload(key, upload_id)
+        if bool(checksum_sha256) != bool(upload["checksum_algorithm"]):
+            raise StorageError("InvalidRequest", "Checksum type mismatch")
+
+        data = storage_data_bytes(data)
+        if checksum_sha256 and storage_checksum_sha256(data) != checksum_sha256:
+            raise StorageError("BadDigest", f"Part {part_number}")
+
+        part = StoragePart(
+            part_number=part_number, etag=hashlib.md5(data).hexdigest(), size=len(data), checksum=checksum_sha256
+        )
+        upload_dir = self._upload_dir(upload_id)
+        self._write(os.path.join(upload_dir, f"{part_number}.part"), [data])
+        # After the bytes: a part is only listed once it is whole.
+        self._write(
+            os.path.join(upload_dir, f"{part_number}.json"),
+            [json.dumps({"etag": part.etag, "size": part.size, "checksum": part.checksum}).encode()],
+        )
+
+        return part
+
+    def multipart_list_parts(self, key: str, upload_id: str) -> List[StoragePart]:
+        self._upload(key, upload_id)
+        upload_dir = self._upload_dir(upload_id)
+
+        parts = []
+        for name in os.listdir(upload_dir):
+            part_number, extension = os.path.splitext(name)
+            if extension != ".json" or not part_number.isdigit():
+                continue
+
+            with open(os.path.join(upload_dir, name)) as fp:
+                part = json.load(fp)
+            parts.append(StoragePart(part_number=int(part_number), **part))
+
+        return sorted(parts, key=lambda part: part.part_number)
+
+    def multipart_complete(self, key: str, upload_id: str, parts: List[StoragePart]) -> str:
+        listed = {part.part_number: part for part in self.multipart_list_parts(key, upload_id)}
+
+        numbers = [part.part_number for part in parts]
+        if not parts or numbers != sorted(set(numbers)):
+            raise StorageError("InvalidPartOrder")
+        for part in parts:
+            stored = listed.get(part.part_number)
+            if stored is None or stored.etag != part.etag or (stored.checksum or None) != (part.checksum or None):
+                raise StorageError("InvalidPart", f"Part {part.part_number}")
+
+        upload_dir = self._upload_dir(upload_id)
+
+        def chunks():
+            for part in parts:
+                with open(os.path.join(upload_dir, f"{part.part_number}.part"), "rb") as fp:
+                    yield from iter(lambda: fp.read(1024 * 1024), b"")
+
+        path = self.path(key)
+        self._write(path, chunks())
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+        return _stat_etag(os.stat(path))
+
+    def multipart_abort(self, key: str, upload_id: str):
+        self._upload(key, upload_id)
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+
+    def multipart_list(self, prefix: str = "") -> Iterator[StorageUpload]:
+        uploads = []
+        try:
+            upload_ids = os.listdir(os.path.join(self.root, UPLOADS_DIR))
+        except FileNotFoundError:
+            upload_ids = []
+
+        for upload_id in upload_ids:
+            try:
+                with open(os.path.join(self.root, UPLOADS_DIR, upload_id, "upload.json")) as fp:
+                    upload = json.load(fp)
+            except FileNotFoundError:
+                # Completed or aborted meanwhile
+                continue
+
+            if upload["key"].startswith(prefix):
+                uploads.append(
+                    StorageUpload(
+                        key=upload["key"],
+                        upload_id=upload_id,
+                        initiated=datetime.fromtimestamp(upload["initiated"], tz=timezone.utc),
+                    )
+                )
+
+        yield from sorted(uploads, key=lambda upload: upload.initiated)
@@ -0,0 +1,248 @@
+import hashlib
+import io
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from integrations.storage.base import (
+    ByteRange,
+    StorageBackend,
+    StorageError,
+    StorageObject,
+    StoragePart,
+    StorageResponse,
+    StorageUpload,
+    storage_checksum_sha256,
+    storage_composite_checksum,
+    storage_composite_etag,
+    storage_data_bytes,
+)
+
+
+class ThrottledBody:
+    """
+    Reads of an in-memory object, at `bandwidth` bytes per second (0: unlimited).
+    """
+
+    def __init__(self, data: memoryview, bandwidth: int):
+        self.data = io.BytesIO(data)
+        self.bandwidth = bandwidth
+
+    def read(self, amt: int = -1) -> bytes:
+        data = self.data.read(amt)
+        if self.bandwidth and data:
+            time.sleep(len(data) / self.bandwidth)
+
+        return data
+
+    def close(self):
+        self.data.close()
+
+
+class MemoryStorageBackend(StorageBackend):
+    """
+    Objects in a dict of this process, for tests and benchmarks.
+
+    Behaves like S3 where the application can tell: ranged reads, multipart uploads checked against
+    their part checksums and ETags, parts under `min_part_size` refused (but the last one).
+    Every call waits `latency` seconds and moves bytes at `bandwidth` bytes per second per stream.
+    Failures are injected with `error_rate` (a random fraction of calls fail with SlowDown), or
+    queued in `errors`: each call pops one error code, if any, and fails with it.
+    """
+
+    name = "memory"
+
+    def __init__(self, *, latency: float = 0, bandwidth: int = 0, error_rate: float = 0, min_part_size: int = 0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.min_part_size = min_part_size
+        self.errors = deque()
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.objects: Dict[str, bytes] = {}
+            self.etags: Dict[str, str] = {}
+            self.checksums: Dict[str, str] = {}
+            self.uploads: Dict[str, dict] = {}
+            self.errors.clear()
+            self.calls: Dict[str, int] = {}
+
+    def _call(self, operation: str, size: int = 0):
+        """
+        Accounts for a call moving `size` bytes: the latency, the transfer time and the injected failures.
+        """
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            error = self.errors.popleft() if self.errors else None
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if error is None and self.error_rate and random.random() < self.error_rate:
+            error = "SlowDown"
+        if error is not None:
+            raise StorageError(error, f"{operation} failed (injected)")
+
+        if self.bandwidth and size:
+            time.sleep(size / self.bandwidth)
+
+    def _store(self, key: str, data: bytes, etag: str, checksum: Optional[str] = None):
+        with self._lock:
+            self.objects[key] = data
+            self.etags[key] = etag
+            self.checksums.pop(key, None)
+            if checksum:
+                self.checksums[key] = checksum
+
+    def open(self, key: str, byte_range: Optional[ByteRange] = None) -> StorageResponse:
+        self._call("open")
+
+        data = self.objects.get(key)
+        if data is None:
+            return StorageResponse(404, {})
+
+        return StorageResponse.for_range(
+            len(data),
+            byte_range,
+            lambda first_byte, length: ThrottledBody(memoryview(data)[first_byte:first_byte + length], self.bandwidth),
+        )
+
+    def head(self, key: str, checksum: bool = False) -> Optional[StorageObject]:
+        self._call("head")
+
+        with self._lock:
+            data = self.objects.get(key)
+            if data is None:
+                return None
+
+            return StorageObject(
+                size=len(data), etag=self.etags[key], checksum=self.checksums.get(key) if checksum else None
+            )
+
+    def get(self, key: str) -> bytes:
+        data = self.objects.get(key)
+        self._call("get", len(data or b""))
+
+        if data is None:
+            raise StorageError("NoSuchKey", key)
+
+        return data
+
+    def put(self, key: str, data) -> str:
+        data = storage_data_bytes(data)
+        self._call("put", len(data))
+
+        etag = hashlib.md5(data).hexdigest()
+        self._store(key, data, etag)
+
+        return etag
+
+    def delete_many(self, keys: Iterable[str]):
+        self._call("delete")
+
+        with self._lock:
+            for key in keys:
+                self.objects.pop(key, None)
+                self.etags.pop(key, None)
+                self.checksums.pop(key, None)
+
+    def _upload(self, key: str, upload_id: str) -> dict:
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload["key"] != key:
+            raise StorageError("NoSuchUpload", upload_id)
+
+        return upload
+
+    def multipart_init(self, key: str, checksum_algorithm: Optional[str] = None) -> str:
+        self._call("multipart_init")
+
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {
+                "key": key,
+                "initiated": datetime.now(tz=timezone.utc),
+                "checksum_algorithm": checksum_algorithm or "",
+                "parts": {},
+            }
+
+        return upload_id
+
+    def multipart_upload_part(
+        self, key: str, upload_id: str, part_number: int, data, checksum_sha256: Optional[str] = None
+    ) -> StoragePart:
+        data = storage_data_bytes(data)
+        self._call("multipart_upload_part", len(data))
+
+        upload = self._upload(key, upload_id)
+        if bool(checksum_sha256) != bool(upload["checksum_algorithm"]):
+            raise StorageError("InvalidRequest", "Checksum type mismatch")
+        if checksum_sha256 and storage_checksum_sha256(data) != checksum_sha256:
+            raise StorageError("BadDigest", f"Part {part_number}")
+
+        part = StoragePart(
+            part_number=part_number, etag=hashlib.md5(data).hexdigest(), size=len(data), checksum=checksum_sha256
+        )
+        with self._lock:
+            upload["parts"][part_number] = (part, data)
+
+        return part
+
+    def multipart_list_parts(self, key: str, upload_id: str) -> List[StoragePart]:
+        self._call("multipart_list_parts")
+
+        with self._lock:
+            parts = list(self._upload(key, upload_id)["parts"].values())
+
+        return [part for part, _ in sorted(parts, key=lambda item: item[0].part_number)]
+
+    def multipart_complete(self, key: str, upload_id: str, parts: List[StoragePart]) -> str:
+        self._call("multipart_complete")
+
+        upload = self._upload(key, upload_id)
+        numbers = [part.part_number for part in parts]
+        if not parts or numbers != sorted(set(numbers)):
+            raise StorageError("InvalidPartOrder")
+
+        stored_parts = []
+        for index, part in enumerate(parts):
+            stored, data = upload["parts"].get(part.part_number, (None, b""))
+            if stored is None or stored.etag != part.etag or (stored.checksum or None) != (part.checksum or None):
+                raise StorageError("InvalidPart", f"Part {part.part_number}")
+            if index < len(parts) - 1 and stored.size < self.min_part_size:
+                raise StorageError("EntityTooSmall", f"Part {part.part_number}")
+            stored_parts.append((stored, data))
+
+        etag = storage_composite_etag([stored for stored, _ in stored_parts])
+        checksum = storage_composite_checksum([stored for stored, _ in stored_parts]) if upload["checksum_algorithm"] else None
+        self._store(key, b"".join(data for _, data in stored_parts), etag, checksum)
+        with self._lock:
+            self.uploads.pop(upload_id, None)
+
+        return etag
+
+    def multipart_abort(self, key: str, upload_id: str):
+        self._call("multipart_abort")
+
+        self._upload(key, upload_id)
+        with self._lock:
+            self.uploads.pop(upload_id, None)
+
+    def multipart_list(self, prefix: str = "") -> Iterator[StorageUpload]:
+        self._call("multipart_list")
+
+        with self._lock:
+            uploads = [
+                StorageUpload(key=upload["key"], upload_id=upload_id, initiated=upload["initiated"])
+                for upload_id, upload in self.uploads.items()
+                if upload["key"].startswith(prefix)
+            ]
+
+        yield from sorted(uploads, key=lambda upload: upload.initiated)
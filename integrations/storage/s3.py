@@ -0,0 +1,188 @@
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from botocore.exceptions import ClientError
+
+from integrations.aws.client import (
+    s3_delete_objects,
+    s3_generate_download_presigned_url,
+    s3_generate_upload_part_presigned_url,
+    s3_get_credentials,
+    s3_get_object_data,
+    s3_head_object,
+    s3_multipart_upload_abort,
+    s3_multipart_upload_data,
+    s3_multipart_upload_finish,
+    s3_multipart_upload_init,
+    s3_multipart_upload_list,
+    s3_multipart_upload_list_parts,
+    s3_put_object,
+)
+from integrations.storage.base import (
+    ByteRange,
+    StorageBackend,
+    StorageError,
+    StorageObject,
+    StoragePart,
+    StorageUpload,
+    storage_data_size,
+)
+from integrations.upstream.client import AsyncUpstreamResponse, UpstreamResponse, upstream_aget, upstream_get
+
+# https://docs.aws.amazon.com/AmazonS3/latest/API/API_DeleteObjects.html
+S3_DELETE_BATCH_SIZE = 1000
+
+
+@contextmanager
+def _s3_errors():
+    try:
+        yield
+    except ClientError as e:
+        error = e.response.get("Error", {})
+        raise StorageError(error.get("Code", ""), error.get("Message", "")) from e
+
+
+def _format_range(byte_range: ByteRange) -> str:
+    first_byte, last_byte = byte_range
+
+    return f"bytes={'' if first_byte is None else first_byte}-{'' if last_byte is None else last_byte}"
+
+
+class S3StorageBackend(StorageBackend):
+    """
+    The bucket of AWS_STORAGE_BUCKET_NAME, through the process' shared boto3 client.
+
+    Reads are plain HTTP GETs of `object_url(key)` (a presigned URL, or the public one) over the
+    pooled upstream session (the async client for `aopen`), so ranges and the bytes themselves
+    never go through boto3.
+    """
+
+    presigned_urls = True
+
+    def __init__(self, object_url: Callable[[str], str]):
+        self.object_url = object_url
+
+    @property
+    def name(self) -> str:
+        return s3_get_credentials().bucket_name
+
+    def open(self, key: str, byte_range: Optional[ByteRange] = None) -> UpstreamResponse:
+        headers = {}
+        if byte_range is not None:
+            headers["Range"] = _format_range(byte_range)
+
+        return upstream_get(self.object_url(key), headers=headers)
+
+    async def aopen(self, key: str, byte_range: Optional[ByteRange] = None) -> AsyncUpstreamResponse:
+        headers = {}
+        if byte_range is not None:
+            headers["Range"] = _format_range(byte_range)
+
+        return await upstream_aget(self.object_url(key), headers=headers)
+
+    def head(self, key: str, checksum: bool = False) -> Optional[StorageObject]:
+        with _s3_errors():
+            head = s3_head_object(bucket=self.name, key=key, checksum=checksum)
+
+        if head is None:
+            return None
+
+        return StorageObject(size=head["ContentLength"], etag=head.get("ETag", "").strip('"'), checksum=head.get("ChecksumSHA256"))
+
+    def get(self, key: str) -> bytes:
+        with _s3_errors():
+            return s3_get_object_data(bucket=self.name, key=key)
+
+    def put(self, key: str, data) -> str:
+        with _s3_errors():
+            upload_data = s3_put_object(bucket=self.name, key=key, body=data)
+
+        return upload_data.get("ETag", "").strip('"')
+
+    def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+
+        for start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+            with _s3_errors():
+                errors = s3_delete_objects(bucket=self.name, keys=keys[start:start + S3_DELETE_BATCH_SIZE])
+            if errors:
+                raise StorageError(errors[0].get("Code", ""), f"{len(errors)} objects could not be deleted")
+
+    def multipart_init(self, key: str, checksum_algorithm: Optional[str] = None) -> str:
+        with _s3_errors():
+            return s3_multipart_upload_init(file_path=key, checksum_algorithm=checksum_algorithm)["UploadId"]
+
+    def multipart_upload_part(
+        self, key: str, upload_id: str, part_number: int, data, checksum_sha256: Optional[str] = None
+    ) -> StoragePart:
+        with _s3_errors():
+            upload_data = s3_multipart_upload_data(
+                file_object=data,
+                bucket=self.name,
+                key=key,
+                upload_id=upload_id,
+                part_num=part_number,
+                checksum_sha256=checksum_sha256,
+            )
+
+        return StoragePart(
+            part_number=part_number,
+            etag=upload_data["ETag"].strip('"'),
+            size=storage_data_size(data),
+            checksum=checksum_sha256,
+        )
+
+    def multipart_list_parts(self, key: str, upload_id: str) -> List[StoragePart]:
+        with _s3_errors():
+            parts = s3_multipart_upload_list_parts(bucket=self.name, key=key, upload_id=upload_id)
+
+        return [
+            StoragePart(
+                part_number=part["PartNumber"],
+                etag=part["ETag"].strip('"'),
+                size=part["Size"],
+                checksum=part.get("ChecksumSHA256"),
+            )
+            for part in parts
+        ]
+
+    def multipart_complete(self, key: str, upload_id: str, parts: List[StoragePart]) -> str:
+        completed_parts = []
+        for part in parts:
+            completed_part = {"ETag": f'"{part.etag}"', "PartNumber": part.part_number}
+            if part.checksum:
+                completed_part["ChecksumSHA256"] = part.checksum
+            completed_parts.append(completed_part)
+
+        with _s3_errors():
+            upload_data = s3_multipart_upload_finish(bucket=self.name, key=key, upload_id=upload_id, parts=completed_parts)
+
+        return upload_data.get("ETag", "").strip('"')
+
+    def multipart_abort(self, key: str, upload_id: str):
+        with _s3_errors():
+            s3_multipart_upload_abort(bucket=self.name, key=key, upload_id=upload_id)
+
+    def multipart_list(self, prefix: str = "") -> Iterator[StorageUpload]:
+        with _s3_errors():
+            for upload in s3_multipart_upload_list(bucket=self.name, prefix=prefix):
+                yield StorageUpload(key=upload["Key"], upload_id=upload["UploadId"], initiated=upload["Initiated"])
+
+    def presign_get(
+        self, key: str, *, expires_in: int, content_disposition: Optional[str] = None, content_type: Optional[str] = None
+    ) -> str:
+        return s3_generate_download_presigned_url(
+            key, expires_in=expires_in, content_disposition=content_disposition, content_type=content_type
+        )
+
+    def presign_upload_part(
+        self, key: str, upload_id: str, part_number: int, *, expires_in: int, checksum_algorithm: Optional[str] = None
+    ) -> str:
+        return s3_generate_upload_part_presigned_url(
+            bucket=self.name,
+            key=key,
+            upload_id=upload_id,
+            part_num=part_number,
+            expires_in=expires_in,
+            checksum_algorithm=checksum_algorithm,
+        )
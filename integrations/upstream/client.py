@@ -0,0 +1,344 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+import requests
+from attrs import define
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from integrations.aws.utils import assert_settings
+
+
+@define
+class UpstreamConfig:
+    pool_connections: int
+    pool_maxsize: int
+    pool_timeout: float
+    connect_timeout: float
+    read_timeout: float
+    max_retries: int
+    retry_backoff: float
+    async_max_connections: int
+
+
+@lru_cache
+def upstream_get_config() -> UpstreamConfig:
+    required_config = assert_settings(
+        [
+            "UPSTREAM_POOL_CONNECTIONS",
+            "UPSTREAM_POOL_MAXSIZE",
+            "UPSTREAM_POOL_TIMEOUT",
+            "UPSTREAM_CONNECT_TIMEOUT",
+            "UPSTREAM_READ_TIMEOUT",
+            "UPSTREAM_MAX_RETRIES",
+            "UPSTREAM_RETRY_BACKOFF",
+            "UPSTREAM_ASYNC_MAX_CONNECTIONS",
+        ],
+        "Upstream settings not found.",
+    )
+
+    return UpstreamConfig(
+        pool_connections=int(required_config["UPSTREAM_POOL_CONNECTIONS"]),
+        pool_maxsize=int(required_config["UPSTREAM_POOL_MAXSIZE"]),
+        pool_timeout=float(required_config["UPSTREAM_POOL_TIMEOUT"]),
+        connect_timeout=float(required_config["UPSTREAM_CONNECT_TIMEOUT"]),
+        read_timeout=float(required_config["UPSTREAM_READ_TIMEOUT"]),
+        max_retries=int(required_config["UPSTREAM_MAX_RETRIES"]),
+        retry_backoff=float(required_config["UPSTREAM_RETRY_BACKOFF"]),
+        async_max_connections=int(required_config["UPSTREAM_ASYNC_MAX_CONNECTIONS"]),
+    )
+
+
+class UpstreamPoolStats:
+    """
+    Process wide counters of the upstream connection pools.
+
+    A checkout is a "hit" when it reuses an already connected keep-alive socket,
+    the wait time is how long we were blocked on a full pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.hits = 0
+            self.connections_created = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+
+    def record_checkout(self, *, reused: bool, waited: float):
+        with self._lock:
+            self.checkouts += 1
+            self.hits += int(reused)
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def record_new_connection(self):
+        with self._lock:
+            self.connections_created += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.checkouts if self.checkouts else 0.0,
+                "connections_created": self.connections_created,
+                "wait_seconds": self.wait_seconds,
+                "avg_wait_seconds": self.wait_seconds / self.checkouts if self.checkouts else 0.0,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+upstream_pool_stats = UpstreamPoolStats()
+
+
+class InstrumentedPoolMixin:
+    stats = upstream_pool_stats
+
+    def pool_timeout(self) -> Optional[float]:
+        # requests never passes a pool timeout, which would block forever on a full pool.
+        return upstream_get_config().pool_timeout
+
+    def _get_conn(self, timeout=None):
+        if timeout is None:
+            timeout = self.pool_timeout()
+
+        started = time.perf_counter()
+        conn = super()._get_conn(timeout=timeout)
+        self.stats.record_checkout(
+            reused=getattr(conn, "sock", None) is not None,
+            waited=time.perf_counter() - started,
+        )
+
+        return conn
+
+    def _new_conn(self):
+        self.stats.record_new_connection()
+
+        return super()._new_conn()
+
+
+class InstrumentedHTTPConnectionPool(InstrumentedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class InstrumentedHTTPSConnectionPool(InstrumentedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class UpstreamHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": InstrumentedHTTPConnectionPool,
+            "https": InstrumentedHTTPSConnectionPool,
+        }
+
+
+@lru_cache
+def upstream_get_session() -> requests.Session:
+    """
+    One keep-alive session per process, with a bounded connection pool per storage host.
+
+    Only idempotent reads are retried, with exponential backoff.
+    """
+    config = upstream_get_config()
+
+    retries = Retry(
+        total=config.max_retries,
+        backoff_factor=config.retry_backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = UpstreamHTTPAdapter(
+        pool_connections=config.pool_connections,
+        pool_maxsize=config.pool_maxsize,
+        pool_block=True,
+        max_retries=retries,
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+# Sockets must never be shared between gunicorn workers.
+os.register_at_fork(after_in_child=upstream_get_session.cache_clear)
+
+
+class UpstreamResponse:
+    """
+    File-like view over a streamed upstream response.
+
+    The connection goes back to the pool as soon as the body has been fully read,
+    `close` drops it (and frees its pool slot) when the client went away mid-stream.
+    """
+
+    def __init__(self, response: requests.Response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+        content_length = response.headers.get("Content-Length")
+        self._remaining = int(content_length) if content_length is not None else None
+        self._released = False
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        data = self.response.raw.read(amt)
+
+        if self._remaining is not None:
+            self._remaining -= len(data)
+
+        if self._remaining == 0 or (self._remaining is None and not data):
+            self.release()
+
+        return data
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.response.raw.release_conn()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self.response.close()
+
+    def raise_for_status(self):
+        try:
+            self.response.raise_for_status()
+        except requests.HTTPError:
+            self.close()
+            raise
+
+
+def upstream_get(url: str, headers: Optional[Dict[str, str]] = None, allow_redirects: bool = True) -> UpstreamResponse:
+    config = upstream_get_config()
+
+    response = upstream_get_session().get(
+        url,
+        headers=headers,
+        stream=True,
+        timeout=(config.connect_timeout, config.read_timeout),
+        allow_redirects=allow_redirects,
+    )
+
+    return UpstreamResponse(response)
+
+
+# Statuses retried on idempotent reads, as the sync session does
+UPSTREAM_RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+_async_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+
+def upstream_get_async_session() -> aiohttp.ClientSession:
+    """
+    One keep-alive aiohttp session per event loop, connections cannot move between loops.
+
+    Unlike the sync pool, which is sized for the threads of a worker, it holds UPSTREAM_ASYNC_MAX_CONNECTIONS
+    connections: under ASGI every download in flight has its own, for as long as it lasts.
+    """
+    loop = asyncio.get_running_loop()
+
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        config = upstream_get_config()
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=config.async_max_connections),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                # Waiting for a free connection included, as the sync pool timeout
+                connect=config.pool_timeout + config.connect_timeout,
+                sock_connect=config.connect_timeout,
+                sock_read=config.read_timeout,
+            ),
+            # Bytes are relayed as storage sent them, like the raw reads of the sync session
+            auto_decompress=False,
+        )
+        _async_sessions[loop] = session
+
+    return session
+
+
+os.register_at_fork(after_in_child=_async_sessions.clear)
+
+
+class AsyncUpstreamResponse:
+    """
+    Async counterpart of UpstreamResponse, iterated with `aiter_chunks`.
+
+    The connection goes back to the pool once the body has been read, `aclose` drops it mid-stream.
+    """
+
+    def __init__(self, response: aiohttp.ClientResponse):
+        self.response = response
+        self.status_code = response.status
+        self.headers = response.headers
+
+        self._loop = asyncio.get_running_loop()
+        self._released = False
+
+    async def aiter_chunks(self, chunk_size: int) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.response.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            await self.aclose()
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            if self.response.content.at_eof():
+                self.response.release()
+            else:
+                self.response.close()
+
+    async def aclose(self):
+        self._release()
+
+    def close(self):
+        # Django closes responses synchronously, from a worker thread under ASGI.
+        if not self._released and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._release)
+
+    async def araise_for_status(self):
+        if self.status_code >= 400:
+            self._release()
+            self.response.raise_for_status()
+
+
+async def upstream_aget(url: str, headers: Optional[Dict[str, str]] = None) -> AsyncUpstreamResponse:
+    """
+    Async `upstream_get`: the body is streamed, connection failures and 5xx are retried with the same backoff.
+    """
+    config = upstream_get_config()
+    session = upstream_get_async_session()
+
+    for attempt in range(config.max_retries + 1):
+        try:
+            response = await session.get(url, headers=headers)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == config.max_retries:
+                raise
+        else:
+            if response.status not in UPSTREAM_RETRY_STATUSES or attempt == config.max_retries:
+                return AsyncUpstreamResponse(response)
+            response.release()
+
+        await asyncio.sleep(config.retry_backoff * 2 ** attempt)